@@ -0,0 +1,380 @@
+"""
+Async serving mode: the Flask app's API as a plain ASGI application, for an
+asyncio server such as uvicorn or hypercorn:
+
+    uvicorn --factory api.asgi:create_asgi_app --workers 4
+
+Requests are routed by the Flask app's URL map. The redirect, shorten and
+metrics endpoints are served on the event loop: a redirect that misses the
+cache awaits the database instead of holding a worker thread, so
+concurrency is not capped by the thread count. Every other request (batch
+shortening, link statistics, the admin endpoints, the docs page, and
+unknown paths or methods) is passed to a Flask app built on the same
+components, on a thread of the loop's default executor. Status codes,
+headers and bodies match the Flask app in api/handlers.py.
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+from typing import Optional
+
+from flask import Flask
+from werkzeug.exceptions import BadRequest, HTTPException, UnsupportedMediaType
+from werkzeug.http import parse_options_header
+from werkzeug.wrappers import Response
+
+from api.fast_path import _redirect_parts
+from api.handlers import _background_tasks, _build_shared, _create_flask_app, _install_signal_handler, \
+    _parse_shorten_item
+from repository.async_repo import AsyncBaseRepository, AsyncDBRepository
+from repository.base import UnavailableError
+from repository.factory import create_async_repository
+from service.async_redirector import AsyncRedirectorService
+from service.async_url_generator import AsyncURLGeneratorService
+from service.redirector import GoneError, NotFoundError
+from service.url_generator import AliasConflictError, InvalidURLError
+from util import config as default_config
+from util.metrics import Metrics, instrument
+from util.singleflight import AsyncSingleFlight
+
+# Request bodies beyond this are answered 413 without being read
+MAX_BODY_SIZE = 1 << 20
+
+_JSON_HEADERS = [(b'content-type', b'application/json')]
+
+
+def create_asgi_app(config: dict = None) -> 'ASGIApp':
+    """
+    Application factory for the async serving mode. Settings and shared
+    components are those of create_app(); the counter key allocator and
+    dedup are not supported.
+    :param config: overrides for the settings in util.config
+    :return: ASGIApp
+    :raises ValueError: a setting the async mode does not support
+    """
+    settings = default_config.as_dict(config)
+    if settings['key_allocator'] != 'random':
+        raise ValueError("The async app only supports key_allocator = 'random'")
+    if settings['dedup_enabled']:
+        raise ValueError("The async app does not support dedup_enabled")
+
+    shared = _build_shared(settings)
+    metrics = shared['metrics']
+    # The synchronous repo stays in use for click flushing and the key filter
+    # refresh, which run on background threads
+    repo = create_async_repository(settings, shared['repo'], cache=shared['redirect_cache'],
+                                   key_filter=shared['key_filter'], guard=shared['guard'])
+    single_flight = AsyncSingleFlight(settings['redirect_single_flight_timeout']) \
+        if settings['redirect_single_flight'] else None
+
+    url_generator = AsyncURLGeneratorService(repo, metrics=metrics, writer=shared['group_commit'])
+    redirector = AsyncRedirectorService(repo, cache=shared['redirect_cache'], key_filter=shared['key_filter'],
+                                        click_tracker=shared['click_tracker'],
+                                        redirect_code=settings['redirect_code'],
+                                        cache_max_age=settings['redirect_cache_max_age'],
+                                        snapshot=shared['snapshot'], snapshot_mode=settings['snapshot_mode'],
+                                        single_flight=single_flight, hot_keys=shared['hot_keys'],
+                                        stale_max_age=settings['redirect_stale_max_age'], metrics=metrics)
+    if metrics is not None:
+        if isinstance(repo, AsyncDBRepository):
+            # Adapters call the synchronous repo, which is already timed
+            instrument(repo, ['save_url_mapping', 'existing_keys', 'get_redirect_target'],
+                       metrics.repository_duration)
+        instrument(url_generator, ['generate'], metrics.service_duration)
+        instrument(redirector, ['resolve'], metrics.service_duration)
+
+    # Serves the routes not implemented here; its background tasks are this app's
+    flask_app = _create_flask_app(settings, shared, start_background=False)
+    return ASGIApp(settings, repo, url_generator, redirector, flask_app, click_tracker=shared['click_tracker'],
+                   metrics=metrics, background_tasks=_background_tasks(settings, shared, redirector))
+
+
+class ASGIApp:
+    """
+    ASGI application serving POST /shorten, GET /metrics and GET /<short_key>,
+    and every other request through flask_app
+    """
+
+    def __init__(self, settings: dict, repo: AsyncBaseRepository, url_generator: AsyncURLGeneratorService,
+                 redirector: AsyncRedirectorService, flask_app: Flask, click_tracker=None,
+                 metrics: Optional[Metrics] = None, background_tasks=None):
+        self.settings = settings
+        self.repo = repo
+        self.url_generator = url_generator
+        self.redirector = redirector
+        self.flask_app = flask_app
+        self._routes = flask_app.url_map.bind('localhost')
+        self.click_tracker = click_tracker
+        self.metrics = metrics
+        self.background_tasks = background_tasks
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if self.background_tasks is not None:
+            # Started at lifespan startup; this covers servers that do not send lifespan events
+            self.background_tasks()
+
+        started = time.perf_counter()
+        endpoint, status = await self._dispatch(scope, receive, send)
+        if endpoint is not None and self.metrics is not None:
+            self.metrics.http_duration.observe(time.perf_counter() - started, endpoint)
+            self.metrics.http_responses.inc(endpoint, str(status))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # On the loop's thread, the main one: worker classes reset handlers after the fork
+                _install_signal_handler(self.flask_app)
+                if self.background_tasks is not None:
+                    # In each worker before it serves; pre-warming reads the DB synchronously
+                    await asyncio.to_thread(self.background_tasks)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.click_tracker is not None:
+                    # Flush buffered clicks before the worker exits
+                    self.click_tracker.stop()
+                await self.repo.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _dispatch(self, scope, receive, send) -> tuple[Optional[str], int]:
+        # Returns (endpoint name, status) for metrics; the endpoint is None for requests
+        # passed to the Flask app, which records them itself
+        try:
+            endpoint, args = self._routes.match(scope['path'], scope['method'])
+        except HTTPException:
+            # 404, 405 and trailing-slash redirects, as Flask renders them
+            endpoint = None
+        if endpoint == 'url_shortener.shorten':
+            return 'shorten', await self.shorten(scope, receive, send)
+        if endpoint == 'url_shortener.redirect_short':
+            return 'redirect_short', await self.redirect_short(args['short_key'], send)
+        if endpoint == 'url_shortener.metrics_endpoint':
+            if self.metrics is None:
+                return 'metrics_endpoint', await _send_json(send, 404, {'error': 'Not Found'})
+            body = self.metrics.render().encode()
+            return 'metrics_endpoint', await _send(send, 200, [(b'content-type', Metrics.CONTENT_TYPE.encode())],
+                                                   body)
+        return None, await _call_wsgi(self.flask_app.wsgi_app, scope, receive, send)
+
+    async def shorten(self, scope, receive, send) -> int:
+        """
+        POST /shorten; same request body and responses as the Flask route
+        """
+        body = await _read_body(receive)
+        if body is None:
+            return await _send_json(send, 413, {'error': 'Request body too large'})
+        try:
+            data = _decode_json(scope, body)
+        except HTTPException as e:
+            return await _send_response(send, e.get_response())
+        try:
+            long_url, alias, expires_dt, redirect_code, cache_max_age = _parse_shorten_item(data)
+        except ValueError as e:
+            return await _send_json(send, 400, {'error': str(e)})
+
+        try:
+            short_url = await self.url_generator.generate(long_url=long_url, custom_alias=alias,
+                                                          expires_at=expires_dt, redirect_code=redirect_code,
+                                                          cache_max_age=cache_max_age)
+            return await _send_json(send, 200, {'short_url': short_url})
+        except InvalidURLError as e:
+            return await _send_json(send, 400, {'error': str(e)})
+        except AliasConflictError as e:
+            return await _send_json(send, 409, {'error': str(e)})
+        except ValueError as e:
+            return await _send_json(send, 400, {'error': str(e)})
+        except UnavailableError:
+            return await _send_json(send, 503, {'error': 'Service Unavailable'})
+        except Exception:
+            return await _send_json(send, 500, {'error': 'Internal Server Error'})
+
+    async def redirect_short(self, short_key: str, send) -> int:
+        """
+        GET /<short_key>; same responses as the Flask route
+        """
+        try:
+            target = await self.redirector.resolve(short_key)
+        except NotFoundError:
+            return await _send_json(send, 404, {'error': 'Not Found'})
+        except GoneError:
+            return await _send_json(send, 410, {'error': 'Gone'})
+        except (TimeoutError, UnavailableError):
+            return await _send_json(send, 503, {'error': 'Service Unavailable'})
+        except Exception:
+            return await _send_json(send, 500, {'error': 'Internal Server Error'})
+
+        # The body and headers of Flask's redirect()
+        location, body = _redirect_parts(target.long_url)
+        headers = [(b'content-type', b'text/html; charset=utf-8'), (b'location', location.encode())]
+        cache_control = target.cache_control
+        if cache_control is not None:
+            headers.append((b'cache-control', cache_control.encode()))
+        return await _send(send, target.status_code, headers, body)
+
+
+def _decode_json(scope, body: bytes):
+    """
+    Decodes a request body as Flask's request.get_json() does
+    :param scope: ASGI connection scope
+    :param body:
+    :return: decoded JSON value
+    :raises UnsupportedMediaType: the Content-Type is not JSON
+    :raises BadRequest: the body is not valid JSON
+    """
+    content_type = next((value.decode('latin-1') for name, value in scope.get('headers', ())
+                         if name.lower() == b'content-type'), '')
+    mimetype = parse_options_header(content_type)[0].lower()
+    if not (mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))):
+        raise UnsupportedMediaType("Did not attempt to load JSON data because the request Content-Type was not "
+                                   "'application/json'.")
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise BadRequest() from None
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    # None once the body exceeds MAX_BODY_SIZE
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _send(send, status: int, headers: list, body: bytes) -> int:
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers + [(b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+    return status
+
+
+async def _send_json(send, status: int, payload: dict) -> int:
+    return await _send(send, status, _JSON_HEADERS, json.dumps(payload).encode())
+
+
+async def _send_response(send, response: Response) -> int:
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers.to_wsgi_list() if name.lower() != 'content-length']
+    return await _send(send, response.status_code, headers, response.get_data())
+
+
+class _WSGIInput(io.RawIOBase):
+    """
+    wsgi.input for a WSGI app on a worker thread: reads the ASGI request body
+    from the event loop as the app consumes it
+    """
+
+    def __init__(self, receive, loop: asyncio.AbstractEventLoop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self._done = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._done:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._done = True
+            else:
+                self._buffer = message.get('body', b'')
+                self._done = not message.get('more_body')
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _wsgi_environ(scope, body) -> dict:
+    """
+    Builds the WSGI environ for an ASGI HTTP request
+    :param scope: ASGI connection scope
+    :param body: file-like request body
+    :return: dict
+    """
+    host, port = scope.get('server') or ('localhost', None)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # Bodies without a Content-Length (chunked uploads) are read to the end
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def _call_wsgi(wsgi_app, scope, receive, send) -> int:
+    """
+    Runs a WSGI app for one request on a thread of the loop's default
+    executor, streaming the request and response bodies
+    :return: response status
+    """
+    loop = asyncio.get_running_loop()
+    environ = _wsgi_environ(scope, io.BufferedReader(_WSGIInput(receive, loop)))
+    return await loop.run_in_executor(None, _run_wsgi, wsgi_app, environ, send, loop)
+
+
+def _run_wsgi(wsgi_app, environ: dict, send, loop: asyncio.AbstractEventLoop) -> int:
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    start = {}
+
+    def start_response(status, headers, exc_info=None):
+        start.update(type='http.response.start', status=int(status.split(' ', 1)[0]),
+                     headers=[(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers])
+
+    result = wsgi_app(environ, start_response)
+    try:
+        started = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                send_message(start)
+                started = True
+            send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            send_message(start)
+        send_message({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return start['status']
@@ -0,0 +1,109 @@
+"""
+WSGI middleware answering GET /<short_key> without going through Flask:
+no request context, URL map matching or response objects, just a
+precompiled pattern, RedirectorService.resolve and prebuilt headers.
+
+Responses are byte-for-byte those of the redirect_short view (status line,
+headers in the same order and body), the view's error responses are
+rendered once by Flask itself, and request metrics and the per-worker
+background tasks are recorded as for any Flask request. Every other request
+(another method, a path with a slash, a key that is not alphanumeric or a
+path Flask routes elsewhere, such as /metrics or /docs) goes to Flask.
+"""
+import re
+import time
+from functools import lru_cache
+
+from flask import Flask, jsonify
+from markupsafe import escape
+from werkzeug.urls import iri_to_uri
+
+from model.url_mapping import REDIRECT_CODES
+from repository.base import UnavailableError
+from service.redirector import GoneError, NotFoundError
+
+# Short keys are generated and aliased as Base62
+_SHORT_KEY = re.compile(r'/([A-Za-z0-9]{1,64})')
+
+# werkzeug.utils.redirect's body
+_REDIRECT_BODY = (
+    "<!doctype html>\n"
+    "<html lang=en>\n"
+    "<title>Redirecting...</title>\n"
+    "<h1>Redirecting...</h1>\n"
+    "<p>You should be redirected automatically to the target URL: "
+    '<a href="{0}">{0}</a>. If not, click the link.\n'
+)
+
+
+@lru_cache(maxsize=4096)
+def _redirect_parts(long_url: str) -> tuple[str, bytes]:
+    # Location header and body for a long URL; hot URLs are rendered once
+    return iri_to_uri(long_url), _REDIRECT_BODY.format(escape(long_url)).encode()
+
+
+class RedirectFastPath:
+    """
+    Serves short-key redirects in front of a Flask app built by create_app;
+    install it with app.wsgi_app = RedirectFastPath(app, app.wsgi_app)
+    """
+
+    ENDPOINT = 'redirect_short'
+
+    def __init__(self, app: Flask, wsgi_app):
+        self.wsgi_app = wsgi_app
+        services = app.extensions['url_shortener']
+        self.redirector = services['redirector']
+        self.metrics = services['metrics']
+        self.background_tasks = services['background_tasks']
+        # One-segment paths with a route of their own (/shorten, /metrics, /docs, ...)
+        self._reserved = {rule.rule[1:] for rule in app.url_map.iter_rules()
+                          if not rule.arguments and rule.rule.count('/') == 1}
+        self._status = {code: app.response_class(status=code).status for code in REDIRECT_CODES}
+        # The view's error responses, as Flask renders them
+        self._errors = {}
+        with app.app_context():
+            for code, message in ((404, 'Not Found'), (410, 'Gone'), (500, 'Internal Server Error'),
+                                  (503, 'Service Unavailable')):
+                response = jsonify({'error': message})
+                response.status_code = code
+                body = response.get_data()
+                self._errors[code] = (response.status, list(response.get_wsgi_headers({}).to_wsgi_list()), body)
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'GET':
+            return self.wsgi_app(environ, start_response)
+        match = _SHORT_KEY.fullmatch(environ.get('PATH_INFO', ''))
+        if match is None or match.group(1) in self._reserved:
+            return self.wsgi_app(environ, start_response)
+
+        started = time.perf_counter()
+        if self.background_tasks is not None:
+            self.background_tasks()
+        status_code, status, headers, body = self._respond(match.group(1))
+        start_response(status, headers)
+        if self.metrics is not None:
+            self.metrics.http_duration.observe(time.perf_counter() - started, self.ENDPOINT)
+            self.metrics.http_responses.inc(self.ENDPOINT, str(status_code))
+        return [body]
+
+    def _respond(self, short_key: str) -> tuple[int, str, list, bytes]:
+        try:
+            target = self.redirector.resolve(short_key)
+            location, body = _redirect_parts(target.long_url)
+            headers = [('Content-Type', 'text/html; charset=utf-8'), ('Content-Length', str(len(body))),
+                       ('Location', location)]
+            cache_control = target.cache_control
+            if cache_control is not None:
+                headers.append(('Cache-Control', cache_control))
+            return target.status_code, self._status[target.status_code], headers, body
+        except NotFoundError:
+            code = 404
+        except GoneError:
+            code = 410
+        except (TimeoutError, UnavailableError):
+            code = 503
+        except Exception:
+            code = 500
+        status, headers, body = self._errors[code]
+        return code, status, list(headers), body
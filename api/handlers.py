@@ -1,24 +1,321 @@
-from datetime import datetime
-from zoneinfo import ZoneInfo
+from datetime import datetime, timezone
+from functools import wraps
+from itertools import islice
+from typing import Optional
+import base64
+import hmac
+import logging
 import os
-from flask import Flask, request, jsonify, redirect, send_file
+import json
+import threading
+import time
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, redirect, send_file, stream_with_context
 
+from api.fast_path import RedirectFastPath
+from api.profiling import ProfileRequests, install_signal_handler
 from service.url_generator import URLGeneratorService, AliasConflictError, InvalidURLError
 from service.redirector import RedirectorService, NotFoundError, GoneError
+from service.key_allocator import KeyAllocator
+from service.click_tracker import ClickTracker
+from service.group_commit import GroupCommitWriter
+from service.hot_keys import HotKeyTracker
+from repository.base import MAPPING_FIELDS, BaseRepository, UnavailableError
+from repository.factory import create_repository
+from repository.guard import MongoGuard
+from repository.key_filter import KeyFilter
+from repository.snapshot import SnapshotSource
+from util.cache import LRUCache
+from util.shared_cache import SharedCache
+from util.metrics import Metrics, instrument
+from util.process import OncePerProcess
+from util.profiling import Profiler, ProfilingError
+from util.singleflight import SingleFlight
+from util import config as default_config
 
-app = Flask(__name__)
+bp = Blueprint('url_shortener', __name__)
+logger = logging.getLogger(__name__)
 
-url_generator = URLGeneratorService()
-redirector = RedirectorService()
 
-@app.route('/shorten', methods=['POST'])
+def create_app(config: dict = None) -> Flask:
+    """
+    Application factory. Builds one repository shared by both services; the
+    MongoDB connection and background threads are started lazily in each
+    worker process, so the app can be created before a preforking server forks.
+    :param config: overrides for the settings in util.config
+    :return: Flask app
+    """
+    settings = default_config.as_dict(config)
+    return _create_flask_app(settings, _build_shared(settings))
+
+
+def _create_flask_app(settings: dict, shared: dict, start_background: bool = True) -> Flask:
+    """
+    Builds the Flask app on the components from _build_shared()
+    :param settings: dict from util.config.as_dict()
+    :param shared: dict from _build_shared()
+    :param start_background: start the per-worker background tasks before the first request;
+                             False when another app sharing the components starts them
+    :return: Flask app
+    """
+    repo, key_filter, dedup_cache = shared['repo'], shared['key_filter'], shared['dedup_cache']
+    metrics = shared['metrics']
+
+    key_allocator = KeyAllocator(repo, block_size=settings['key_block_size'], scramble=settings['key_scramble'],
+                                 secret=settings['key_scramble_secret']) \
+        if settings['key_allocator'] == 'counter' else None
+    single_flight = SingleFlight(settings['redirect_single_flight_timeout']) \
+        if settings['redirect_single_flight'] else None
+
+    url_generator = URLGeneratorService(repo=repo, key_allocator=key_allocator,
+                                        batch_max_size=settings['batch_max_size'],
+                                        dedup=settings['dedup_enabled'], dedup_cache=dedup_cache, metrics=metrics,
+                                        writer=shared['group_commit'])
+    redirector = RedirectorService(repo=repo, cache=shared['redirect_cache'], key_filter=key_filter,
+                                   click_tracker=shared['click_tracker'], redirect_code=settings['redirect_code'],
+                                   cache_max_age=settings['redirect_cache_max_age'], snapshot=shared['snapshot'],
+                                   snapshot_mode=settings['snapshot_mode'], single_flight=single_flight,
+                                   hot_keys=shared['hot_keys'], stale_max_age=settings['redirect_stale_max_age'],
+                                   metrics=metrics)
+    if metrics is not None:
+        # Timers are attached to these instances only, so disabled metrics cost nothing
+        instrument(url_generator, ['generate', 'generate_many'], metrics.service_duration)
+        instrument(redirector, ['resolve'], metrics.service_duration)
+
+    # Profiling hooks need the admin token to be reachable at all
+    profiler = Profiler(settings['profiling_dir'], settings['profiling_max_seconds']) \
+        if settings['profiling_enabled'] and settings['admin_token'] else None
+
+    app = Flask(__name__)
+    app.extensions['url_shortener'] = {
+        'settings': settings,
+        'repo': repo,
+        'url_generator': url_generator,
+        'redirector': redirector,
+        'click_tracker': shared['click_tracker'],
+        'group_commit': shared['group_commit'],
+        'metrics': metrics,
+        'snapshot': shared['snapshot'],
+        'hot_keys': shared['hot_keys'],
+        'profiler': profiler,
+    }
+
+    background_tasks = _background_tasks(settings, shared, redirector) if start_background else None
+    app.extensions['url_shortener']['background_tasks'] = background_tasks
+    if background_tasks is not None:
+        # Threads do not survive a fork, so they start in each worker: from the server's
+        # post-fork hook (start_worker), or else on the worker's first request
+        app.before_request(background_tasks)
+
+    if metrics is not None:
+        app.before_request(_start_request_timer)
+        app.after_request(_record_request)
+
+    app.register_blueprint(bp)
+    if settings['redirect_fast_path']:
+        app.wsgi_app = RedirectFastPath(app, app.wsgi_app)
+    if profiler is not None:
+        # Outermost, so profiled requests include the fast path
+        app.wsgi_app = ProfileRequests(app.wsgi_app, profiler, settings['profiling_header'], settings['admin_token'])
+        # For single-process servers; forking servers reset it, so start_worker installs it again
+        _install_signal_handler(app)
+    return app
+
+
+def start_worker(app: Flask) -> None:
+    """
+    Runs the per-worker start-up now: installs the profiling signal handler,
+    pre-warms the redirect cache and starts the background threads. Call it
+    from the server's post-fork hook (gunicorn.conf.py does) so the worker's
+    first request does not wait on it; without the hook the background
+    tasks run before that request, but the signal handler is only there if
+    the server kept the one create_app() installed.
+    :param app: app built by create_app()
+    """
+    _install_signal_handler(app)
+    background_tasks = app.extensions['url_shortener']['background_tasks']
+    if background_tasks is not None:
+        background_tasks()
+
+
+def _install_signal_handler(app: Flask) -> None:
+    # Only possible from the main thread, so not from the first request's before_request
+    services = app.extensions['url_shortener']
+    if services['profiler'] is not None:
+        install_signal_handler(services['profiler'], services['settings']['profiling_signal_seconds'])
+
+
+def _build_shared(settings: dict) -> dict:
+    """
+    Builds the parts both the WSGI and the ASGI app use: one repository, with
+    the redirect cache, key filter and dedup cache it keeps in step, plus
+    click tracking, group commit, the snapshot, hot-key tracking and metrics
+    :param settings: dict from util.config.as_dict()
+    :return: dict
+    """
+    # One repository shared by both services so writes invalidate the redirect cache
+    redirect_cache = None
+    if settings['redirect_cache_size'] > 0 and settings['redirect_cache_shared_path']:
+        redirect_cache = SharedCache(settings['redirect_cache_shared_path'], settings['redirect_cache_size'],
+                                     settings['redirect_cache_ttl'], max_stale=settings['redirect_stale_max_age'],
+                                     url_bytes=settings['redirect_cache_url_bytes'])
+    elif settings['redirect_cache_size'] > 0:
+        redirect_cache = LRUCache(settings['redirect_cache_size'], settings['redirect_cache_ttl'],
+                                  max_stale=settings['redirect_stale_max_age'])
+    key_filter = KeyFilter(settings['bloom_filter_capacity'], settings['bloom_filter_error_rate'],
+                           settings['bloom_filter_path'],
+                           max_age=KeyFilter.STALE_REFRESHES * settings['bloom_filter_refresh_interval']) \
+        if settings['bloom_filter_enabled'] else None
+    dedup_cache = LRUCache(settings['dedup_cache_size'], settings['dedup_cache_ttl']) \
+        if settings['dedup_enabled'] and settings['dedup_cache_size'] > 0 else None
+    metrics = Metrics() if settings['metrics_enabled'] else None
+    guard = MongoGuard.from_config(settings, metrics) if settings['storage_backend'] == 'mongo' else None
+    repo = create_repository(settings, cache=redirect_cache, key_filter=key_filter, dedup_cache=dedup_cache,
+                             guard=guard)
+    click_tracker = ClickTracker(repo, flush_interval_ms=settings['click_flush_interval_ms'],
+                                 flush_max_keys=settings['click_flush_max_keys'],
+                                 max_pending_keys=settings['click_max_pending_keys']) \
+        if settings['click_tracking_enabled'] else None
+    group_commit = GroupCommitWriter(repo, max_delay_ms=settings['group_commit_max_delay_ms'],
+                                     max_batch=settings['group_commit_max_batch'],
+                                     timeout_ms=settings['group_commit_timeout_ms']) \
+        if settings['group_commit_enabled'] else None
+    hot_keys = HotKeyTracker(settings['hot_keys_capacity'], settings['hot_keys_path'],
+                             settings['hot_keys_decay']) if settings['hot_keys_enabled'] else None
+
+    snapshot = SnapshotSource(settings['snapshot_path']) if settings['snapshot_path'] else None
+    if snapshot is not None:
+        # Mapped before any fork, so workers share the pages
+        snapshot.refresh()
+
+    if metrics is not None:
+        if redirect_cache is not None:
+            metrics.watch_cache(redirect_cache)
+        instrument(repo, [name for name in vars(BaseRepository) if not name.startswith('_')],
+                   metrics.repository_duration)
+
+    return {
+        'repo': repo,
+        'redirect_cache': redirect_cache,
+        'key_filter': key_filter,
+        'dedup_cache': dedup_cache,
+        'click_tracker': click_tracker,
+        'group_commit': group_commit,
+        'snapshot': snapshot,
+        'metrics': metrics,
+        'hot_keys': hot_keys,
+        'guard': guard,
+    }
+
+
+def _background_tasks(settings: dict, shared: dict, redirector: RedirectorService) -> Optional[OncePerProcess]:
+    """
+    Per-worker start-up, run from the server's post-fork hook or else before
+    the worker's first request: pre-warms the redirect cache from the saved
+    hot keys, then starts the background threads
+    :param settings: dict from util.config.as_dict()
+    :param shared: dict from _build_shared()
+    :param redirector: the app's redirector
+    :return: OncePerProcess to call before each request, or None if there is nothing to start
+    """
+    repo, key_filter, snapshot, hot_keys = shared['repo'], shared['key_filter'], shared['snapshot'], \
+        shared['hot_keys']
+    if key_filter is None and snapshot is None and hot_keys is None:
+        return None
+
+    def start():
+        if hot_keys is not None and hot_keys.path and redirector.cache is not None:
+            # Before the worker serves, so a fresh worker does not send its hottest keys to the DB
+            try:
+                count = redirector.prewarm(HotKeyTracker.load(hot_keys.path), repo=repo)
+                logger.info("Pre-warmed the redirect cache with %d hot keys", count)
+            except Exception:
+                logger.exception("Pre-warming the redirect cache failed")
+        if key_filter is not None:
+            # Lookups go to the DB until the filter is built, so build it in the background
+            threading.Thread(target=key_filter.run, args=(repo, settings['bloom_filter_refresh_interval']),
+                             name='key-filter', daemon=True).start()
+        if snapshot is not None:
+            threading.Thread(target=snapshot.run, args=(settings['snapshot_refresh_interval'],),
+                             name='snapshot', daemon=True).start()
+        if hot_keys is not None:
+            threading.Thread(target=hot_keys.run, args=(settings['hot_keys_interval'],),
+                             name='hot-keys', daemon=True).start()
+
+    return OncePerProcess(start)
+
+
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+def _record_request(response):
+    # Streamed responses are timed up to the first byte
+    metrics = _services()['metrics']
+    endpoint = request.endpoint.rpartition('.')[2] if request.endpoint else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        metrics.http_duration.observe(time.perf_counter() - started, endpoint)
+    metrics.http_responses.inc(endpoint, str(response.status_code))
+    return response
+
+
+def _services() -> dict:
+    return current_app.extensions['url_shortener']
+
+
+def _parse_datetime(value: str, field: str) -> datetime:
+    """
+    Parses a timezone-aware ISO-8601 timestamp
+    :param value:
+    :param field: name used in the error messages
+    :return: datetime
+    :raises ValueError: with the client-facing error message
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid {field} format; use ISO-8601 with offset') from None
+    if parsed.tzinfo is None:
+        #enforce timezone awares
+        raise ValueError(f'{field} must include a timezone offset')
+    return parsed
+
+
+def _parse_shorten_item(data):
+    """
+    Validates a shorten request body
+    :param data: decoded JSON object
+    :return: (long_url, alias, expires_at datetime or None, redirect_code or None, cache_max_age or None)
+    :raises ValueError: with the client-facing error message
+    """
+    if not data or not isinstance(data, dict) or 'long_url' not in data:
+        raise ValueError('Missing required field: long_url')
+
+    #parse expires_at if provided
+    expires_dt = None
+    expires_at = data.get('expires_at')
+    if expires_at:
+        expires_dt = _parse_datetime(expires_at, 'expires_at')
+
+    # bool is a subclass of int, so rule it out explicitly
+    for field in ('redirect_code', 'cache_max_age'):
+        value = data.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(f'{field} must be an integer')
+
+    return data['long_url'], data.get('alias'), expires_dt, data.get('redirect_code'), data.get('cache_max_age')
+
+
+@bp.route('/shorten', methods=['POST'])
 def shorten():
     """
       Request JSON:
         {
           "long_url": "https://example.com/very/long/path",
           "alias": "customAlias",          # optional
-          "expires_at": "2025-07-01T12:00:00+00:00"  # optional ISO-8601 string
+          "expires_at": "2025-07-01T12:00:00+00:00",  # optional ISO-8601 string
+          "redirect_code": 301,            # optional: 301, 302, 307 or 308
+          "cache_max_age": 86400           # optional: seconds clients may cache the redirect
         }
 
       Responses:
@@ -26,33 +323,22 @@ def shorten():
         400: { "error": "Invalid URL" }
         409: { "error": "Alias 'foo' already in use" }
         500: { "error": "Internal Server Error" }
+        503: { "error": "Service Unavailable" } (the database is down or too slow)
     """
 
     data = request.get_json()
-    if not data or 'long_url' not in data:
-        return jsonify({'error': 'Missing required field: long_url'}), 400
-
-    long_url = data['long_url']
-    alias = data.get('alias')
-
-    #parse expires_at if provided
-    expires_dt = None
-    expires_at = data.get('expires_at')
-    if expires_at:
-        try:
-            expires_dt = datetime.fromisoformat(expires_at)
-            if expires_dt.tzinfo is None:
-                #enforce timezone awares
-                return jsonify({'error': 'expires_at must include a timezone offset'}), 400
-        except ValueError:
-            return jsonify({'error': 'Invalid expires_at format; use ISO-8601 with offset'}),400
-
+    try:
+        long_url, alias, expires_dt, redirect_code, cache_max_age = _parse_shorten_item(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
-        short_url = url_generator.generate(
+        short_url = _services()['url_generator'].generate(
             long_url=long_url,
             custom_alias=alias,
-            expires_at=expires_dt
+            expires_at=expires_dt,
+            redirect_code=redirect_code,
+            cache_max_age=cache_max_age
         )
         return jsonify({'short_url': short_url}), 200
 
@@ -65,24 +351,129 @@ def shorten():
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
 
+    except UnavailableError:
+        return jsonify({'error': 'Service Unavailable'}), 503
+
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+
+def _batch_result(result) -> dict:
+    # Per-item result using the same status codes as POST /shorten
+    if isinstance(result, str):
+        return {'short_url': result, 'status': 200}
+    if isinstance(result, AliasConflictError):
+        return {'error': str(result), 'status': 409}
+    if isinstance(result, (InvalidURLError, ValueError)):
+        return {'error': str(result), 'status': 400}
+    if isinstance(result, UnavailableError):
+        return {'error': 'Service Unavailable', 'status': 503}
+    return {'error': 'Internal Server Error', 'status': 500}
+
+
+def _shorten_chunk(chunk: list) -> list[dict]:
+    """
+    Shortens a list of decoded request items (or parse errors) in one batch
+    :param chunk: decoded JSON objects, or ValueError for undecodable lines
+    :return: per-item result dicts, in order
+    """
+    results = [None] * len(chunk)
+    items, positions = [], []
+    for i, data in enumerate(chunk):
+        try:
+            if isinstance(data, Exception):
+                raise data
+            items.append(_parse_shorten_item(data))
+            positions.append(i)
+        except ValueError as e:
+            results[i] = e
+    if items:
+        try:
+            generated = _services()['url_generator'].generate_many(items)
+        except Exception as e:
+            generated = [e] * len(items)
+        for i, result in zip(positions, generated):
+            results[i] = result
+    return [_batch_result(result) for result in results]
+
+
+def _iter_ndjson_chunks(stream, size: int):
+    # Decodes JSON lines lazily and groups them into chunks of at most `size`
+    chunk = []
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            chunk.append(json.loads(line))
+        except ValueError:
+            chunk.append(ValueError('Invalid JSON'))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@bp.route('/shorten/batch', methods=['POST'])
+def shorten_batch():
+    """
+      Request JSON:
+        { "items": [ { "long_url": ..., "alias": ..., "expires_at": ... }, ... ] }
+
+      or, with Content-Type: application/x-ndjson, one item per line (no size
+      limit; the response is streamed back as one result per line).
+
+      Responses:
+        200: { "results": [ { "short_url": "abc123", "status": 200 },
+                            { "error": "Invalid URL: x", "status": 400 }, ... ] }
+        400: { "error": "Batch exceeds the maximum of 1000 items" }
+        500: { "error": "Internal Server Error" }
+    """
+    batch_max_size = _services()['settings']['batch_max_size']
+    if request.mimetype == 'application/x-ndjson':
+        stream = request.stream
+
+        def generate():
+            for chunk in _iter_ndjson_chunks(stream, batch_max_size):
+                for result in _shorten_chunk(chunk):
+                    yield json.dumps(result) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('items'), list):
+        return jsonify({'error': 'Missing required field: items'}), 400
+    if len(data['items']) > batch_max_size:
+        return jsonify({'error': f"Batch exceeds the maximum of {batch_max_size} items"}), 400
+
+    try:
+        return jsonify({'results': _shorten_chunk(data['items'])}), 200
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
 
 
-@app.route('/<string:short_key>', methods=['GET'])
+@bp.route('/<string:short_key>', methods=['GET'])
 def redirect_short(short_key):
     """
-      Redirects the client to the original URL.
+      Redirects the client to the original URL, with the mapping's status
+      code and Cache-Control policy (or the configured defaults).
 
       Responses:
-        302 redirect → long_url
+        301/302/307/308 redirect → long_url
         404: { "error": "Not Found" }
         410: { "error": "Gone" }
         500: { "error": "Internal Server Error" }
+        503: { "error": "Service Unavailable" } (the database is down or too slow and there is
+             no recent enough cached or snapshot copy, or timed out waiting on another
+             request's lookup)
       """
     try:
-        long_url = redirector.redirect(short_key)
-        return redirect(long_url, code=302)
+        target = _services()['redirector'].resolve(short_key)
+        response = redirect(target.long_url, code=target.status_code)
+        cache_control = target.cache_control
+        if cache_control is not None:
+            response.headers['Cache-Control'] = cache_control
+        return response
 
     except NotFoundError:
         return jsonify({'error': 'Not Found'}), 404
@@ -90,11 +481,314 @@ def redirect_short(short_key):
     except GoneError:
         return jsonify({'error': 'Gone'}), 410
 
+    except (TimeoutError, UnavailableError):
+        return jsonify({'error': 'Service Unavailable'}), 503
+
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
 
 
-@app.route('/docs', methods=['GET'])
+@bp.route('/stats/<string:short_key>', methods=['GET'])
+def link_stats(short_key):
+    """
+      Returns click statistics for a short key. Counts include clicks this
+      worker has not flushed yet; other workers' clicks appear once flushed.
+
+      Responses:
+        200: { "short_key": "abc123", "click_count": 42, "last_accessed_at": "2025-07-01T12:00:00+00:00" }
+        404: { "error": "Not Found" }
+        500: { "error": "Internal Server Error" }
+        503: { "error": "Service Unavailable" }
+    """
+    try:
+        stats = _services()['repo'].get_click_stats(short_key)
+        if stats is None:
+            return jsonify({'error': 'Not Found'}), 404
+        click_count, last_accessed_at = stats
+
+        click_tracker = _services()['click_tracker']
+        if click_tracker is not None:
+            pending_count, pending_accessed_at = click_tracker.pending(short_key)
+            click_count += pending_count
+            if pending_accessed_at is not None:
+                last_accessed_at = max(last_accessed_at or 0, pending_accessed_at)
+
+        return jsonify({
+            'short_key': short_key,
+            'click_count': click_count,
+            'last_accessed_at': datetime.fromtimestamp(last_accessed_at, tz=timezone.utc).isoformat()
+            if last_accessed_at is not None else None,
+        }), 200
+
+    except UnavailableError:
+        return jsonify({'error': 'Service Unavailable'}), 503
+
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Serves request, service and repository latency histograms and outcome
+    counters in the Prometheus text format.
+
+    Responses:
+      200: metrics
+      404: metrics are disabled
+    """
+    metrics = _services()['metrics']
+    if metrics is None:
+        return jsonify({'error': 'Not Found'}), 404
+    return Response(metrics.render(), content_type=Metrics.CONTENT_TYPE)
+
+
+def _require_admin(view):
+    """
+    Guards an admin endpoint with the admin_token setting: 404 while no token
+    is configured, 401 unless the request sends "Authorization: Bearer <token>"
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _services()['settings']['admin_token']
+        if not token:
+            return jsonify({'error': 'Not Found'}), 404
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.encode(), token.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@bp.route('/admin/hot-keys', methods=['GET'])
+@_require_admin
+def hot_keys():
+    """
+    Lists the most redirected short keys seen by the worker answering the
+    request, with decayed counts (see hot_keys_decay).
+
+    Query parameters:
+      limit: number of keys to return (default 100)
+
+    Responses:
+      200: { "total": 1234, "hot_keys": [ { "short_key": "abc123", "count": 420, "error": 3 }, ... ] }
+      400: { "error": "limit must be a positive integer" }
+      401: { "error": "Unauthorized" }
+      404: hot-key tracking or the admin endpoints are disabled
+    """
+    tracker = _services()['hot_keys']
+    if tracker is None:
+        return jsonify({'error': 'Not Found'}), 404
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    return jsonify({
+        'total': tracker.total,
+        'hot_keys': [{'short_key': short_key, 'count': count, 'error': error}
+                     for short_key, count, error in tracker.top(limit)],
+    }), 200
+
+
+@bp.route('/admin/profile/cpu', methods=['POST'])
+@_require_admin
+def start_cpu_profile():
+    """
+    Starts sampling the stacks of every thread in the worker answering the
+    request; the collapsed stacks are written to path when it ends.
+
+    Query parameters:
+      seconds: how long to sample (default 30, at most profiling_max_seconds)
+      interval_ms: time between samples (default 5)
+
+    Responses:
+      202: { "path": "profiles/cpu-1234-20250701T120000-1.collapsed", "seconds": 30 }
+      400: { "error": "seconds must be between 0 and 300" }
+      401: { "error": "Unauthorized" }
+      404: profiling or the admin endpoints are disabled
+      409: { "error": "A CPU profile is already being recorded" }
+    """
+    profiler = _services()['profiler']
+    if profiler is None:
+        return jsonify({'error': 'Not Found'}), 404
+    try:
+        seconds = float(request.args.get('seconds', 30))
+        interval = float(request.args.get('interval_ms', 5)) / 1000
+        path = profiler.start_sampling(seconds, interval)
+    except ProfilingError as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'path': path, 'seconds': seconds}), 202
+
+
+@bp.route('/admin/profile/cpu/stop', methods=['POST'])
+@_require_admin
+def stop_cpu_profile():
+    """
+    Ends the worker's CPU sampling early and writes the profile.
+
+    Responses:
+      200: { "path": "profiles/cpu-1234-20250701T120000-1.collapsed" }
+      401: { "error": "Unauthorized" }
+      404: profiling or the admin endpoints are disabled
+      409: { "error": "No CPU profile is being recorded" }
+    """
+    profiler = _services()['profiler']
+    if profiler is None:
+        return jsonify({'error': 'Not Found'}), 404
+    try:
+        return jsonify({'path': profiler.stop_sampling()}), 200
+    except ProfilingError as e:
+        return jsonify({'error': str(e)}), 409
+
+
+@bp.route('/admin/profile/memory', methods=['POST'])
+@_require_admin
+def snapshot_memory():
+    """
+    Takes a tracemalloc snapshot in the worker answering the request and
+    writes the allocation growth since its previous snapshot by source line.
+    The first call starts tracing (which slows allocations down until it is
+    stopped) and only records the baseline.
+
+    Query parameters:
+      limit: differences returned in the response (default 20; the file has all)
+
+    Responses:
+      200: { "path": "profiles/memory-1234-20250701T120500-2.txt",
+             "top": [ "util/cache.py:80: size=1.2 MiB (+1.2 MiB), count=9000 (+9000), average=140 B", ... ] }
+           (path is null and top empty for the baseline)
+      400: { "error": "limit must be an integer" }
+      401: { "error": "Unauthorized" }
+      404: profiling or the admin endpoints are disabled
+    """
+    profiler = _services()['profiler']
+    if profiler is None:
+        return jsonify({'error': 'Not Found'}), 404
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    path, top = profiler.snapshot_memory(limit)
+    return jsonify({'path': path, 'top': top}), 200
+
+
+@bp.route('/admin/profile/memory/stop', methods=['POST'])
+@_require_admin
+def stop_memory_profile():
+    """
+    Stops tracemalloc in the worker answering the request.
+
+    Responses:
+      200: { "tracing": false, "was_tracing": true }
+      401: { "error": "Unauthorized" }
+      404: profiling or the admin endpoints are disabled
+    """
+    profiler = _services()['profiler']
+    if profiler is None:
+        return jsonify({'error': 'Not Found'}), 404
+    return jsonify({'tracing': False, 'was_tracing': profiler.stop_memory()}), 200
+
+
+def _encode_cursor(created_at: float, short_key: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, short_key]).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> tuple[float, str]:
+    """
+    Reads a position written by _encode_cursor
+    :param cursor:
+    :return: (created_at epoch, short_key)
+    :raises ValueError: if the cursor is malformed
+    """
+    try:
+        created_at, short_key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor') from None
+    if not isinstance(created_at, (int, float)) or isinstance(created_at, bool) or not isinstance(short_key, str):
+        raise ValueError('Invalid cursor')
+    return created_at, short_key
+
+
+def _mapping_json(row: dict, fields: tuple) -> dict:
+    item = {}
+    for field in fields:
+        value = row[field]
+        if value is not None:
+            if field in ('created_at', 'expires_at', 'last_accessed_at'):
+                value = datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+            elif field == 'url_hash':
+                value = bytes(value).hex()
+        item[field] = value
+    return item
+
+
+@bp.route('/admin/mappings', methods=['GET'])
+@_require_admin
+def list_mappings():
+    """
+    Lists mappings oldest first, one page at a time. next_cursor holds the
+    position of the page's last mapping and the next page starts after it
+    (keyset pagination), so a deep page costs the same as the first. Send
+    the same filters with every cursor.
+
+    Query parameters:
+      limit: mappings per page (default 100, at most admin_page_max_size)
+      cursor: next_cursor of the previous page
+      expires_before, expires_after: ISO-8601 with offset; only mappings expiring before / after it
+      domain: only long URLs that start with it after the scheme, such as "example.com" or "example.com/blog"
+      fields: comma-separated fields to return (default all)
+
+    Responses:
+      200: { "mappings": [ { "short_key": "abc123", "long_url": "https://example.com", ... }, ... ],
+             "next_cursor": "WzE3NTE..." }   # null on the last page
+      400: { "error": "limit must be between 1 and 1000" }
+      401: { "error": "Unauthorized" }
+      404: the admin endpoints are disabled
+      500: { "error": "Internal Server Error" }
+      503: { "error": "Service Unavailable" }
+    """
+    args = request.args
+    max_size = _services()['settings']['admin_page_max_size']
+    try:
+        try:
+            limit = int(args.get('limit', 100))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= max_size:
+            raise ValueError(f'limit must be between 1 and {max_size}')
+        after = _decode_cursor(args['cursor']) if args.get('cursor') else None
+        filters = {name: _parse_datetime(args[name], name).timestamp()
+                   for name in ('expires_before', 'expires_after') if args.get(name)}
+        fields = tuple(args['fields'].split(',')) if args.get('fields') else MAPPING_FIELDS
+        unknown = [field for field in fields if field not in MAPPING_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # One extra row tells whether there is a next page
+        rows = list(islice(_services()['repo'].iter_mappings(after=after, domain_prefix=args.get('domain'),
+                                                             fields=fields, batch_size=limit + 1, **filters),
+                           limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['short_key'])
+        return jsonify({'mappings': [_mapping_json(row, fields) for row in rows], 'next_cursor': next_cursor}), 200
+
+    except UnavailableError:
+        return jsonify({'error': 'Service Unavailable'}), 503
+
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+
+
+@bp.route('/docs', methods=['GET'])
 def api_docs():
     """
     Serves the API documentation file.
@@ -119,5 +813,10 @@ def api_docs():
         return jsonify({'error': 'Internal Server Error'}), 500
 
 
+app = create_app()
+url_generator = app.extensions['url_shortener']['url_generator']
+redirector = app.extensions['url_shortener']['redirector']
+
+
 if __name__ == '__main__':
     app.run(host='localhost', port=5000, debug=True)
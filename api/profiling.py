@@ -0,0 +1,77 @@
+"""
+Per-request and per-signal hooks for util.profiling.Profiler. create_app
+installs them only while profiling_enabled is set, so requests pay nothing
+for them otherwise.
+"""
+import hmac
+import logging
+import signal
+import threading
+
+from util.profiling import Profiler, ProfilingError
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATH_HEADER = 'X-Profile-Path'
+
+
+class ProfileRequests:
+    """
+    WSGI middleware running a request under cProfile when it sends `header`
+    with the admin token as its value. The pstats path is returned in the
+    X-Profile-Path response header; a profiled response is buffered so the
+    profile covers writing its body too.
+    """
+
+    def __init__(self, wsgi_app, profiler: Profiler, header: str, token: str):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+        self.token = token.encode()
+        self._environ_key = 'HTTP_' + header.upper().replace('-', '_')
+
+    def __call__(self, environ, start_response):
+        value = environ.get(self._environ_key)
+        if value is None or not hmac.compare_digest(value.encode(), self.token):
+            return self.wsgi_app(environ, start_response)
+        try:
+            with self.profiler.profile() as path:
+                def start_profiled_response(status, headers, exc_info=None):
+                    return start_response(status, headers + [(PROFILE_PATH_HEADER, path)], exc_info)
+
+                app_iter = self.wsgi_app(environ, start_profiled_response)
+                try:
+                    body = list(app_iter)
+                finally:
+                    if hasattr(app_iter, 'close'):
+                        app_iter.close()
+        except ProfilingError as e:
+            logger.warning("Request not profiled: %s", e)
+            return self.wsgi_app(environ, start_response)
+        return body
+
+
+def install_signal_handler(profiler: Profiler, seconds: float, signum: int = signal.SIGUSR2) -> bool:
+    """
+    Make `signum` start sampling the receiving process for `seconds`, or
+    stop it early when a profile is already being recorded, so a single
+    worker can be profiled with `kill -USR2 <pid>`. Servers reset signal
+    handlers in their workers (gunicorn does after the fork, so one
+    installed by a --preload app is lost and the signal kills the worker),
+    so install it in each worker: api.handlers.start_worker does.
+    :return: whether the handler was installed (only possible from the main thread)
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return False
+
+    def toggle(signum, frame):
+        # Stopping waits for the file, so it is left to a thread
+        try:
+            if profiler.sampling:
+                threading.Thread(target=profiler.stop_sampling, name='profiler-stop', daemon=True).start()
+            else:
+                logger.info("Sampling CPU profile to %s", profiler.start_sampling(seconds))
+        except (ProfilingError, ValueError) as e:
+            logger.warning("Profiling signal ignored: %s", e)
+
+    signal.signal(signum, toggle)
+    return True
@@ -0,0 +1,128 @@
+"""
+Compares the Flask app under a thread pool with the ASGI app under asyncio
+at high concurrency, when redirects wait on a slow database.
+
+    python -m benchmarks.async_load [--ops 20000] [--concurrency 500]
+                                    [--threads 32] [--latency-ms 5]
+                                    [--keys 10000] [--zipf 1.1]
+
+Both apps use the in-memory backend with the redirect cache disabled, and
+every repository lookup is delayed by --latency-ms to stand in for a
+database round trip: time.sleep() in the Flask app, which holds the
+thread, and asyncio.sleep() in the ASGI app, which does not. The Flask app
+is driven by --threads threads (a typical worker's thread count); the ASGI
+app by --concurrency in-flight requests on one event loop.
+
+Requests are dispatched in-process, so the figures exclude the network
+and server, and the two stacks pay the same preload and routing costs.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from api.asgi import create_asgi_app
+from api.handlers import create_app
+from benchmarks.load import run, summarise, zipf_sampler
+from model.url_mapping import URLMapping
+
+SETTINGS = {'storage_backend': 'memory', 'redirect_cache_size': 0, 'metrics_enabled': False,
+            'click_tracking_enabled': False}
+
+
+def redirect_paths(keys: list[str], ops: int, exponent: float, seed: int) -> list[str]:
+    pick = zipf_sampler(len(keys), exponent, random.Random(seed))
+    return [f"/{keys[pick()]}" for _ in range(ops)]
+
+
+def preload(repo, count: int) -> list[str]:
+    keys = [f"k{i:07d}" for i in range(count)]
+    for key in keys:
+        repo.save_url_mapping(URLMapping(short_key=key, long_url=f"https://example.com/{key}"))
+    return keys
+
+
+def bench_sync(paths: list[str], keys: int, latency: float, threads: int) -> dict:
+    app = create_app(SETTINGS)
+    repo = app.extensions['url_shortener']['repo']
+    preload(repo, keys)
+    lookup = repo.get_redirect_target
+
+    def slow_lookup(short_key):
+        time.sleep(latency)
+        return lookup(short_key)
+
+    repo.get_redirect_target = slow_lookup
+    results, elapsed = run(app, [('redirect', 'GET', path, None) for path in paths], threads=threads)
+    latencies, errors = results['redirect']
+    return summarise(latencies, errors, elapsed)
+
+
+async def _drive(app, paths: list[str], concurrency: int) -> tuple[list[float], int, float]:
+    latencies, errors = [], 0
+    queue = iter(paths)
+    perf_counter = time.perf_counter
+
+    async def worker():
+        nonlocal errors
+        for path in queue:
+            status = []
+            sent = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+
+            async def receive():
+                return next(sent)
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            start = perf_counter()
+            await app({'type': 'http', 'method': 'GET', 'path': path, 'headers': []}, receive, send)
+            latencies.append(perf_counter() - start)
+            if status[0] >= 500:
+                errors += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, perf_counter() - start
+
+
+def bench_async(paths: list[str], keys: int, latency: float, concurrency: int) -> dict:
+    app = create_asgi_app(SETTINGS)
+    # The in-memory backend sits behind a direct adapter; its sync repo takes the writes
+    preload(app.repo.repo, keys)
+    lookup = app.repo.get_redirect_target
+
+    async def slow_lookup(short_key):
+        await asyncio.sleep(latency)
+        return await lookup(short_key)
+
+    app.repo.get_redirect_target = slow_lookup
+    latencies, errors, elapsed = asyncio.run(_drive(app, paths, concurrency))
+    return summarise(latencies, errors, elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=10000, help='mappings preloaded before the run')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of the redirect key mix')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='delay added to every repository lookup')
+    parser.add_argument('--threads', type=int, default=32, help='threads driving the Flask app')
+    parser.add_argument('--concurrency', type=int, default=500, help='in-flight requests on the ASGI app')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    paths = redirect_paths([f"k{i:07d}" for i in range(args.keys)], args.ops, args.zipf, args.seed)
+    latency = args.latency_ms / 1000
+    print(f"{args.ops} redirects, {args.latency_ms}ms per lookup")
+    print(f"{'':>28} {'rps':>9} {'p50':>10} {'p99':>10} {'errors':>7}")
+    for name, summary in ((f"wsgi ({args.threads} threads)", bench_sync(paths, args.keys, latency, args.threads)),
+                          (f"asgi ({args.concurrency} in flight)",
+                           bench_async(paths, args.keys, latency, args.concurrency))):
+        print(f"{name:>28} {summary['throughput_rps']:>9.0f} {summary['p50_us'] / 1000:>8.1f}ms "
+              f"{summary['p99_us'] / 1000:>8.1f}ms {summary['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares redirect throughput of the Flask app with and without the WSGI
+fast path (the redirect_fast_path setting).
+
+    python -m benchmarks.fast_path [--ops 100000] [--keys 10000] [--zipf 1.1]
+                                   [--miss-ratio 0.05] [--set NAME=VALUE]
+
+Both apps use the in-memory backend and the default redirect cache, so the
+figures are the per-request cost of the HTTP layer: routing, the request
+context and building the response. Each request calls the app's WSGI
+callable directly with a prebuilt environ, without a server or the test
+client; --miss-ratio of the requests are for unknown keys (404).
+"""
+import argparse
+import io
+import random
+import sys
+import time
+
+from api.handlers import create_app
+from benchmarks.load import parse_overrides, percentile, zipf_sampler
+from model.url_mapping import URLMapping
+
+
+def environ(path: str) -> dict:
+    return {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': False, 'wsgi.multiprocess': True,
+        'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+
+
+def measure(app, paths: list[str]) -> dict:
+    wsgi_app = app.wsgi_app
+    statuses = []
+
+    def start_response(status, headers):
+        statuses.append(status)
+
+    latencies = []
+    perf_counter = time.perf_counter
+    for path in paths[:1000]:
+        b''.join(wsgi_app(environ(path), start_response))
+    start = perf_counter()
+    for path in paths:
+        request_start = perf_counter()
+        b''.join(wsgi_app(environ(path), start_response))
+        latencies.append(perf_counter() - request_start)
+    elapsed = perf_counter() - start
+    latencies.sort()
+    return {
+        'rps': len(paths) / elapsed,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=100000)
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--miss-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a util.config setting (repeatable)')
+    args = parser.parse_args(argv)
+
+    keys = [f"k{i:07d}" for i in range(args.keys)]
+    rng = random.Random(args.seed)
+    pick = zipf_sampler(len(keys), args.zipf, rng)
+    paths = [f"/missing{i}" if rng.random() < args.miss_ratio else f"/{keys[pick()]}" for i in range(args.ops)]
+
+    results = {}
+    for fast_path in (False, True):
+        settings = parse_overrides(args.set)
+        settings.update({'storage_backend': 'memory', 'redirect_fast_path': fast_path})
+        app = create_app(settings)
+        repo = app.extensions['url_shortener']['repo']
+        for start in range(0, len(keys), 1000):
+            repo.save_many([URLMapping(short_key=key, long_url=f"https://example.com/{key}")
+                            for key in keys[start:start + 1000]])
+        results[fast_path] = measure(app, paths)
+        click_tracker = app.extensions['url_shortener']['click_tracker']
+        if click_tracker is not None:
+            click_tracker.stop()
+
+    print(f"{'':>10} {'rps':>9} {'p50 us':>9} {'p99 us':>9}")
+    for fast_path, result in results.items():
+        print(f"{'fast path' if fast_path else 'flask':>10} {result['rps']:>9.0f} {result['p50_us']:>9.1f} "
+              f"{result['p99_us']:>9.1f}")
+    print(f"speed-up: {results[True]['rps'] / results[False]['rps']:.2f}x")
+    return results
+
+
+if __name__ == '__main__':
+    main()
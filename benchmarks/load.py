@@ -0,0 +1,273 @@
+"""
+Load test: drives the real Flask app from api/handlers.py in-process and
+reports throughput and p50/p95/p99/p999 latency per operation.
+
+    python -m benchmarks.load [--backend memory|sqlite|mongo] [--ops 50000]
+                              [--shorten-ratio 0.1] [--zipf 1.1] [--keys 10000]
+                              [--trace trace.jsonl] [--threads 1]
+                              [--set redirect_cache_size=0] [--output result.json]
+                              [--compare baseline.json]
+
+Workloads:
+  synthetic (default)  --keys mappings are preloaded, then --ops requests are
+                       issued: POST /shorten with probability --shorten-ratio,
+                       otherwise GET /<key> with keys drawn from a Zipf
+                       distribution (exponent --zipf; rank 1 is the hottest).
+  trace                --trace replays a JSONL file, one request per line:
+                       {"method": "GET", "path": "/abc123"} or
+                       {"method": "POST", "path": "/shorten", "json": {...}}.
+                       Paths may use "{key}", which is replaced by a preloaded
+                       key drawn from the same Zipf distribution.
+
+Backends (the storage_backend setting):
+  memory   the in-memory repository; measures the HTTP, service and cache
+           layers with next to no storage cost
+  sqlite   a SQLite file (--sqlite-path), removed after the run
+  mongo    a local mongod (--host/--port/--db); the benchmark collection is
+           dropped before and after the run
+
+Results are written as JSON (--output) so runs from different commits can be
+compared with --compare.
+"""
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import accumulate
+from typing import Optional
+
+from model.url_mapping import URLMapping
+from repository.factory import BACKENDS
+
+PERCENTILES = (('p50', 50), ('p95', 95), ('p99', 99), ('p999', 99.9))
+
+
+def zipf_sampler(n: int, exponent: float, rng: random.Random):
+    """
+    Return a function drawing ranks 0..n-1 with P(rank) proportional to 1/(rank+1)**exponent
+    """
+    cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+    population = range(n)
+    return lambda: rng.choices(population, cum_weights=cum_weights)[0]
+
+
+def synthetic_workload(keys: list[str], ops: int, shorten_ratio: float, exponent: float, seed: int):
+    rng = random.Random(seed)
+    pick = zipf_sampler(len(keys), exponent, rng)
+    for i in range(ops):
+        if rng.random() < shorten_ratio:
+            yield 'shorten', 'POST', '/shorten', {'long_url': f"https://example.com/new/{seed}/{i}"}
+        else:
+            yield 'redirect', 'GET', f"/{keys[pick()]}", None
+
+
+def trace_workload(path: str, keys: list[str], exponent: float, seed: int):
+    pick = zipf_sampler(len(keys), exponent, random.Random(seed))
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            method = entry.get('method', 'GET').upper()
+            path = entry['path']
+            # Group results by the path as written, so "{key}" lookups form one operation
+            name = entry.get('name') or f"{method} {path.split('?')[0]}"
+            if '{key}' in path:
+                path = path.replace('{key}', keys[pick()])
+            yield name, method, path, entry.get('json')
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarise(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    summary = {
+        'count': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_us': sum(latencies) / len(latencies) * 1e6 if latencies else 0.0,
+    }
+    for name, pct in PERCENTILES:
+        summary[f"{name}_us"] = percentile(latencies, pct) * 1e6
+    summary['max_us'] = latencies[-1] * 1e6 if latencies else 0.0
+    return summary
+
+
+def run(app, requests: list, threads: int = 1) -> tuple[dict, float]:
+    """
+    Issue requests against app and time each one
+    :param requests: (name, method, url, json body or None) tuples
+    :return: ({name: (latencies, errors)}, elapsed seconds)
+    """
+    results = defaultdict(lambda: ([], [0]))
+    lock = threading.Lock()
+
+    def worker(part):
+        client = app.test_client()
+        local = defaultdict(lambda: ([], [0]))
+        perf_counter = time.perf_counter
+        for name, method, url, body in part:
+            start = perf_counter()
+            response = client.open(url, method=method, json=body)
+            latency = perf_counter() - start
+            latencies, errors = local[name]
+            latencies.append(latency)
+            if response.status_code >= 500:
+                errors[0] += 1
+        with lock:
+            for name, (latencies, errors) in local.items():
+                results[name][0].extend(latencies)
+                results[name][1][0] += errors[0]
+
+    parts = [requests[i::threads] for i in range(threads)]
+    start = time.perf_counter()
+    if threads == 1:
+        worker(parts[0])
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(worker, parts))
+    elapsed = time.perf_counter() - start
+    return {name: (latencies, errors[0]) for name, (latencies, errors) in results.items()}, elapsed
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_overrides(pairs: list[str]) -> dict:
+    overrides = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    return overrides
+
+
+def compare(result: dict, baseline: dict) -> None:
+    print(f"\nChange against {baseline['meta'].get('commit') or 'baseline'}:")
+    for name, summary in result['operations'].items():
+        before = baseline['operations'].get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric in ('throughput_rps', 'p50_us', 'p99_us', 'p999_us'):
+            if before[metric]:
+                changes.append(f"{metric} {(summary[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+        print(f"  {name:>18}: " + "  ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=BACKENDS, default='memory')
+    parser.add_argument('--sqlite-path', default='bench.db')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--db', default='url_shortener_bench')
+    parser.add_argument('--ops', type=int, default=50000)
+    parser.add_argument('--keys', type=int, default=10000, help='mappings preloaded before the run')
+    parser.add_argument('--shorten-ratio', type=float, default=0.1)
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of the redirect key mix')
+    parser.add_argument('--trace', help='JSONL request trace to replay instead of the synthetic mix')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=1000, help='untimed requests issued first')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a util.config setting (repeatable)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    overrides = parse_overrides(args.set)
+    overrides.update({'storage_backend': args.backend, 'sqlite_path': args.sqlite_path,
+                      'mongo_host': args.host, 'mongo_port': args.port, 'mongo_db': args.db})
+    if args.backend == 'sqlite' and os.path.exists(args.sqlite_path):
+        parser.error(f"{args.sqlite_path} already exists")
+
+    from api.handlers import create_app
+    app = create_app(overrides)
+    services = app.extensions['url_shortener']
+    repo = services['repo']
+    if args.backend == 'mongo':
+        repo._connect()
+        URLMapping.drop_collection()
+
+    now = datetime.now(timezone.utc)
+    keys = [f"bench{i:04d}" for i in range(args.keys)]
+    for start in range(0, len(keys), 1000):
+        repo.save_many([URLMapping(short_key=key, long_url=f"https://example.com/{key}", created_at=now)
+                        for key in keys[start:start + 1000]])
+
+    try:
+        if args.trace:
+            workload = list(trace_workload(args.trace, keys, args.zipf, args.seed))
+        else:
+            workload = list(synthetic_workload(keys, args.ops, args.shorten_ratio, args.zipf, args.seed))
+        warmup = list(synthetic_workload(keys, args.warmup, args.shorten_ratio, args.zipf, args.seed + 1))
+        run(app, warmup)
+
+        measured, elapsed = run(app, workload, args.threads)
+        if services['click_tracker'] is not None:
+            services['click_tracker'].stop()
+    finally:
+        if args.backend == 'mongo':
+            URLMapping.drop_collection()
+        elif args.backend == 'sqlite':
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(args.sqlite_path + suffix):
+                    os.remove(args.sqlite_path + suffix)
+
+    all_latencies = [latency for latencies, _ in measured.values() for latency in latencies]
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'backend': args.backend,
+            'workload': {'trace': args.trace} if args.trace else {
+                'ops': args.ops, 'shorten_ratio': args.shorten_ratio, 'zipf': args.zipf},
+            'keys': args.keys,
+            'threads': args.threads,
+            'overrides': parse_overrides(args.set),
+        },
+        'overall': summarise(all_latencies, sum(errors for _, errors in measured.values()), elapsed),
+        'operations': {name: summarise(latencies, errors, elapsed) for name, (latencies, errors) in measured.items()},
+    }
+
+    print(f"{'operation':>18} {'count':>8} {'rps':>9} {'p50 us':>9} {'p95 us':>9} "
+          f"{'p99 us':>9} {'p999 us':>9} {'errors':>7}")
+    for name, summary in [('overall', result['overall'])] + sorted(result['operations'].items()):
+        print(f"{name:>18} {summary['count']:>8} {summary['throughput_rps']:>9.0f} {summary['p50_us']:>9.1f} "
+              f"{summary['p95_us']:>9.1f} {summary['p99_us']:>9.1f} {summary['p999_us']:>9.1f} "
+              f"{summary['errors']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark: per-lookup latency and allocations of the redirect lookup.
+
+Compares the previous path (hydrated URLMapping via get_mapping_by_key plus
+ZoneInfo-based expiry normalisation) with the projection-only
+get_redirect_target plus an epoch comparison.
+
+    python -m benchmarks.redirect_lookup [--host localhost] [--mock] [-n 20000]
+
+--mock runs against mongomock (if installed) instead of a live mongod; it
+measures client-side overhead only.
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from mongoengine import connect, disconnect
+
+from model.url_mapping import URLMapping
+from repository.db_repo import DBRepository
+
+
+def hydrated_lookup(repo: DBRepository, short_key: str) -> str:
+    # The lookup RedirectorService.redirect used before get_redirect_target
+    mapping = repo.get_mapping_by_key(short_key=short_key)
+    if mapping.expires_at:
+        expires_at = mapping.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=ZoneInfo("UTC"))
+        else:
+            expires_at = expires_at.astimezone(ZoneInfo("UTC"))
+        if expires_at < datetime.now(tz=ZoneInfo("UTC")):
+            raise RuntimeError("expired")
+    return mapping.long_url
+
+
+def projection_lookup(repo: DBRepository, short_key: str) -> str:
+    long_url, expires_at, _, _ = repo.get_redirect_target(short_key=short_key)
+    if expires_at is not None and expires_at < time.time():
+        raise RuntimeError("expired")
+    return long_url
+
+
+def measure(fn, repo: DBRepository, keys: list[str], iterations: int) -> dict:
+    for key in keys[:100]:
+        fn(repo, key)
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(repo, keys[i % len(keys)])
+    elapsed = time.perf_counter() - start
+
+    # Peak traced memory above the baseline while a single lookup runs
+    sample = min(iterations, 1000)
+    tracemalloc.start()
+    peak_total = 0
+    for i in range(sample):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(repo, keys[i % len(keys)])
+        peak_total += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return {
+        'us_per_lookup': elapsed / iterations * 1e6,
+        'peak_bytes_per_lookup': peak_total / sample,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--db', default='url_shortener_bench')
+    parser.add_argument('--mock', action='store_true', help='use mongomock instead of a live mongod')
+    parser.add_argument('-n', '--iterations', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=1000)
+    args = parser.parse_args()
+
+    disconnect(alias='default')
+    if args.mock:
+        import mongomock
+        connect(db=args.db, host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    else:
+        connect(db=args.db, host=args.host, port=args.port)
+
+    URLMapping.drop_collection()
+    now = datetime.now(tz=ZoneInfo("UTC"))
+    keys = [f"bench{i:04d}" for i in range(args.keys)]
+    for i, key in enumerate(keys):
+        URLMapping(short_key=key, long_url=f"https://example.com/{i}/" + "x" * 80, created_at=now,
+                   expires_at=now + timedelta(days=1) if i % 2 else None).save()
+
+    repo = DBRepository()
+    try:
+        for name, fn in (('hydrated', hydrated_lookup), ('projection', projection_lookup)):
+            result = measure(fn, repo, keys, args.iterations)
+            print(f"{name:>10}: {result['us_per_lookup']:8.1f} us/lookup  "
+                  f"{result['peak_bytes_per_lookup']:8.0f} peak bytes/lookup")
+    finally:
+        URLMapping.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+"""
+gunicorn settings, read from the working directory:
+
+    gunicorn -w 4 'api.handlers:create_app()'
+"""
+
+
+def post_worker_init(worker):
+    # Install the profiling signal handler (gunicorn resets signals in workers), pre-warm the
+    # redirect cache and start the background threads before the worker accepts requests;
+    # imported here so the master does not load the app unless asked to (--preload)
+    from api.handlers import start_worker
+    start_worker(worker.wsgi)
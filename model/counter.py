@@ -0,0 +1,10 @@
+from mongoengine import Document, StringField, IntField
+
+
+class Counter(Document):
+    """
+    A named monotonically increasing counter, used to lease blocks of integer IDs
+    """
+    meta = {'collection': 'counters'}
+    name = StringField(primary_key=True, required=True)
+    value = IntField(required=True, default=0)
@@ -1,27 +1,80 @@
-from datetime import datetime
-from mongoengine import Document, StringField, DateTimeField
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from mongoengine import Document, StringField, DateTimeField, IntField, BinaryField
+
+# Redirect status codes a mapping may use; 301 and 308 are permanent
+REDIRECT_CODES = (301, 302, 307, 308)
 
 
 def current_time() -> datetime:
     """
-    Returns the current time
+    Returns the current time as a timezone-aware UTC datetime
     :return: datetime
     """
-    return datetime.utcnow()
+    return datetime.now(timezone.utc)
+
+
+def to_epoch(value: Optional[datetime]) -> Optional[float]:
+    """
+    Converts a datetime to epoch seconds, treating naive values as UTC
+    :param value:
+    :return: float or None
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def expiry_index(expires_at_index: bool = True, ttl_seconds: Optional[int] = None) -> Optional[dict]:
+    """
+    The expires_at index for the expires_at_index and mapping_ttl_seconds
+    settings. It is created by DBRepository rather than declared in
+    URLMapping.meta, which is fixed when this module is imported.
+    :param expires_at_index: index expires_at for the sweeper
+    :param ttl_seconds: let MongoDB delete mappings this long after they expire
+    :return: create_index arguments ({'fields': [...], **options}), or None for no index
+    """
+    if ttl_seconds is not None:
+        # A TTL index doubles as the expires_at index
+        return {'fields': [('expires_at', 1)], 'expireAfterSeconds': ttl_seconds}
+    if expires_at_index:
+        return {'fields': [('expires_at', 1)]}
+    return None
 
 
 class URLMapping(Document):
     """
     A mapping from a short key to a long URL, with optional expiration
     """
-    meta = {'collection': 'url_mappings'}
+    # (created_at, _id) serves created_at range scans and the keyset-paginated
+    # listing; sparse: only mappings created in dedup mode carry a url_hash
+    meta = {'collection': 'url_mappings',
+            'indexes': [{'fields': ['created_at', 'short_key']}, {'fields': ['url_hash'], 'sparse': True}]}
     short_key = StringField(primary_key=True, required=True)
     long_url = StringField(required=True)
-    created_at = DateTimeField(default=current_time(), required=True)
+    created_at = DateTimeField(default=current_time, required=True)
     expires_at = DateTimeField(null=True)
+    # 16-byte hash of the normalised long_url, set in dedup mode
+    url_hash = BinaryField(max_bytes=16)
+    # Per-link HTTP redirect policy; unset means the service-wide default
+    redirect_code = IntField(choices=REDIRECT_CODES)
+    cache_max_age = IntField(min_value=0)
+    # Maintained by batched $inc updates from ClickTracker
+    click_count = IntField(default=0)
+    last_accessed_at = DateTimeField(null=True)
 
 
     def save(self, *args, **kwargs):
+        self.check_expiry()
+        return super(URLMapping, self).save(*args, **kwargs)
+
+    def check_expiry(self):
+        """
+        Raises ValueError if expires_at is before created_at
+        """
         # Enforce expires_at >= created_at using timestamps to handle aware/naive mix
         if self.expires_at and self.created_at:
             try:
@@ -31,7 +84,6 @@ class URLMapping(Document):
                 # In unusual cases, fallback to direct comparison
                 if self.expires_at < self.created_at:
                     raise ValueError("expires_at must not be before created_at")
-        return super(URLMapping, self).save(*args, **kwargs)
 
     def is_expired(self) -> bool:
         """
@@ -40,7 +92,7 @@ class URLMapping(Document):
         """
         if not self.expires_at:
             return False
-            # Compare using timestamps against current UTC
-        return self.expires_at.timestamp() < datetime.utcnow().timestamp()
+        # Compare epoch timestamps; naive values are stored UTC
+        return to_epoch(self.expires_at) < time.time()
 
 
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError as MongoDuplicateKeyError
+
+from model.url_mapping import URLMapping, to_epoch
+from repository.base import BaseRepository, DuplicateKeyError, RedirectRow, RepositoryHooks
+from repository.connection import MongoConnection
+from repository.db_repo import DBRepository
+from repository.guard import MongoGuard, guarded
+from repository.key_filter import KeyFilter
+from util.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBaseRepository(RepositoryHooks):
+    """
+    The part of the storage interface the async services use, as coroutines.
+    Same contract as the BaseRepository methods of the same names.
+    """
+
+    async def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        """
+        Save a new URLMapping or update an existing one
+        :param mapping:
+        :param force_insert: only insert; raise DuplicateKeyError if the key already exists
+        :return: URLMapping
+        """
+        raise NotImplementedError
+
+    async def existing_keys(self, short_keys: list[str]) -> set[str]:
+        """
+        Return which of the given short keys already exist
+        :param short_keys:
+        :return: set of existing short keys
+        """
+        raise NotImplementedError
+
+    async def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        """
+        Hot-path lookup for redirects
+        :param short_key:
+        :return: (long_url, expires_at epoch, redirect_code, cache_max_age) with None for unset
+                 fields, or None if not found
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """
+        Release connections; called when the app shuts down
+        """
+
+
+class AsyncDBRepository(AsyncBaseRepository):
+    """
+    MongoDB repository on pymongo's native asyncio client. The client is
+    bound to an event loop, so one is opened lazily per process and loop;
+    clients of loops that have since closed are closed when the next one is
+    opened. The guard, if any, is shared with the synchronous DBRepository.
+    """
+
+    def __init__(self, connection: MongoConnection, cache: Optional[LRUCache] = None,
+                 key_filter: Optional[KeyFilter] = None, dedup_cache: Optional[LRUCache] = None,
+                 guard: Optional[MongoGuard] = None):
+        super().__init__(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+        self.connection = connection
+        self.guard = guard
+        # (pid, event loop) -> client
+        self._clients: dict[tuple, AsyncMongoClient] = {}
+
+    async def _collection(self):
+        owner = (os.getpid(), asyncio.get_running_loop())
+        client = self._clients.get(owner)
+        if client is None:
+            # A client from the parent process or another loop cannot be reused
+            client = self._clients[owner] = AsyncMongoClient(**self.connection.client_options())
+            await self._close_stale()
+        return client[self.connection.db][URLMapping._get_collection_name()]
+
+    async def _close_stale(self) -> None:
+        """
+        Drops the clients this process can no longer use: those inherited from
+        the parent process, which are left for the parent to close, and those
+        of closed event loops, which are closed so their pools are released
+        """
+        pid = os.getpid()
+        for owner in [owner for owner in list(self._clients) if owner[0] != pid or owner[1].is_closed()]:
+            client = self._clients.pop(owner, None)
+            if client is None or owner[0] != pid:
+                continue
+            try:
+                await client.close()
+            except Exception:
+                logger.warning("Closing a MongoDB client of a closed event loop failed", exc_info=True)
+
+    @guarded('write')
+    async def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        mapping.check_expiry()
+        mapping.validate()
+        doc = mapping.to_mongo()
+        collection = await self._collection()
+        try:
+            if force_insert:
+                await collection.insert_one(doc)
+            else:
+                # As DBRepository, so a re-save keeps the click counts
+                await collection.update_one({'_id': mapping.short_key}, DBRepository._upsert(doc), upsert=True)
+        except MongoDuplicateKeyError as e:
+            raise DuplicateKeyError(f"Key {mapping.short_key} already exists") from e
+        self._on_saved(mapping.short_key)
+        return mapping
+
+    @guarded('read')
+    async def existing_keys(self, short_keys: list[str]) -> set[str]:
+        if not short_keys:
+            return set()
+        collection = await self._collection()
+        cursor = collection.find({'_id': {'$in': list(short_keys)}}, {'_id': 1})
+        return {doc['_id'] async for doc in cursor}
+
+    @guarded('redirect')
+    async def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        collection = await self._collection()
+        doc = await collection.find_one(
+            {'_id': short_key}, {'long_url': 1, 'expires_at': 1, 'redirect_code': 1, 'cache_max_age': 1})
+        if doc is None:
+            return None
+        return doc['long_url'], to_epoch(doc.get('expires_at')), doc.get('redirect_code'), doc.get('cache_max_age')
+
+    async def close(self) -> None:
+        client = self._clients.pop((os.getpid(), asyncio.get_running_loop()), None)
+        if client is not None:
+            await client.close()
+        await self._close_stale()
+
+
+class AsyncRepositoryAdapter(AsyncBaseRepository):
+    """
+    Async view of a synchronous repository. With offload=True each call runs
+    in the default thread pool, so blocking I/O (SQLite) does not stall the
+    event loop; the in-memory backend never blocks and is called directly.
+
+    The wrapped repository runs its own write hooks.
+    """
+
+    def __init__(self, repo: BaseRepository, offload: bool = True):
+        super().__init__()
+        self.repo = repo
+        self.offload = offload
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.offload:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        return await self._call(self.repo.save_url_mapping, mapping, force_insert=force_insert)
+
+    async def existing_keys(self, short_keys: list[str]) -> set[str]:
+        return await self._call(self.repo.existing_keys, short_keys)
+
+    async def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        return await self._call(self.repo.get_redirect_target, short_key)
@@ -0,0 +1,228 @@
+from datetime import datetime
+from typing import Iterator, Optional
+
+from model.url_mapping import URLMapping
+from repository.key_filter import KeyFilter
+from util.cache import LRUCache
+
+
+# (long_url, expires_at epoch, redirect_code, cache_max_age)
+RedirectRow = tuple[str, Optional[float], Optional[int], Optional[int]]
+
+# Field order of the rows yielded by iter_mapping_rows(); times are epoch seconds
+MAPPING_FIELDS = ('short_key', 'long_url', 'created_at', 'expires_at', 'url_hash', 'redirect_code',
+                  'cache_max_age', 'click_count', 'last_accessed_at')
+
+
+class DuplicateKeyError(Exception):
+    pass
+
+
+class UnavailableError(Exception):
+    """
+    The storage backend timed out, could not be reached, or is being
+    avoided by an open circuit breaker
+    """
+
+
+class RepositoryHooks:
+    """
+    In-process state kept in step with a repository's writes. Backends call
+    _on_saved / _on_deleted after every write so the redirect cache, key
+    filter and dedup cache match the data.
+    """
+
+    def __init__(self, cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                 dedup_cache: Optional[LRUCache] = None):
+        # Redirect cache to invalidate whenever a mapping is written or removed
+        self.cache = cache
+        # Short-key membership filter to keep in step with writes
+        self.key_filter = key_filter
+        # Recent url_hash -> short key pairs, dropped when their mapping is deleted
+        self.dedup_cache = dedup_cache
+
+    def _invalidate(self, short_key: str):
+        if self.cache is not None:
+            self.cache.invalidate(short_key)
+
+    def _on_saved(self, short_key: str):
+        if self.key_filter is not None:
+            self.key_filter.add(short_key)
+        self._invalidate(short_key)
+
+    def _on_deleted(self, short_key: str, url_hash: Optional[bytes] = None):
+        if self.key_filter is not None:
+            self.key_filter.discard(short_key)
+        self._invalidate(short_key)
+        if url_hash is not None and self.dedup_cache is not None:
+            self.dedup_cache.invalidate(bytes(url_hash).hex())
+
+
+class BaseRepository(RepositoryHooks):
+    """
+    Storage interface used by the services. Backends implement the methods
+    below and call the RepositoryHooks after every write.
+
+    Mappings go in and come out as URLMapping objects; hot-path lookups
+    return plain tuples with times as epoch seconds.
+    """
+
+    def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        """
+        Save a new URLMapping or update an existing one
+        :param mapping:
+        :param force_insert: only insert; raise DuplicateKeyError if the key already exists
+        :return: URLMapping
+        """
+        raise NotImplementedError
+
+    def save_many(self, mappings: list[URLMapping]) -> dict[int, Exception]:
+        """
+        Insert many new URLMappings; every mapping is attempted even if some fail
+        :param mappings:
+        :return: errors by index into mappings (DuplicateKeyError for taken keys); empty if all were saved
+        """
+        raise NotImplementedError
+
+    def existing_keys(self, short_keys: list[str]) -> set[str]:
+        """
+        Return which of the given short keys already exist
+        :param short_keys:
+        :return: set of existing short keys
+        """
+        raise NotImplementedError
+
+    def get_mapping_by_key(self, short_key: str) -> Optional[URLMapping]:
+        """
+        Retrieve a URLMapping by its short_key.
+        :param short_key:
+        :return: returns None if not found
+        """
+        raise NotImplementedError
+
+    def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        """
+        Hot-path lookup for redirects
+        :param short_key:
+        :return: (long_url, expires_at epoch, redirect_code, cache_max_age) with None for unset
+                 fields, or None if not found
+        """
+        raise NotImplementedError
+
+    def get_redirect_targets(self, short_keys: list[str]) -> dict[str, RedirectRow]:
+        """
+        get_redirect_target for many keys in one round trip, for cache pre-warming
+        :param short_keys:
+        :return: short_key -> redirect row, for the keys that exist
+        """
+        raise NotImplementedError
+
+    def find_by_url_hashes(self, url_hashes: list[bytes]) -> list[tuple[bytes, str, str, Optional[float]]]:
+        """
+        Find mappings by long-URL hash
+        :param url_hashes:
+        :return: (url_hash, short_key, long_url, expires_at epoch or None) tuples
+        """
+        raise NotImplementedError
+
+    def delete_mapping(self, short_key: str) -> bool:
+        """
+        Delete a URLMapping by its short_key
+        :param short_key:
+        :return: True if a mapping was deleted, else False
+        """
+        raise NotImplementedError
+
+    def list_expired_mappings(self, batch_size: int = 1000) -> Iterator[URLMapping]:
+        """
+        Stream all mappings that have expired (expires < now)
+        :param batch_size:
+        :return: iterator of URLMappings
+        """
+        raise NotImplementedError
+
+    def purge_expired(self, batch_size: int = 1000, max_runtime: Optional[float] = None) -> int:
+        """
+        Delete expired mappings in chunks of batch_size
+        :param batch_size: mappings per delete
+        :param max_runtime: stop starting new chunks after this many seconds
+        :return: number of mappings deleted
+        """
+        raise NotImplementedError
+
+    def allocate_id_block(self, name: str, size: int) -> int:
+        """
+        Atomically lease a block of `size` integer IDs from the named counter
+        :param name: counter name
+        :param size: number of IDs to lease
+        :return: the first ID of the leased block [start, start + size)
+        """
+        raise NotImplementedError
+
+    def read_counter(self, name: str) -> int:
+        """
+        Current value of the named counter, without changing it
+        :param name: counter name
+        :return: the start of the next block allocate_id_block() would lease (0 for a new counter)
+        """
+        raise NotImplementedError
+
+    def iter_short_keys(self, created_since: Optional[datetime] = None,
+                        batch_size: int = 10000) -> Iterator[str]:
+        """
+        Stream every short key
+        :param created_since: epoch seconds or datetime; only keys created at or after it
+        :param batch_size:
+        :return: iterator of short keys
+        """
+        raise NotImplementedError
+
+    def iter_redirect_rows(self, created_since: Optional[datetime] = None,
+                           batch_size: int = 10000) -> Iterator[tuple]:
+        """
+        Stream the redirect fields of every mapping that has not expired, in ascending short_key order
+        :param created_since: epoch seconds or datetime; only mappings created at or after it
+        :param batch_size:
+        :return: iterator of (short_key, long_url, expires_at epoch, redirect_code, cache_max_age)
+        """
+        raise NotImplementedError
+
+    def iter_mapping_rows(self, batch_size: int = 10000) -> Iterator[tuple]:
+        """
+        Stream every mapping, expired or not, as a plain tuple
+        :param batch_size:
+        :return: iterator of tuples with the fields in MAPPING_FIELDS order
+        """
+        raise NotImplementedError
+
+    def iter_mappings(self, after: Optional[tuple[float, str]] = None, expires_before: Optional[float] = None,
+                      expires_after: Optional[float] = None, domain_prefix: Optional[str] = None,
+                      fields: tuple = MAPPING_FIELDS, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        Stream mappings in (created_at, short_key) order, resuming after a
+        position instead of skipping over the mappings before it
+        :param after: (created_at epoch, short_key) of the last mapping already seen
+        :param expires_before: epoch seconds; only mappings expiring before it
+        :param expires_after: epoch seconds; only mappings expiring after it
+        :param domain_prefix: only mappings whose long URL is http(s)://, scheme in any case, then it
+        :param fields: names from MAPPING_FIELDS to return
+        :param batch_size:
+        :return: iterator of dicts holding fields plus short_key and created_at, with times as epoch seconds
+        """
+        raise NotImplementedError
+
+    def increment_clicks(self, clicks: dict[str, tuple[int, float]]) -> int:
+        """
+        Apply buffered click counts
+        :param clicks: short_key -> (clicks to add, last access epoch)
+        :return: number of mappings updated
+        """
+        raise NotImplementedError
+
+    def get_click_stats(self, short_key: str) -> Optional[tuple[int, Optional[float]]]:
+        """
+        Fetch the persisted click count and last access time of a mapping
+        :param short_key:
+        :return: (click_count, last_accessed_at epoch or None), or None if not found
+        """
+        raise NotImplementedError
@@ -0,0 +1,76 @@
+from mongoengine import connect, disconnect
+
+from util.process import OncePerProcess
+
+
+class MongoConnection:
+    """
+    Lazily opens the mongoengine connection the first time it is needed in
+    each process. Nothing is opened at import or construction time, and a
+    forked worker never reuses its parent's client.
+    """
+
+    def __init__(self, db: str = 'url_shortener', host: str = 'localhost', port: int = 27017,
+                 username: str = None, password: str = None, authentication_source: str = 'admin',
+                 max_pool_size: int = 100, connect_timeout_ms: int = 2000,
+                 server_selection_timeout_ms: int = 5000, socket_timeout_ms: int = 5000,
+                 alias: str = 'default'):
+        self.alias = alias
+        self._settings = dict(
+            db=db,
+            host=host,
+            port=port,
+            username=username,
+            password=password,
+            authentication_source=authentication_source,
+            maxPoolSize=max_pool_size,
+            connectTimeoutMS=connect_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+        )
+        self.ensure = OncePerProcess(self._connect)
+
+    @classmethod
+    def from_config(cls, settings: dict, alias: str = 'default', host: str = None) -> 'MongoConnection':
+        """
+        Build from the mongo_* settings of util.config
+        :param settings: dict of config values
+        :param alias: mongoengine connection alias
+        :param host: host or mongodb:// URI to use instead of mongo_host (e.g. a shard's)
+        :return: MongoConnection
+        """
+        return cls(
+            db=settings['mongo_db'],
+            host=host or settings['mongo_host'],
+            port=settings['mongo_port'],
+            username=settings['mongo_username'],
+            password=settings['mongo_password'],
+            authentication_source=settings['mongo_auth_source'],
+            max_pool_size=settings['mongo_max_pool_size'],
+            connect_timeout_ms=settings['mongo_connect_timeout_ms'],
+            server_selection_timeout_ms=settings['mongo_server_selection_timeout_ms'],
+            socket_timeout_ms=settings['mongo_socket_timeout_ms'],
+            alias=alias,
+        )
+
+    def _connect(self):
+        # Drop any client registered before a fork; connect=False defers the
+        # socket until the first operation in this process
+        disconnect(alias=self.alias)
+        connect(alias=self.alias, connect=False, **self._settings)
+
+    @property
+    def db(self) -> str:
+        return self._settings['db']
+
+    def client_options(self) -> dict:
+        """
+        The same settings as keyword arguments for a pymongo client
+        (e.g. AsyncMongoClient), which takes authSource instead of
+        mongoengine's authentication_source and no database name
+        :return: dict
+        """
+        options = {name: value for name, value in self._settings.items()
+                   if name not in ('db', 'authentication_source')}
+        options['authSource'] = self._settings['authentication_source']
+        return options
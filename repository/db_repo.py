@@ -1,69 +1,457 @@
-from typing import Optional
-from mongoengine import connect, DoesNotExist, ValidationError
+import re
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+from mongoengine import DEFAULT_CONNECTION_NAME, Document, ValidationError
+from mongoengine.connection import get_db
+from bson import Binary
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError as PyMongoDuplicateKeyError
+from model.counter import Counter
 from model.url_mapping import URLMapping
-from model.url_mapping import current_time
-
-# Establish MongoDB connection
-connect(
-    db="url_shortener",
-    host="localhost",
-    port=27017,
-    username=None,
-    password=None,
-    authentication_source="admin"
-)
-
-class DBRepository:
+from model.url_mapping import current_time, expiry_index, to_epoch
+from repository.base import MAPPING_FIELDS, BaseRepository, DuplicateKeyError, RedirectRow
+from repository.connection import MongoConnection
+from repository.guard import MongoGuard, guarded
+from repository.key_filter import KeyFilter
+from util.cache import LRUCache
+from util.process import OncePerProcess
+
+# MongoDB server error code for a unique index violation
+DUPLICATE_KEY_CODE = 11000
+# Key pattern of the index the keyset-paginated listing walks
+KEYSET_INDEX = [('created_at', 1), ('_id', 1)]
+# Fields a re-save replaces; click_count and last_accessed_at belong to the
+# stored document, kept up to date by ClickTracker's $inc updates
+REPLACED_FIELDS = ('long_url', 'created_at', 'expires_at', 'url_hash', 'redirect_code', 'cache_max_age')
+
+
+class DBRepository(BaseRepository):
     """
-    Repository for CRUD operations on URLMapping documents
+    Repository for CRUD operations on URLMapping documents in MongoDB.
+
+    With a guard, single-document and batch calls run under per-operation
+    time budgets and a circuit breaker; the streaming and sweeping methods
+    used by the offline tools are not guarded.
+
+    Documents are read and written through the collection of the
+    connection's alias, so several repositories (one per shard) can each
+    use their own server.
     """
 
-    def save_url_mapping(self, mapping: URLMapping) -> URLMapping:
+    def __init__(self, cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                 connection: Optional[MongoConnection] = None, dedup_cache: Optional[LRUCache] = None,
+                 guard: Optional[MongoGuard] = None, expires_at_index: bool = True,
+                 mapping_ttl_seconds: Optional[int] = None):
+        super().__init__(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+        # Opened lazily per process; None means the caller manages the connection
+        self.connection = connection
+        self.guard = guard
+        self.expiry_index = expiry_index(expires_at_index, mapping_ttl_seconds)
+        self.alias = connection.alias if connection is not None else DEFAULT_CONNECTION_NAME
+        self._ensure_indexes = OncePerProcess(self._create_indexes)
+
+    def _connect(self):
+        if self.connection is not None:
+            self.connection.ensure()
+        self._ensure_indexes()
+
+    def _collection(self, document: Optional[type[Document]] = None) -> Collection:
+        # mongoengine binds documents to the default alias (and creates their
+        # indexes there); other aliases get the same collection from their own database
+        document = document or URLMapping
+        if self.alias == DEFAULT_CONNECTION_NAME:
+            return document._get_collection()
+        return get_db(self.alias)[document._get_collection_name()]
+
+    def _create_indexes(self):
+        # The expires_at index follows this repository's settings; mongoengine
+        # only creates URLMapping.meta's indexes on the default alias
+        specs = [self.expiry_index] if self.expiry_index is not None else []
+        if self.alias != DEFAULT_CONNECTION_NAME:
+            specs += URLMapping._meta['index_specs']
+        if not specs:
+            return
+        collection = self._collection()
+        for spec in specs:
+            options = dict(spec)
+            collection.create_index(options.pop('fields'), **options)
+
+    @guarded('write')
+    def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
         """
         Save a new URLMapping or update an existing one
         :param mapping:
+        :param force_insert: only insert; raise DuplicateKeyError if the key already exists
         :return: URLMapping
         """
-        mapping.save()
+        self._connect()
+        mapping.check_expiry()
+        mapping.validate()
+        doc = mapping.to_mongo()
+        try:
+            if force_insert:
+                self._collection().insert_one(doc)
+            else:
+                self._collection().update_one({'_id': mapping.short_key}, self._upsert(doc), upsert=True)
+        except PyMongoDuplicateKeyError as e:
+            raise DuplicateKeyError(f"Key {mapping.short_key} already exists") from e
+        self._on_saved(mapping.short_key)
         return mapping
 
+    @staticmethod
+    def _upsert(doc) -> dict:
+        # Replaces the mapping's own fields (unsetting those now empty) and
+        # sets the click counters only when the document is inserted
+        update = {'$set': {field: doc[field] for field in REPLACED_FIELDS if field in doc},
+                  '$setOnInsert': {field: doc[field] for field in doc
+                                   if field != '_id' and field not in REPLACED_FIELDS}}
+        unset = {field: '' for field in REPLACED_FIELDS if field not in doc}
+        if unset:
+            update['$unset'] = unset
+        return update
+
+    @guarded('write')
+    def save_many(self, mappings: list[URLMapping]) -> dict[int, Exception]:
+        """
+        Insert many new URLMappings with a single unordered bulk insert.
+        Every mapping is attempted even if some fail.
+        :param mappings:
+        :return: errors by index into mappings (DuplicateKeyError for taken keys); empty if all were saved
+        """
+        self._connect()
+        errors: dict[int, Exception] = {}
+        docs, positions = [], []
+        for i, mapping in enumerate(mappings):
+            try:
+                mapping.check_expiry()
+                mapping.validate()
+            except (ValueError, ValidationError) as e:
+                errors[i] = e
+                continue
+            docs.append(mapping.to_mongo())
+            positions.append(i)
+
+        if docs:
+            try:
+                self._collection().insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                for write_error in e.details.get('writeErrors', []):
+                    i = positions[write_error['index']]
+                    if write_error.get('code') == DUPLICATE_KEY_CODE:
+                        errors[i] = DuplicateKeyError(f"Key {mappings[i].short_key} already exists")
+                    else:
+                        errors[i] = Exception(write_error.get('errmsg', 'Write failed'))
+            for i in positions:
+                if i not in errors:
+                    self._on_saved(mappings[i].short_key)
+        return errors
 
+
+    @guarded('read')
+    def existing_keys(self, short_keys: list[str]) -> set[str]:
+        """
+        Return which of the given short keys already exist, using a single $in query
+        :param short_keys:
+        :return: set of existing short keys
+        """
+        self._connect()
+        if not short_keys:
+            return set()
+        cursor = self._collection().find({'_id': {'$in': list(short_keys)}}, {'_id': 1})
+        return {doc['_id'] for doc in cursor}
+
+
+    @guarded('read')
     def get_mapping_by_key(self, short_key: str) -> Optional[URLMapping]:
         """
         Retrieve a URLMapping by its short_key.
         :param short_key:
         :return: returns None if not found
         """
-        try:
-            return URLMapping.objects.get(short_key=short_key)
-        except (DoesNotExist, ValidationError):
+        self._connect()
+        doc = self._collection().find_one({'_id': short_key})
+        return URLMapping._from_son(doc) if doc is not None else None
+
+
+    @guarded('redirect')
+    def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        """
+        Hot-path lookup for redirects: fetches only the redirect fields as a
+        raw document, skipping URLMapping construction and validation.
+        :param short_key:
+        :return: (long_url, expires_at epoch, redirect_code, cache_max_age), or None if not found
+        """
+        self._connect()
+        doc = self._collection().find_one(
+            {'_id': short_key}, {'long_url': 1, 'expires_at': 1, 'redirect_code': 1, 'cache_max_age': 1})
+        if doc is None:
             return None
+        return doc['long_url'], to_epoch(doc.get('expires_at')), doc.get('redirect_code'), doc.get('cache_max_age')
+
+    @guarded('redirect')
+    def get_redirect_targets(self, short_keys: list[str]) -> dict[str, RedirectRow]:
+        """
+        Redirect rows for many keys with a single $in query
+        :param short_keys:
+        :return: short_key -> (long_url, expires_at epoch, redirect_code, cache_max_age), for the keys that exist
+        """
+        self._connect()
+        if not short_keys:
+            return {}
+        cursor = self._collection().find(
+            {'_id': {'$in': list(short_keys)}}, {'long_url': 1, 'expires_at': 1, 'redirect_code': 1, 'cache_max_age': 1})
+        return {doc['_id']: (doc['long_url'], to_epoch(doc.get('expires_at')), doc.get('redirect_code'),
+                             doc.get('cache_max_age'))
+                for doc in cursor}
 
 
+    @guarded('read')
+    def find_by_url_hashes(self, url_hashes: list[bytes]) -> list[tuple[bytes, str, str, Optional[float]]]:
+        """
+        Find mappings by long-URL hash with a single $in query on the url_hash index
+        :param url_hashes:
+        :return: (url_hash, short_key, long_url, expires_at epoch or None) tuples
+        """
+        self._connect()
+        if not url_hashes:
+            return []
+        cursor = self._collection().find(
+            {'url_hash': {'$in': [Binary(url_hash) for url_hash in url_hashes]}}, {'url_hash': 1, 'long_url': 1, 'expires_at': 1})
+        return [(bytes(doc['url_hash']), doc['_id'], doc['long_url'], to_epoch(doc.get('expires_at')))
+                for doc in cursor]
+
+
+    @guarded('write')
     def delete_mapping(self, short_key: str) -> bool:
         """
         Delete a URLMapping by its short_key
         :param short_key:
         :return: True if a document was deleted, else False
         """
-        result = URLMapping.objects(short_key=short_key).delete()
-        return result > 0
+        self._connect()
+        doc = self._collection().find_one_and_delete({'_id': short_key}, projection={'url_hash': 1})
+        self._on_deleted(short_key, doc.get('url_hash') if doc is not None else None)
+        return doc is not None
+
+
+    def list_expired_mappings(self, batch_size: int = 1000) -> Iterator[URLMapping]:
+        """
+        Stream all mappings that have expired (expires < now) from a cursor,
+        fetching batch_size documents per round trip
+        :param batch_size:
+        :return: iterator of URLMappings
+        """
+        self._connect()
+        cursor = self._collection().find({'expires_at': {'$lt': current_time()}}).batch_size(batch_size)
+        for doc in cursor:
+            yield URLMapping._from_son(doc)
+
+
+    def purge_expired(self, batch_size: int = 1000, max_runtime: Optional[float] = None) -> int:
+        """
+        Delete expired mappings in chunks of batch_size with delete_many on _id $in
+        :param batch_size: documents per delete
+        :param max_runtime: stop starting new chunks after this many seconds
+        :return: number of mappings deleted
+        """
+        self._connect()
+        collection = self._collection()
+        now = current_time()
+        deadline = time.monotonic() + max_runtime if max_runtime is not None else None
+        deleted = 0
+        while deadline is None or time.monotonic() < deadline:
+            url_hashes = {doc['_id']: doc.get('url_hash') for doc in
+                          collection.find({'expires_at': {'$lt': now}}, {'_id': 1, 'url_hash': 1}).limit(batch_size)}
+            if not url_hashes:
+                break
+            result = collection.delete_many({'_id': {'$in': list(url_hashes)}, 'expires_at': {'$lt': now}})
+            deleted += result.deleted_count
+            for short_key, url_hash in url_hashes.items():
+                self._on_deleted(short_key, url_hash)
+        return deleted
+
+
+    @guarded('write')
+    def allocate_id_block(self, name: str, size: int) -> int:
+        """
+        Atomically lease a block of `size` integer IDs from the named counter
+        :param name: counter name
+        :param size: number of IDs to lease
+        :return: the first ID of the leased block [start, start + size)
+        """
+        self._connect()
+        doc = self._collection(Counter).find_one_and_update(
+            {'_id': name},
+            {'$inc': {'value': size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc['value'] - size
+
+
+    @guarded('read')
+    def read_counter(self, name: str) -> int:
+        """
+        Current value of the named counter, without changing it
+        :param name: counter name
+        :return: the start of the next block allocate_id_block() would lease (0 for a new counter)
+        """
+        self._connect()
+        doc = self._collection(Counter).find_one({'_id': name}, {'value': 1})
+        return doc['value'] if doc is not None else 0
 
 
-    def list_expired_mappings(self) -> list[URLMapping]:
+    def iter_short_keys(self, created_since: Optional[datetime] = None,
+                        batch_size: int = 10000) -> Iterator[str]:
         """
-        List all mappings that have expired (expires < now)
-        :return: list of URLMappings
+        Stream every short key without loading the documents
+        :param created_since: epoch seconds or datetime; only keys created at or after it
+        :param batch_size: cursor batch size
+        :return: iterator of short keys
         """
-        return list(URLMapping.objects(expires_at__lt=current_time()))
+        self._connect()
+        query = {}
+        if created_since is not None:
+            if not isinstance(created_since, datetime):
+                created_since = datetime.fromtimestamp(created_since, tz=timezone.utc)
+            query['created_at'] = {'$gte': created_since}
+        cursor = self._collection().find(query, {'_id': 1}).batch_size(batch_size)
+        for doc in cursor:
+            yield doc['_id']
 
 
+    def iter_redirect_rows(self, created_since: Optional[datetime] = None,
+                           batch_size: int = 10000) -> Iterator[tuple]:
+        """
+        Stream the redirect fields of every unexpired mapping in _id order,
+        so the scan walks the _id index instead of sorting in memory
+        :param created_since: epoch seconds or datetime; only mappings created at or after it
+        :param batch_size: cursor batch size
+        :return: iterator of (short_key, long_url, expires_at epoch, redirect_code, cache_max_age)
+        """
+        self._connect()
+        query = {'$or': [{'expires_at': None}, {'expires_at': {'$gte': current_time()}}]}
+        if created_since is not None:
+            if not isinstance(created_since, datetime):
+                created_since = datetime.fromtimestamp(created_since, tz=timezone.utc)
+            query['created_at'] = {'$gte': created_since}
+        cursor = self._collection().find(
+            query, {'long_url': 1, 'expires_at': 1, 'redirect_code': 1, 'cache_max_age': 1}
+        ).sort('_id', 1).batch_size(batch_size)
+        for doc in cursor:
+            yield (doc['_id'], doc['long_url'], to_epoch(doc.get('expires_at')),
+                   doc.get('redirect_code'), doc.get('cache_max_age'))
 
 
+    def iter_mapping_rows(self, batch_size: int = 10000) -> Iterator[tuple]:
+        """
+        Stream every mapping from a batched cursor as raw documents, skipping
+        URLMapping construction
+        :param batch_size: cursor batch size
+        :return: iterator of tuples with the fields in MAPPING_FIELDS order
+        """
+        self._connect()
+        cursor = self._collection().find({}, {field: 1 for field in MAPPING_FIELDS[1:]})
+        for doc in cursor.batch_size(batch_size):
+            url_hash = doc.get('url_hash')
+            yield (doc['_id'], doc['long_url'], to_epoch(doc.get('created_at')), to_epoch(doc.get('expires_at')),
+                   bytes(url_hash) if url_hash is not None else None, doc.get('redirect_code'),
+                   doc.get('cache_max_age'), doc.get('click_count', 0), to_epoch(doc.get('last_accessed_at')))
 
 
+    def iter_mappings(self, after: Optional[tuple[float, str]] = None, expires_before: Optional[float] = None,
+                      expires_after: Optional[float] = None, domain_prefix: Optional[str] = None,
+                      fields: tuple = MAPPING_FIELDS, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        Stream mappings in (created_at, _id) order, one query of batch_size
+        per batch. Each query seeks the (created_at, _id) index to the last
+        position rather than skipping, so a deep page costs the same as the first
+        :param after: (created_at epoch, short_key) of the last mapping already seen
+        :param expires_before: epoch seconds; only mappings expiring before it
+        :param expires_after: epoch seconds; only mappings expiring after it
+        :param domain_prefix: only mappings whose long URL is http(s)://, scheme in any case, then it
+        :param fields: names from MAPPING_FIELDS to return
+        :param batch_size: mappings per query
+        :return: iterator of dicts holding fields plus short_key and created_at, with times as epoch seconds
+        """
+        query = {}
+        if expires_before is not None or expires_after is not None:
+            query['expires_at'] = {}
+            if expires_before is not None:
+                query['expires_at']['$lt'] = datetime.fromtimestamp(expires_before, tz=timezone.utc)
+            if expires_after is not None:
+                query['expires_at']['$gt'] = datetime.fromtimestamp(expires_after, tz=timezone.utc)
+        if domain_prefix:
+            # Same rule as util.urls.has_domain_prefix: the scheme in any case, the prefix as given
+            query['long_url'] = {'$regex': '^(?i:https?)://' + re.escape(domain_prefix)}
+        projection = {field: 1 for field in fields if field != 'short_key'}
+        projection['created_at'] = 1
+        position = (datetime.fromtimestamp(after[0], tz=timezone.utc), after[1]) if after is not None else None
+        while True:
+            docs = self._find_mappings(query, projection, position, batch_size)
+            for doc in docs:
+                row = {'short_key': doc['_id'], 'created_at': to_epoch(doc['created_at'])}
+                for field in fields:
+                    if field not in row:
+                        value = doc.get(field)
+                        if field in ('expires_at', 'last_accessed_at'):
+                            value = to_epoch(value)
+                        elif field == 'url_hash' and value is not None:
+                            value = bytes(value)
+                        elif field == 'click_count':
+                            value = value or 0
+                        row[field] = value
+                yield row
+            if len(docs) < batch_size:
+                return
+            position = (docs[-1]['created_at'], docs[-1]['_id'])
 
 
+    @guarded('read')
+    def _find_mappings(self, query: dict, projection: dict, position: Optional[tuple[datetime, str]],
+                       limit: int) -> list[dict]:
+        # One batch of iter_mappings, so each batch gets the read time budget
+        self._connect()
+        if position is not None:
+            created_at, short_key = position
+            # The $gte bound lets the index scan start at the position
+            query = {'$and': [query, {'created_at': {'$gte': created_at}},
+                              {'$or': [{'created_at': {'$gt': created_at}}, {'_id': {'$gt': short_key}}]}]}
+        cursor = self._collection().find(query, projection).sort(KEYSET_INDEX).hint(KEYSET_INDEX)
+        return list(cursor.limit(limit))
 
 
+    @guarded('write')
+    def increment_clicks(self, clicks: dict[str, tuple[int, float]]) -> int:
+        """
+        Apply buffered click counts with a single unordered bulk write
+        :param clicks: short_key -> (clicks to add, last access epoch)
+        :return: number of mappings updated
+        """
+        self._connect()
+        if not clicks:
+            return 0
+        requests = [
+            UpdateOne({'_id': short_key},
+                      {'$inc': {'click_count': count},
+                       '$max': {'last_accessed_at': datetime.fromtimestamp(accessed_at, tz=timezone.utc)}})
+            for short_key, (count, accessed_at) in clicks.items()
+        ]
+        result = self._collection().bulk_write(requests, ordered=False)
+        return result.modified_count
 
+
+    @guarded('read')
+    def get_click_stats(self, short_key: str) -> Optional[tuple[int, Optional[float]]]:
+        """
+        Fetch the persisted click count and last access time of a mapping
+        :param short_key:
+        :return: (click_count, last_accessed_at epoch or None), or None if not found
+        """
+        self._connect()
+        doc = self._collection().find_one({'_id': short_key}, {'click_count': 1, 'last_accessed_at': 1})
+        if doc is None:
+            return None
+        return doc.get('click_count', 0), to_epoch(doc.get('last_accessed_at'))
@@ -0,0 +1,89 @@
+from typing import Optional
+
+from repository.async_repo import AsyncBaseRepository, AsyncDBRepository, AsyncRepositoryAdapter
+from repository.base import BaseRepository
+from repository.connection import MongoConnection
+from repository.db_repo import DBRepository
+from repository.guard import MongoGuard
+from repository.key_filter import KeyFilter
+from repository.memory_repo import MemoryRepository
+from repository.sharded_repo import ShardedRepository
+from repository.sqlite_repo import SQLiteRepository
+from util.cache import LRUCache
+
+BACKENDS = ('mongo', 'sqlite', 'memory')
+
+
+def create_repository(settings: dict, cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                      dedup_cache: Optional[LRUCache] = None, guard: Optional[MongoGuard] = None) -> BaseRepository:
+    """
+    Builds the repository selected by settings['storage_backend']
+    :param settings: dict from util.config.as_dict()
+    :param cache: redirect cache to keep in step with writes
+    :param key_filter: short-key filter to keep in step with writes
+    :param dedup_cache: url_hash -> short key cache to keep in step with deletes
+    :param guard: time budgets and circuit breaker for MongoDB calls (ignored by the other backends)
+    :return: BaseRepository
+    """
+    backend = settings['storage_backend']
+    if backend == 'mongo' and settings['mongo_shards']:
+        shards = create_shards(settings, cache=cache, key_filter=key_filter, dedup_cache=dedup_cache, guard=guard)
+        # Holds only the counters; the mappings and their indexes are on the shards
+        counters = DBRepository(connection=MongoConnection.from_config(settings), guard=guard,
+                                expires_at_index=False)
+        return ShardedRepository(shards, counters, vnodes=settings['mongo_shard_vnodes'], cache=cache,
+                                 key_filter=key_filter, dedup_cache=dedup_cache, nodes=settings['mongo_shards'],
+                                 previous_nodes=settings['mongo_previous_shards'])
+    if backend == 'mongo':
+        return DBRepository(cache=cache, key_filter=key_filter, connection=MongoConnection.from_config(settings),
+                            dedup_cache=dedup_cache, guard=guard, expires_at_index=settings['expires_at_index'],
+                            mapping_ttl_seconds=settings['mapping_ttl_seconds'])
+    if backend == 'sqlite':
+        return SQLiteRepository(settings['sqlite_path'], cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+    if backend == 'memory':
+        return MemoryRepository(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+    raise ValueError(f"Unknown storage_backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def create_shards(settings: dict, cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                  dedup_cache: Optional[LRUCache] = None,
+                  guard: Optional[MongoGuard] = None) -> dict[str, DBRepository]:
+    """
+    Builds one repository per entry of settings['mongo_shards'] and
+    settings['mongo_previous_shards'] (the former's host wins for a name in
+    both), each on its own connection alias and with its own circuit breaker
+    :param settings: dict from util.config.as_dict()
+    :param cache: redirect cache to keep in step with writes
+    :param key_filter: short-key filter to keep in step with writes
+    :param dedup_cache: url_hash -> short key cache to keep in step with deletes
+    :param guard: time budgets and circuit breaker settings to copy for each shard
+    :return: shard name -> DBRepository
+    """
+    return {name: DBRepository(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache,
+                               connection=MongoConnection.from_config(settings, alias=f'shard-{name}', host=host),
+                               guard=guard.for_shard(name) if guard is not None else None,
+                               expires_at_index=settings['expires_at_index'],
+                               mapping_ttl_seconds=settings['mapping_ttl_seconds'])
+            for name, host in {**settings['mongo_previous_shards'], **settings['mongo_shards']}.items()}
+
+
+def create_async_repository(settings: dict, repo: BaseRepository, cache: Optional[LRUCache] = None,
+                            key_filter: Optional[KeyFilter] = None,
+                            guard: Optional[MongoGuard] = None) -> AsyncBaseRepository:
+    """
+    Builds the async repository for settings['storage_backend']: a native
+    async client for MongoDB, otherwise the synchronous repo behind an adapter
+    :param settings: dict from util.config.as_dict()
+    :param repo: the synchronous repository from create_repository() for the same settings
+    :param cache: redirect cache to keep in step with writes
+    :param key_filter: short-key filter to keep in step with writes
+    :param guard: time budgets and circuit breaker for MongoDB calls, shared with repo
+    :return: AsyncBaseRepository
+    """
+    backend = settings['storage_backend']
+    if backend == 'mongo' and not settings['mongo_shards']:
+        return AsyncDBRepository(MongoConnection.from_config(settings), cache=cache, key_filter=key_filter,
+                                 guard=guard)
+    # Sharded MongoDB and SQLite calls block on the network, disk and locks;
+    # in-memory calls never block
+    return AsyncRepositoryAdapter(repo, offload=backend != 'memory')
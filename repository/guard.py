@@ -0,0 +1,117 @@
+import functools
+import inspect
+from contextlib import contextmanager
+from typing import Optional
+
+import pymongo
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from repository.base import UnavailableError
+from util.circuit_breaker import CircuitBreaker
+from util.metrics import Metrics
+
+
+def is_outage(error: BaseException) -> bool:
+    """
+    Whether error means MongoDB is unreachable or too slow, as opposed to
+    rejecting the operation (duplicate key, validation, ...)
+    """
+    # mongoengine re-raises some driver errors as its own, so follow the chain
+    while error is not None:
+        if isinstance(error, PyMongoError):
+            return isinstance(error, ConnectionFailure) or error.timeout
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class MongoGuard:
+    """
+    Time budgets and a circuit breaker for MongoDB calls.
+
+    Each guarded call runs under pymongo.timeout() with the budget of its
+    operation class ('redirect', 'read' or 'write'), which bounds server
+    selection, the query and any retry together. Timeouts and connection
+    errors are raised as UnavailableError and count against the breaker;
+    while it is open, calls raise UnavailableError without touching MongoDB.
+    """
+
+    def __init__(self, timeouts: Optional[dict] = None, breaker: Optional[CircuitBreaker] = None):
+        # Operation class -> seconds; a missing class keeps the driver's own timeouts
+        self.timeouts = timeouts or {}
+        self.breaker = breaker
+
+    @classmethod
+    def from_config(cls, settings: dict, metrics: Optional[Metrics] = None) -> 'MongoGuard':
+        """
+        Build from the mongo_*_timeout_ms and breaker_* settings of util.config
+        :param settings: dict of config values
+        :param metrics: exports the breaker's state and counts
+        :return: MongoGuard
+        """
+        timeouts = {operation: settings[f'mongo_{operation}_timeout_ms'] / 1000
+                    for operation in ('redirect', 'read', 'write')
+                    if settings[f'mongo_{operation}_timeout_ms'] is not None}
+        breaker = CircuitBreaker('mongo', failure_threshold=settings['breaker_failure_threshold'],
+                                 reset_timeout=settings['breaker_reset_timeout'], metrics=metrics) \
+            if settings['breaker_enabled'] else None
+        return cls(timeouts, breaker)
+
+    def for_shard(self, name: str) -> 'MongoGuard':
+        """
+        A guard with the same budgets and its own breaker, so one failing
+        shard does not cut off the others
+        :param name: shard name, appended to the breaker's name
+        :return: MongoGuard
+        """
+        breaker = self.breaker
+        if breaker is not None:
+            breaker = CircuitBreaker(f'{breaker.name}_{name}', failure_threshold=breaker.failure_threshold,
+                                     reset_timeout=breaker.reset_timeout, metrics=breaker.metrics)
+        return MongoGuard(self.timeouts, breaker)
+
+    @contextmanager
+    def __call__(self, operation: str):
+        """
+        Context manager guarding one call
+        :param operation: 'redirect', 'read' or 'write'
+        :raises UnavailableError: the breaker is open, or MongoDB timed out or could not be reached
+        """
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow():
+            raise UnavailableError("MongoDB circuit breaker is open")
+        failed = False
+        try:
+            with pymongo.timeout(self.timeouts.get(operation)):
+                yield
+        except Exception as e:
+            if not is_outage(e):
+                raise
+            failed = True
+            raise UnavailableError(f"MongoDB {operation} failed: {e}") from e
+        finally:
+            if breaker is not None:
+                breaker.record(not failed)
+
+
+def guarded(operation: str):
+    """
+    Decorator running a repository method under self.guard (if set) for operation
+    """
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(self, *args, **kwargs):
+                if self.guard is None:
+                    return await fn(self, *args, **kwargs)
+                with self.guard(operation):
+                    return await fn(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if self.guard is None:
+                return fn(self, *args, **kwargs)
+            with self.guard(operation):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from util.bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+
+class KeyFilter:
+    """
+    Bloom filter over every existing short key, used to answer definite
+    misses without a database lookup.
+
+    Until the first build completes every key is reported as possibly
+    present, so the filter never causes a false 404. Deleted keys stay in the
+    filter (they just become false positives) until the next rebuild.
+
+    Writes made through this process are added immediately; keys created by
+    other processes are picked up by refresh(), so with several writers a
+    brand-new key can be reported missing for up to the refresh interval.
+    With max_age set, a filter whose last build or refresh started longer
+    ago than that (refreshes keep failing) reports every key as possibly
+    present again, so the window stays bounded while the database is down.
+
+    Bulk loads keep each mapping's original created_at, so refresh() and a
+    persisted filter's load would never stream their keys. A bulk load
+    bumps the REBUILD_COUNTER counter when it finishes; a filter built
+    before the bump, running or persisted, is rebuilt with a full scan.
+    """
+
+    # Keys created this long before a persisted filter was saved are re-read
+    # on load, to cover writes racing the save and clock skew between hosts
+    LOAD_OVERLAP_SECONDS = 300
+    # Same for refresh(), which runs often and must stay cheap
+    REFRESH_OVERLAP_SECONDS = 5
+    # Repository counter bumped by bulk loads (see request_rebuild())
+    REBUILD_COUNTER = 'key_filter_rebuilds'
+    # The app stops trusting misses after this many refresh intervals without one
+    STALE_REFRESHES = 3
+
+    def __init__(self, capacity: int, error_rate: float, path: Optional[str] = None,
+                 max_age: Optional[float] = None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.max_age = max_age
+        self.deleted = 0
+        self._refreshed_at: Optional[float] = None
+        # REBUILD_COUNTER when the filter was built
+        self._generation = 0
+        self._filter: Optional[BloomFilter] = None
+        self._building: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """
+        True once the filter holds more keys (live or deleted) than it was sized for
+        """
+        current = self._filter
+        return current is not None and current.count > current.capacity
+
+    @property
+    def stale(self) -> bool:
+        """
+        True once the last build or refresh started more than max_age seconds ago
+        """
+        refreshed_at = self._refreshed_at
+        return self.max_age is not None and refreshed_at is not None \
+            and time.time() - refreshed_at > self.max_age
+
+    def might_contain(self, short_key: str) -> bool:
+        current = self._filter
+        return current is None or self.stale or short_key in current
+
+    def add(self, short_key: str) -> None:
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(short_key)
+            if self._building is not None:
+                self._building.add(short_key)
+
+    def discard(self, short_key: str) -> None:
+        # Bloom filters cannot unset bits; count it so rebuilds can be scheduled
+        self.deleted += 1
+
+    def build(self, repo, use_saved: bool = True) -> None:
+        """
+        (Re)build the filter by streaming keys from the repository. If a
+        persisted filter exists it is loaded and only keys created since it
+        was saved are streamed. Writes made during the build are not lost.
+        :param repo: repository providing iter_short_keys()
+        :param use_saved: load the persisted filter, if any, instead of a full scan
+        """
+        # Read first: a bulk load finishing during the build triggers another
+        generation = repo.read_counter(self.REBUILD_COUNTER)
+        bloom, since = None, None
+        if use_saved and self.path and os.path.exists(self.path):
+            try:
+                saved, saved_at, saved_generation = BloomFilter.load(self.path)
+                if saved_generation == generation:
+                    bloom, since = saved, saved_at - self.LOAD_OVERLAP_SECONDS
+                else:
+                    logger.info("Key filter at %s predates a bulk load; rebuilding", self.path)
+            except (OSError, ValueError):
+                logger.warning("Ignoring unreadable key filter at %s", self.path, exc_info=True)
+        if bloom is None:
+            bloom = BloomFilter(self.capacity, self.error_rate)
+
+        # Keys written by other processes after this point are picked up by
+        # the next load, which streams everything created since started_at
+        started_at = time.time()
+        with self._lock:
+            self._building = bloom
+        try:
+            for short_key in repo.iter_short_keys(created_since=since):
+                bloom.add(short_key)
+        except Exception:
+            with self._lock:
+                self._building = None
+            raise
+        with self._lock:
+            self._filter = bloom
+            self._building = None
+            self._refreshed_at = started_at
+            self._generation = generation
+            self.deleted = 0
+        logger.info("Key filter ready with %d keys", bloom.count)
+
+        if self.path:
+            self.save(saved_at=started_at)
+
+    def refresh(self, repo) -> None:
+        """
+        Add keys created (by any process) since the last build or refresh,
+        or rebuild from a full scan if a bulk load has finished since the build
+        :param repo: repository providing iter_short_keys()
+        """
+        current = self._filter
+        if current is None:
+            return
+        if repo.read_counter(self.REBUILD_COUNTER) != self._generation:
+            self.build(repo, use_saved=False)
+            return
+        started_at = time.time()
+        for short_key in repo.iter_short_keys(created_since=self._refreshed_at - self.REFRESH_OVERLAP_SECONDS):
+            current.add(short_key)
+        self._refreshed_at = started_at
+
+    def run(self, repo, refresh_interval: float, stop: Optional[threading.Event] = None) -> None:
+        """
+        Build the filter, then keep refreshing it until stop is set.
+        Intended as the target of a daemon thread.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                if self.ready:
+                    self.refresh(repo)
+                else:
+                    self.build(repo)
+            except Exception:
+                logger.exception("Key filter update failed")
+            stop.wait(refresh_interval)
+
+    def save(self, saved_at: Optional[float] = None) -> None:
+        current = self._filter
+        if current is not None and self.path:
+            current.save(self.path, saved_at=saved_at, generation=self._generation)
+
+    @classmethod
+    def request_rebuild(cls, repo) -> None:
+        """
+        Make every filter over repo rebuild with a full scan: for writers
+        that insert keys with created_at in the past, which refresh() misses
+        :param repo: repository providing allocate_id_block()
+        """
+        repo.allocate_id_block(cls.REBUILD_COUNTER, 1)
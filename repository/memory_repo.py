@@ -0,0 +1,302 @@
+import bisect
+import heapq
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from mongoengine import ValidationError
+
+from model.url_mapping import URLMapping, to_epoch
+from repository.base import MAPPING_FIELDS, BaseRepository, DuplicateKeyError, RedirectRow
+from repository.key_filter import KeyFilter
+from util.cache import LRUCache
+from util.urls import has_domain_prefix
+
+
+def _from_epoch(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value is not None else None
+
+
+class _Record:
+    """
+    One stored mapping, with all times as epoch seconds
+    """
+    __slots__ = ('long_url', 'created_at', 'expires_at', 'url_hash', 'redirect_code', 'cache_max_age',
+                 'click_count', 'last_accessed_at')
+
+    def __init__(self, mapping: URLMapping):
+        self.long_url = mapping.long_url
+        self.created_at = to_epoch(mapping.created_at)
+        self.expires_at = to_epoch(mapping.expires_at)
+        self.url_hash = bytes(mapping.url_hash) if mapping.url_hash is not None else None
+        self.redirect_code = mapping.redirect_code
+        self.cache_max_age = mapping.cache_max_age
+        self.click_count = mapping.click_count or 0
+        self.last_accessed_at = to_epoch(mapping.last_accessed_at)
+
+
+class MemoryRepository(BaseRepository):
+    """
+    Process-local repository keeping mappings in a dict, with a min-heap of
+    expiry times so expired mappings are purged without a full scan and a
+    sorted list of (created_at, short_key) so listings and "created since"
+    scans start where they need to.
+
+    Nothing is persisted and nothing is shared between processes, so it
+    suits single-process deployments, tests and benchmarks.
+    """
+
+    def __init__(self, cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                 dedup_cache: Optional[LRUCache] = None):
+        super().__init__(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+        self._records: dict[str, _Record] = {}
+        # url_hash -> short keys, the equivalent of the url_hash index
+        self._by_hash: dict[bytes, set[str]] = {}
+        # (expires_at epoch, short_key); entries for replaced or deleted mappings are skipped lazily
+        self._expiry_heap: list[tuple[float, str]] = []
+        # (created_at epoch, short_key) of every mapping, sorted; the equivalent of the created_at index
+        self._by_created: list[tuple[float, str]] = []
+        self._counters: dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def _store(self, short_key: str, record: _Record):
+        # Caller holds the lock
+        old = self._records.get(short_key)
+        if old is not None:
+            self._unindex(short_key, old)
+        self._records[short_key] = record
+        # New mappings are usually the newest, so this is mostly an append
+        bisect.insort(self._by_created, (record.created_at, short_key))
+        if record.url_hash is not None:
+            self._by_hash.setdefault(record.url_hash, set()).add(short_key)
+        if record.expires_at is not None:
+            heapq.heappush(self._expiry_heap, (record.expires_at, short_key))
+
+    def _unindex(self, short_key: str, record: _Record):
+        # Caller holds the lock
+        entry = (record.created_at, short_key)
+        i = bisect.bisect_left(self._by_created, entry)
+        if i < len(self._by_created) and self._by_created[i] == entry:
+            del self._by_created[i]
+        if record.url_hash is not None:
+            keys = self._by_hash.get(record.url_hash)
+            if keys is not None:
+                keys.discard(short_key)
+                if not keys:
+                    del self._by_hash[record.url_hash]
+
+    def _remove(self, short_key: str) -> Optional[_Record]:
+        # Caller holds the lock
+        record = self._records.pop(short_key, None)
+        if record is not None:
+            self._unindex(short_key, record)
+        return record
+
+    def _to_mapping(self, short_key: str, record: _Record) -> URLMapping:
+        return URLMapping(short_key=short_key, long_url=record.long_url,
+                          created_at=_from_epoch(record.created_at), expires_at=_from_epoch(record.expires_at),
+                          url_hash=record.url_hash, redirect_code=record.redirect_code,
+                          cache_max_age=record.cache_max_age, click_count=record.click_count,
+                          last_accessed_at=_from_epoch(record.last_accessed_at))
+
+    def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        mapping.check_expiry()
+        mapping.validate()
+        record = _Record(mapping)
+        with self._lock:
+            old = self._records.get(mapping.short_key)
+            if force_insert and old is not None:
+                raise DuplicateKeyError(f"Key {mapping.short_key} already exists")
+            if old is not None:
+                # Click counts belong to the stored mapping, as in the other backends
+                record.click_count, record.last_accessed_at = old.click_count, old.last_accessed_at
+            self._store(mapping.short_key, record)
+        self._on_saved(mapping.short_key)
+        return mapping
+
+    def save_many(self, mappings: list[URLMapping]) -> dict[int, Exception]:
+        errors: dict[int, Exception] = {}
+        saved = []
+        with self._lock:
+            for i, mapping in enumerate(mappings):
+                try:
+                    mapping.check_expiry()
+                    mapping.validate()
+                except (ValueError, ValidationError) as e:
+                    errors[i] = e
+                    continue
+                if mapping.short_key in self._records:
+                    errors[i] = DuplicateKeyError(f"Key {mapping.short_key} already exists")
+                    continue
+                self._store(mapping.short_key, _Record(mapping))
+                saved.append(mapping.short_key)
+        for short_key in saved:
+            self._on_saved(short_key)
+        return errors
+
+    def existing_keys(self, short_keys: list[str]) -> set[str]:
+        records = self._records
+        return {short_key for short_key in short_keys if short_key in records}
+
+    def get_mapping_by_key(self, short_key: str) -> Optional[URLMapping]:
+        record = self._records.get(short_key)
+        return self._to_mapping(short_key, record) if record is not None else None
+
+    def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        record = self._records.get(short_key)
+        if record is None:
+            return None
+        return record.long_url, record.expires_at, record.redirect_code, record.cache_max_age
+
+    def get_redirect_targets(self, short_keys: list[str]) -> dict[str, RedirectRow]:
+        records = self._records
+        targets = {}
+        for short_key in short_keys:
+            record = records.get(short_key)
+            if record is not None:
+                targets[short_key] = record.long_url, record.expires_at, record.redirect_code, record.cache_max_age
+        return targets
+
+    def find_by_url_hashes(self, url_hashes: list[bytes]) -> list[tuple[bytes, str, str, Optional[float]]]:
+        found = []
+        with self._lock:
+            for url_hash in set(url_hashes):
+                for short_key in self._by_hash.get(url_hash, ()):
+                    record = self._records[short_key]
+                    found.append((url_hash, short_key, record.long_url, record.expires_at))
+        return found
+
+    def delete_mapping(self, short_key: str) -> bool:
+        with self._lock:
+            record = self._remove(short_key)
+        self._on_deleted(short_key, record.url_hash if record is not None else None)
+        return record is not None
+
+    def _expired_keys(self, now: float, limit: Optional[int] = None) -> list[str]:
+        # Caller holds the lock. Pops due heap entries, skipping stale ones
+        keys = []
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now and (limit is None or len(keys) < limit):
+            expires_at, short_key = heapq.heappop(heap)
+            record = self._records.get(short_key)
+            if record is not None and record.expires_at == expires_at:
+                keys.append(short_key)
+        return keys
+
+    def list_expired_mappings(self, batch_size: int = 1000) -> Iterator[URLMapping]:
+        now = time.time()
+        expired: dict[str, _Record] = {}
+        with self._lock:
+            for expires_at, short_key in sorted(self._expiry_heap):
+                if expires_at >= now:
+                    break
+                record = self._records.get(short_key)
+                if record is not None and record.expires_at == expires_at:
+                    expired.setdefault(short_key, record)
+        for short_key, record in expired.items():
+            yield self._to_mapping(short_key, record)
+
+    def purge_expired(self, batch_size: int = 1000, max_runtime: Optional[float] = None) -> int:
+        now = time.time()
+        deadline = time.monotonic() + max_runtime if max_runtime is not None else None
+        deleted = 0
+        while deadline is None or time.monotonic() < deadline:
+            # Release the lock between chunks so lookups and writes are not held up
+            with self._lock:
+                keys = self._expired_keys(now, batch_size)
+                # A key pushed twice with the same expiry is popped twice; the second _remove is a no-op
+                removed = [(short_key, record) for short_key in keys
+                           if (record := self._remove(short_key)) is not None]
+            if not keys:
+                break
+            deleted += len(removed)
+            for short_key, record in removed:
+                self._on_deleted(short_key, record.url_hash)
+        return deleted
+
+    def allocate_id_block(self, name: str, size: int) -> int:
+        with self._lock:
+            start = self._counters.get(name, 0)
+            self._counters[name] = start + size
+        return start
+
+    def read_counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def iter_short_keys(self, created_since: Optional[datetime] = None,
+                        batch_size: int = 10000) -> Iterator[str]:
+        since = to_epoch(created_since) if isinstance(created_since, datetime) else created_since
+        with self._lock:
+            if since is None:
+                keys = list(self._records)
+            else:
+                start = bisect.bisect_left(self._by_created, (since,))
+                keys = [short_key for _, short_key in self._by_created[start:]]
+        yield from keys
+
+    def iter_redirect_rows(self, created_since: Optional[datetime] = None,
+                           batch_size: int = 10000) -> Iterator[tuple]:
+        since = to_epoch(created_since) if isinstance(created_since, datetime) else created_since
+        now = time.time()
+        with self._lock:
+            rows = [(short_key, record.long_url, record.expires_at, record.redirect_code, record.cache_max_age)
+                    for short_key, record in self._records.items()
+                    if (since is None or record.created_at >= since)
+                    and (record.expires_at is None or record.expires_at >= now)]
+        rows.sort()
+        yield from rows
+
+    def iter_mapping_rows(self, batch_size: int = 10000) -> Iterator[tuple]:
+        with self._lock:
+            rows = [(short_key, record.long_url, record.created_at, record.expires_at, record.url_hash,
+                     record.redirect_code, record.cache_max_age, record.click_count, record.last_accessed_at)
+                    for short_key, record in self._records.items()]
+        yield from rows
+
+    def iter_mappings(self, after: Optional[tuple[float, str]] = None, expires_before: Optional[float] = None,
+                      expires_after: Optional[float] = None, domain_prefix: Optional[str] = None,
+                      fields: tuple = MAPPING_FIELDS, batch_size: int = 1000) -> Iterator[dict]:
+        position = tuple(after) if after is not None else None
+        while True:
+            # Walks the created_at order from the cursor one batch at a time, so a page
+            # costs the rows it scans rather than a sort of every mapping
+            with self._lock:
+                start = bisect.bisect_right(self._by_created, position) if position is not None else 0
+                scanned = self._by_created[start:start + batch_size]
+                rows = []
+                for created_at, short_key in scanned:
+                    record = self._records[short_key]
+                    if (expires_before is not None and (record.expires_at is None
+                                                        or record.expires_at >= expires_before)) \
+                            or (expires_after is not None and (record.expires_at is None
+                                                               or record.expires_at <= expires_after)) \
+                            or (domain_prefix and not has_domain_prefix(record.long_url, domain_prefix)):
+                        continue
+                    row = {'short_key': short_key, 'created_at': created_at}
+                    for field in fields:
+                        if field not in row:
+                            row[field] = getattr(record, field)
+                    rows.append(row)
+            if not scanned:
+                return
+            position = scanned[-1]
+            yield from rows
+
+    def increment_clicks(self, clicks: dict[str, tuple[int, float]]) -> int:
+        updated = 0
+        with self._lock:
+            for short_key, (count, accessed_at) in clicks.items():
+                record = self._records.get(short_key)
+                if record is None:
+                    continue
+                record.click_count += count
+                if record.last_accessed_at is None or accessed_at > record.last_accessed_at:
+                    record.last_accessed_at = accessed_at
+                updated += 1
+        return updated
+
+    def get_click_stats(self, short_key: str) -> Optional[tuple[int, Optional[float]]]:
+        record = self._records.get(short_key)
+        return (record.click_count, record.last_accessed_at) if record is not None else None
@@ -0,0 +1,262 @@
+import heapq
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Optional
+
+from model.url_mapping import URLMapping
+from repository.base import MAPPING_FIELDS, BaseRepository, RedirectRow, UnavailableError
+from repository.key_filter import KeyFilter
+from util.cache import LRUCache
+from util.hash_ring import HashRing
+from util.process import OncePerProcess
+
+
+class ShardedRepository(BaseRepository):
+    """
+    Spreads mappings across several repositories (shards) by consistent
+    hashing of short_key; see util.hash_ring.HashRing.
+
+    Calls for one key go to the shard that owns it, and calls for many keys
+    are split by owner and sent to their shards concurrently. Calls that
+    cannot be routed (url_hash lookups, the expiry sweep, the listings) fan
+    out to every shard in parallel; the ordered listings merge the shards'
+    streams. ID counters live in the separate `counters` repository, so
+    adding a shard never moves them.
+
+    While tools.rebalance moves mappings after the shard list changed, pass
+    the old list as previous_nodes: a key missing on its owner is then
+    looked up on its owner under the old ring, deletes and click counts go
+    to both, and shards that were removed keep being listed and swept.
+    New mappings are only written to their owner.
+
+    The shards call the redirect cache, key filter and dedup cache hooks
+    themselves, so pass the same ones to them as to this repository.
+    """
+
+    def __init__(self, shards: dict[str, BaseRepository], counters: BaseRepository, vnodes: int = 160,
+                 cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                 dedup_cache: Optional[LRUCache] = None, nodes: Optional[Iterable[str]] = None,
+                 previous_nodes: Optional[Iterable[str]] = None):
+        """
+        :param shards: shard name -> repository, for every shard that may hold mappings
+        :param counters: repository holding the ID counters
+        :param vnodes: points per shard on the ring
+        :param nodes: names of the shards on the ring (default: all of shards)
+        :param previous_nodes: names on the ring before the last change, while it is rebalanced
+        """
+        if not shards:
+            raise ValueError("At least one shard is required")
+        nodes = list(shards if nodes is None else nodes)
+        previous_nodes = list(previous_nodes or ())
+        unknown = set(nodes + previous_nodes) - set(shards)
+        if unknown:
+            raise ValueError(f"No repository for shards: {', '.join(sorted(unknown))}")
+        super().__init__(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+        self.shards = shards
+        self.counters = counters
+        self.ring = HashRing(nodes, vnodes)
+        self.previous_ring = HashRing(previous_nodes, vnodes) if previous_nodes else None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Threads do not survive a fork, so each process starts its own pool
+        self._start_pool = OncePerProcess(self._create_pool)
+
+    def _create_pool(self):
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='shard')
+
+    def shard_for(self, short_key: str) -> BaseRepository:
+        return self.shards[self.ring.node_for(short_key)]
+
+    def _previous_shard_for(self, short_key: str) -> Optional[BaseRepository]:
+        """
+        :return: the key's owner under previous_nodes, if that is another shard
+        """
+        if self.previous_ring is None:
+            return None
+        name = self.previous_ring.node_for(short_key)
+        return self.shards[name] if name != self.ring.node_for(short_key) else None
+
+    def _group(self, short_keys, previous: bool = False) -> dict[str, list[str]]:
+        # previous: group by the owner under previous_nodes instead, leaving out
+        # the keys it does not move
+        groups: dict[str, list[str]] = {}
+        for short_key in short_keys:
+            name = self.ring.node_for(short_key)
+            if previous:
+                if self.previous_ring is None or self.previous_ring.node_for(short_key) == name:
+                    continue
+                name = self.previous_ring.node_for(short_key)
+            groups.setdefault(name, []).append(short_key)
+        return groups
+
+    def _map(self, fn: Callable, args: dict[str, object]) -> dict[str, object]:
+        """
+        Call fn(shard, arg) for each shard name in args, concurrently when there is more than one
+        :param fn:
+        :param args: shard name -> argument
+        :return: shard name -> result; the first failure is raised once every call has finished
+        """
+        if len(args) <= 1:
+            return {name: fn(self.shards[name], arg) for name, arg in args.items()}
+        self._start_pool()
+        futures = {name: self._executor.submit(fn, self.shards[name], arg) for name, arg in args.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _merge(self, streams: dict[str, Iterator], key: Callable, prefetch: int) -> Iterator:
+        # The shards' first batches are fetched concurrently, then the
+        # streams are merged lazily in key order
+        heads = self._map(lambda shard, stream: list(islice(stream, prefetch)), streams)
+        return heapq.merge(*(chain(heads[name], stream) for name, stream in streams.items()), key=key)
+
+    def _gather(self, streams: dict[str, Iterator], batch_size: int) -> Iterator:
+        """
+        Yield the items of every stream, reading one batch ahead from each
+        concurrently; batches come in the order they arrive, not key order
+        :param streams: shard name -> iterator
+        :param batch_size: items read per call
+        """
+        if len(streams) <= 1:
+            yield from chain.from_iterable(streams.values())
+            return
+        self._start_pool()
+
+        def read(stream):
+            return stream, list(islice(stream, batch_size))
+
+        pending = {self._executor.submit(read, stream) for stream in streams.values()}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stream, batch = future.result()
+                    if batch:
+                        # Read the shard's next batch while this one is consumed
+                        pending.add(self._executor.submit(read, stream))
+                        yield from batch
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        return self.shard_for(mapping.short_key).save_url_mapping(mapping, force_insert=force_insert)
+
+    def save_many(self, mappings: list[URLMapping]) -> dict[int, Exception]:
+        """
+        Insert many new URLMappings with one save_many per shard, run concurrently.
+        An unavailable shard fails only its own mappings.
+        """
+        positions: dict[str, list[int]] = {}
+        for i, mapping in enumerate(mappings):
+            positions.setdefault(self.ring.node_for(mapping.short_key), []).append(i)
+
+        def save(shard, indexes):
+            try:
+                return shard.save_many([mappings[i] for i in indexes])
+            except UnavailableError as e:
+                return {j: e for j in range(len(indexes))}
+
+        errors: dict[int, Exception] = {}
+        for name, shard_errors in self._map(save, positions).items():
+            for j, error in shard_errors.items():
+                errors[positions[name][j]] = error
+        return dict(sorted(errors.items()))
+
+    def existing_keys(self, short_keys: list[str]) -> set[str]:
+        results = self._map(lambda shard, keys: shard.existing_keys(keys), self._group(short_keys))
+        found = set().union(*results.values())
+        missing = self._group([short_key for short_key in short_keys if short_key not in found], previous=True)
+        if missing:
+            found.update(*self._map(lambda shard, keys: shard.existing_keys(keys), missing).values())
+        return found
+
+    def get_mapping_by_key(self, short_key: str) -> Optional[URLMapping]:
+        mapping = self.shard_for(short_key).get_mapping_by_key(short_key)
+        previous = self._previous_shard_for(short_key) if mapping is None else None
+        return previous.get_mapping_by_key(short_key) if previous is not None else mapping
+
+    def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        target = self.shard_for(short_key).get_redirect_target(short_key)
+        previous = self._previous_shard_for(short_key) if target is None else None
+        return previous.get_redirect_target(short_key) if previous is not None else target
+
+    def get_redirect_targets(self, short_keys: list[str]) -> dict[str, RedirectRow]:
+        targets: dict[str, RedirectRow] = {}
+        for shard_targets in self._map(lambda shard, keys: shard.get_redirect_targets(keys),
+                                       self._group(short_keys)).values():
+            targets.update(shard_targets)
+        missing = self._group([short_key for short_key in short_keys if short_key not in targets], previous=True)
+        if missing:
+            for shard_targets in self._map(lambda shard, keys: shard.get_redirect_targets(keys), missing).values():
+                targets.update(shard_targets)
+        return targets
+
+    def find_by_url_hashes(self, url_hashes: list[bytes]) -> list[tuple[bytes, str, str, Optional[float]]]:
+        if not url_hashes:
+            return []
+        results = self._map(lambda shard, hashes: shard.find_by_url_hashes(hashes),
+                            {name: url_hashes for name in self.shards})
+        return list(chain.from_iterable(results.values()))
+
+    def delete_mapping(self, short_key: str) -> bool:
+        deleted = self.shard_for(short_key).delete_mapping(short_key)
+        # A copy not yet moved (or moved but not yet deleted) must go too
+        previous = self._previous_shard_for(short_key)
+        if previous is not None:
+            deleted = previous.delete_mapping(short_key) or deleted
+        return deleted
+
+    def list_expired_mappings(self, batch_size: int = 1000) -> Iterator[URLMapping]:
+        return self._gather({name: shard.list_expired_mappings(batch_size) for name, shard in self.shards.items()},
+                            batch_size)
+
+    def purge_expired(self, batch_size: int = 1000, max_runtime: Optional[float] = None) -> int:
+        """
+        Sweep every shard concurrently, each with its own max_runtime
+        """
+        results = self._map(lambda shard, _: shard.purge_expired(batch_size, max_runtime),
+                            dict.fromkeys(self.shards))
+        return sum(results.values())
+
+    def allocate_id_block(self, name: str, size: int) -> int:
+        return self.counters.allocate_id_block(name, size)
+
+    def read_counter(self, name: str) -> int:
+        return self.counters.read_counter(name)
+
+    def iter_short_keys(self, created_since: Optional[datetime] = None,
+                        batch_size: int = 10000) -> Iterator[str]:
+        return self._gather({name: shard.iter_short_keys(created_since, batch_size)
+                             for name, shard in self.shards.items()}, batch_size)
+
+    def iter_redirect_rows(self, created_since: Optional[datetime] = None,
+                           batch_size: int = 10000) -> Iterator[tuple]:
+        streams = {name: shard.iter_redirect_rows(created_since, batch_size) for name, shard in self.shards.items()}
+        return self._merge(streams, key=lambda row: row[0], prefetch=batch_size)
+
+    def iter_mapping_rows(self, batch_size: int = 10000) -> Iterator[tuple]:
+        return self._gather({name: shard.iter_mapping_rows(batch_size) for name, shard in self.shards.items()},
+                            batch_size)
+
+    def iter_mappings(self, after: Optional[tuple[float, str]] = None, expires_before: Optional[float] = None,
+                      expires_after: Optional[float] = None, domain_prefix: Optional[str] = None,
+                      fields: tuple = MAPPING_FIELDS, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        Merge every shard's keyset stream; a page of up to batch_size
+        mappings needs only each shard's first batch, fetched concurrently
+        """
+        streams = {name: shard.iter_mappings(after, expires_before, expires_after, domain_prefix, fields, batch_size)
+                   for name, shard in self.shards.items()}
+        return self._merge(streams, key=lambda row: (row['created_at'], row['short_key']), prefetch=batch_size)
+
+    def increment_clicks(self, clicks: dict[str, tuple[int, float]]) -> int:
+        # While rebalancing, both copies are counted: whichever survives the move has them
+        groups: dict[str, dict[str, tuple[int, float]]] = {}
+        for grouping in (self._group(clicks), self._group(clicks, previous=True)):
+            for name, short_keys in grouping.items():
+                groups.setdefault(name, {}).update((short_key, clicks[short_key]) for short_key in short_keys)
+        return sum(self._map(lambda shard, shard_clicks: shard.increment_clicks(shard_clicks), groups).values())
+
+    def get_click_stats(self, short_key: str) -> Optional[tuple[int, Optional[float]]]:
+        stats = self.shard_for(short_key).get_click_stats(short_key)
+        previous = self._previous_shard_for(short_key) if stats is None else None
+        return previous.get_click_stats(short_key) if previous is not None else stats
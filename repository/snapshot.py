@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from repository.base import BaseRepository, RedirectRow
+from util.snapshot import Snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def export_snapshot(repo: BaseRepository, path: str, batch_size: int = 10000) -> int:
+    """
+    Write every unexpired mapping to a full snapshot at path
+    :param repo:
+    :param path:
+    :param batch_size: rows per repository round trip
+    :return: number of mappings written
+    """
+    # Taken before the scan, so the next delta re-reads anything written during it
+    generated_at = time.time()
+    return write_snapshot(path, repo.iter_redirect_rows(batch_size=batch_size), generated_at=generated_at)
+
+
+def export_delta(repo: BaseRepository, path: str, delta_path: Optional[str] = None,
+                 overlap: float = 5.0, batch_size: int = 10000) -> int:
+    """
+    Write the mappings created or re-saved since the snapshot at path was generated
+    :param repo:
+    :param path: the full snapshot the delta applies to
+    :param delta_path: defaults to path + SnapshotSource.DELTA_SUFFIX
+    :param overlap: seconds re-read before the snapshot's generated_at, for clock skew between hosts
+    :param batch_size: rows per repository round trip
+    :return: number of mappings written
+    """
+    base = Snapshot(path)
+    try:
+        base_generated_at = base.generated_at
+    finally:
+        base.close()
+    generated_at = time.time()
+    rows = repo.iter_redirect_rows(created_since=base_generated_at - overlap, batch_size=batch_size)
+    return write_snapshot(delta_path or path + SnapshotSource.DELTA_SUFFIX, rows, generated_at=generated_at,
+                          base_generated_at=base_generated_at)
+
+
+class SnapshotSource:
+    """
+    Redirect lookups served from a snapshot file and an optional delta of
+    recent writes, without touching the database.
+
+    refresh() re-opens either file once it has been replaced (the exporter
+    writes to a temporary file and renames it), so a new snapshot is picked
+    up by running workers without a restart. A delta is only used with the
+    snapshot it was exported against.
+
+    Mappings deleted since the last export are still served until the next
+    full snapshot; expiry is enforced by the caller as usual.
+    """
+
+    DELTA_SUFFIX = '.delta'
+
+    def __init__(self, path: str, delta_path: Optional[str] = None):
+        self.path = path
+        self.delta_path = delta_path or path + self.DELTA_SUFFIX
+        # (snapshot, delta) swapped as one tuple, so lookups never see a mismatched pair
+        self._current: tuple[Optional[Snapshot], Optional[Snapshot]] = (None, None)
+        self._stats: tuple = (None, None)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._current[0] is not None
+
+    @property
+    def generated_at(self) -> Optional[float]:
+        """
+        When the data in use was read from the repository: the delta's export
+        time if there is one, else the snapshot's; None before the first load
+        """
+        snapshot, delta = self._current
+        if delta is not None:
+            return delta.generated_at
+        return snapshot.generated_at if snapshot is not None else None
+
+    def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        """
+        Look up short_key in the delta, then the snapshot
+        :param short_key:
+        :return: (long_url, expires_at epoch, redirect_code, cache_max_age), or None if not found
+        """
+        snapshot, delta = self._current
+        if delta is not None:
+            row = delta.get(short_key)
+            if row is not None:
+                return row
+        return snapshot.get(short_key) if snapshot is not None else None
+
+    @staticmethod
+    def _stat(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def refresh(self) -> bool:
+        """
+        Re-open the snapshot and delta if either file has changed
+        :return: True if the pair in use was replaced
+        """
+        with self._lock:
+            stats = (self._stat(self.path), self._stat(self.delta_path))
+            if stats == self._stats:
+                return False
+            snapshot, delta = self._current
+            if stats[0] != self._stats[0]:
+                snapshot = Snapshot(self.path) if stats[0] is not None else None
+            if stats[1] is not None:
+                delta = Snapshot(self.delta_path)
+                if snapshot is None or delta.base_generated_at != snapshot.generated_at:
+                    # Exported against an older snapshot; its rows may be staler than the new one
+                    delta = None
+            else:
+                delta = None
+            # Replaced files are unmapped once the last in-flight lookup drops them
+            self._current = (snapshot, delta)
+            self._stats = stats
+        logger.info("Snapshot loaded with %d mappings and %d in the delta",
+                    len(snapshot) if snapshot is not None else 0, len(delta) if delta is not None else 0)
+        return True
+
+    def run(self, refresh_interval: float, stop: Optional[threading.Event] = None) -> None:
+        """
+        Keep re-opening replaced files until stop is set.
+        Intended as the target of a daemon thread.
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Snapshot refresh failed")
+            stop.wait(refresh_interval)
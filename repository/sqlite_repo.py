@@ -0,0 +1,309 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from mongoengine import ValidationError
+
+from model.url_mapping import URLMapping, to_epoch
+from repository.base import MAPPING_FIELDS, BaseRepository, DuplicateKeyError, RedirectRow
+from repository.key_filter import KeyFilter
+from util.cache import LRUCache
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS url_mappings (
+        short_key TEXT PRIMARY KEY,
+        long_url TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL,
+        url_hash BLOB,
+        redirect_code INTEGER,
+        cache_max_age INTEGER,
+        click_count INTEGER NOT NULL DEFAULT 0,
+        last_accessed_at REAL
+    ) WITHOUT ROWID""",
+    # (created_at, short_key) covers the key filter's "short_key WHERE created_at >= ?"
+    # scan and serves the keyset-paginated listing
+    "CREATE INDEX IF NOT EXISTS url_mappings_created_at ON url_mappings (created_at, short_key)",
+    "CREATE INDEX IF NOT EXISTS url_mappings_expires_at ON url_mappings (expires_at) WHERE expires_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS url_mappings_url_hash ON url_mappings (url_hash) WHERE url_hash IS NOT NULL",
+    "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID",
+)
+
+# Statements are constants so sqlite3's per-connection statement cache
+# prepares each one once and reuses it
+_COLUMNS = ("short_key, long_url, created_at, expires_at, url_hash, redirect_code, cache_max_age,"
+            " click_count, last_accessed_at")
+_INSERT = f"INSERT INTO url_mappings ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+_UPSERT = _INSERT + (" ON CONFLICT (short_key) DO UPDATE SET long_url = excluded.long_url,"
+                     " created_at = excluded.created_at, expires_at = excluded.expires_at,"
+                     " url_hash = excluded.url_hash, redirect_code = excluded.redirect_code,"
+                     " cache_max_age = excluded.cache_max_age")
+_SELECT_MAPPING = f"SELECT {_COLUMNS} FROM url_mappings WHERE short_key = ?"
+_SELECT_TARGET = "SELECT long_url, expires_at, redirect_code, cache_max_age FROM url_mappings WHERE short_key = ?"
+_SELECT_ALL = f"SELECT {_COLUMNS} FROM url_mappings"
+# Primary-key order, so no sort step
+_SELECT_REDIRECT_ROWS = ("SELECT short_key, long_url, expires_at, redirect_code, cache_max_age FROM url_mappings"
+                         " WHERE (expires_at IS NULL OR expires_at >= ?) AND created_at >= ? ORDER BY short_key")
+_SELECT_CLICKS = "SELECT click_count, last_accessed_at FROM url_mappings WHERE short_key = ?"
+_DELETE = "DELETE FROM url_mappings WHERE short_key = ? RETURNING url_hash"
+_SELECT_EXPIRED = f"SELECT {_COLUMNS} FROM url_mappings WHERE expires_at < ? ORDER BY expires_at"
+_PURGE_EXPIRED = ("DELETE FROM url_mappings WHERE short_key IN"
+                  " (SELECT short_key FROM url_mappings WHERE expires_at < ? LIMIT ?)"
+                  " RETURNING short_key, url_hash")
+_ALLOCATE = ("INSERT INTO counters (name, value) VALUES (?, ?)"
+             " ON CONFLICT (name) DO UPDATE SET value = value + excluded.value RETURNING value")
+_SELECT_COUNTER = "SELECT value FROM counters WHERE name = ?"
+_INCREMENT_CLICKS = ("UPDATE url_mappings SET click_count = click_count + ?,"
+                     " last_accessed_at = max(coalesce(last_accessed_at, 0), ?) WHERE short_key = ?")
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+_MAX_PARAMS = 500
+
+
+def _from_epoch(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value is not None else None
+
+
+def _row(mapping: URLMapping) -> tuple:
+    return (mapping.short_key, mapping.long_url, to_epoch(mapping.created_at), to_epoch(mapping.expires_at),
+            bytes(mapping.url_hash) if mapping.url_hash is not None else None,
+            mapping.redirect_code, mapping.cache_max_age, mapping.click_count or 0,
+            to_epoch(mapping.last_accessed_at))
+
+
+def _to_mapping(row: tuple) -> URLMapping:
+    (short_key, long_url, created_at, expires_at, url_hash, redirect_code, cache_max_age,
+     click_count, last_accessed_at) = row
+    return URLMapping(short_key=short_key, long_url=long_url, created_at=_from_epoch(created_at),
+                      expires_at=_from_epoch(expires_at), url_hash=url_hash, redirect_code=redirect_code,
+                      cache_max_age=cache_max_age, click_count=click_count,
+                      last_accessed_at=_from_epoch(last_accessed_at))
+
+
+class SQLiteRepository(BaseRepository):
+    """
+    Repository backed by a single SQLite file in WAL mode, so readers never
+    block on the writer and several worker processes can share one file.
+
+    Each thread (and each process after a fork) opens its own connection on
+    first use. `path` must be a file; ':memory:' would give every connection
+    a separate, empty database.
+    """
+
+    def __init__(self, path: str, cache: Optional[LRUCache] = None, key_filter: Optional[KeyFilter] = None,
+                 dedup_cache: Optional[LRUCache] = None, timeout: float = 5.0):
+        super().__init__(cache=cache, key_filter=key_filter, dedup_cache=dedup_cache)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # Autocommit; multi-statement writes use explicit transactions
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, cached_statements=128)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _select_in(self, sql: str, values: list) -> list[tuple]:
+        # Runs sql with "{}" replaced by chunks of placeholders
+        conn = self._conn()
+        rows = []
+        for start in range(0, len(values), _MAX_PARAMS):
+            chunk = values[start:start + _MAX_PARAMS]
+            rows.extend(conn.execute(sql.format(', '.join('?' * len(chunk))), chunk).fetchall())
+        return rows
+
+    def save_url_mapping(self, mapping: URLMapping, force_insert: bool = False) -> URLMapping:
+        mapping.check_expiry()
+        mapping.validate()
+        try:
+            self._conn().execute(_INSERT if force_insert else _UPSERT, _row(mapping))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"Key {mapping.short_key} already exists") from e
+        self._on_saved(mapping.short_key)
+        return mapping
+
+    def save_many(self, mappings: list[URLMapping]) -> dict[int, Exception]:
+        errors: dict[int, Exception] = {}
+        saved = []
+        rows = []
+        for i, mapping in enumerate(mappings):
+            try:
+                mapping.check_expiry()
+                mapping.validate()
+            except (ValueError, ValidationError) as e:
+                errors[i] = e
+                continue
+            rows.append((i, _row(mapping)))
+
+        if rows:
+            # One transaction, so the whole batch costs a single commit
+            with self._transaction() as conn:
+                for i, row in rows:
+                    try:
+                        conn.execute(_INSERT, row)
+                        saved.append(i)
+                    except sqlite3.IntegrityError:
+                        errors[i] = DuplicateKeyError(f"Key {mappings[i].short_key} already exists")
+        for i in saved:
+            self._on_saved(mappings[i].short_key)
+        return errors
+
+    def existing_keys(self, short_keys: list[str]) -> set[str]:
+        rows = self._select_in("SELECT short_key FROM url_mappings WHERE short_key IN ({})", list(short_keys))
+        return {short_key for short_key, in rows}
+
+    def get_mapping_by_key(self, short_key: str) -> Optional[URLMapping]:
+        row = self._conn().execute(_SELECT_MAPPING, (short_key,)).fetchone()
+        return _to_mapping(row) if row is not None else None
+
+    def get_redirect_target(self, short_key: str) -> Optional[RedirectRow]:
+        return self._conn().execute(_SELECT_TARGET, (short_key,)).fetchone()
+
+    def get_redirect_targets(self, short_keys: list[str]) -> dict[str, RedirectRow]:
+        rows = self._select_in("SELECT short_key, long_url, expires_at, redirect_code, cache_max_age"
+                               " FROM url_mappings WHERE short_key IN ({})", list(short_keys))
+        return {short_key: tuple(row) for short_key, *row in rows}
+
+    def find_by_url_hashes(self, url_hashes: list[bytes]) -> list[tuple[bytes, str, str, Optional[float]]]:
+        rows = self._select_in(
+            "SELECT url_hash, short_key, long_url, expires_at FROM url_mappings WHERE url_hash IN ({})",
+            [bytes(url_hash) for url_hash in url_hashes])
+        return [(bytes(url_hash), short_key, long_url, expires_at)
+                for url_hash, short_key, long_url, expires_at in rows]
+
+    def delete_mapping(self, short_key: str) -> bool:
+        row = self._conn().execute(_DELETE, (short_key,)).fetchone()
+        self._on_deleted(short_key, row[0] if row is not None else None)
+        return row is not None
+
+    def list_expired_mappings(self, batch_size: int = 1000) -> Iterator[URLMapping]:
+        cursor = self._conn().execute(_SELECT_EXPIRED, (time.time(),))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _to_mapping(row)
+
+    def purge_expired(self, batch_size: int = 1000, max_runtime: Optional[float] = None) -> int:
+        conn = self._conn()
+        now = time.time()
+        deadline = time.monotonic() + max_runtime if max_runtime is not None else None
+        deleted = 0
+        while deadline is None or time.monotonic() < deadline:
+            # Each chunk is its own short write transaction
+            rows = conn.execute(_PURGE_EXPIRED, (now, batch_size)).fetchall()
+            if not rows:
+                break
+            deleted += len(rows)
+            for short_key, url_hash in rows:
+                self._on_deleted(short_key, url_hash)
+        return deleted
+
+    def allocate_id_block(self, name: str, size: int) -> int:
+        value, = self._conn().execute(_ALLOCATE, (name, size)).fetchone()
+        return value - size
+
+    def read_counter(self, name: str) -> int:
+        row = self._conn().execute(_SELECT_COUNTER, (name,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def iter_short_keys(self, created_since: Optional[datetime] = None,
+                        batch_size: int = 10000) -> Iterator[str]:
+        if created_since is None:
+            cursor = self._conn().execute("SELECT short_key FROM url_mappings")
+        else:
+            since = to_epoch(created_since) if isinstance(created_since, datetime) else created_since
+            cursor = self._conn().execute("SELECT short_key FROM url_mappings WHERE created_at >= ?", (since,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for short_key, in rows:
+                yield short_key
+
+    def iter_redirect_rows(self, created_since: Optional[datetime] = None,
+                           batch_size: int = 10000) -> Iterator[tuple]:
+        since = to_epoch(created_since) if isinstance(created_since, datetime) else created_since
+        cursor = self._conn().execute(_SELECT_REDIRECT_ROWS, (time.time(), since if since is not None else 0))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def iter_mapping_rows(self, batch_size: int = 10000) -> Iterator[tuple]:
+        # _COLUMNS is in MAPPING_FIELDS order
+        cursor = self._conn().execute(_SELECT_ALL)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def iter_mappings(self, after: Optional[tuple[float, str]] = None, expires_before: Optional[float] = None,
+                      expires_after: Optional[float] = None, domain_prefix: Optional[str] = None,
+                      fields: tuple = MAPPING_FIELDS, batch_size: int = 1000) -> Iterator[dict]:
+        # Field names are interpolated into the statement, so only known ones are accepted
+        unknown = set(fields) - set(MAPPING_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        columns = ['short_key', 'created_at'] + [field for field in fields if field not in ('short_key', 'created_at')]
+        conditions, params = [], []
+        if after is not None:
+            # A row-value comparison seeks the (created_at, short_key) index
+            conditions.append("(created_at, short_key) > (?, ?)")
+            params.extend(after)
+        if expires_before is not None:
+            conditions.append("expires_at < ?")
+            params.append(expires_before)
+        if expires_after is not None:
+            conditions.append("expires_at > ?")
+            params.append(expires_after)
+        if domain_prefix:
+            # Same rule as util.urls.has_domain_prefix: the scheme in any case, the prefix as given
+            conditions.append("((lower(substr(long_url, 1, 7)) = 'http://' AND substr(long_url, 8, ?) = ?)"
+                              " OR (lower(substr(long_url, 1, 8)) = 'https://' AND substr(long_url, 9, ?) = ?))")
+            params.extend((len(domain_prefix), domain_prefix) * 2)
+        sql = f"SELECT {', '.join(columns)} FROM url_mappings"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        cursor = self._conn().execute(sql + " ORDER BY created_at, short_key", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def increment_clicks(self, clicks: dict[str, tuple[int, float]]) -> int:
+        if not clicks:
+            return 0
+        with self._transaction() as conn:
+            cursor = conn.executemany(_INCREMENT_CLICKS, [(count, accessed_at, short_key)
+                                                          for short_key, (count, accessed_at) in clicks.items()])
+        return cursor.rowcount
+
+    def get_click_stats(self, short_key: str) -> Optional[tuple[int, Optional[float]]]:
+        return self._conn().execute(_SELECT_CLICKS, (short_key,)).fetchone()
@@ -0,0 +1,71 @@
+from typing import Optional
+
+from repository.async_repo import AsyncBaseRepository
+from repository.key_filter import KeyFilter
+from repository.snapshot import SnapshotSource
+from service.click_tracker import ClickTracker
+from service.hot_keys import HotKeyTracker
+from service.redirector import RedirectorService, RedirectTarget
+from util.cache import LRUCache
+from util.metrics import Metrics
+from util.singleflight import AsyncSingleFlight
+
+
+class AsyncRedirectorService(RedirectorService):
+    """
+    RedirectorService for an asyncio server: the same cache, key filter,
+    snapshot tiers and redirect policy, with the repository lookup awaited
+    so a slow database holds no thread while it answers.
+    """
+
+    def __init__(self, repo: AsyncBaseRepository, cache: Optional[LRUCache] = None,
+                 key_filter: Optional[KeyFilter] = None, click_tracker: Optional[ClickTracker] = None,
+                 redirect_code: int = 302, cache_max_age: int = 0, snapshot: Optional[SnapshotSource] = None,
+                 snapshot_mode: str = 'fallback', single_flight: Optional[AsyncSingleFlight] = None,
+                 hot_keys: Optional[HotKeyTracker] = None, stale_max_age: Optional[float] = None,
+                 metrics: Optional[Metrics] = None):
+        super().__init__(repo=repo, cache=cache, key_filter=key_filter, click_tracker=click_tracker,
+                         redirect_code=redirect_code, cache_max_age=cache_max_age, snapshot=snapshot,
+                         snapshot_mode=snapshot_mode, single_flight=single_flight, hot_keys=hot_keys,
+                         stale_max_age=stale_max_age, metrics=metrics)
+
+    async def redirect(self, short_key: str) -> str:
+        return (await self.resolve(short_key)).long_url
+
+    async def resolve(self, short_key: str) -> RedirectTarget:
+        """
+        Look up short_key and work out the redirect response
+        :param short_key:
+        :return: RedirectTarget
+        :raises NotFoundError: no mapping for short_key
+        :raises GoneError: the mapping has expired
+        """
+        # Cache hits complete without yielding to the event loop
+        target = self._cached(short_key)
+        if target is None:
+            if self.single_flight is not None:
+                target = await self.single_flight.do(short_key, self._load, short_key)
+            else:
+                target = await self._load(short_key)
+            target = self._checked(short_key, target)
+        return self._respond(short_key, target)
+
+    async def _load(self, short_key: str) -> Optional[tuple]:
+        generation = self._generation(short_key)
+        try:
+            target = await self._fetch(short_key)
+        except Exception:
+            target = self._fallback(short_key)
+            if target is None:
+                raise
+            return target
+        self._store(short_key, target, generation)
+        return target
+
+    async def _fetch(self, short_key: str) -> Optional[tuple]:
+        snapshot = self.snapshot
+        if snapshot is not None and self.snapshot_first:
+            target = snapshot.get_redirect_target(short_key)
+            if target is not None:
+                return target
+        return await self.repo.get_redirect_target(short_key)
@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from model.url_mapping import URLMapping
+from repository.async_repo import AsyncBaseRepository
+from repository.base import DuplicateKeyError
+from service.group_commit import GroupCommitWriter
+from service.url_generator import BaseURLGenerator
+from util.config import collision_retries
+from util.metrics import Metrics
+
+
+class AsyncURLGeneratorService(BaseURLGenerator):
+    """
+    URLGeneratorService.generate for an asyncio server, with the same
+    validation rules and errors. Keys are random; dedup and counter-allocated
+    keys are only available in the synchronous service.
+    """
+
+    def __init__(self, repo: AsyncBaseRepository, metrics: Optional[Metrics] = None,
+                 writer: Optional[GroupCommitWriter] = None):
+        super().__init__(metrics)
+        self.repo = repo
+        # When set, mappings are inserted in batches by its thread
+        self.writer = writer
+
+    async def _save(self, mapping: URLMapping):
+        # Insert-only, so a key taken concurrently is reported rather than overwritten
+        if self.writer is not None:
+            await self.writer.save_async(mapping)
+        else:
+            await self.repo.save_url_mapping(mapping, force_insert=True)
+
+    async def generate(self, long_url: str,
+                       custom_alias: str = None,
+                       expires_at: datetime = None,
+                       redirect_code: int = None,
+                       cache_max_age: int = None) -> str:
+        self._validate(long_url, custom_alias, expires_at, redirect_code, cache_max_age)
+
+        if custom_alias:
+            # A taken alias is reported by the insert
+            short_key = custom_alias
+        else:
+            # One query checks every candidate, instead of a round trip per retry
+            candidates = [self._make_random_key() for _ in range(collision_retries)]
+            short_key = self._first_free(candidates, await self.repo.existing_keys(candidates))
+
+        now = datetime.now(tz=ZoneInfo("UTC"))
+        for attempt in range(collision_retries + 1):
+            mapping = URLMapping(short_key=short_key, long_url=long_url, created_at=now, expires_at=expires_at,
+                                 redirect_code=redirect_code, cache_max_age=cache_max_age)
+            try:
+                await self._save(mapping)
+                return short_key
+            except DuplicateKeyError as e:
+                short_key = self._key_after_duplicate(e, custom_alias, attempt)
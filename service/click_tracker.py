@@ -0,0 +1,125 @@
+import atexit
+import logging
+import threading
+import time
+from typing import Optional
+
+from util.process import OncePerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class ClickTracker:
+    """
+    Buffers per-link click counts in memory and flushes them to the
+    repository as one bulk update, from a background thread, every
+    `flush_interval_ms` or as soon as `flush_max_keys` distinct keys are
+    pending. At most `max_pending_keys` keys are held; clicks on further keys
+    are dropped (and counted) until the next flush succeeds.
+    """
+
+    def __init__(self, repo, flush_interval_ms: int = 1000, flush_max_keys: int = 1000,
+                 max_pending_keys: int = 100000):
+        self.repo = repo
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_keys = flush_max_keys
+        self.max_pending_keys = max_pending_keys
+        self.dropped = 0
+        self.flushed = 0
+        # short_key -> [clicks, last access epoch]
+        self._pending: dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start = OncePerProcess(self._start_flusher)
+
+    def _start_flusher(self):
+        # Runs once per process: a flusher started before a fork does not exist in the child
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def record(self, short_key: str) -> None:
+        """
+        Count one click on short_key
+        :param short_key:
+        """
+        self._start()
+        now = time.time()
+        with self._lock:
+            entry = self._pending.get(short_key)
+            if entry is not None:
+                entry[0] += 1
+                entry[1] = now
+                return
+            if len(self._pending) >= self.max_pending_keys:
+                self.dropped += 1
+                return
+            self._pending[short_key] = [1, now]
+            if len(self._pending) >= self.flush_max_keys:
+                self._wake.set()
+
+    def pending(self, short_key: str) -> tuple[int, Optional[float]]:
+        """
+        Clicks on short_key recorded by this process but not yet flushed
+        :param short_key:
+        :return: (clicks, last access epoch or None)
+        """
+        with self._lock:
+            entry = self._pending.get(short_key)
+            return (entry[0], entry[1]) if entry else (0, None)
+
+    def flush(self) -> int:
+        """
+        Write all pending counts with one bulk update. On failure the counts
+        are merged back so they are retried on the next flush.
+        :return: number of keys flushed
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            self.repo.increment_clicks({key: (count, accessed_at) for key, (count, accessed_at) in batch.items()})
+        except Exception:
+            with self._lock:
+                for key, (count, accessed_at) in batch.items():
+                    entry = self._pending.get(key)
+                    if entry is not None:
+                        entry[0] += count
+                        entry[1] = max(entry[1], accessed_at)
+                    elif len(self._pending) < self.max_pending_keys:
+                        self._pending[key] = [count, accessed_at]
+                    else:
+                        self.dropped += count
+            raise
+        self.flushed += len(batch)
+        return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Click count flush failed")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop the flusher thread and flush whatever is still pending
+        :param timeout: seconds to wait for the thread
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final click count flush failed")
@@ -0,0 +1,177 @@
+import asyncio
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from model.url_mapping import URLMapping
+from repository.base import UnavailableError
+from util.process import OncePerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """
+    Group commit for new mappings: concurrent requests queue their mapping
+    and a writer thread inserts everything queued with one save_many, at
+    most `max_delay_ms` after the first mapping arrives or as soon as
+    `max_batch` are queued.
+
+    Each caller waits on a future resolved when its batch is acknowledged,
+    with its own mapping's error (DuplicateKeyError, ValidationError, ...)
+    or the error of the whole bulk insert, so a response is only sent once
+    its mapping is stored. save_many runs the repository hooks, so the key
+    is in the key filter and out of the redirect cache by then as well.
+    A caller waiting longer than `timeout_ms` gets UnavailableError, and its
+    mapping is withdrawn unless its batch is already being written.
+    """
+
+    def __init__(self, repo, max_delay_ms: float = 2, max_batch: int = 256, timeout_ms: Optional[float] = 5000):
+        self.repo = repo
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self.timeout = timeout_ms / 1000 if timeout_ms is not None else None
+        self.batches = 0
+        self.written = 0
+        self._queue: list[tuple[URLMapping, Future]] = []
+        self._lock = threading.Lock()
+        # Set while anything is queued, and once a full batch is queued
+        self._queued = threading.Event()
+        self._full = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Set by stop(); mappings submitted afterwards are written inline
+        self._closed = False
+        self._start = OncePerProcess(self._start_writer)
+
+    def _start_writer(self):
+        # Runs once per process: a writer started before a fork does not exist in the child
+        self._lock = threading.Lock()
+        self._queue = []
+        self._queued = threading.Event()
+        self._full = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, mapping: URLMapping) -> Future:
+        """
+        Queue a new mapping for the next bulk insert
+        :param mapping:
+        :return: future resolved with the mapping once it is stored, or with the error it failed with
+        """
+        if not self._closed:
+            self._start()
+        future = Future()
+        with self._lock:
+            self._queue.append((mapping, future))
+            self._queued.set()
+            if len(self._queue) >= self.max_batch:
+                self._full.set()
+        if self._closed:
+            # No writer left to pick it up; a failure is on the future
+            try:
+                self.flush()
+            except Exception:
+                pass
+        return future
+
+    def save(self, mapping: URLMapping) -> URLMapping:
+        """
+        Insert a new mapping with the next batch and wait until it is stored
+        :param mapping:
+        :return: mapping
+        :raises DuplicateKeyError: if the key already exists (or any other error of its insert)
+        :raises UnavailableError: if it is not stored within the timeout
+        """
+        future = self.submit(mapping)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            if not future.done():
+                raise self._timed_out(future, mapping) from None
+            raise
+
+    async def save_async(self, mapping: URLMapping) -> URLMapping:
+        """
+        save() for a coroutine: waits without blocking the event loop
+        :param mapping:
+        :return: mapping
+        :raises DuplicateKeyError: if the key already exists (or any other error of its insert)
+        :raises UnavailableError: if it is not stored within the timeout
+        """
+        future = self.submit(mapping)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+        except TimeoutError:
+            if not future.done():
+                raise self._timed_out(future, mapping) from None
+            raise
+
+    @staticmethod
+    def _timed_out(future: Future, mapping: URLMapping) -> UnavailableError:
+        # Withdraws the mapping if its batch has not started; otherwise it may still be stored
+        future.cancel()
+        return UnavailableError(f"Timed out waiting for the insert of {mapping.short_key}")
+
+    def flush(self) -> int:
+        """
+        Insert up to max_batch queued mappings with one save_many and resolve their futures
+        :return: number of mappings taken from the queue, including withdrawn ones
+        """
+        with self._lock:
+            queued, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            if not self._queue:
+                self._queued.clear()
+            if len(self._queue) < self.max_batch:
+                self._full.clear()
+        # Skips mappings whose callers stopped waiting
+        batch = [(mapping, future) for mapping, future in queued if future.set_running_or_notify_cancel()]
+        if not batch:
+            return len(queued)
+        try:
+            errors = self.repo.save_many([mapping for mapping, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            raise
+        for i, (mapping, future) in enumerate(batch):
+            error = errors.get(i)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(mapping)
+        self.batches += 1
+        self.written += len(batch) - len(errors)
+        return len(queued)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._queued.wait()
+            if not self._stop.is_set():
+                # Give concurrent requests max_delay to join the batch, unless it fills up first
+                self._full.wait(self.max_delay)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Group commit failed")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop the writer thread once everything queued is written
+        :param timeout: seconds to wait for the thread
+        """
+        self._closed = True
+        self._stop.set()
+        self._queued.set()
+        self._full.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        try:
+            while self.flush():
+                pass
+        except Exception:
+            logger.exception("Group commit failed")
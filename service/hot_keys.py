@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Optional
+
+from util.heavy_hitters import SpaceSaving
+
+logger = logging.getLogger(__name__)
+
+
+class HotKeyTracker:
+    """
+    Tracks the most redirected short keys in this worker with a fixed-size
+    Space-Saving summary, so memory does not grow with the number of keys.
+
+    run() periodically saves the top keys to `path` (if set) and decays the
+    counts, so the ranking follows recent traffic. A starting worker reads
+    the saved keys with load() to pre-warm its redirect cache. Workers
+    behind one load balancer see much the same mix, so each overwrites the
+    file with its own ranking rather than merging.
+
+    Redirects are counted in a buffer per thread, added to the summary every
+    `buffer_size` redirects and before every read, so request threads do not
+    contend for the summary's lock on each redirect.
+    """
+
+    def __init__(self, capacity: int = 1000, path: Optional[str] = None, decay: float = 0.5,
+                 buffer_size: int = 64):
+        self.path = path
+        self.decay = decay
+        self.buffer_size = buffer_size
+        self._summary = SpaceSaving(capacity)
+        self._local = threading.local()
+        # Every thread's buffer, dropped with its thread
+        self._buffers: weakref.WeakSet[_Buffer] = weakref.WeakSet()
+        self._buffers_lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        self._drain()
+        return self._summary.total
+
+    def record(self, short_key: str) -> None:
+        """
+        Count one redirect of short_key
+        :param short_key:
+        """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = _Buffer()
+            with self._buffers_lock:
+                self._buffers.add(buffer)
+            # Counts still buffered when the thread exits are added then
+            weakref.finalize(buffer, self._summary.add_many, buffer.counts)
+        # Only contended while a read drains the buffer
+        with buffer.lock:
+            buffer.counts[short_key] = buffer.counts.get(short_key, 0) + 1
+            buffer.size += 1
+            if buffer.size < self.buffer_size:
+                return
+            counts = buffer.take()
+        self._summary.add_many(counts)
+
+    def _drain(self) -> None:
+        # Adds every thread's buffered redirects to the summary
+        with self._buffers_lock:
+            buffers = list(self._buffers)
+        for buffer in buffers:
+            with buffer.lock:
+                counts = buffer.take()
+            if counts:
+                self._summary.add_many(counts)
+
+    def top(self, k: Optional[int] = None) -> list[tuple[str, int, int]]:
+        """
+        The k most redirected keys
+        :param k: defaults to every tracked key
+        :return: (short_key, count, error) tuples, highest count first;
+                 count overestimates the true count by at most error
+        """
+        self._drain()
+        return self._summary.top(k)
+
+    def save(self) -> int:
+        """
+        Write the current ranking to path, replacing the file atomically
+        :return: number of keys written
+        """
+        top = self.top()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'saved_at': time.time(), 'keys': [[key, count] for key, count, _ in top]}, f)
+        os.replace(tmp_path, self.path)
+        return len(top)
+
+    @staticmethod
+    def load(path: str, limit: Optional[int] = None) -> list[str]:
+        """
+        Read a saved ranking
+        :param path:
+        :param limit: return at most this many keys
+        :return: short keys, hottest first; empty if the file does not exist
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        keys = [key for key, _ in data['keys']]
+        return keys[:limit] if limit is not None else keys
+
+    def run(self, interval: float, stop: Optional[threading.Event] = None) -> None:
+        """
+        Every interval seconds, save the ranking (if path is set) and decay
+        the counts, until stop is set. Intended as the target of a daemon thread.
+        """
+        stop = stop or threading.Event()
+        while not stop.wait(interval):
+            if self.path:
+                try:
+                    self.save()
+                except Exception:
+                    logger.exception("Saving hot keys failed")
+            self._drain()
+            self._summary.decay(self.decay)
+
+
+class _Buffer:
+    """
+    Redirects counted by one thread since its last flush
+    """
+
+    __slots__ = ('counts', 'size', 'lock', '__weakref__')
+
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def take(self) -> dict[str, int]:
+        # Caller holds the lock; counts stays the same dict for the finalizer
+        counts = self.counts.copy()
+        self.counts.clear()
+        self.size = 0
+        return counts
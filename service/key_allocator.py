@@ -0,0 +1,98 @@
+import threading
+
+from util import base62
+
+
+class KeyAllocator:
+    """
+    Hands out short keys from blocks of integer IDs leased from a counter in the
+    repository, so a new key costs no database round trip and needs no
+    existence check. With `scramble` enabled, IDs are passed through a keyed
+    Feistel permutation of the key space so consecutive keys look unrelated.
+    """
+
+    _ROUNDS = 4
+
+    def __init__(self, repo, block_size: int = 1000, key_length: int = 8,
+                 scramble: bool = True, secret: int = 0, counter_name: str = 'url_mappings'):
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        self.repo = repo
+        self.block_size = block_size
+        self.key_length = key_length
+        self.scramble = scramble
+        self.counter_name = counter_name
+        self._space = base62.BASE ** key_length
+        # Feistel halves must together cover the whole key space
+        self._half_bits = ((self._space - 1).bit_length() + 1) // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._round_keys = [(secret * (r + 1) + 0x9E3779B9 * (r + 1)) & 0xFFFFFFFF
+                            for r in range(self._ROUNDS)]
+        self._next_id = 0
+        self._end_id = 0
+        self._lock = threading.Lock()
+
+    def _round(self, half: int, round_key: int) -> int:
+        x = ((half ^ round_key) * 0x5BD1E995) & 0xFFFFFFFFFFFF
+        return (x ^ (x >> 13)) & self._half_mask
+
+    def _permute(self, num: int) -> int:
+        left, right = num >> self._half_bits, num & self._half_mask
+        for round_key in self._round_keys:
+            left, right = right, left ^ self._round(right, round_key)
+        return (left << self._half_bits) | right
+
+    def _unpermute(self, num: int) -> int:
+        left, right = num >> self._half_bits, num & self._half_mask
+        for round_key in reversed(self._round_keys):
+            left, right = right ^ self._round(left, round_key), left
+        return (left << self._half_bits) | right
+
+    def scramble_id(self, num: int) -> int:
+        """
+        Map an ID to a unique ID in the same key space (bijective)
+        :param num:
+        :return: int
+        """
+        # Cycle-walk: the Feistel domain is a power of two slightly larger than
+        # the key space, so re-apply until the result lands back inside it
+        num = self._permute(num)
+        while num >= self._space:
+            num = self._permute(num)
+        return num
+
+    def unscramble_id(self, num: int) -> int:
+        """
+        Inverse of scramble_id
+        :param num:
+        :return: int
+        """
+        num = self._unpermute(num)
+        while num >= self._space:
+            num = self._unpermute(num)
+        return num
+
+    def next_id(self) -> int:
+        """
+        Return the next unused ID, leasing a new block when the current one runs out
+        :return: int
+        """
+        with self._lock:
+            if self._next_id >= self._end_id:
+                start = self.repo.allocate_id_block(self.counter_name, self.block_size)
+                self._next_id, self._end_id = start, start + self.block_size
+            num = self._next_id
+            self._next_id += 1
+        if num >= self._space:
+            raise RuntimeError("Short key space exhausted")
+        return num
+
+    def next_key(self) -> str:
+        """
+        Return the next short key
+        :return: str
+        """
+        num = self.next_id()
+        if self.scramble:
+            num = self.scramble_id(num)
+        return base62.encode(num, min_length=self.key_length)
@@ -1,7 +1,16 @@
-from datetime import datetime, tzinfo
-from zoneinfo import ZoneInfo
+import time
+from datetime import datetime, timezone
+from typing import Optional
 
+from repository.base import BaseRepository
 from repository.db_repo import DBRepository
+from repository.key_filter import KeyFilter
+from repository.snapshot import SnapshotSource
+from service.click_tracker import ClickTracker
+from service.hot_keys import HotKeyTracker
+from util.cache import LRUCache
+from util.metrics import Metrics
+from util.singleflight import SingleFlight
 
 
 # Custom exceptions
@@ -11,29 +20,213 @@ class NotFoundError(Exception):
 class GoneError(Exception):
     pass
 
+class RedirectTarget:
+    """
+    Where to redirect and how: the status code and how long clients and
+    CDNs may cache the redirect (never past the link's expiry)
+    """
+    __slots__ = ('long_url', 'status_code', 'max_age')
+
+    PERMANENT_CODES = (301, 308)
+
+    def __init__(self, long_url: str, status_code: int, max_age: int):
+        self.long_url = long_url
+        self.status_code = status_code
+        self.max_age = max_age
+
+    @property
+    def cache_control(self) -> Optional[str]:
+        """
+        Cache-Control header value, or None to leave the response uncached by default
+        """
+        if self.max_age > 0:
+            return f"public, max-age={self.max_age}"
+        if self.status_code in self.PERMANENT_CODES:
+            # Browsers cache permanent redirects indefinitely unless told otherwise
+            return "no-store"
+        return None
+
+
 class RedirectorService:
     """
-    Given a short key, looks up the mapping, enforces expiry, and returns the target long URL
+    Given a short key, looks up the mapping, enforces expiry, and returns the target long URL.
+
+    With a snapshot, lookups are served from it either before the repository
+    (snapshot_mode 'first'; misses still go to the repository) or only when
+    the repository lookup fails ('fallback').
+
+    When the repository lookup fails, a cache entry past its ttl or the
+    snapshot may answer instead if it is younger than stale_max_age; expired
+    links are never served.
     """
-    def __init__(self):
-        self.repo = DBRepository()
+
+    SNAPSHOT_MODES = ('first', 'fallback')
+
+    def __init__(self, repo: Optional[BaseRepository] = None, cache: Optional[LRUCache] = None,
+                 key_filter: Optional[KeyFilter] = None, click_tracker: Optional[ClickTracker] = None,
+                 redirect_code: int = 302, cache_max_age: int = 0, snapshot: Optional[SnapshotSource] = None,
+                 snapshot_mode: str = 'fallback', single_flight: Optional[SingleFlight] = None,
+                 hot_keys: Optional[HotKeyTracker] = None, stale_max_age: Optional[float] = None,
+                 metrics: Optional[Metrics] = None):
+        if snapshot_mode not in self.SNAPSHOT_MODES:
+            raise ValueError(f"Unknown snapshot_mode {snapshot_mode!r}; "
+                             f"expected one of {', '.join(self.SNAPSHOT_MODES)}")
+        self.repo = repo if repo is not None else DBRepository(cache=cache, key_filter=key_filter)
+        self.cache = cache
+        self.key_filter = key_filter
+        self.click_tracker = click_tracker
+        self.hot_keys = hot_keys
+        self.snapshot = snapshot
+        self.snapshot_first = snapshot_mode == 'first'
+        # Shares one fetch between concurrent cache misses for the same key
+        self.single_flight = single_flight
+        # Seconds stale data may be served while the repository fails; None is unlimited
+        self.stale_max_age = stale_max_age
+        # Stale-serving counter; None disables it
+        self.metrics = metrics
+        # Defaults for mappings without their own redirect policy
+        self.redirect_code = redirect_code
+        self.cache_max_age = cache_max_age
 
     def redirect(self, short_key: str) -> str:
-        # Fetch data from DB
-        mapping = self.repo.get_mapping_by_key(short_key=short_key)
-        if not mapping:
+        return self.resolve(short_key).long_url
+
+    def resolve(self, short_key: str) -> RedirectTarget:
+        """
+        Look up short_key and work out the redirect response
+        :param short_key:
+        :return: RedirectTarget
+        :raises NotFoundError: no mapping for short_key
+        :raises GoneError: the mapping has expired
+        """
+        return self._respond(short_key, self._lookup(short_key))
+
+    def _respond(self, short_key: str, target: tuple) -> RedirectTarget:
+        long_url, expires_at, redirect_code, cache_max_age = target
+        if self.click_tracker is not None:
+            self.click_tracker.record(short_key)
+        if self.hot_keys is not None:
+            self.hot_keys.record(short_key)
+
+        max_age = self.cache_max_age if cache_max_age is None else cache_max_age
+        if expires_at is not None:
+            # A cached redirect must not outlive the link
+            max_age = min(max_age, max(0, int(expires_at - time.time())))
+        return RedirectTarget(long_url, redirect_code or self.redirect_code, max_age)
+
+    def prewarm(self, short_keys: list[str], repo: Optional[BaseRepository] = None) -> int:
+        """
+        Load the mappings of short_keys into the cache with one batched lookup
+        :param short_keys: hottest first; only as many as the cache holds are loaded
+        :param repo: synchronous repository to read from, if self.repo is not one
+        :return: number of mappings cached
+        """
+        if self.cache is None or not short_keys:
+            return 0
+        short_keys = short_keys[:self.cache.max_size]
+        generations = {short_key: self.cache.generation(short_key) for short_key in short_keys}
+        targets = (repo or self.repo).get_redirect_targets(short_keys)
+        now = time.time()
+        live = {short_key: target for short_key, target in targets.items()
+                if target[1] is None or target[1] > now}
+        for short_key, target in live.items():
+            self._store(short_key, target, generations[short_key])
+        return len(live)
+
+    def _lookup(self, short_key: str) -> tuple:
+        target = self._cached(short_key)
+        if target is not None:
+            return target
+
+        # Fetch only the redirect fields, from the snapshot or the DB; a
+        # burst of misses for one key (a link going viral) waits on one fetch
+        if self.single_flight is not None:
+            target = self.single_flight.do(short_key, self._load, short_key)
+        else:
+            target = self._load(short_key)
+        return self._checked(short_key, target)
+
+    def _cached(self, short_key: str) -> Optional[tuple]:
+        # 1) Serve hot keys from the in-process cache
+        if self.cache is not None:
+            entry = self.cache.get(short_key)
+            if entry is not None:
+                long_url, redirect_code, cache_max_age = entry.value
+                return long_url, entry.expires_at, redirect_code, cache_max_age
+
+        # Keys the filter has never seen cannot exist
+        if self.key_filter is not None and not self.key_filter.might_contain(short_key):
+            raise NotFoundError(f"No mapping for key '{short_key}'")
+        return None
+
+    @staticmethod
+    def _checked(short_key: str, target: Optional[tuple]) -> tuple:
+        if not target:
             raise NotFoundError(f"No mapping for key '{short_key}'")
 
-        # 2 check expiry
-        if mapping.expires_at:
-            expires_at = mapping.expires_at
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=ZoneInfo("UTC"))
-            else:
-                expires_at = expires_at.astimezone(ZoneInfo("UTC"))
-            now = datetime.now(tz=ZoneInfo("UTC"))
-            if expires_at < now:
-                raise GoneError(f"Mapping for '{short_key}' expired at {mapping.expires_at.isoformat()}")
+        # 2 check expiry (epoch seconds, so no timezone handling per request)
+        expires_at = target[1]
+        if expires_at is not None and expires_at < time.time():
+            expired = datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat()
+            raise GoneError(f"Mapping for '{short_key}' expired at {expired}")
 
         # 3) All good
-        return mapping.long_url
+        return target
+
+    def _load(self, short_key: str) -> Optional[tuple]:
+        generation = self._generation(short_key)
+        try:
+            target = self._fetch(short_key)
+        except Exception:
+            target = self._fallback(short_key)
+            if target is None:
+                raise
+            return target
+        self._store(short_key, target, generation)
+        return target
+
+    def _generation(self, short_key: str) -> Optional[int]:
+        # Read before the fetch, so a write landing during it keeps the row out of the cache
+        return self.cache.generation(short_key) if self.cache is not None else None
+
+    def _store(self, short_key: str, target: Optional[tuple], generation: Optional[int]):
+        # Filled before single-flight waiters are released, so later requests
+        # hit the cache (expired rows are not stored)
+        if target and self.cache is not None:
+            long_url, expires_at, redirect_code, cache_max_age = target
+            self.cache.put(short_key, (long_url, redirect_code, cache_max_age), expires_at, generation)
+
+    def _fetch(self, short_key: str) -> Optional[tuple]:
+        snapshot = self.snapshot
+        if snapshot is not None and self.snapshot_first:
+            target = snapshot.get_redirect_target(short_key)
+            if target is not None:
+                return target
+            # Keys created since the last export are only in the repository
+        return self.repo.get_redirect_target(short_key=short_key)
+
+    def _fallback(self, short_key: str) -> Optional[tuple]:
+        """
+        Stale answer for a key the repository could not look up: a cache
+        entry past its ttl, then the snapshot, if younger than stale_max_age.
+        Not stored in the cache, so stale data is never passed off as fresh.
+        :return: redirect row, or None if there is no recent enough data
+        """
+        if self.cache is not None:
+            entry = self.cache.get_stale(short_key, self.stale_max_age)
+            if entry is not None:
+                self._count_stale('cache')
+                long_url, redirect_code, cache_max_age = entry.value
+                return long_url, entry.expires_at, redirect_code, cache_max_age
+        snapshot = self.snapshot
+        if snapshot is not None and not self.snapshot_first and snapshot.ready and \
+                (self.stale_max_age is None or time.time() - snapshot.generated_at < self.stale_max_age):
+            target = snapshot.get_redirect_target(short_key)
+            if target is not None:
+                self._count_stale('snapshot')
+                return target
+        return None
+
+    def _count_stale(self, source: str):
+        if self.metrics is not None:
+            self.metrics.stale_redirects.inc(source)
@@ -2,12 +2,20 @@ import re
 import secrets
 import string
 from datetime import datetime
+from typing import Optional, Union
 from zoneinfo import ZoneInfo
 from urllib.parse import urlparse
 
-from model.url_mapping import URLMapping
+from model.url_mapping import REDIRECT_CODES, URLMapping, to_epoch
+from repository.base import BaseRepository, DuplicateKeyError
 from repository.db_repo import DBRepository
+from service.group_commit import GroupCommitWriter
+from service.key_allocator import KeyAllocator
+from util.cache import LRUCache
 from util.config import collision_retries
+from util.metrics import Metrics
+from util.urls import hash_url, normalize_url
+from util import config
 
 
 #Custom exceptions
@@ -17,62 +25,357 @@ class AliasConflictError(Exception):
 class InvalidURLError(Exception):
     pass
 
-class URLGeneratorService:
+class BatchTooLargeError(ValueError):
+    pass
+
+class BaseURLGenerator:
     """
-    Generates or validates a short key for a given long URL,
-    persists the mapping and returns the full hosrt URL
+    Validation and random key generation shared by URLGeneratorService and
+    the asyncio AsyncURLGeneratorService, which only differ in how they
+    query and write the repository
     """
 
     _ALIAS_REGEX = re.compile(r'^[A-Za-z0-9]{4,8}$')
 
-    def __init__(self):
-        self.repo = DBRepository()
+    def __init__(self, metrics: Optional[Metrics] = None):
+        # Outcome counters; None disables them
+        self.metrics = metrics
         self._alphabet = string.ascii_letters + string.digits
         self._key_length = 8
 
-    def _validate_url(self, url: str):
-
+    @staticmethod
+    def _validate_url(url: str):
         parts = urlparse(url)
         if parts.scheme not in ('http', 'https') or not parts.netloc:
             raise InvalidURLError(f"Invalid URL: {url}")
 
 
+    @staticmethod
+    def _validate_policy(redirect_code: Optional[int], cache_max_age: Optional[int]):
+        if redirect_code is not None and redirect_code not in REDIRECT_CODES:
+            raise ValueError(f"redirect_code must be one of {', '.join(map(str, REDIRECT_CODES))}")
+        if cache_max_age is not None and cache_max_age < 0:
+            raise ValueError("cache_max_age must not be negative")
+
+    def _validate(self, long_url: str, custom_alias: Optional[str], expires_at: Optional[datetime],
+                  redirect_code: Optional[int], cache_max_age: Optional[int]):
+        """
+        Check one shortening request, without touching the repository
+        :raises InvalidURLError: for a bad URL or alias
+        :raises ValueError: for a naive expires_at or an unsupported redirect policy
+        """
+        self._validate_url(long_url)
+        if expires_at and expires_at.tzinfo is None:
+            raise ValueError("expires_at must be timezone-aware")
+        self._validate_policy(redirect_code, cache_max_age)
+        if custom_alias and not self._ALIAS_REGEX.fullmatch(custom_alias):
+            raise InvalidURLError("Alias must be 4-8 alphanumeric characters")
+
     def _make_random_key(self) -> str:
         return ''.join(secrets.choice(self._alphabet) for _ in range(self._key_length))
 
+    def _long_key(self) -> str:
+        # Fall back to longer key once every candidate was taken
+        if self.metrics is not None:
+            self.metrics.long_key_fallbacks.inc()
+        return self._make_random_key() + self._make_random_key()
+
+    def _first_free(self, candidates: list[str], taken: set[str]) -> str:
+        """
+        Pick the first candidate not in taken, or a long key if all are
+        :param candidates: random keys, in the order they were generated
+        :param taken: those of them that already exist
+        :return: short key
+        """
+        short_key = next((candidate for candidate in candidates if candidate not in taken), None)
+        if self.metrics is not None:
+            retries = candidates.index(short_key) if short_key is not None else len(candidates)
+            if retries:
+                self.metrics.collision_retries.inc(amount=retries)
+        return short_key if short_key is not None else self._long_key()
+
+    def _alias_conflict(self, custom_alias: str) -> AliasConflictError:
+        if self.metrics is not None:
+            self.metrics.alias_conflicts.inc()
+        return AliasConflictError(f"Alias {custom_alias} already in use")
+
+    def _key_after_duplicate(self, error: DuplicateKeyError, custom_alias: Optional[str], attempt: int) -> str:
+        """
+        Handle an insert that found its key taken since it was checked
+        :param error: the insert's DuplicateKeyError
+        :param custom_alias: the requested alias, if any
+        :param attempt: how many inserts failed before this one
+        :return: a fresh random key to retry with
+        :raises AliasConflictError: for an alias, which is never replaced
+        :raises DuplicateKeyError: once collision_retries inserts have failed
+        """
+        if custom_alias:
+            raise self._alias_conflict(custom_alias) from None
+        if attempt == collision_retries:
+            raise error
+        if self.metrics is not None:
+            self.metrics.collision_retries.inc()
+        return self._make_random_key()
+
+
+class URLGeneratorService(BaseURLGenerator):
+    """
+    Generates or validates a short key for a given long URL,
+    persists the mapping and returns the full hosrt URL
+    """
+
+    def __init__(self, repo: Optional[BaseRepository] = None,
+                 key_allocator: Optional[KeyAllocator] = None,
+                 batch_max_size: Optional[int] = None,
+                 dedup: bool = False, dedup_cache: Optional[LRUCache] = None,
+                 metrics: Optional[Metrics] = None, writer: Optional[GroupCommitWriter] = None):
+        super().__init__(metrics)
+        self.repo = repo if repo is not None else DBRepository()
+        self.batch_max_size = batch_max_size if batch_max_size is not None else config.batch_max_size
+        # When set, keys come from the allocator instead of random probing
+        self.key_allocator = key_allocator
+        # Dedup mode: reuse the key of an identical earlier mapping
+        self.dedup = dedup
+        self.dedup_cache = dedup_cache
+        # When set, single mappings are inserted in batches with concurrent requests
+        self.writer = writer
+
+    def _save(self, mapping: URLMapping, force_insert: bool = True):
+        # Insert-only by default, like the writer, so a key taken since it was
+        # checked raises DuplicateKeyError instead of being overwritten
+        if self.writer is not None:
+            self.writer.save(mapping)
+        else:
+            self.repo.save_url_mapping(mapping, force_insert=force_insert)
+
+    @staticmethod
+    def _expiry_ms(expires_at: Optional[datetime]) -> Optional[int]:
+        # MongoDB keeps milliseconds, so compare expiries at that precision
+        if expires_at is None:
+            return None
+        return round(to_epoch(expires_at.replace(microsecond=expires_at.microsecond // 1000 * 1000)) * 1000)
+
+    def _find_duplicates(self, wanted: list[tuple[bytes, str, Optional[datetime]]]) -> dict[tuple, str]:
+        """
+        Look up existing mappings for long URLs, from the recent-pairs cache
+        first and then with one query on the url_hash index
+        :param wanted: (url_hash, long_url, expires_at) tuples
+        :return: (url_hash, expiry in ms) -> short key, for those with an identical mapping
+        """
+        found: dict[tuple, str] = {}
+        missing: dict[tuple, str] = {}
+        for url_hash, long_url, expires_at in wanted:
+            identity = (url_hash, self._expiry_ms(expires_at))
+            entry = self.dedup_cache.get(url_hash.hex()) if self.dedup_cache is not None else None
+            if entry is not None and entry.value[1] == identity[1]:
+                found[identity] = entry.value[0]
+            else:
+                missing[identity] = long_url
+        if not missing:
+            return found
+
+        rows = self.repo.find_by_url_hashes(list({url_hash for url_hash, _ in missing}))
+        for url_hash, short_key, stored_url, stored_expiry in rows:
+            identity = (url_hash, round(stored_expiry * 1000) if stored_expiry is not None else None)
+            long_url = missing.get(identity)
+            # Only reuse mappings with the same expiry, and guard against hash collisions
+            if long_url is not None and identity not in found and normalize_url(stored_url) == normalize_url(long_url):
+                found[identity] = short_key
+                self._remember(url_hash, short_key, identity[1])
+        return found
+
+    def _remember(self, url_hash: bytes, short_key: str, expiry_ms: Optional[int]):
+        # Cache the pair until the mapping itself expires
+        if self.dedup_cache is not None:
+            self.dedup_cache.put(url_hash.hex(), (short_key, expiry_ms),
+                                 expiry_ms / 1000 if expiry_ms is not None else None)
+
     def generate(self, long_url: str,
                  custom_alias: str = None,
-                 expires_at: datetime = None) -> str:
+                 expires_at: datetime = None,
+                 redirect_code: int = None,
+                 cache_max_age: int = None) -> str:
 
-        # Validate the URL
-        self._validate_url(long_url)
-        if expires_at:
-            if expires_at.tzinfo is None:
-                raise ValueError("expires_at must be timezone-aware")
+        # Validate the URL, alias and redirect policy
+        self._validate(long_url, custom_alias, expires_at, redirect_code, cache_max_age)
+        policy = {'redirect_code': redirect_code, 'cache_max_age': cache_max_age}
+
+        # Reuse an identical mapping in dedup mode (only for the default redirect policy)
+        url_hash = None
+        if self.dedup and not custom_alias and redirect_code is None and cache_max_age is None:
+            url_hash = hash_url(long_url)
+            existing = self._find_duplicates([(url_hash, long_url, expires_at)])
+            if existing:
+                return next(iter(existing.values()))
 
         # Determine short_key
         if custom_alias:
-            if not self._ALIAS_REGEX.fullmatch(custom_alias):
-                raise InvalidURLError("Alias must be 4-8 alphanumeric characters")
             if self.repo.get_mapping_by_key(custom_alias):
-                raise AliasConflictError(f"Alias {custom_alias} already in use")
+                raise self._alias_conflict(custom_alias)
             short_key = custom_alias
+        elif self.key_allocator is not None:
+            return self._save_allocated(long_url, expires_at, url_hash, policy)
         else:
             for i in range(collision_retries):
                 candidate = self._make_random_key()
                 if not self.repo.get_mapping_by_key(candidate):
                     short_key = candidate
                     break
+                if self.metrics is not None:
+                    self.metrics.collision_retries.inc()
             else:
-                # Fall back to longer key
-                short_key = self._make_random_key() + self._make_random_key()
+                short_key = self._long_key()
 
 
         # Build a domain object and save
         now = datetime.now(tz=ZoneInfo("UTC"))
-        mapping = URLMapping(short_key=short_key, long_url=long_url, created_at=now, expires_at=expires_at)
-        self.repo.save_url_mapping(mapping)
+        for attempt in range(collision_retries + 1):
+            mapping = URLMapping(short_key=short_key, long_url=long_url, created_at=now, expires_at=expires_at,
+                                 url_hash=url_hash, **policy)
+            try:
+                self._save(mapping)
+                break
+            except DuplicateKeyError as e:
+                # The key was taken since the check above
+                short_key = self._key_after_duplicate(e, custom_alias, attempt)
+        if url_hash is not None:
+            self._remember(url_hash, short_key, self._expiry_ms(expires_at))
 
         return short_key
 
+    def _save_allocated(self, long_url: str, expires_at: datetime = None, url_hash: bytes = None,
+                        policy: dict = None) -> str:
+        # Allocated keys are unique among themselves, so no existence check is
+        # needed; an insert can only clash with a custom alias of the same shape
+        now = datetime.now(tz=ZoneInfo("UTC"))
+        for _ in range(collision_retries):
+            short_key = self.key_allocator.next_key()
+            mapping = URLMapping(short_key=short_key, long_url=long_url, created_at=now, expires_at=expires_at,
+                                 url_hash=url_hash, **(policy or {}))
+            try:
+                self._save(mapping)
+                if url_hash is not None:
+                    self._remember(url_hash, short_key, self._expiry_ms(expires_at))
+                return short_key
+            except DuplicateKeyError:
+                if self.metrics is not None:
+                    self.metrics.collision_retries.inc()
+                continue
+        raise RuntimeError("Could not allocate a free short key")
+
+    def _new_key(self) -> str:
+        if self.key_allocator is not None:
+            return self.key_allocator.next_key()
+        return self._make_random_key()
+
+    def generate_many(self, items: list[tuple]) -> list[Union[str, Exception]]:
+        """
+        Shorten many URLs at once. All items are validated up front, custom
+        aliases are checked with a single query and the mappings are written
+        with one bulk insert per round.
+        :param items: (long_url, custom_alias, expires_at[, redirect_code, cache_max_age]) tuples
+        :return: per item, in order, the short key or the exception it failed with
+        """
+        if len(items) > self.batch_max_size:
+            raise BatchTooLargeError(f"Batch exceeds the maximum of {self.batch_max_size} items")
+
+        # The redirect policy fields are optional
+        items = [tuple(item) + (None,) * (5 - len(item)) for item in items]
+        results: list[Union[str, Exception, None]] = [None] * len(items)
+        aliases: dict[str, int] = {}
+        generated: list[int] = []
+        for i, (long_url, custom_alias, expires_at, redirect_code, cache_max_age) in enumerate(items):
+            try:
+                self._validate(long_url, custom_alias, expires_at, redirect_code, cache_max_age)
+                if custom_alias:
+                    if custom_alias in aliases:
+                        raise AliasConflictError(f"Alias {custom_alias} already in use")
+                    aliases[custom_alias] = i
+                else:
+                    generated.append(i)
+            except (InvalidURLError, AliasConflictError, ValueError) as e:
+                results[i] = e
+
+        # Reuse identical mappings in dedup mode, with one lookup for the whole batch
+        hashes: dict[int, bytes] = {}
+        followers: dict[int, int] = {}
+        candidates = [i for i in generated if items[i][3] is None and items[i][4] is None]
+        if self.dedup and candidates:
+            hashes = {i: hash_url(items[i][0]) for i in candidates}
+            identities = {i: (hashes[i], self._expiry_ms(items[i][2])) for i in candidates}
+            leaders: dict[tuple, int] = {}
+            for i in candidates:
+                # Identical items within the batch share one key
+                leaders.setdefault(identities[i], i)
+            existing = self._find_duplicates([(hashes[i], items[i][0], items[i][2]) for i in leaders.values()])
+            remaining = [i for i in generated if i not in hashes]
+            for i in candidates:
+                leader = leaders[identities[i]]
+                if identities[i] in existing:
+                    results[i] = existing[identities[i]]
+                elif leader != i:
+                    followers[i] = leader
+                else:
+                    remaining.append(i)
+            generated = remaining
+
+        now = datetime.now(tz=ZoneInfo("UTC"))
+        keys: dict[int, str] = {i: alias for alias, i in aliases.items()}
+        alias_positions = set(aliases.values())
+        pending = list(alias_positions) + generated
+        retries = fallbacks = 0
+        for attempt in range(collision_retries + 1):
+            if not pending:
+                break
+            for i in pending:
+                if i not in alias_positions:
+                    # The last round falls back to longer random keys, like generate()
+                    keys[i] = self._new_key() if attempt < collision_retries \
+                        else self._make_random_key() + self._make_random_key()
+            if attempt == collision_retries:
+                fallbacks += sum(1 for i in pending if i not in alias_positions)
+
+            # Allocated keys are unique by construction; only aliases and random keys need probing
+            probe = [keys[i] for i in pending if i in alias_positions or self.key_allocator is None]
+            taken = self.repo.existing_keys(probe)
+            retry, to_save = [], []
+            for i in pending:
+                if keys[i] not in taken:
+                    to_save.append(i)
+                elif i in alias_positions:
+                    results[i] = AliasConflictError(f"Alias {keys[i]} already in use")
+                else:
+                    retry.append(i)
+                    retries += 1
+
+            mappings = [URLMapping(short_key=keys[i], long_url=items[i][0], created_at=now,
+                                   expires_at=items[i][2], url_hash=hashes.get(i),
+                                   redirect_code=items[i][3], cache_max_age=items[i][4]) for i in to_save]
+            try:
+                errors = self.repo.save_many(mappings)
+            except Exception as e:
+                errors = {pos: e for pos in range(len(to_save))}
+            for pos, i in enumerate(to_save):
+                error = errors.get(pos)
+                if error is None:
+                    results[i] = keys[i]
+                    if i in hashes:
+                        self._remember(hashes[i], keys[i], identities[i][1])
+                elif not isinstance(error, DuplicateKeyError):
+                    results[i] = error
+                elif i in alias_positions:
+                    results[i] = AliasConflictError(f"Alias {keys[i]} already in use")
+                else:
+                    retry.append(i)
+                    retries += 1
+            pending = retry
 
+        for i in pending:
+            results[i] = RuntimeError("Could not allocate a free short key")
+        for i, leader in followers.items():
+            results[i] = results[leader]
+        if self.metrics is not None:
+            self.metrics.alias_conflicts.inc(amount=sum(isinstance(r, AliasConflictError) for r in results))
+            self.metrics.collision_retries.inc(amount=retries)
+            self.metrics.long_key_fallbacks.inc(amount=fallbacks)
+        return results
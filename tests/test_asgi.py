@@ -0,0 +1,391 @@
+import asyncio
+import json
+from datetime import datetime, timezone, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from api.asgi import create_asgi_app
+from api.handlers import create_app
+from model.url_mapping import URLMapping
+from repository.async_repo import AsyncRepositoryAdapter
+from repository.base import DuplicateKeyError
+from repository.memory_repo import MemoryRepository
+from service.async_redirector import AsyncRedirectorService
+from service.async_url_generator import AsyncURLGeneratorService
+from service.redirector import NotFoundError, GoneError
+from service.url_generator import AliasConflictError, InvalidURLError
+from util import config
+from util.cache import LRUCache
+from util.singleflight import AsyncSingleFlight
+
+
+def call(app, method, path, body=b'', headers=None, query_string=b''):
+    """
+    Run one HTTP request through the ASGI app
+    :param headers: request headers; POST bodies are sent as JSON by default
+    :return: (status, headers dict, body bytes)
+    """
+    sent = []
+    received = iter([{'type': 'http.request', 'body': body, 'more_body': False}])
+    if headers is None:
+        headers = {'Content-Type': 'application/json'} if method == 'POST' else {}
+
+    async def receive():
+        return next(received, {'type': 'http.disconnect'})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+             'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    asyncio.run(app(scope, receive, send))
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    return (start['status'], {k.decode(): v.decode() for k, v in start['headers']},
+            b''.join(message.get('body', b'') for message in sent[1:]))
+
+
+@pytest.fixture
+def app():
+    return create_asgi_app({'storage_backend': 'memory'})
+
+
+class TestASGIApp:
+
+    def test_shorten_and_redirect(self, app):
+        status, _, body = call(app, 'POST', '/shorten', json.dumps({'long_url': 'https://example.com/ü'}).encode())
+        assert status == 200
+        short_key = json.loads(body)['short_url']
+
+        status, headers, _ = call(app, 'GET', '/' + short_key)
+        assert status == 302
+        assert headers['location'] == 'https://example.com/%C3%BC'
+        assert 'cache-control' not in headers
+
+    def test_redirect_policy(self, app):
+        call(app, 'POST', '/shorten', json.dumps({'long_url': 'https://example.com', 'alias': 'perm',
+                                                  'redirect_code': 301, 'cache_max_age': 60}).encode())
+
+        status, headers, _ = call(app, 'GET', '/perm')
+        assert status == 301
+        assert headers['cache-control'] == 'public, max-age=60'
+
+    def test_shorten_missing_long_url(self, app):
+        status, _, body = call(app, 'POST', '/shorten', b'{}')
+        assert status == 400
+        assert json.loads(body) == {'error': 'Missing required field: long_url'}
+
+    def test_shorten_invalid_json(self, app):
+        status, _, _ = call(app, 'POST', '/shorten', b'not json')
+        assert status == 400
+
+    def test_shorten_invalid_url(self, app):
+        status, _, body = call(app, 'POST', '/shorten', b'{"long_url": "not-a-url"}')
+        assert status == 400
+        assert 'error' in json.loads(body)
+
+    def test_shorten_alias_conflict(self, app):
+        payload = json.dumps({'long_url': 'https://example.com', 'alias': 'taken'}).encode()
+        assert call(app, 'POST', '/shorten', payload)[0] == 200
+
+        status, _, body = call(app, 'POST', '/shorten', payload)
+        assert status == 409
+        assert json.loads(body) == {'error': 'Alias taken already in use'}
+
+    def test_shorten_internal_error(self, app):
+        app.url_generator.generate = AsyncMock(side_effect=Exception("db down"))
+
+        status, _, body = call(app, 'POST', '/shorten', b'{"long_url": "https://example.com"}')
+        assert status == 500
+        assert json.loads(body) == {'error': 'Internal Server Error'}
+
+    def test_redirect_not_found(self, app):
+        status, _, body = call(app, 'GET', '/missing')
+        assert status == 404
+        assert json.loads(body) == {'error': 'Not Found'}
+
+    def test_redirect_expired(self, app):
+        now = datetime.now(timezone.utc)
+        app.repo.repo.save_url_mapping(URLMapping(short_key='old', long_url='https://example.com',
+                                                  created_at=now - timedelta(days=2),
+                                                  expires_at=now - timedelta(days=1)))
+
+        status, _, body = call(app, 'GET', '/old')
+        assert status == 410
+        assert json.loads(body) == {'error': 'Gone'}
+
+    def test_redirect_internal_error(self, app):
+        app.redirector.resolve = AsyncMock(side_effect=Exception("db down"))
+
+        status, _, body = call(app, 'GET', '/abc123')
+        assert status == 500
+        assert json.loads(body) == {'error': 'Internal Server Error'}
+
+    def test_redirect_lookup_timeout(self, app):
+        app.redirector.resolve = AsyncMock(side_effect=TimeoutError())
+
+        status, _, body = call(app, 'GET', '/abc123')
+        assert status == 503
+        assert json.loads(body) == {'error': 'Service Unavailable'}
+
+    def test_unmatched_and_wrong_method(self, app):
+        assert call(app, 'GET', '/a/b')[0] == 404
+        # As in Flask, GET /shorten is a lookup of the key "shorten"
+        assert call(app, 'GET', '/shorten')[0] == 404
+        assert call(app, 'DELETE', '/shorten')[0] == 405
+        assert call(app, 'POST', '/abc123')[0] == 405
+
+    def test_shorten_requires_json_content_type(self, app):
+        status, _, _ = call(app, 'POST', '/shorten', b'{"long_url": "https://example.com"}',
+                            headers={'Content-Type': 'text/plain'})
+        assert status == 415
+
+    def test_body_too_large(self, app):
+        status, _, _ = call(app, 'POST', '/shorten', b' ' * ((1 << 20) + 1))
+        assert status == 413
+
+    def test_metrics(self, app):
+        call(app, 'GET', '/missing')
+
+        status, headers, body = call(app, 'GET', '/metrics')
+        assert status == 200
+        assert headers['content-type'].startswith('text/plain')
+        assert 'http_responses_total{endpoint="redirect_short",status="404"} 1' in body.decode()
+
+    def test_metrics_disabled(self):
+        app = create_asgi_app({'storage_backend': 'memory', 'metrics_enabled': False})
+        assert call(app, 'GET', '/metrics')[0] == 404
+
+    def test_lifespan_shutdown_flushes_clicks(self, app):
+        app.click_tracker = MagicMock()
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(app({'type': 'lifespan'}, receive, send))
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+        app.click_tracker.stop.assert_called_once()
+
+    def test_lifespan_startup_runs_worker_start_up(self, app):
+        app.background_tasks = MagicMock()
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            if message['type'] == 'lifespan.startup.complete':
+                app.background_tasks.assert_called_once()
+
+        asyncio.run(app({'type': 'lifespan'}, receive, send))
+        app.background_tasks.assert_called_once()
+
+    def test_unsupported_settings(self):
+        with pytest.raises(ValueError):
+            create_asgi_app({'storage_backend': 'memory', 'key_allocator': 'counter'})
+        with pytest.raises(ValueError):
+            create_asgi_app({'storage_backend': 'memory', 'dedup_enabled': True})
+
+
+class TestFlaskParity:
+    """
+    Sends the same requests to the ASGI app and to the Flask app
+    """
+
+    SETTINGS = {'storage_backend': 'memory', 'admin_token': 'secret', 'click_tracking_enabled': False}
+    AUTH = {'Authorization': 'Bearer secret'}
+
+    @pytest.fixture
+    def apps(self):
+        asgi_app = create_asgi_app(self.SETTINGS)
+        flask_client = create_app(self.SETTINGS).test_client()
+        for alias, extra in (('perm', {'redirect_code': 301, 'cache_max_age': 60}), ('temp', {})):
+            body = json.dumps({'long_url': 'https://example.com/ü', 'alias': alias, **extra}).encode()
+            assert call(asgi_app, 'POST', '/shorten', body)[0] == 200
+            assert flask_client.post('/shorten', data=body, content_type='application/json').status_code == 200
+        return asgi_app, flask_client
+
+    @staticmethod
+    def assert_same(apps, method, path, body=b'', headers=None, query_string=''):
+        asgi_app, flask_client = apps
+        if headers is None:
+            headers = {'Content-Type': 'application/json'} if method == 'POST' else {}
+        status, asgi_headers, asgi_body = call(asgi_app, method, path, body, headers=headers,
+                                               query_string=query_string.encode())
+        response = flask_client.open(path, method=method, data=body, headers=headers, query_string=query_string)
+
+        assert status == response.status_code, (method, path)
+        for name in ('Content-Type', 'Location', 'Cache-Control', 'Allow'):
+            assert asgi_headers.get(name.lower()) == response.headers.get(name), (method, path, name)
+        if response.mimetype in ('application/json', 'application/x-ndjson'):
+            # Same values; the JSON may be spaced differently
+            assert [json.loads(line) for line in asgi_body.splitlines()] == \
+                   [json.loads(line) for line in response.get_data().splitlines()], (method, path)
+        else:
+            assert asgi_body == response.get_data(), (method, path)
+        return status
+
+    def test_redirects(self, apps):
+        assert self.assert_same(apps, 'GET', '/perm') == 301
+        assert self.assert_same(apps, 'GET', '/temp') == 302
+        assert self.assert_same(apps, 'GET', '/missing') == 404
+
+    def test_shorten_errors(self, apps):
+        assert self.assert_same(apps, 'POST', '/shorten', b'{}') == 400
+        assert self.assert_same(apps, 'POST', '/shorten', b'not json') == 400
+        assert self.assert_same(apps, 'POST', '/shorten', b'') == 400
+        assert self.assert_same(apps, 'POST', '/shorten', b'{"long_url": "https://example.com"}',
+                                headers={'Content-Type': 'text/plain'}) == 415
+        assert self.assert_same(apps, 'POST', '/shorten',
+                                b'{"long_url": "https://example.com", "alias": "perm"}') == 409
+
+    def test_routes_served_by_flask(self, apps):
+        assert self.assert_same(apps, 'GET', '/docs') == 200
+        assert self.assert_same(apps, 'GET', '/stats/perm') == 200
+        assert self.assert_same(apps, 'GET', '/stats/missing') == 404
+        assert self.assert_same(apps, 'POST', '/shorten/batch', json.dumps({'items': [
+            {'long_url': 'https://example.com', 'alias': 'b1'}, {'long_url': 'nope'}]}).encode()) == 200
+        assert self.assert_same(apps, 'POST', '/shorten/batch', b'{"long_url": "https://example.com", "alias": "b2"}'
+                                b'\nnot json\n', headers={'Content-Type': 'application/x-ndjson'}) == 200
+        assert self.assert_same(apps, 'GET', '/admin/hot-keys') == 401
+        assert self.assert_same(apps, 'GET', '/admin/hot-keys', headers=self.AUTH, query_string='limit=x') == 400
+        assert self.assert_same(apps, 'GET', '/admin/mappings', headers=self.AUTH,
+                                query_string='fields=short_key,long_url') == 200
+
+    def test_unmatched_and_wrong_method(self, apps):
+        assert self.assert_same(apps, 'GET', '/a/b') == 404
+        assert self.assert_same(apps, 'GET', '/shorten') == 404
+        assert self.assert_same(apps, 'DELETE', '/shorten') == 405
+        assert self.assert_same(apps, 'POST', '/perm') == 405
+        assert self.assert_same(apps, 'POST', '/docs') == 405
+
+    def test_flask_routes_recorded_once(self, apps):
+        asgi_app, _ = apps
+        call(asgi_app, 'GET', '/stats/perm')
+
+        body = call(asgi_app, 'GET', '/metrics')[2].decode()
+        assert 'http_responses_total{endpoint="link_stats",status="200"} 1' in body
+
+
+class TestAsyncRedirectorService:
+
+    def test_resolve(self):
+        repo = MagicMock()
+        repo.get_redirect_target = AsyncMock(return_value=("https://example.com", None, 301, 60))
+        redirector = AsyncRedirectorService(repo)
+
+        target = asyncio.run(redirector.resolve("abc123"))
+        assert (target.long_url, target.status_code, target.cache_control) == \
+            ("https://example.com", 301, 'public, max-age=60')
+
+    def test_not_found_and_expired(self):
+        repo = MagicMock()
+        repo.get_redirect_target = AsyncMock(side_effect=[None, ("https://example.com", 1.0, None, None)])
+        redirector = AsyncRedirectorService(repo)
+
+        with pytest.raises(NotFoundError):
+            asyncio.run(redirector.resolve("missing"))
+        with pytest.raises(GoneError):
+            asyncio.run(redirector.resolve("old"))
+
+    def test_cache_hit_skips_repository(self):
+        cache = LRUCache(10, 60)
+        repo = AsyncRepositoryAdapter(MemoryRepository(cache=cache), offload=False)
+        asyncio.run(repo.save_url_mapping(URLMapping(short_key='abc123', long_url='https://example.com')))
+        repo.repo.get_redirect_target = MagicMock(wraps=repo.repo.get_redirect_target)
+        redirector = AsyncRedirectorService(repo, cache=cache)
+
+        asyncio.run(redirector.resolve('abc123'))
+        asyncio.run(redirector.resolve('abc123'))
+        repo.repo.get_redirect_target.assert_called_once_with('abc123')
+
+    def test_concurrent_misses_share_one_lookup(self):
+        calls = []
+
+        async def get_redirect_target(short_key):
+            calls.append(short_key)
+            await asyncio.sleep(0.01)
+            return "https://example.com", None, None, None
+
+        repo = MagicMock()
+        repo.get_redirect_target = get_redirect_target
+        redirector = AsyncRedirectorService(repo, single_flight=AsyncSingleFlight(timeout=5))
+
+        async def resolve_all():
+            return await asyncio.gather(*(redirector.resolve("abc123") for _ in range(50)))
+
+        targets = asyncio.run(resolve_all())
+        assert calls == ["abc123"]
+        assert {target.long_url for target in targets} == {"https://example.com"}
+
+
+class TestAsyncURLGeneratorService:
+
+    @pytest.fixture
+    def repo(self):
+        repo = MagicMock()
+        repo.existing_keys = AsyncMock(return_value=set())
+        repo.save_url_mapping = AsyncMock(side_effect=lambda mapping, force_insert=False: mapping)
+        return repo
+
+    def test_generate_random_key(self, repo):
+        short_key = asyncio.run(AsyncURLGeneratorService(repo).generate("https://example.com"))
+
+        assert len(short_key) == 8
+        repo.existing_keys.assert_awaited_once()
+        mapping = repo.save_url_mapping.await_args.args[0]
+        assert mapping.short_key == short_key
+        assert repo.save_url_mapping.await_args.kwargs == {'force_insert': True}
+
+    def test_skips_taken_candidates(self, repo):
+        generator = AsyncURLGeneratorService(repo)
+        keys = iter(['taken111', 'free2222'])
+        generator._make_random_key = lambda: next(keys, 'free3333')
+        repo.existing_keys = AsyncMock(return_value={'taken111'})
+
+        assert asyncio.run(generator.generate("https://example.com")) == 'free2222'
+
+    def test_long_key_when_all_candidates_taken(self, repo):
+        repo.existing_keys = AsyncMock(side_effect=lambda keys: set(keys))
+
+        assert len(asyncio.run(AsyncURLGeneratorService(repo).generate("https://example.com"))) == 16
+
+    def test_invalid_url(self, repo):
+        with pytest.raises(InvalidURLError):
+            asyncio.run(AsyncURLGeneratorService(repo).generate("not-a-url"))
+
+    def test_alias_conflict(self, repo):
+        repo.save_url_mapping = AsyncMock(side_effect=DuplicateKeyError("exists"))
+
+        with pytest.raises(AliasConflictError):
+            asyncio.run(AsyncURLGeneratorService(repo).generate("https://example.com", custom_alias="taken"))
+
+    def test_key_taken_since_the_check_is_retried(self, repo):
+        generator = AsyncURLGeneratorService(repo)
+        keys = iter(['raced111'] * 5 + ['free2222'])
+        generator._make_random_key = lambda: next(keys)
+        saved = []
+
+        async def save(mapping, force_insert=False):
+            if mapping.short_key == 'raced111':
+                raise DuplicateKeyError("exists")
+            saved.append(mapping.short_key)
+            return mapping
+
+        repo.save_url_mapping = AsyncMock(side_effect=save)
+
+        assert asyncio.run(generator.generate("https://example.com")) == 'free2222'
+        assert saved == ['free2222']
+
+    def test_gives_up_after_collision_retries(self, repo):
+        repo.save_url_mapping = AsyncMock(side_effect=DuplicateKeyError("exists"))
+
+        with pytest.raises(DuplicateKeyError):
+            asyncio.run(AsyncURLGeneratorService(repo).generate("https://example.com"))
+        assert repo.save_url_mapping.await_count == config.collision_retries + 1
@@ -0,0 +1,31 @@
+import pytest
+
+from util import base62
+
+
+class TestBase62:
+
+    def test_round_trip(self):
+        for num in (0, 1, 61, 62, 3843, 3844, 62 ** 8 - 1, 2 ** 64):
+            assert base62.decode(base62.encode(num)) == num
+
+    def test_known_values(self):
+        assert base62.encode(0) == "0"
+        assert base62.encode(61) == "Z"
+        assert base62.encode(62) == "10"
+
+    def test_padding(self):
+        assert base62.encode(1, min_length=8) == "00000001"
+        assert base62.decode("00000001") == 1
+
+    def test_negative(self):
+        with pytest.raises(ValueError):
+            base62.encode(-1)
+
+    def test_invalid_character(self):
+        with pytest.raises(ValueError):
+            base62.decode("abc-123")
+
+    def test_empty(self):
+        with pytest.raises(ValueError):
+            base62.decode("")
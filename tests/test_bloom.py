@@ -0,0 +1,143 @@
+import os
+
+import pytest
+from unittest.mock import MagicMock
+
+from util.bloom import BloomFilter
+from repository.key_filter import KeyFilter
+
+
+class TestBloomFilter:
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [f"key{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        assert all(key in bloom for key in keys)
+        assert len(bloom) == 1000
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"key{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        assert false_positives / 10000 < 0.03
+
+    def test_save_and_load(self, tmp_path):
+        path = str(tmp_path / "keys.bloom")
+        bloom = BloomFilter(capacity=100, error_rate=0.01)
+        bloom.add("abc123")
+        bloom.save(path, saved_at=123.0, generation=7)
+
+        loaded, saved_at, generation = BloomFilter.load(path)
+        assert (saved_at, generation) == (123.0, 7)
+        assert "abc123" in loaded
+        assert loaded.num_bits == bloom.num_bits
+        assert loaded.count == 1
+        # Only the final file is left behind
+        assert [p.name for p in tmp_path.iterdir()] == ["keys.bloom"]
+
+    def test_save_uses_per_process_temp_file(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "keys.bloom")
+        replaced = []
+        monkeypatch.setattr("util.bloom.os.replace", lambda src, dst: replaced.append(src))
+        BloomFilter(capacity=100, error_rate=0.01).save(path)
+
+        assert replaced == [f"{path}.{os.getpid()}.tmp"]
+
+    def test_invalid_parameters(self):
+        with pytest.raises(ValueError):
+            BloomFilter(capacity=0, error_rate=0.01)
+        with pytest.raises(ValueError):
+            BloomFilter(capacity=10, error_rate=1.5)
+
+
+class TestKeyFilter:
+
+    @pytest.fixture
+    def repo(self):
+        repo = MagicMock()
+        repo.iter_short_keys.return_value = iter(["abc123", "def456"])
+        repo.read_counter.return_value = 0
+        return repo
+
+    def test_unknown_until_built(self):
+        key_filter = KeyFilter(capacity=100, error_rate=0.01)
+        assert key_filter.might_contain("anything") is True
+
+    def test_build(self, repo):
+        key_filter = KeyFilter(capacity=100, error_rate=0.01)
+        key_filter.build(repo)
+
+        assert key_filter.ready
+        assert key_filter.might_contain("abc123")
+        assert not key_filter.might_contain("missing")
+        repo.iter_short_keys.assert_called_once_with(created_since=None)
+
+    def test_stale_filter_reports_every_key(self, repo):
+        key_filter = KeyFilter(capacity=100, error_rate=0.01, max_age=3.0)
+        key_filter.build(repo)
+        assert not key_filter.might_contain("missing")
+
+        # Refreshes have been failing for longer than max_age
+        key_filter._refreshed_at -= 10
+        assert key_filter.stale
+        assert key_filter.might_contain("missing")
+
+        repo.iter_short_keys.return_value = iter([])
+        key_filter.refresh(repo)
+        assert not key_filter.stale
+        assert not key_filter.might_contain("missing")
+
+    def test_add_after_build(self, repo):
+        key_filter = KeyFilter(capacity=100, error_rate=0.01)
+        key_filter.build(repo)
+        key_filter.add("new123")
+
+        assert key_filter.might_contain("new123")
+
+    def test_refresh_streams_recent_keys(self, repo):
+        key_filter = KeyFilter(capacity=100, error_rate=0.01)
+        key_filter.build(repo)
+        repo.iter_short_keys.return_value = iter(["other1"])
+        key_filter.refresh(repo)
+
+        assert key_filter.might_contain("other1")
+        _, kwargs = repo.iter_short_keys.call_args
+        assert kwargs['created_since'] is not None
+
+    def test_persisted_filter_only_streams_new_keys(self, repo, tmp_path):
+        path = str(tmp_path / "keys.bloom")
+        KeyFilter(capacity=100, error_rate=0.01, path=path).build(repo)
+
+        repo.iter_short_keys.return_value = iter([])
+        reloaded = KeyFilter(capacity=100, error_rate=0.01, path=path)
+        reloaded.build(repo)
+
+        assert reloaded.might_contain("abc123")
+        _, kwargs = repo.iter_short_keys.call_args
+        assert kwargs['created_since'] is not None
+
+    def test_bulk_load_forces_full_rebuild(self, repo, tmp_path):
+        path = str(tmp_path / "keys.bloom")
+        key_filter = KeyFilter(capacity=100, error_rate=0.01, path=path)
+        key_filter.build(repo)
+
+        # Keys loaded with an old created_at, then the rebuild requested
+        repo.iter_short_keys.return_value = iter(["abc123", "def456", "old123"])
+        repo.read_counter.return_value = 1
+        key_filter.refresh(repo)
+        assert key_filter.might_contain("old123")
+        repo.iter_short_keys.assert_called_with(created_since=None)
+
+        # A filter persisted before the bulk load is not trusted either
+        KeyFilter(capacity=100, error_rate=0.01, path=path).build(repo)
+        repo.read_counter.return_value = 2
+        repo.iter_short_keys.return_value = iter(["abc123", "def456", "old123", "old456"])
+        reloaded = KeyFilter(capacity=100, error_rate=0.01, path=path)
+        reloaded.build(repo)
+        assert reloaded.might_contain("old456")
+        repo.iter_short_keys.assert_called_with(created_since=None)
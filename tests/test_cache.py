@@ -0,0 +1,95 @@
+import time
+import pytest
+
+from util.cache import LRUCache
+
+
+class TestLRUCache:
+
+    def test_put_and_get(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.put("abc123", "https://example.com")
+
+        entry = cache.get("abc123")
+        assert entry is not None
+        assert entry.value == "https://example.com"
+        assert cache.hits == 1
+
+    def test_miss(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        assert cache.get("missing") is None
+        assert cache.misses == 1
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.put("a", "https://a.example.com")
+        cache.put("b", "https://b.example.com")
+        cache.get("a")  # a becomes most recently used
+        cache.put("c", "https://c.example.com")
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.evictions == 1
+
+    def test_entry_never_outlives_expires_at(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.put("soon", "https://example.com", expires_at=time.time() + 0.05)
+        assert cache.get("soon") is not None
+
+        time.sleep(0.06)
+        assert cache.get("soon") is None
+
+    def test_already_expired_is_not_stored(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.put("past", "https://example.com", expires_at=time.time() - 1)
+        assert len(cache) == 0
+
+    def test_ttl(self):
+        cache = LRUCache(max_size=2, ttl=0)
+        cache.put("abc123", "https://example.com")
+        assert cache.get("abc123") is None
+
+    def test_stale_entries_are_kept_for_get_stale(self):
+        cache = LRUCache(max_size=2, ttl=0, max_stale=60)
+        cache.put("abc123", "https://example.com")
+
+        assert cache.get("abc123") is None
+        assert cache.get_stale("abc123").value == "https://example.com"
+        assert cache.get_stale("abc123", max_age=0) is None
+
+    def test_stale_entries_are_dropped_after_max_stale(self):
+        cache = LRUCache(max_size=2, ttl=0, max_stale=0.05)
+        cache.put("abc123", "https://example.com")
+
+        time.sleep(0.06)
+        assert cache.get_stale("abc123") is None
+        cache.get("abc123")
+        assert len(cache) == 0
+
+    def test_get_stale_never_returns_expired_mappings(self):
+        cache = LRUCache(max_size=2, ttl=0, max_stale=60)
+        cache.put("soon", "https://example.com", expires_at=time.time() + 0.05)
+
+        time.sleep(0.06)
+        assert cache.get_stale("soon") is None
+
+    def test_invalidate(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.put("abc123", "https://example.com")
+        cache.invalidate("abc123")
+        assert cache.get("abc123") is None
+
+    def test_put_after_invalidation_is_dropped(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        generation = cache.generation("abc123")
+        cache.invalidate("abc123")
+        cache.put("abc123", "https://old.example.com", generation=generation)
+        assert cache.get("abc123") is None
+
+        cache.put("abc123", "https://example.com", generation=cache.generation("abc123"))
+        assert cache.get("abc123").value == "https://example.com"
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            LRUCache(max_size=0, ttl=60)
@@ -0,0 +1,139 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import DuplicateKeyError as MongoDuplicateKeyError, ExecutionTimeout, NetworkTimeout
+from mongoengine import OperationError
+
+from repository.base import UnavailableError
+from repository.guard import MongoGuard, is_outage
+from util.circuit_breaker import CircuitBreaker
+from util.metrics import Metrics
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('db', failure_threshold=3, reset_timeout=10, clock=FakeClock())
+        for success in (False, False, True, False, False):
+            assert breaker.allow()
+            breaker.record(success)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        breaker.allow()
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        assert breaker.rejected == 1
+
+    def test_single_trial_call_when_half_open(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker('db', failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.allow()
+        breaker.record(False)
+
+        clock.now = 10
+        assert breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow()
+
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+
+    def test_failed_trial_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker('db', failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.allow()
+        breaker.record(False)
+
+        clock.now = 10
+        breaker.allow()
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.OPEN
+        clock.now = 19
+        assert not breaker.allow()
+        clock.now = 20
+        assert breaker.allow()
+
+    def test_exports_state_and_counts(self):
+        metrics = Metrics()
+        breaker = CircuitBreaker('mongo', failure_threshold=1, reset_timeout=10, metrics=metrics,
+                                 clock=FakeClock())
+        assert metrics.breaker_state.value('mongo') == 0
+
+        breaker.allow()
+        breaker.record(False)
+        breaker.allow()
+
+        assert metrics.breaker_state.value('mongo') == 2
+        assert metrics.breaker_transitions.value('mongo', 'open') == 1
+        assert metrics.breaker_failures.value('mongo') == 1
+        assert metrics.breaker_rejections.value('mongo') == 1
+        assert 'circuit_breaker_state{name="mongo"} 2' in metrics.render()
+
+    def test_invalid_threshold(self):
+        with pytest.raises(ValueError):
+            CircuitBreaker('db', failure_threshold=0)
+
+
+class TestMongoGuard:
+
+    def test_outages_are_unavailable_errors(self):
+        guard = MongoGuard(breaker=CircuitBreaker('mongo', failure_threshold=2))
+
+        for _ in range(2):
+            with pytest.raises(UnavailableError):
+                with guard('redirect'):
+                    raise NetworkTimeout("timed out")
+
+        assert guard.breaker.state == CircuitBreaker.OPEN
+        call = MagicMock()
+        with pytest.raises(UnavailableError):
+            with guard('redirect'):
+                call()
+        call.assert_not_called()
+
+    def test_rejected_operations_do_not_count(self):
+        guard = MongoGuard(breaker=CircuitBreaker('mongo', failure_threshold=1))
+
+        with pytest.raises(MongoDuplicateKeyError):
+            with guard('write'):
+                raise MongoDuplicateKeyError("duplicate")
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+
+    def test_is_outage_follows_wrapped_errors(self):
+        try:
+            try:
+                raise ExecutionTimeout("operation exceeded time limit")
+            except ExecutionTimeout as e:
+                raise OperationError(str(e))
+        except OperationError as e:
+            assert is_outage(e)
+        assert not is_outage(ValueError("bad"))
+
+    def test_from_config(self):
+        settings = {'mongo_redirect_timeout_ms': 250, 'mongo_read_timeout_ms': None, 'mongo_write_timeout_ms': 2000,
+                    'breaker_enabled': True, 'breaker_failure_threshold': 3, 'breaker_reset_timeout': 5.0}
+
+        guard = MongoGuard.from_config(settings)
+        assert guard.timeouts == {'redirect': 0.25, 'write': 2.0}
+        assert guard.breaker.failure_threshold == 3
+        assert MongoGuard.from_config({**settings, 'breaker_enabled': False}).breaker is None
+
+    def test_for_shard(self):
+        guard = MongoGuard({'read': 1.0}, CircuitBreaker('mongo', failure_threshold=3))
+        shard_guard = guard.for_shard('a')
+
+        assert shard_guard.timeouts == guard.timeouts
+        assert shard_guard.breaker is not guard.breaker
+        assert (shard_guard.breaker.name, shard_guard.breaker.failure_threshold) == ('mongo_a', 3)
+        assert MongoGuard().for_shard('a').breaker is None
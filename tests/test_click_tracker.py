@@ -0,0 +1,75 @@
+import time
+import pytest
+from unittest.mock import MagicMock
+
+from service.click_tracker import ClickTracker
+
+
+@pytest.fixture
+def tracker():
+    tracker = ClickTracker(MagicMock(), flush_interval_ms=60000, flush_max_keys=100, max_pending_keys=3)
+    yield tracker
+    tracker.stop(timeout=1)
+
+
+class TestClickTracker:
+
+    def test_aggregates_clicks(self, tracker):
+        for _ in range(3):
+            tracker.record("abc123")
+        tracker.record("def456")
+
+        assert tracker.pending("abc123")[0] == 3
+        assert tracker.pending("def456")[0] == 1
+        tracker.repo.increment_clicks.assert_not_called()
+
+    def test_flush_is_one_bulk_update(self, tracker):
+        tracker.record("abc123")
+        tracker.record("abc123")
+        tracker.record("def456")
+
+        assert tracker.flush() == 2
+        tracker.repo.increment_clicks.assert_called_once()
+        clicks = tracker.repo.increment_clicks.call_args[0][0]
+        assert clicks["abc123"][0] == 2
+        assert clicks["def456"][0] == 1
+        assert tracker.pending("abc123") == (0, None)
+
+    def test_failed_flush_is_retried(self, tracker):
+        tracker.repo.increment_clicks.side_effect = [Exception("db down"), 1]
+        tracker.record("abc123")
+
+        with pytest.raises(Exception):
+            tracker.flush()
+        assert tracker.pending("abc123")[0] == 1
+
+        tracker.flush()
+        assert tracker.repo.increment_clicks.call_args[0][0]["abc123"][0] == 1
+
+    def test_memory_bound(self, tracker):
+        for key in ("a", "b", "c", "d"):
+            tracker.record(key)
+        tracker.record("a")
+
+        assert tracker.dropped == 1
+        assert tracker.pending("d") == (0, None)
+        assert tracker.pending("a")[0] == 2
+
+    def test_flushes_when_enough_keys_pending(self):
+        tracker = ClickTracker(MagicMock(), flush_interval_ms=60000, flush_max_keys=2)
+        try:
+            tracker.record("a")
+            tracker.record("b")
+            deadline = time.time() + 2
+            while not tracker.repo.increment_clicks.called and time.time() < deadline:
+                time.sleep(0.01)
+            tracker.repo.increment_clicks.assert_called_once()
+        finally:
+            tracker.stop(timeout=1)
+
+    def test_stop_flushes_pending(self):
+        tracker = ClickTracker(MagicMock(), flush_interval_ms=60000)
+        tracker.record("abc123")
+        tracker.stop(timeout=1)
+
+        tracker.repo.increment_clicks.assert_called_once()
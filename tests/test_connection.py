@@ -0,0 +1,206 @@
+import asyncio
+
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from model.url_mapping import URLMapping
+from repository.connection import MongoConnection
+from repository.db_repo import DBRepository
+from util.process import OncePerProcess
+
+
+class TestOncePerProcess:
+
+    def test_runs_once(self):
+        fn = MagicMock()
+        once = OncePerProcess(fn)
+        once()
+        once()
+        fn.assert_called_once()
+
+    def test_runs_again_after_fork_reset(self):
+        fn = MagicMock()
+        once = OncePerProcess(fn)
+        once()
+        once.reset()  # what the after-fork hook does in a child
+        once()
+        assert fn.call_count == 2
+
+    def test_failure_is_retried(self):
+        fn = MagicMock(side_effect=[Exception("down"), None])
+        once = OncePerProcess(fn)
+        with pytest.raises(Exception):
+            once()
+        once()
+        assert fn.call_count == 2
+
+
+class TestMongoConnection:
+
+    def test_no_connection_until_used(self):
+        with patch('repository.connection.connect') as mock_connect:
+            connection = MongoConnection(host="db.internal", max_pool_size=10)
+            DBRepository(connection=connection)
+            mock_connect.assert_not_called()
+
+    def test_connects_lazily_once(self):
+        with patch('repository.connection.connect') as mock_connect, \
+             patch('repository.connection.disconnect'):
+            connection = MongoConnection(host="db.internal", port=27018, max_pool_size=10,
+                                         server_selection_timeout_ms=100)
+            connection.ensure()
+            connection.ensure()
+
+            mock_connect.assert_called_once()
+            _, kwargs = mock_connect.call_args
+            assert kwargs['host'] == "db.internal"
+            assert kwargs['port'] == 27018
+            assert kwargs['maxPoolSize'] == 10
+            assert kwargs['serverSelectionTimeoutMS'] == 100
+            assert kwargs['connect'] is False
+
+    def test_reconnects_in_forked_child(self):
+        with patch('repository.connection.connect') as mock_connect, \
+             patch('repository.connection.disconnect') as mock_disconnect:
+            connection = MongoConnection()
+            connection.ensure()
+            connection.ensure.reset()
+            connection.ensure()
+
+            assert mock_connect.call_count == 2
+            assert mock_disconnect.call_count == 2
+
+    def test_repository_connects_on_first_call(self):
+        connection = MagicMock(alias='default')
+        repo = DBRepository(connection=connection)
+        with patch('repository.db_repo.URLMapping') as mock_model:
+            mock_model._get_collection.return_value.find_one.return_value = None
+            repo.get_redirect_target("abc123")
+        connection.ensure.assert_called_once()
+
+    def test_repository_calls_are_guarded(self):
+        from pymongo.errors import NetworkTimeout
+        from repository.base import UnavailableError
+        from repository.guard import MongoGuard
+        from util.circuit_breaker import CircuitBreaker
+        repo = DBRepository(guard=MongoGuard(breaker=CircuitBreaker('mongo', failure_threshold=1)))
+        with patch('repository.db_repo.URLMapping') as mock_model:
+            mock_model._get_collection.return_value.find_one.side_effect = NetworkTimeout("timed out")
+            with pytest.raises(UnavailableError):
+                repo.get_redirect_target("abc123")
+            with pytest.raises(UnavailableError):
+                repo.get_click_stats("abc123")
+            assert mock_model._get_collection.return_value.find_one.call_count == 1
+
+    def test_expiry_index_follows_settings(self):
+        for kwargs, expected in (({}, {}), ({'mapping_ttl_seconds': 3600}, {'expireAfterSeconds': 3600})):
+            repo = DBRepository(connection=MagicMock(alias='default'), **kwargs)
+            with patch('repository.db_repo.URLMapping') as mock_model:
+                mock_model._get_collection.return_value.find_one.return_value = None
+                repo.get_redirect_target("abc123")
+                mock_model._get_collection.return_value.create_index.assert_called_once_with(
+                    [('expires_at', 1)], **expected)
+
+        repo = DBRepository(connection=MagicMock(alias='default'), expires_at_index=False)
+        with patch('repository.db_repo.URLMapping') as mock_model:
+            repo.get_redirect_target("abc123")
+            mock_model._get_collection.return_value.create_index.assert_not_called()
+
+    def test_purge_expired_invalidates_dedup_cache(self):
+        from util.cache import LRUCache
+        url_hash = bytes(16)
+        dedup_cache = LRUCache(10, 60)
+        dedup_cache.put(url_hash.hex(), ("abc123", None))
+        repo = DBRepository(dedup_cache=dedup_cache)
+        with patch('repository.db_repo.URLMapping') as mock_model:
+            collection = mock_model._get_collection.return_value
+            collection.find.return_value.limit.side_effect = [[{'_id': "abc123", 'url_hash': url_hash}], []]
+            collection.delete_many.return_value.deleted_count = 1
+            assert repo.purge_expired() == 1
+
+        assert dedup_cache.get(url_hash.hex()) is None
+
+    def test_from_config(self):
+        settings = {
+            'mongo_db': 'db', 'mongo_host': 'h', 'mongo_port': 1, 'mongo_username': None,
+            'mongo_password': None, 'mongo_auth_source': 'admin', 'mongo_max_pool_size': 5,
+            'mongo_connect_timeout_ms': 1, 'mongo_server_selection_timeout_ms': 2,
+            'mongo_socket_timeout_ms': 3,
+        }
+        with patch('repository.connection.connect') as mock_connect, \
+             patch('repository.connection.disconnect'):
+            MongoConnection.from_config(settings).ensure()
+            _, kwargs = mock_connect.call_args
+            assert kwargs['db'] == 'db'
+            assert kwargs['maxPoolSize'] == 5
+
+    def test_client_options(self):
+        options = MongoConnection(db="db", host="db.internal", authentication_source="auth",
+                                  max_pool_size=10).client_options()
+
+        assert options['host'] == "db.internal"
+        assert options['authSource'] == "auth"
+        assert options['maxPoolSize'] == 10
+        assert 'db' not in options and 'authentication_source' not in options
+
+    def test_async_repository_connects_lazily(self):
+        from repository.async_repo import AsyncDBRepository
+        with patch('repository.async_repo.AsyncMongoClient') as mock_client:
+            repo = AsyncDBRepository(MongoConnection(db="db", host="db.internal"))
+            mock_client.assert_not_called()
+
+            async def lookup():
+                mock_client.return_value.__getitem__.return_value.__getitem__.return_value.find_one = \
+                    AsyncMock(return_value=None)
+                await repo.get_redirect_target("abc123")
+                await repo.get_redirect_target("abc123")
+
+            asyncio.run(lookup())
+            mock_client.assert_called_once()
+            assert mock_client.call_args.kwargs['host'] == "db.internal"
+
+    def test_async_resave_keeps_click_counts(self):
+        from repository.async_repo import AsyncDBRepository
+        with patch('repository.async_repo.AsyncMongoClient') as mock_client:
+            collection = mock_client.return_value.__getitem__.return_value.__getitem__.return_value
+            collection.update_one = AsyncMock()
+            repo = AsyncDBRepository(MongoConnection(db="db", host="db.internal"))
+
+            asyncio.run(repo.save_url_mapping(URLMapping(short_key="abc123", long_url="https://example.com")))
+
+            query, update = collection.update_one.call_args.args
+            assert query == {'_id': "abc123"}
+            assert update['$set']['long_url'] == "https://example.com"
+            assert update['$setOnInsert']['click_count'] == 0
+            assert collection.update_one.call_args.kwargs == {'upsert': True}
+
+    def test_async_repository_closes_clients_of_closed_loops(self):
+        from repository.async_repo import AsyncDBRepository
+        with patch('repository.async_repo.AsyncMongoClient') as mock_client:
+            clients = []
+
+            def new_client(**kwargs):
+                client = MagicMock()
+                client.close = AsyncMock()
+                client.__getitem__.return_value.__getitem__.return_value.find_one = AsyncMock(return_value=None)
+                clients.append(client)
+                return client
+
+            mock_client.side_effect = new_client
+            repo = AsyncDBRepository(MongoConnection(db="db", host="db.internal"))
+
+            asyncio.run(repo.get_redirect_target("abc123"))
+            asyncio.run(repo.get_redirect_target("abc123"))
+            assert len(clients) == 2
+            clients[0].close.assert_awaited_once()
+            clients[1].close.assert_not_awaited()
+
+            async def lookup_and_close():
+                await repo.get_redirect_target("abc123")
+                await repo.close()
+
+            asyncio.run(lookup_and_close())
+            assert len(clients) == 3
+            clients[1].close.assert_awaited_once()
+            clients[2].close.assert_awaited_once()
+            assert repo._clients == {}
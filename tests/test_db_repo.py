@@ -1,6 +1,6 @@
 import pytest
 from datetime import datetime, timezone, timedelta
-from repository.db_repo import DBRepository
+from repository.db_repo import DBRepository, DuplicateKeyError
 from model.url_mapping import URLMapping
 from mongoengine import connect, disconnect
 
@@ -90,4 +90,93 @@ def test_list_expired_mappings(repo):
     expired_list = repo.list_expired_mappings()
     keys = {m.short_key for m in expired_list}
     assert "expired1" in keys
-    assert "valid1" not in keys
\ No newline at end of file
+    assert "valid1" not in keys
+
+def test_save_many_reports_duplicates(repo):
+    now = datetime.now(timezone.utc)
+    URLMapping(short_key="bulk1", long_url="http://example.com/1", created_at=now).save()
+    mappings = [
+        URLMapping(short_key="bulk1", long_url="http://example.com/dup", created_at=now),
+        URLMapping(short_key="bulk2", long_url="http://example.com/2", created_at=now),
+    ]
+
+    errors = repo.save_many(mappings)
+
+    assert list(errors) == [0]
+    assert isinstance(errors[0], DuplicateKeyError)
+    assert repo.get_mapping_by_key("bulk2") is not None
+    assert repo.existing_keys(["bulk1", "bulk2", "bulk3"]) == {"bulk1", "bulk2"}
+
+
+def test_get_redirect_target(repo):
+    now = datetime.now(timezone.utc)
+    expires = now + timedelta(days=1)
+    URLMapping(short_key="target1", long_url="http://example.com/t", created_at=now, expires_at=expires,
+               redirect_code=301).save()
+
+    long_url, expires_at, redirect_code, cache_max_age = repo.get_redirect_target("target1")
+    assert long_url == "http://example.com/t"
+    assert abs(expires_at - expires.timestamp()) < 0.001
+    assert (redirect_code, cache_max_age) == (301, None)
+    assert repo.get_redirect_target("missing1") is None
+
+
+def test_get_redirect_targets(repo):
+    URLMapping(short_key="target1", long_url="http://example.com/1").save()
+    URLMapping(short_key="target2", long_url="http://example.com/2", cache_max_age=60).save()
+
+    targets = repo.get_redirect_targets(["target1", "target2", "missing1"])
+    assert targets == {"target1": ("http://example.com/1", None, None, None),
+                       "target2": ("http://example.com/2", None, None, 60)}
+
+
+def test_iter_mappings_resumes_after_position(repo):
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(5):
+        URLMapping(short_key=f"page{i}", long_url=f"https://example.com/{i}",
+                   created_at=created + timedelta(milliseconds=i // 2)).save()
+
+    rows = list(repo.iter_mappings(batch_size=2, fields=('long_url',)))
+    assert [row['short_key'] for row in rows] == [f"page{i}" for i in range(5)]
+    assert rows[0] == {'short_key': "page0", 'created_at': created.timestamp(), 'long_url': "https://example.com/0"}
+    after = (rows[2]['created_at'], rows[2]['short_key'])
+    assert [row['short_key'] for row in repo.iter_mappings(after=after)] == ["page3", "page4"]
+
+
+def test_iter_mappings_domain_prefix_rule(repo):
+    # Same rule as the SQLite and memory backends (see test_storage_backends)
+    for short_key, long_url in [("upper001", "HTTPS://example.com/a"), ("mixed001", "Http://example.com/b"),
+                                ("noschem1", "xxexample.com/c"), ("ftp00001", "ftp://example.com/d"),
+                                ("case0001", "https://Example.com/e")]:
+        URLMapping(short_key=short_key, long_url=long_url).save()
+
+    assert sorted(row['short_key'] for row in repo.iter_mappings(domain_prefix="example.com")) == \
+        ["mixed001", "upper001"]
+    assert list(repo.iter_mappings(domain_prefix="ample.com/c")) == []
+
+
+def test_resave_keeps_click_counts(repo):
+    repo.save_url_mapping(URLMapping(short_key="clicks1", long_url="http://example.com/a",
+                                     expires_at=datetime.now(timezone.utc) + timedelta(days=1)))
+    repo.increment_clicks({"clicks1": (3, 1000.0)})
+    repo.save_url_mapping(URLMapping(short_key="clicks1", long_url="http://example.com/b"))
+
+    fetched = repo.get_mapping_by_key("clicks1")
+    assert fetched.long_url == "http://example.com/b"
+    assert fetched.expires_at is None
+    assert repo.get_click_stats("clicks1") == (3, 1000.0)
+
+
+def test_purge_expired(repo):
+    now = datetime.now(timezone.utc)
+    for i in range(5):
+        URLMapping(short_key=f"purge{i}", long_url="x", created_at=now - timedelta(days=2),
+                   expires_at=now - timedelta(days=1)).save()
+    URLMapping(short_key="keep1", long_url="x", created_at=now, expires_at=now + timedelta(days=1)).save()
+
+    deleted = repo.purge_expired(batch_size=2)
+
+    assert deleted >= 5
+    assert repo.get_mapping_by_key("purge0") is None
+    assert repo.get_mapping_by_key("keep1") is not None
+    assert list(repo.list_expired_mappings()) == []
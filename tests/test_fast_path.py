@@ -0,0 +1,70 @@
+from datetime import datetime, timezone, timedelta
+from unittest.mock import patch
+
+import pytest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from api.fast_path import RedirectFastPath
+from api.handlers import create_app
+from model.url_mapping import URLMapping
+from repository.base import UnavailableError
+
+
+def make_app(fast_path: bool):
+    app = create_app({'storage_backend': 'memory', 'redirect_fast_path': fast_path})
+    repo = app.extensions['url_shortener']['repo']
+    now = datetime.now(timezone.utc)
+    repo.save_url_mapping(URLMapping(short_key='abc123', long_url='https://example.com/a b"<c>?q=é&r=1'))
+    repo.save_url_mapping(URLMapping(short_key='perm01', long_url='https://example.com', redirect_code=301,
+                                     cache_max_age=600))
+    repo.save_url_mapping(URLMapping(short_key='old001', long_url='https://example.com',
+                                     created_at=now - timedelta(days=2), expires_at=now - timedelta(days=1)))
+    return app
+
+
+def call(app, path: str, method: str = 'GET'):
+    app_iter, status, headers = run_wsgi_app(app.wsgi_app, EnvironBuilder(path=path, method=method).get_environ(),
+                                             buffered=True)
+    return status, headers.to_wsgi_list(), b''.join(app_iter)
+
+
+@pytest.fixture(scope='module')
+def apps():
+    return make_app(True), make_app(False)
+
+
+class TestRedirectFastPath:
+
+    def test_installed_by_setting(self, apps):
+        assert isinstance(apps[0].wsgi_app, RedirectFastPath)
+        assert not isinstance(apps[1].wsgi_app, RedirectFastPath)
+
+    @pytest.mark.parametrize('path', ['/abc123', '/perm01', '/old001', '/missing', '/docs', '/a-b', '/stats/missing'])
+    def test_same_bytes_as_flask(self, apps, path):
+        fast, flask = apps
+        assert call(fast, path) == call(flask, path)
+
+    @pytest.mark.parametrize('error', [UnavailableError('breaker open'), TimeoutError(), RuntimeError('boom')])
+    def test_same_error_bytes_as_flask(self, apps, error):
+        responses = []
+        for app in apps:
+            with patch.object(app.extensions['url_shortener']['redirector'], 'resolve', side_effect=error):
+                responses.append(call(app, '/abc123'))
+        assert responses[0] == responses[1]
+
+    def test_other_requests_go_to_flask(self, apps):
+        fast = apps[0]
+        with patch.object(fast.extensions['url_shortener']['redirector'], 'resolve') as mock_resolve:
+            assert call(fast, '/abc123', method='POST')[0] == '405 METHOD NOT ALLOWED'
+            assert call(fast, '/metrics')[0] == '200 OK'
+            mock_resolve.assert_not_called()
+
+    def test_records_request_metrics(self):
+        app = make_app(True)
+        call(app, '/abc123')
+        call(app, '/missing')
+
+        metrics = app.extensions['url_shortener']['metrics']
+        assert metrics.http_responses.value('redirect_short', '302') == 1
+        assert metrics.http_responses.value('redirect_short', '404') == 1
+        assert metrics.http_duration.count('redirect_short') == 2
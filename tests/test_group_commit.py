@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from model.url_mapping import URLMapping
+from repository.base import DuplicateKeyError, UnavailableError
+from repository.memory_repo import MemoryRepository
+from service.group_commit import GroupCommitWriter
+from service.redirector import RedirectorService
+from service.url_generator import AliasConflictError, URLGeneratorService
+from util.cache import LRUCache
+
+
+def make_mapping(short_key):
+    return URLMapping(short_key=short_key, long_url=f"https://example.com/{short_key}")
+
+
+@pytest.fixture
+def writer():
+    writer = GroupCommitWriter(MemoryRepository(), max_delay_ms=20, max_batch=8)
+    yield writer
+    writer.stop(timeout=1)
+
+
+class TestGroupCommitWriter:
+
+    def test_concurrent_saves_share_a_bulk_insert(self, writer):
+        writer.repo.save_many = MagicMock(wraps=writer.repo.save_many)
+        keys = [f"key{i:05d}" for i in range(8)]
+        with ThreadPoolExecutor(8) as pool:
+            saved = list(pool.map(lambda key: writer.save(make_mapping(key)), keys))
+
+        assert [mapping.short_key for mapping in saved] == keys
+        assert sorted(writer.repo.iter_short_keys()) == keys
+        assert writer.repo.save_many.call_count < len(keys)
+        assert writer.written == len(keys)
+
+    def test_duplicate_fails_only_its_request(self, writer):
+        writer.repo.save_url_mapping(make_mapping("taken1"))
+        futures = {key: writer.submit(make_mapping(key)) for key in ("fresh1", "taken1", "fresh2")}
+
+        assert futures["fresh1"].result(1).short_key == "fresh1"
+        assert futures["fresh2"].result(1).short_key == "fresh2"
+        assert isinstance(futures["taken1"].exception(1), DuplicateKeyError)
+
+    def test_failed_insert_fails_the_whole_batch(self, writer):
+        writer.repo.save_many = MagicMock(side_effect=UnavailableError("breaker open"))
+        futures = [writer.submit(make_mapping(key)) for key in ("abcd1", "abcd2")]
+
+        assert all(isinstance(future.exception(1), UnavailableError) for future in futures)
+
+    def test_full_batch_is_not_delayed(self):
+        writer = GroupCommitWriter(MemoryRepository(), max_delay_ms=60000, max_batch=2)
+        try:
+            futures = [writer.submit(make_mapping(key)) for key in ("abcd1", "abcd2")]
+            assert all(future.result(1) for future in futures)
+        finally:
+            writer.stop(timeout=1)
+
+    def test_submit_after_stop_writes_inline(self, writer):
+        writer.stop(timeout=1)
+        assert writer.submit(make_mapping("late1")).result(0).short_key == "late1"
+
+    def test_key_resolves_when_save_returns(self):
+        cache = LRUCache(100, 60)
+        writer = GroupCommitWriter(MemoryRepository(cache=cache), max_delay_ms=20)
+        cache.put("abcd1", ("https://stale.example.com", None, None))
+        generator = URLGeneratorService(repo=writer.repo, writer=writer)
+        redirector = RedirectorService(repo=writer.repo, cache=cache)
+
+        try:
+            assert generator.generate("https://example.com/new", custom_alias="abcd1") == "abcd1"
+            assert redirector.resolve("abcd1").long_url == "https://example.com/new"
+        finally:
+            writer.stop(timeout=1)
+
+    def test_alias_taken_concurrently(self, writer):
+        generator = URLGeneratorService(repo=writer.repo, writer=writer)
+        writer.repo.get_mapping_by_key = MagicMock(return_value=None)
+        writer.repo.save_url_mapping(make_mapping("abcd1"))
+
+        with pytest.raises(AliasConflictError):
+            generator.generate("https://example.com/new", custom_alias="abcd1")
+
+    def test_random_key_taken_since_the_check_is_retried(self, writer):
+        generator = URLGeneratorService(repo=writer.repo, writer=writer)
+        writer.repo.save_url_mapping(make_mapping("raced111"))
+        writer.repo.get_mapping_by_key = MagicMock(return_value=None)
+        generator._make_random_key = MagicMock(side_effect=["raced111", "free2222"])
+
+        assert generator.generate("https://example.com/new") == "free2222"
+        assert writer.repo.get_redirect_target("free2222")[0] == "https://example.com/new"
+
+    def test_save_times_out(self):
+        writer = GroupCommitWriter(MemoryRepository(), max_delay_ms=60000, max_batch=100, timeout_ms=50)
+        try:
+            with pytest.raises(UnavailableError):
+                writer.save(make_mapping("slow1"))
+            with pytest.raises(UnavailableError):
+                asyncio.run(writer.save_async(make_mapping("slow2")))
+        finally:
+            writer.stop(timeout=1)
+        # Withdrawn before their batch was written
+        assert list(writer.repo.iter_short_keys()) == []
+
+    def test_save_async(self, writer):
+        assert asyncio.run(writer.save_async(make_mapping("abcd1"))).short_key == "abcd1"
+        with pytest.raises(DuplicateKeyError):
+            asyncio.run(writer.save_async(make_mapping("abcd1")))
+
+    def test_stop_writes_what_is_queued(self):
+        writer = GroupCommitWriter(MemoryRepository(), max_delay_ms=60000, max_batch=100)
+        futures = [writer.submit(make_mapping(f"key{i:05d}")) for i in range(5)]
+        writer.stop(timeout=1)
+
+        assert all(future.done() for future in futures)
+        assert len(list(writer.repo.iter_short_keys())) == 5
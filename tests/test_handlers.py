@@ -3,9 +3,11 @@ from datetime import datetime, timezone, timedelta
 from unittest.mock import patch, MagicMock
 from flask import json
 
-from api.handlers import app, url_generator, redirector
+from api.handlers import app, url_generator, redirector, create_app, start_worker
 from service.url_generator import InvalidURLError, AliasConflictError
-from service.redirector import NotFoundError, GoneError
+from service.redirector import NotFoundError, GoneError, RedirectTarget
+from model.url_mapping import URLMapping
+from repository.base import UnavailableError
 
 @pytest.fixture
 def client():
@@ -106,15 +108,40 @@ class TestHandlers:
     
     def test_redirect_success(self, client):
         """Test successful redirection."""
-        with patch.object(redirector, 'redirect', return_value='https://example.com'):
+        with patch.object(redirector, 'resolve', return_value=RedirectTarget('https://example.com', 302, 0)):
             response = client.get('/abc123')
             
             assert response.status_code == 302
             assert response.headers['Location'] == 'https://example.com'
     
+    def test_redirect_cache_control(self, client):
+        """Test the redirect policy is applied to the response."""
+        with patch.object(redirector, 'resolve', return_value=RedirectTarget('https://example.com', 301, 600)):
+            response = client.get('/abc123')
+
+            assert response.status_code == 301
+            assert response.headers['Cache-Control'] == 'public, max-age=600'
+
+    def test_shorten_redirect_policy(self, client):
+        """Test the redirect policy fields are passed to the generator."""
+        with patch.object(url_generator, 'generate', return_value='abc123') as mock_generate:
+            response = client.post('/shorten', json={'long_url': 'https://example.com',
+                                                     'redirect_code': 301, 'cache_max_age': 600})
+
+            assert response.status_code == 200
+            _, kwargs = mock_generate.call_args
+            assert (kwargs['redirect_code'], kwargs['cache_max_age']) == (301, 600)
+
+    def test_shorten_invalid_redirect_policy(self, client):
+        """Test non-integer policy fields are rejected."""
+        response = client.post('/shorten', json={'long_url': 'https://example.com', 'cache_max_age': '600'})
+
+        assert response.status_code == 400
+        assert 'cache_max_age must be an integer' in json.loads(response.data)['error']
+
     def test_redirect_not_found(self, client):
         """Test error handling for non-existent short keys."""
-        with patch.object(redirector, 'redirect', side_effect=NotFoundError("No mapping for key 'nonexistent'")):
+        with patch.object(redirector, 'resolve', side_effect=NotFoundError("No mapping for key 'nonexistent'")):
             response = client.get('/nonexistent')
             
             assert response.status_code == 404
@@ -124,7 +151,7 @@ class TestHandlers:
     
     def test_redirect_expired(self, client):
         """Test error handling for expired URLs."""
-        with patch.object(redirector, 'redirect', side_effect=GoneError("URL for key 'expired' has expired")):
+        with patch.object(redirector, 'resolve', side_effect=GoneError("URL for key 'expired' has expired")):
             response = client.get('/expired')
             
             assert response.status_code == 410
@@ -145,10 +172,275 @@ class TestHandlers:
     
     def test_internal_server_error_redirect(self, client):
         """Test internal server error handling for redirect route."""
-        with patch.object(redirector, 'redirect', side_effect=Exception('Unexpected error')):
+        with patch.object(redirector, 'resolve', side_effect=Exception('Unexpected error')):
             response = client.get('/abc123')
             
             assert response.status_code == 500
             data = json.loads(response.data)
             assert 'error' in data
-            assert 'Internal Server Error' in data['error']
\ No newline at end of file
+            assert 'Internal Server Error' in data['error']
+
+    def test_redirect_lookup_timeout(self, client):
+        """Test a timed-out wait on another request's lookup answers 503."""
+        with patch.object(redirector, 'resolve', side_effect=TimeoutError('Timed out')):
+            response = client.get('/abc123')
+
+            assert response.status_code == 503
+            assert 'Service Unavailable' in json.loads(response.data)['error']
+
+    def test_shorten_database_unavailable(self, client):
+        """Test shortening fails fast with 503 while the database is unavailable."""
+        with patch.object(url_generator, 'generate', side_effect=UnavailableError('breaker open')):
+            response = client.post('/shorten', json={'long_url': 'https://example.com'})
+
+            assert response.status_code == 503
+            assert json.loads(response.data) == {'error': 'Service Unavailable'}
+
+    def test_redirect_database_unavailable(self, client):
+        """Test a redirect with no stale copy to fall back on answers 503."""
+        with patch.object(redirector, 'resolve', side_effect=UnavailableError('breaker open')):
+            response = client.get('/abc123')
+
+            assert response.status_code == 503
+
+    def test_shorten_batch(self, client):
+        """Test batch shortening returns one result per item, in order."""
+        with patch.object(url_generator, 'generate_many',
+                          return_value=['abc123', AliasConflictError("Alias custom already in use")]):
+            response = client.post('/shorten/batch', json={'items': [
+                {'long_url': 'https://example.com'},
+                {'long_url': 'https://example.com', 'alias': 'custom'},
+                {'alias': 'nourl'},
+            ]})
+
+            assert response.status_code == 200
+            results = json.loads(response.data)['results']
+            assert results[0] == {'short_url': 'abc123', 'status': 200}
+            assert results[1]['status'] == 409
+            assert results[2] == {'error': 'Missing required field: long_url', 'status': 400}
+
+    def test_shorten_batch_too_large(self, client):
+        """Test batches over the configured maximum are rejected."""
+        with patch.dict(app.extensions['url_shortener']['settings'], batch_max_size=1):
+            response = client.post('/shorten/batch', json={'items': [
+                {'long_url': 'https://example.com'}, {'long_url': 'https://example.org'}]})
+
+            assert response.status_code == 400
+            assert 'maximum' in json.loads(response.data)['error']
+
+    def test_shorten_batch_missing_items(self, client):
+        """Test error handling when items is missing."""
+        response = client.post('/shorten/batch', json={})
+        assert response.status_code == 400
+
+    def test_shorten_batch_ndjson(self, client):
+        """Test the streaming JSON-lines variant."""
+        body = '{"long_url": "https://example.com"}\nnot json\n'
+        with patch.object(url_generator, 'generate_many', return_value=['abc123']):
+            response = client.post('/shorten/batch', data=body, content_type='application/x-ndjson')
+
+            assert response.status_code == 200
+            assert response.mimetype == 'application/x-ndjson'
+            lines = [json.loads(line) for line in response.data.decode().splitlines()]
+            assert lines == [{'short_url': 'abc123', 'status': 200},
+                             {'error': 'Invalid JSON', 'status': 400}]
+
+
+    def test_stats(self, client):
+        """Test click statistics include unflushed clicks."""
+        services = app.extensions['url_shortener']
+        tracker = MagicMock()
+        tracker.pending.return_value = (2, 1751371200.0)
+        with patch.object(services['repo'], 'get_click_stats', return_value=(40, 1751371100.0)), \
+             patch.dict(services, click_tracker=tracker):
+            response = client.get('/stats/abc123')
+
+            assert response.status_code == 200
+            data = json.loads(response.data)
+            assert data['click_count'] == 42
+            assert data['last_accessed_at'] == '2025-07-01T12:00:00+00:00'
+
+    def test_stats_not_found(self, client):
+        """Test stats for an unknown short key."""
+        with patch.object(app.extensions['url_shortener']['repo'], 'get_click_stats', return_value=None):
+            response = client.get('/stats/nonexistent')
+
+            assert response.status_code == 404
+
+    def test_metrics(self, client):
+        """Test request outcomes and stage timings appear in /metrics."""
+        with patch.object(app.extensions['url_shortener']['repo'], 'get_redirect_target', return_value=None):
+            client.get('/nometric1')
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        text = response.data.decode()
+        assert 'http_responses_total{endpoint="redirect_short",status="404"}' in text
+        assert 'service_duration_seconds_count{operation="resolve"}' in text
+        assert '# TYPE repository_duration_seconds histogram' in text
+
+
+class TestAdminHotKeys:
+
+    @pytest.fixture
+    def admin_app(self):
+        return create_app({'storage_backend': 'memory', 'admin_token': 'secret'})
+
+    def test_hot_keys(self, admin_app):
+        services = admin_app.extensions['url_shortener']
+        services['repo'].save_url_mapping(URLMapping(short_key='hot123', long_url='https://example.com'))
+        client = admin_app.test_client()
+        for _ in range(3):
+            client.get('/hot123')
+
+        response = client.get('/admin/hot-keys?limit=10', headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 200
+        assert response.get_json() == {'total': 3,
+                                       'hot_keys': [{'short_key': 'hot123', 'count': 3, 'error': 0}]}
+
+    def test_requires_token(self, admin_app):
+        client = admin_app.test_client()
+        assert client.get('/admin/hot-keys').status_code == 401
+        assert client.get('/admin/hot-keys', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    def test_invalid_limit(self, admin_app):
+        response = admin_app.test_client().get('/admin/hot-keys?limit=x', headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 400
+
+    def test_disabled_without_token(self):
+        assert create_app({'storage_backend': 'memory'}).test_client().get('/admin/hot-keys').status_code == 404
+
+
+class TestAdminMappings:
+
+    AUTH = {'Authorization': 'Bearer secret'}
+
+    @pytest.fixture
+    def admin_app(self):
+        test_app = create_app({'storage_backend': 'memory', 'admin_token': 'secret'})
+        created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        test_app.extensions['url_shortener']['repo'].save_many([
+            URLMapping(short_key=f'key{i:05d}', long_url=f'https://example.com/{i}', created_at=created,
+                       expires_at=created + timedelta(days=i + 1))
+            for i in range(5)])
+        return test_app
+
+    def test_pages(self, admin_app):
+        client = admin_app.test_client()
+        keys, cursor = [], None
+        while True:
+            response = client.get('/admin/mappings', query_string={'limit': 2, 'cursor': cursor}, headers=self.AUTH)
+            assert response.status_code == 200
+            page = response.get_json()
+            assert len(page['mappings']) <= 2
+            keys += [item['short_key'] for item in page['mappings']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        assert keys == [f'key{i:05d}' for i in range(5)]
+
+    def test_fields_and_filters(self, admin_app):
+        response = admin_app.test_client().get('/admin/mappings', headers=self.AUTH, query_string={
+            'fields': 'short_key,expires_at', 'expires_before': '2025-01-03T12:00:00+00:00', 'domain': 'example.com'})
+
+        assert response.get_json() == {'mappings': [
+            {'short_key': 'key00000', 'expires_at': '2025-01-02T00:00:00+00:00'},
+            {'short_key': 'key00001', 'expires_at': '2025-01-03T00:00:00+00:00'},
+        ], 'next_cursor': None}
+
+    @pytest.mark.parametrize('query', [{'limit': 0}, {'limit': 'x'}, {'limit': 1001}, {'cursor': 'not-a-cursor'},
+                                       {'expires_after': '2025-01-01'}, {'fields': 'short_key,password'}])
+    def test_invalid_arguments(self, admin_app, query):
+        response = admin_app.test_client().get('/admin/mappings', query_string=query, headers=self.AUTH)
+        assert response.status_code == 400
+
+    def test_database_unavailable(self, admin_app):
+        repo = admin_app.extensions['url_shortener']['repo']
+        with patch.object(repo, 'iter_mappings', side_effect=UnavailableError('breaker open')):
+            response = admin_app.test_client().get('/admin/mappings', headers=self.AUTH)
+            assert response.status_code == 503
+
+    def test_requires_token(self, admin_app):
+        assert admin_app.test_client().get('/admin/mappings').status_code == 401
+
+
+class TestCreateApp:
+
+    def test_services_share_one_repository(self):
+        test_app = create_app({'redirect_cache_size': 100})
+        services = test_app.extensions['url_shortener']
+
+        assert services['url_generator'].repo is services['repo']
+        assert services['redirector'].repo is services['repo']
+        assert services['repo'].cache is services['redirector'].cache
+
+    def test_does_not_connect(self):
+        with patch('repository.connection.connect') as mock_connect:
+            create_app({'mongo_host': 'db.internal'})
+            mock_connect.assert_not_called()
+
+    def test_apps_are_independent(self):
+        first = create_app()
+        second = create_app()
+        assert first.extensions['url_shortener']['repo'] is not second.extensions['url_shortener']['repo']
+
+    def test_metrics_disabled(self):
+        test_app = create_app({'metrics_enabled': False})
+        services = test_app.extensions['url_shortener']
+
+        assert services['metrics'] is None
+        assert 'get_redirect_target' not in vars(services['repo'])
+        assert test_app.test_client().get('/metrics').status_code == 404
+
+    def test_prewarms_hot_keys_before_first_request(self, tmp_path):
+        path = str(tmp_path / 'hot_keys.json')
+        first = create_app({'storage_backend': 'memory', 'hot_keys_path': path})
+        first.extensions['url_shortener']['repo'].save_url_mapping(
+            URLMapping(short_key='hot123', long_url='https://example.com'))
+        first.test_client().get('/hot123')
+        first.extensions['url_shortener']['hot_keys'].save()
+
+        second = create_app({'storage_backend': 'memory', 'hot_keys_path': path})
+        repo = second.extensions['url_shortener']['repo']
+        repo.save_url_mapping(URLMapping(short_key='hot123', long_url='https://example.com'))
+        repo.cache.invalidate('hot123')
+        with patch.object(repo, 'get_redirect_target') as mock_lookup:
+            response = second.test_client().get('/hot123')
+
+        assert response.status_code == 302
+        mock_lookup.assert_not_called()
+
+    def test_start_worker_prewarms_before_any_request(self, tmp_path):
+        path = str(tmp_path / 'hot_keys.json')
+        with open(path, 'w') as f:
+            json.dump({'saved_at': 0, 'keys': [['hot123', 5]]}, f)
+        test_app = create_app({'storage_backend': 'memory', 'hot_keys_path': path})
+        repo = test_app.extensions['url_shortener']['repo']
+        repo.save_url_mapping(URLMapping(short_key='hot123', long_url='https://example.com'))
+        repo.cache.invalidate('hot123')
+
+        start_worker(test_app)
+        assert repo.cache.get('hot123') is not None
+        with patch.object(test_app.extensions['url_shortener']['redirector'], 'prewarm') as mock_prewarm:
+            assert test_app.test_client().get('/hot123').status_code == 302
+        mock_prewarm.assert_not_called()
+
+    def test_workers_share_the_redirect_cache(self, tmp_path):
+        settings = {'storage_backend': 'memory', 'redirect_cache_shared_path': str(tmp_path / 'redirect_cache')}
+        first, second = create_app(settings), create_app(settings)
+        repo = first.extensions['url_shortener']['repo']
+        repo.save_url_mapping(URLMapping(short_key='hot123', long_url='https://example.com'))
+        assert first.test_client().get('/hot123').status_code == 302
+
+        # Served by the other app's redirector from the shared table
+        assert second.test_client().get('/hot123').headers['Location'] == 'https://example.com'
+        text = second.test_client().get('/metrics').data
+        assert b'redirect_cache_lookups_total{result="hit"} 1' in text
+        assert b'\nredirect_cache_capacity ' in text and b'\nredirect_cache_bytes_per_entry ' in text
+
+    def test_unknown_setting(self):
+        with pytest.raises(KeyError):
+            create_app({'no_such_setting': 1})
+
@@ -0,0 +1,45 @@
+import pytest
+
+from util.hash_ring import HashRing
+
+KEYS = [f"key{i:05d}" for i in range(20000)]
+
+
+class TestHashRing:
+
+    def test_spreads_keys_evenly(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {}
+        for key in KEYS:
+            node = ring.node_for(key)
+            counts[node] = counts.get(node, 0) + 1
+
+        assert set(counts) == {"a", "b", "c", "d"}
+        assert max(counts.values()) < 1.25 * len(KEYS) / 4
+
+    def test_independent_of_node_order(self):
+        first, second = HashRing(["a", "b", "c"]), HashRing(["c", "a", "b"])
+        assert all(first.node_for(key) == second.node_for(key) for key in KEYS[:1000])
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in KEYS}
+        ring.add("d")
+
+        moved = [key for key in KEYS if ring.node_for(key) != before[key]]
+        assert all(ring.node_for(key) == "d" for key in moved)
+        assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+    def test_remove(self):
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in KEYS[:2000]}
+        ring.remove("c")
+
+        assert ring.nodes == ["a", "b"]
+        assert all(ring.node_for(key) == node for key, node in before.items() if node != "c")
+
+    def test_invalid(self):
+        with pytest.raises(LookupError):
+            HashRing().node_for("abc123")
+        with pytest.raises(ValueError):
+            HashRing(["a", "a"])
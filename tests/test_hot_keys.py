@@ -0,0 +1,145 @@
+import random
+import threading
+
+import pytest
+
+from service.hot_keys import HotKeyTracker
+from util.heavy_hitters import SpaceSaving
+
+
+class TestSpaceSaving:
+
+    def test_exact_below_capacity(self):
+        summary = SpaceSaving(10)
+        for key, count in (("a", 5), ("b", 3), ("c", 1)):
+            for _ in range(count):
+                summary.add(key)
+
+        assert summary.top() == [("a", 5, 0), ("b", 3, 0), ("c", 1, 0)]
+        assert summary.top(1) == [("a", 5, 0)]
+        assert summary.total == 9
+
+    def test_memory_is_bounded(self):
+        summary = SpaceSaving(100)
+        for i in range(10000):
+            summary.add(f"key{i}")
+
+        assert len(summary) == 100
+        assert len(summary._heap) == 100
+
+    def test_finds_heavy_hitters_in_zipf_stream(self):
+        rng = random.Random(1)
+        keys = [f"key{i}" for i in range(10000)]
+        weights = [1 / (rank + 1) ** 1.1 for rank in range(len(keys))]
+        stream = rng.choices(keys, weights=weights, k=100000)
+        summary = SpaceSaving(200)
+        for key in stream:
+            summary.add(key)
+
+        true_counts = {}
+        for key in stream:
+            true_counts[key] = true_counts.get(key, 0) + 1
+        tracked = {key for key, _, _ in summary.top()}
+        assert {key for key, count in true_counts.items() if count > len(stream) / 200} <= tracked
+        assert set(keys[:5]) <= {key for key, _, _ in summary.top(10)}
+        for key, count, error in summary.top(50):
+            # Counts never underestimate and overestimate by at most error
+            assert true_counts[key] <= count <= true_counts[key] + error
+
+    def test_new_key_inherits_the_minimum(self):
+        summary = SpaceSaving(2)
+        summary.add("a", 5)
+        summary.add("b", 2)
+        summary.add("c")
+
+        assert summary.top() == [("a", 5, 0), ("c", 3, 2)]
+
+    def test_decay(self):
+        summary = SpaceSaving(10)
+        summary.add("a", 10)
+        summary.add("b", 1)
+        summary.decay(0.5)
+
+        assert summary.top() == [("a", 5, 0)]
+        assert summary.total == 5
+        summary.add("c", 6)
+        assert summary.top(1) == [("c", 6, 0)]
+
+    def test_concurrent_adds(self):
+        summary = SpaceSaving(50)
+
+        def add():
+            for i in range(2000):
+                summary.add(f"key{i % 100}")
+
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert summary.total == 16000
+        assert len(summary) == 50
+
+    def test_invalid_capacity(self):
+        with pytest.raises(ValueError):
+            SpaceSaving(0)
+
+
+class TestHotKeyTracker:
+
+    def test_save_and_load(self, tmp_path):
+        path = str(tmp_path / 'hot_keys.json')
+        tracker = HotKeyTracker(capacity=10, path=path)
+        for key, count in (("abc123", 3), ("def456", 1), ("ghi789", 2)):
+            for _ in range(count):
+                tracker.record(key)
+
+        assert tracker.save() == 3
+        assert HotKeyTracker.load(path) == ["abc123", "ghi789", "def456"]
+        assert HotKeyTracker.load(path, limit=1) == ["abc123"]
+
+    def test_records_are_buffered_per_thread(self):
+        tracker = HotKeyTracker(capacity=10, buffer_size=4)
+        for _ in range(3):
+            tracker.record("abc123")
+        assert tracker._summary.total == 0
+
+        tracker.record("abc123")
+        assert tracker._summary.total == 4
+
+        tracker.record("def456")
+        # Reads include what is still buffered
+        assert tracker.top() == [("abc123", 4, 0), ("def456", 1, 0)]
+        assert tracker.total == 5
+
+    def test_concurrent_records(self):
+        tracker = HotKeyTracker(capacity=200, buffer_size=16)
+
+        def record():
+            for i in range(1000):
+                tracker.record(f"key{i % 100}")
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert tracker.total == 8000
+        assert all(count == 80 for _, count, _ in tracker.top())
+
+    def test_load_missing_file(self, tmp_path):
+        assert HotKeyTracker.load(str(tmp_path / 'missing.json')) == []
+
+    def test_run_saves_and_decays(self, tmp_path):
+        path = str(tmp_path / 'hot_keys.json')
+        tracker = HotKeyTracker(capacity=10, path=path, decay=0.5)
+        for _ in range(4):
+            tracker.record("abc123")
+        stop = threading.Event()
+        tracker._summary.decay = lambda factor, decay=tracker._summary.decay: (decay(factor), stop.set())
+
+        tracker.run(0.001, stop)
+        assert HotKeyTracker.load(path) == ["abc123"]
+        assert tracker.top() == [("abc123", 2, 0)]
@@ -0,0 +1,62 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from service.key_allocator import KeyAllocator
+from util import base62
+
+
+@pytest.fixture
+def repo():
+    repo = MagicMock()
+    blocks = iter(range(0, 10 ** 6, 10))
+    repo.allocate_id_block.side_effect = lambda name, size: next(blocks)
+    return repo
+
+
+class TestKeyAllocator:
+
+    def test_leases_blocks_lazily(self, repo):
+        allocator = KeyAllocator(repo, block_size=10, scramble=False)
+        ids = [allocator.next_id() for _ in range(25)]
+
+        assert ids == list(range(25))
+        assert repo.allocate_id_block.call_count == 3
+        repo.allocate_id_block.assert_called_with('url_mappings', 10)
+
+    def test_unscrambled_keys_are_sequential(self, repo):
+        allocator = KeyAllocator(repo, block_size=10, scramble=False)
+        assert allocator.next_key() == "00000000"
+        assert allocator.next_key() == "00000001"
+
+    def test_scrambled_keys(self, repo):
+        allocator = KeyAllocator(repo, block_size=10, secret=42)
+        keys = [allocator.next_key() for _ in range(100)]
+
+        assert len(set(keys)) == 100
+        assert all(len(key) == 8 for key in keys)
+        assert keys != sorted(keys)
+
+    def test_scramble_is_bijective(self, repo):
+        allocator = KeyAllocator(repo, key_length=2, secret=7)
+        space = base62.BASE ** 2
+        scrambled = {allocator.scramble_id(num) for num in range(space)}
+
+        assert scrambled == set(range(space))
+        assert all(allocator.unscramble_id(allocator.scramble_id(n)) == n for n in range(space))
+
+    def test_thread_safe(self, repo):
+        allocator = KeyAllocator(repo, block_size=10)
+        keys = []
+
+        def worker():
+            for _ in range(200):
+                keys.append(allocator.next_key())
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(set(keys)) == 800
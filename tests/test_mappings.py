@@ -0,0 +1,117 @@
+import io
+import json
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from model.url_mapping import URLMapping
+from repository.key_filter import KeyFilter
+from repository.memory_repo import MemoryRepository
+from service.redirector import RedirectorService
+from tools.mappings import Checkpoint, export_mappings, import_mappings, main, read_records
+from util.urls import hash_url
+
+
+def make_repo():
+    repo = MemoryRepository()
+    now = datetime.now(timezone.utc)
+    repo.save_url_mapping(URLMapping(short_key="abc12345", long_url="https://example.com/a", created_at=now,
+                                     expires_at=now + timedelta(days=1), url_hash=hash_url("https://example.com/a"),
+                                     redirect_code=301, cache_max_age=600))
+    repo.save_url_mapping(URLMapping(short_key="def67890", long_url="https://example.com/ü", created_at=now))
+    repo.increment_clicks({"def67890": (3, 1000.0)})
+    return repo
+
+
+def lines(*records):
+    return io.StringIO(''.join(json.dumps(record) + '\n' for record in records))
+
+
+class TestExportImport:
+
+    @pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+    def test_round_trip(self, fmt):
+        source = make_repo()
+        out = io.StringIO()
+        assert export_mappings(source, out, fmt) == 2
+
+        target = MemoryRepository()
+        rejects = io.StringIO()
+        checkpoint = import_mappings(target, read_records(io.StringIO(out.getvalue()), fmt), rejects, chunk_size=1)
+
+        assert (checkpoint.imported, checkpoint.rejected, checkpoint.position) == (2, 0, 2)
+        assert sorted(target.iter_mapping_rows()) == sorted(source.iter_mapping_rows())
+        assert rejects.getvalue() == ''
+
+    def test_rejects(self):
+        repo = make_repo()
+        rejects = io.StringIO()
+        records = read_records(io.StringIO(
+            '{"short_key": "new12345", "long_url": "https://example.com/new"}\n'
+            '{"short_key": "abc12345", "long_url": "https://example.com/dup"}\n'
+            '{"short_key": "no", "long_url": "https://example.com"}\n'
+            '{"short_key": "bad12345", "long_url": "ftp://example.com"}\n'
+            '{"short_key": "bad23456", "long_url": "https://example.com", "redirect_code": 200}\n'
+            '{"short_key": "bad34567", "long_url": "https://example.com", "expires_at": "2025-01-01T00:00:00"}\n'
+            'not json\n'
+            '\n'
+            '{"short_key": "new67890", "long_url": "https://example.com/new2"}\n'), 'jsonl')
+
+        checkpoint = import_mappings(repo, records, rejects, chunk_size=2)
+
+        assert (checkpoint.imported, checkpoint.rejected) == (2, 6)
+        rejected = [json.loads(line) for line in rejects.getvalue().splitlines()]
+        assert sorted(reject['record'] for reject in rejected) == [2, 3, 4, 5, 6, 7]
+        assert {reject['error'] for reject in rejected if reject['record'] == 2} == {'Duplicate short_key'}
+        assert repo.existing_keys(["new12345", "new67890", "bad12345"]) == {"new12345", "new67890"}
+
+    def test_resume(self, tmp_path):
+        repo = MemoryRepository()
+        records = [{"short_key": f"key{i:05d}", "long_url": f"https://example.com/{i}"} for i in range(5)]
+        checkpoint = Checkpoint(str(tmp_path / "import.checkpoint"))
+        # Stopped after the first two, with the third inserted but not checkpointed
+        checkpoint.position, checkpoint.imported = 2, 2
+        checkpoint.save()
+        for record in records[:3]:
+            repo.save_url_mapping(URLMapping(**record))
+
+        rejects = io.StringIO()
+        resumed = import_mappings(repo, records, rejects, chunk_size=2,
+                                  checkpoint=Checkpoint(checkpoint.path).load())
+
+        assert resumed.position == 5
+        assert resumed.rejected == 0
+        assert resumed.imported == 4  # the third was already there
+        assert len(list(repo.iter_short_keys())) == 5
+        assert Checkpoint(checkpoint.path).load().position == 5
+
+    def test_imported_keys_resolve_with_the_key_filter(self, tmp_path):
+        repo = make_repo()
+        # Built by an app worker before the import, then persisted
+        path = str(tmp_path / "keys.bloom")
+        running = KeyFilter(capacity=100, error_rate=0.01, path=path)
+        running.build(repo)
+
+        record = {'short_key': "old12345", 'long_url': "https://example.com/old",
+                  'created_at': "2020-01-01T00:00:00+00:00"}
+        import_mappings(repo, [record], io.StringIO())
+
+        running.refresh(repo)
+        restarted = KeyFilter(capacity=100, error_rate=0.01, path=path)
+        restarted.build(repo)
+        for key_filter in (running, restarted):
+            redirector = RedirectorService(repo=repo, key_filter=key_filter)
+            assert redirector.redirect("old12345") == "https://example.com/old"
+
+    def test_main(self, tmp_path, monkeypatch):
+        source, target = make_repo(), MemoryRepository()
+        path = str(tmp_path / "backup.csv.gz")
+
+        monkeypatch.setattr('tools.mappings.create_repository', lambda settings: source)
+        main(['export', path])
+        monkeypatch.setattr('tools.mappings.create_repository', lambda settings: target)
+        main(['import', path])
+
+        assert sorted(target.iter_short_keys()) == ["abc12345", "def67890"]
+        assert (tmp_path / "backup.csv.gz.rejects.jsonl").read_text() == ''
+        assert json.loads((tmp_path / "backup.csv.gz.checkpoint").read_text())['imported'] == 2
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from unittest.mock import MagicMock
+
+from util.metrics import Counter, Histogram, Metrics, instrument
+
+
+class TestHistogram:
+
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency', ('stage',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value, 'db')
+
+        lines = histogram.render()
+        assert 'latency_seconds_bucket{stage="db",le="0.1"} 2' in lines
+        assert 'latency_seconds_bucket{stage="db",le="1.0"} 3' in lines
+        assert 'latency_seconds_bucket{stage="db",le="+Inf"} 4' in lines
+        assert 'latency_seconds_count{stage="db"} 4' in lines
+        assert 'latency_seconds_sum{stage="db"} 5.65' in lines
+
+    def test_unlabelled(self):
+        histogram = Histogram('latency_seconds', 'Latency', buckets=(1.0,))
+        histogram.observe(0.5)
+
+        assert histogram.count() == 1
+        assert 'latency_seconds_bucket{le="1.0"} 1' in histogram.render()
+
+
+class TestCounter:
+
+    def test_labels(self):
+        counter = Counter('responses_total', 'Responses', ('status',))
+        counter.inc('200')
+        counter.inc('200')
+        counter.inc('404', amount=3)
+
+        assert counter.value('200') == 2
+        lines = counter.render()
+        assert lines[:2] == ['# HELP responses_total Responses', '# TYPE responses_total counter']
+        assert 'responses_total{status="404"} 3' in lines
+
+    def test_label_values_are_escaped(self):
+        counter = Counter('errors_total', 'Errors', ('message',))
+        counter.inc('say "hi"\n')
+
+        assert 'errors_total{message="say \\"hi\\"\\n"} 1' in counter.render()
+
+
+class TestInstrument:
+
+    class Repo:
+        def lookup(self, key):
+            if key is None:
+                raise KeyError(key)
+            return key.upper()
+
+        def stream(self):
+            yield 1
+
+        async def fetch(self, key):
+            await asyncio.sleep(0.01)
+            return key
+
+    def test_times_calls_including_failures(self):
+        repo = self.Repo()
+        histogram = Histogram('repo_seconds', 'Repo', ('method',))
+        instrument(repo, ['lookup', 'stream'], histogram)
+
+        assert repo.lookup('abc') == 'ABC'
+        with pytest.raises(KeyError):
+            repo.lookup(None)
+
+        assert histogram.count('lookup') == 2
+        # Generator methods are left alone
+        assert list(repo.stream()) == [1]
+        assert histogram.count('stream') == 0
+        assert 'lookup' not in vars(self.Repo())
+
+    def test_times_coroutines_until_they_finish(self):
+        repo = self.Repo()
+        histogram = Histogram('repo_seconds', 'Repo', ('method',), buckets=(0.005, 1.0))
+        instrument(repo, ['fetch'], histogram)
+
+        assert asyncio.run(repo.fetch('abc')) == 'abc'
+        assert histogram.count('fetch') == 1
+        assert 'repo_seconds_bucket{method="fetch",le="0.005"} 0' in histogram.render()
+
+    def test_render_includes_every_metric(self):
+        metrics = Metrics()
+        metrics.collision_retries.inc()
+
+        text = metrics.render()
+        assert '# TYPE http_request_duration_seconds histogram' in text
+        assert 'url_generator_collision_retries_total 1' in text
+
+    def test_render_copies_cache_stats(self):
+        metrics = Metrics()
+        cache = MagicMock()
+        cache.stats.return_value = {'hits': 3, 'misses': 1, 'evictions': 2, 'size': 5, 'max_size': 10}
+        metrics.watch_cache(cache)
+
+        text = metrics.render()
+        assert '# TYPE redirect_cache_lookups_total counter' in text
+        assert 'redirect_cache_lookups_total{result="hit"} 3' in text
+        assert 'redirect_cache_lookups_total{result="miss"} 1' in text
+        assert '# TYPE redirect_cache_evictions_total counter' in text
+        assert 'redirect_cache_evictions_total 2' in text
+        assert 'redirect_cache_entries 5' in text
+        assert 'redirect_cache_capacity 10' in text
+        # Only the shared cache reports its memory per slot
+        assert '\nredirect_cache_bytes_per_entry ' not in text
+
+        cache.stats.return_value = dict(cache.stats.return_value, bytes_per_entry=185.0)
+        assert 'redirect_cache_bytes_per_entry 185.0' in metrics.render()
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import pstats
+import signal
+import time
+
+import pytest
+
+from api.asgi import create_asgi_app
+from api.handlers import create_app, start_worker
+from api.profiling import ProfileRequests, install_signal_handler
+from model.url_mapping import URLMapping
+from util.profiling import Profiler, ProfilingError
+
+AUTH = {'Authorization': 'Bearer secret'}
+
+
+def busy_loop(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    profiler = Profiler(str(tmp_path), max_seconds=10)
+    yield profiler
+    profiler.stop_memory()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'storage_backend': 'memory', 'admin_token': 'secret', 'profiling_enabled': True,
+                      'profiling_dir': str(tmp_path)})
+    app.extensions['url_shortener']['repo'].save_url_mapping(
+        URLMapping(short_key='abc123', long_url='https://example.com'))
+    yield app
+    signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+    app.extensions['url_shortener']['profiler'].stop_memory()
+
+
+class TestProfiler:
+
+    def test_sampling_writes_collapsed_stacks(self, profiler):
+        path = profiler.start_sampling(0.2, interval=0.002)
+        with pytest.raises(ProfilingError):
+            profiler.start_sampling(1)
+        busy_loop(0.3)
+        profiler._sampler.join(1)
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert any('busy_loop' in line for line in lines)
+        stack, hits = lines[0].rsplit(' ', 1)
+        assert int(hits) > 0 and ';' in stack
+
+    def test_stop_sampling_early(self, profiler):
+        with pytest.raises(ProfilingError):
+            profiler.stop_sampling()
+        path = profiler.start_sampling(10)
+        assert profiler.stop_sampling() == path
+        assert os.path.exists(path) and not profiler.sampling
+
+    def test_invalid_duration(self, profiler):
+        with pytest.raises(ValueError):
+            profiler.start_sampling(11)
+
+    def test_profile_writes_pstats(self, profiler):
+        with profiler.profile() as path:
+            busy_loop(0.01)
+        stats = pstats.Stats(path)
+        assert any(func[2] == 'busy_loop' for func in stats.stats)
+
+    def test_memory_diff(self, profiler):
+        assert profiler.snapshot_memory() == (None, [])
+        kept = [bytearray(1000) for _ in range(1000)]
+        path, top = profiler.snapshot_memory(limit=5)
+
+        assert len(top) <= 5 and 'test_profiling.py' in top[0]
+        assert os.path.exists(path)
+        assert profiler.stop_memory() is True and kept
+
+
+class TestProfilingHooks:
+
+    def test_nothing_installed_by_default(self):
+        app = create_app({'storage_backend': 'memory', 'admin_token': 'secret'})
+        assert app.extensions['url_shortener']['profiler'] is None
+        assert not isinstance(app.wsgi_app, ProfileRequests)
+        assert app.test_client().post('/admin/profile/cpu', headers=AUTH).status_code == 404
+
+    def test_profiles_requests_with_the_header(self, app):
+        client = app.test_client()
+        assert 'X-Profile-Path' not in client.get('/abc123', headers={'X-Profile': 'wrong'}).headers
+
+        response = client.get('/abc123', headers={'X-Profile': 'secret'})
+        assert response.status_code == 302
+        stats = pstats.Stats(response.headers['X-Profile-Path'])
+        assert any(func[2] == 'resolve' for func in stats.stats)
+
+    def test_cpu_endpoints(self, app):
+        client = app.test_client()
+        assert client.post('/admin/profile/cpu').status_code == 401
+        assert client.post('/admin/profile/cpu?seconds=1000', headers=AUTH).status_code == 400
+
+        response = client.post('/admin/profile/cpu?seconds=5', headers=AUTH)
+        assert response.status_code == 202
+        assert client.post('/admin/profile/cpu', headers=AUTH).status_code == 409
+        stopped = client.post('/admin/profile/cpu/stop', headers=AUTH)
+        assert stopped.json['path'] == response.json['path'] and os.path.exists(stopped.json['path'])
+        assert client.post('/admin/profile/cpu/stop', headers=AUTH).status_code == 409
+
+    def test_memory_endpoints(self, app):
+        client = app.test_client()
+        assert client.post('/admin/profile/memory', headers=AUTH).json == {'path': None, 'top': []}
+        response = client.post('/admin/profile/memory?limit=3', headers=AUTH)
+        assert os.path.exists(response.json['path']) and len(response.json['top']) <= 3
+        assert client.post('/admin/profile/memory/stop', headers=AUTH).json['was_tracing'] is True
+
+    def test_start_worker_reinstalls_the_signal_handler(self, app):
+        # As gunicorn does in each worker, after a --preload app was built
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        start_worker(app)
+
+        assert signal.getsignal(signal.SIGUSR2) not in (signal.SIG_DFL, signal.SIG_IGN, None)
+
+    def test_asgi_lifespan_installs_the_signal_handler(self, tmp_path):
+        app = create_asgi_app({'storage_backend': 'memory', 'admin_token': 'secret', 'profiling_enabled': True,
+                               'profiling_dir': str(tmp_path)})
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            pass
+
+        try:
+            asyncio.run(app({'type': 'lifespan'}, receive, send))
+            assert signal.getsignal(signal.SIGUSR2) not in (signal.SIG_DFL, signal.SIG_IGN, None)
+        finally:
+            signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+
+    def test_signal_toggles_sampling(self, profiler):
+        assert install_signal_handler(profiler, 10)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR2)
+            assert profiler.sampling
+            os.kill(os.getpid(), signal.SIGUSR2)
+            profiler._sampler.join(1)
+            assert not profiler.sampling
+        finally:
+            signal.signal(signal.SIGUSR2, signal.SIG_DFL)
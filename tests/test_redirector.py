@@ -1,9 +1,17 @@
 import pytest
+import threading
+import time
 from datetime import datetime, timezone, timedelta
 from unittest.mock import patch, MagicMock
 
 from service.redirector import RedirectorService, NotFoundError, GoneError
 from model.url_mapping import URLMapping
+from repository.base import UnavailableError
+from repository.db_repo import DBRepository
+from service.hot_keys import HotKeyTracker
+from util.cache import LRUCache
+from util.metrics import Metrics
+from util.singleflight import SingleFlight
 
 @pytest.fixture
 def redirector():
@@ -15,24 +23,19 @@ def redirector():
 class TestRedirectorService:
 
     def test_redirect_success(self, redirector):
-        # Setup mock mapping
-        mock_mapping = MagicMock()
-        mock_mapping.long_url = "https://example.com"
-        mock_mapping.expires_at = None
-
-        # Configure the mock repo to return our mock mapping
-        redirector.repo.get_mapping_by_key.return_value = mock_mapping
+        # Configure the mock repo to return (long_url, expires_at epoch, redirect_code, cache_max_age)
+        redirector.repo.get_redirect_target.return_value = ("https://example.com", None, None, None)
 
         # Test the redirect method
         result = redirector.redirect("abc123")
 
         # Verify the result
         assert result == "https://example.com"
-        redirector.repo.get_mapping_by_key.assert_called_once_with(short_key="abc123")
+        redirector.repo.get_redirect_target.assert_called_once_with(short_key="abc123")
 
     def test_redirect_not_found(self, redirector):
         # Configure the mock repo to return None (mapping not found)
-        redirector.repo.get_mapping_by_key.return_value = None
+        redirector.repo.get_redirect_target.return_value = None
 
         # Test that NotFoundError is raised
         with pytest.raises(NotFoundError) as excinfo:
@@ -40,16 +43,12 @@ class TestRedirectorService:
 
         # Verify the error message
         assert "No mapping for key 'nonexistent'" in str(excinfo.value)
-        redirector.repo.get_mapping_by_key.assert_called_once_with(short_key="nonexistent")
+        redirector.repo.get_redirect_target.assert_called_once_with(short_key="nonexistent")
 
     def test_redirect_expired(self, redirector):
-        # Setup mock mapping with expired timestamp
-        mock_mapping = MagicMock()
-        mock_mapping.long_url = "https://example.com"
-        mock_mapping.expires_at = datetime.now(timezone.utc) - timedelta(days=1)  # Expired yesterday
-
-        # Configure the mock repo to return our expired mock mapping
-        redirector.repo.get_mapping_by_key.return_value = mock_mapping
+        # Configure the mock repo to return a target that expired yesterday
+        expired_at = (datetime.now(timezone.utc) - timedelta(days=1)).timestamp()
+        redirector.repo.get_redirect_target.return_value = ("https://example.com", expired_at, None, None)
 
         # Test that GoneError is raised
         with pytest.raises(GoneError) as excinfo:
@@ -57,20 +56,312 @@ class TestRedirectorService:
 
         # Verify the error message contains "expired"
         assert "expired" in str(excinfo.value)
-        redirector.repo.get_mapping_by_key.assert_called_once_with(short_key="expired")
+        redirector.repo.get_redirect_target.assert_called_once_with(short_key="expired")
 
     def test_redirect_future_expiry(self, redirector):
-        # Setup mock mapping with future expiry
-        mock_mapping = MagicMock()
-        mock_mapping.long_url = "https://example.com"
-        mock_mapping.expires_at = datetime.now(timezone.utc) + timedelta(days=1)  # Expires tomorrow
-
-        # Configure the mock repo to return our mock mapping
-        redirector.repo.get_mapping_by_key.return_value = mock_mapping
+        # Configure the mock repo to return a target that expires tomorrow
+        expires_at = (datetime.now(timezone.utc) + timedelta(days=1)).timestamp()
+        redirector.repo.get_redirect_target.return_value = ("https://example.com", expires_at, None, None)
 
         # Test the redirect method
         result = redirector.redirect("future")
 
         # Verify the result
         assert result == "https://example.com"
-        redirector.repo.get_mapping_by_key.assert_called_once_with(short_key="future")
+        redirector.repo.get_redirect_target.assert_called_once_with(short_key="future")
+
+
+class TestRedirectorCache:
+
+    @pytest.fixture
+    def cached_redirector(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        service = RedirectorService(repo=MagicMock(), cache=cache)
+        return service
+
+    def test_second_lookup_served_from_cache(self, cached_redirector):
+        cached_redirector.repo.get_redirect_target.return_value = ("https://example.com", None, None, None)
+
+        assert cached_redirector.redirect("abc123") == "https://example.com"
+        assert cached_redirector.redirect("abc123") == "https://example.com"
+
+        cached_redirector.repo.get_redirect_target.assert_called_once_with(short_key="abc123")
+        assert cached_redirector.cache.hits == 1
+
+    def test_not_found_is_not_cached(self, cached_redirector):
+        cached_redirector.repo.get_redirect_target.return_value = None
+
+        with pytest.raises(NotFoundError):
+            cached_redirector.redirect("nonexistent")
+        assert len(cached_redirector.cache) == 0
+
+    def test_repository_writes_invalidate_cache(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.put("abc123", "https://old.example.com")
+        repo = DBRepository(cache=cache)
+
+        with patch.object(URLMapping, '_get_collection') as mock_collection:
+            mock_collection.return_value.find_one_and_delete.return_value = {'_id': "abc123"}
+            assert repo.delete_mapping("abc123") is True
+
+        assert cache.get("abc123") is None
+
+    def test_row_read_before_a_write_is_not_cached(self, cached_redirector):
+        def fetch_then_write(short_key):
+            # The mapping is replaced while the old row is in flight
+            cached_redirector.cache.invalidate(short_key)
+            return "https://old.example.com", None, None, None
+        cached_redirector.repo.get_redirect_target.side_effect = fetch_then_write
+
+        assert cached_redirector.redirect("abc123") == "https://old.example.com"
+        assert cached_redirector.cache.get("abc123") is None
+
+
+class TestRedirectorKeyFilter:
+
+    def test_definite_miss_skips_repository(self):
+        key_filter = MagicMock()
+        key_filter.might_contain.return_value = False
+        service = RedirectorService(repo=MagicMock(), key_filter=key_filter)
+
+        with pytest.raises(NotFoundError):
+            service.redirect("typo123")
+        service.repo.get_redirect_target.assert_not_called()
+
+    def test_possible_hit_reaches_repository(self):
+        key_filter = MagicMock()
+        key_filter.might_contain.return_value = True
+        service = RedirectorService(repo=MagicMock(), key_filter=key_filter)
+        service.repo.get_redirect_target.return_value = None
+
+        with pytest.raises(NotFoundError):
+            service.redirect("abc123")
+        service.repo.get_redirect_target.assert_called_once_with(short_key="abc123")
+
+
+class TestRedirectorClickTracking:
+
+    def test_successful_redirects_are_counted(self):
+        tracker = MagicMock()
+        service = RedirectorService(repo=MagicMock(), cache=LRUCache(max_size=10, ttl=60),
+                                    click_tracker=tracker)
+        service.repo.get_redirect_target.return_value = ("https://example.com", None, None, None)
+
+        service.redirect("abc123")
+        service.redirect("abc123")  # cache hit
+
+        assert tracker.record.call_count == 2
+
+    def test_misses_are_not_counted(self):
+        tracker = MagicMock()
+        service = RedirectorService(repo=MagicMock(), click_tracker=tracker)
+        service.repo.get_redirect_target.return_value = None
+
+        with pytest.raises(NotFoundError):
+            service.redirect("nonexistent")
+        tracker.record.assert_not_called()
+
+
+class TestRedirectorPolicy:
+
+    def test_defaults(self):
+        service = RedirectorService(repo=MagicMock(), redirect_code=301, cache_max_age=3600)
+        service.repo.get_redirect_target.return_value = ("https://example.com", None, None, None)
+
+        target = service.resolve("abc123")
+        assert (target.status_code, target.max_age) == (301, 3600)
+        assert target.cache_control == "public, max-age=3600"
+
+    def test_mapping_policy_overrides_defaults(self):
+        service = RedirectorService(repo=MagicMock(), cache=LRUCache(max_size=10, ttl=60), cache_max_age=3600)
+        service.repo.get_redirect_target.return_value = ("https://example.com", None, 307, 0)
+
+        for _ in range(2):  # second lookup is a cache hit
+            target = service.resolve("abc123")
+            assert (target.status_code, target.max_age) == (307, 0)
+            assert target.cache_control is None
+        service.repo.get_redirect_target.assert_called_once()
+
+    def test_max_age_capped_at_expiry(self):
+        service = RedirectorService(repo=MagicMock(), cache_max_age=86400)
+        expires_at = (datetime.now(timezone.utc) + timedelta(seconds=100)).timestamp()
+        service.repo.get_redirect_target.return_value = ("https://example.com", expires_at, None, None)
+
+        assert 95 <= service.resolve("abc123").max_age <= 100
+
+    def test_permanent_redirect_without_max_age_is_not_stored(self):
+        service = RedirectorService(repo=MagicMock())
+        service.repo.get_redirect_target.return_value = ("https://example.com", None, 301, None)
+
+        assert service.resolve("abc123").cache_control == "no-store"
+
+
+class TestRedirectorSnapshot:
+
+    @pytest.fixture
+    def snapshot(self):
+        snapshot = MagicMock()
+        snapshot.get_redirect_target.return_value = ("https://example.com/snap", None, None, None)
+        return snapshot
+
+    def test_fallback_on_repository_error(self, snapshot):
+        service = RedirectorService(repo=MagicMock(), snapshot=snapshot)
+        service.repo.get_redirect_target.side_effect = ConnectionError("db down")
+
+        assert service.redirect("abc123") == "https://example.com/snap"
+
+    def test_fallback_miss_raises_repository_error(self, snapshot):
+        service = RedirectorService(repo=MagicMock(), snapshot=snapshot)
+        service.repo.get_redirect_target.side_effect = ConnectionError("db down")
+        snapshot.get_redirect_target.return_value = None
+
+        with pytest.raises(ConnectionError):
+            service.redirect("abc123")
+
+    def test_fallback_prefers_repository(self, snapshot):
+        service = RedirectorService(repo=MagicMock(), snapshot=snapshot)
+        service.repo.get_redirect_target.return_value = ("https://example.com/db", None, None, None)
+
+        assert service.redirect("abc123") == "https://example.com/db"
+        snapshot.get_redirect_target.assert_not_called()
+
+    def test_first_tier(self, snapshot):
+        service = RedirectorService(repo=MagicMock(), snapshot=snapshot, snapshot_mode='first')
+
+        assert service.redirect("abc123") == "https://example.com/snap"
+        service.repo.get_redirect_target.assert_not_called()
+
+        # Keys missing from the snapshot still reach the repository
+        snapshot.get_redirect_target.return_value = None
+        service.repo.get_redirect_target.return_value = ("https://example.com/db", None, None, None)
+        assert service.redirect("new123") == "https://example.com/db"
+
+    def test_expired_snapshot_row(self, snapshot):
+        service = RedirectorService(repo=MagicMock(), snapshot=snapshot, snapshot_mode='first')
+        snapshot.get_redirect_target.return_value = ("https://example.com/snap", time.time() - 10, None, None)
+
+        with pytest.raises(GoneError):
+            service.redirect("abc123")
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            RedirectorService(repo=MagicMock(), snapshot_mode='only')
+
+
+class TestRedirectorStaleWhileError:
+
+    def make_service(self, **kwargs):
+        service = RedirectorService(repo=MagicMock(), cache=LRUCache(max_size=10, ttl=0, max_stale=60), **kwargs)
+        service.cache.put("abc123", ("https://example.com/cached", None, None))
+        service.repo.get_redirect_target.side_effect = UnavailableError("breaker open")
+        return service
+
+    def test_serves_stale_cache_entry(self):
+        metrics = Metrics()
+        service = self.make_service(stale_max_age=60, metrics=metrics)
+
+        assert service.redirect("abc123") == "https://example.com/cached"
+        assert metrics.stale_redirects.value('cache') == 1
+        # Not re-stored as a fresh entry
+        assert service.cache.get_stale("abc123").value == ("https://example.com/cached", None, None)
+
+    def test_stale_limit(self):
+        service = self.make_service(stale_max_age=0)
+
+        with pytest.raises(UnavailableError):
+            service.redirect("abc123")
+
+    def test_fresh_data_is_preferred(self):
+        service = self.make_service(stale_max_age=60)
+        service.repo.get_redirect_target.side_effect = None
+        service.repo.get_redirect_target.return_value = ("https://example.com/db", None, None, None)
+
+        assert service.redirect("abc123") == "https://example.com/db"
+
+    def test_never_serves_expired_links(self):
+        service = self.make_service(stale_max_age=60)
+        service.cache.put("abc123", ("https://example.com/cached", None, None), time.time() + 0.05)
+        time.sleep(0.06)
+
+        with pytest.raises(UnavailableError):
+            service.redirect("abc123")
+
+    def test_snapshot_within_limit(self):
+        snapshot = MagicMock()
+        snapshot.get_redirect_target.return_value = ("https://example.com/snap", None, None, None)
+        snapshot.generated_at = time.time() - 120
+        service = self.make_service(stale_max_age=60, snapshot=snapshot)
+
+        with pytest.raises(UnavailableError):
+            service.redirect("other1")
+        snapshot.generated_at = time.time() - 30
+        assert service.redirect("other1") == "https://example.com/snap"
+
+
+class TestRedirectorSingleFlight:
+
+    def test_concurrent_misses_share_one_lookup(self):
+        service = RedirectorService(repo=MagicMock(), cache=LRUCache(max_size=10, ttl=60),
+                                    single_flight=SingleFlight(timeout=5))
+        release = threading.Event()
+
+        def get_redirect_target(short_key):
+            release.wait(5)
+            return ("https://example.com", None, None, None)
+        service.repo.get_redirect_target.side_effect = get_redirect_target
+
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(service.redirect("abc123"))) for _ in range(20)]
+        for worker in workers:
+            worker.start()
+        deadline = time.monotonic() + 5
+        while service.single_flight.waiting("abc123") < 19 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for worker in workers:
+            worker.join(5)
+
+        assert results == ["https://example.com"] * 20
+        service.repo.get_redirect_target.assert_called_once_with(short_key="abc123")
+        assert service.cache.get("abc123") is not None
+
+    def test_not_found_is_shared(self):
+        service = RedirectorService(repo=MagicMock(), single_flight=SingleFlight(timeout=5))
+        service.repo.get_redirect_target.return_value = None
+
+        with pytest.raises(NotFoundError):
+            service.redirect("missing")
+
+
+class TestRedirectorHotKeys:
+
+    def test_successful_redirects_are_counted(self):
+        service = RedirectorService(repo=MagicMock(), hot_keys=HotKeyTracker(capacity=10))
+        service.repo.get_redirect_target.side_effect = [("https://example.com", None, None, None), None]
+
+        service.redirect("abc123")
+        with pytest.raises(NotFoundError):
+            service.redirect("missing")
+
+        assert service.hot_keys.top() == [("abc123", 1, 0)]
+
+    def test_prewarm_loads_live_mappings_in_one_query(self):
+        service = RedirectorService(repo=MagicMock(), cache=LRUCache(max_size=10, ttl=60))
+        service.repo.get_redirect_targets.return_value = {
+            "abc123": ("https://example.com", None, 301, None),
+            "old": ("https://example.org", time.time() - 1, None, None),
+        }
+
+        assert service.prewarm(["abc123", "old", "missing"]) == 1
+        service.repo.get_redirect_targets.assert_called_once_with(["abc123", "old", "missing"])
+        assert service.redirect("abc123") == "https://example.com"
+        service.repo.get_redirect_target.assert_not_called()
+
+    def test_prewarm_is_bounded_by_the_cache(self):
+        repo = MagicMock()
+        repo.get_redirect_targets.return_value = {}
+        service = RedirectorService(repo=MagicMock(), cache=LRUCache(max_size=2, ttl=60))
+
+        service.prewarm(["a", "b", "c"], repo=repo)
+        repo.get_redirect_targets.assert_called_once_with(["a", "b"])
+        assert RedirectorService(repo=repo).prewarm(["a"]) == 0
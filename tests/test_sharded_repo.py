@@ -0,0 +1,276 @@
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+from model.url_mapping import URLMapping
+from repository.base import DuplicateKeyError, UnavailableError
+from repository.factory import create_repository
+from repository.memory_repo import MemoryRepository
+from repository.sharded_repo import ShardedRepository
+from tools.rebalance import rebalance
+from util import config
+from util.cache import LRUCache
+from util.hash_ring import HashRing
+
+KEYS = [f"key{i:05d}" for i in range(200)]
+
+
+def make_mapping(short_key, expires_in=None, **kwargs):
+    now = datetime.now(timezone.utc)
+    return URLMapping(short_key=short_key, long_url=f"https://example.com/{short_key}", created_at=now,
+                      expires_at=now + timedelta(seconds=expires_in) if expires_in is not None else None, **kwargs)
+
+
+@pytest.fixture
+def cache():
+    return LRUCache(100, 60)
+
+
+@pytest.fixture
+def repo(cache):
+    shards = {name: MemoryRepository(cache=cache) for name in ("a", "b", "c")}
+    return ShardedRepository(shards, counters=MemoryRepository(), cache=cache)
+
+
+class TestShardedRepository:
+
+    def test_routes_to_owning_shard(self, repo):
+        assert repo.save_many([make_mapping(key) for key in KEYS]) == {}
+
+        for name, shard in repo.shards.items():
+            stored = set(shard.iter_short_keys())
+            assert stored and all(repo.ring.node_for(key) == name for key in stored)
+        assert repo.get_mapping_by_key("key00007").long_url == "https://example.com/key00007"
+        assert repo.get_redirect_target("key00008")[0] == "https://example.com/key00008"
+        assert repo.existing_keys(["key00001", "key00002", "missing1"]) == {"key00001", "key00002"}
+        assert set(repo.get_redirect_targets(KEYS[:20] + ["missing1"])) == set(KEYS[:20])
+        assert repo.delete_mapping("key00003") is True
+        assert repo.get_mapping_by_key("key00003") is None
+
+    def test_save_many_maps_errors_back(self, repo):
+        repo.save_url_mapping(make_mapping("key00005"))
+        mappings = [make_mapping(key) for key in KEYS[:10]]
+
+        errors = repo.save_many(mappings)
+        assert list(errors) == [5]
+        assert isinstance(errors[5], DuplicateKeyError)
+
+    def test_unavailable_shard_fails_only_its_mappings(self, repo):
+        down = repo.ring.node_for("key00000")
+        repo.shards[down].save_many = MagicMock(side_effect=UnavailableError("breaker open"))
+
+        errors = repo.save_many([make_mapping(key) for key in KEYS[:30]])
+        assert {KEYS[i] for i in errors} == {key for key in KEYS[:30] if repo.ring.node_for(key) == down}
+        assert all(isinstance(error, UnavailableError) for error in errors.values())
+
+    def test_invalidates_shared_cache(self, repo, cache):
+        cache.put("key00001", ("https://stale.example.com", None, None))
+        repo.save_url_mapping(make_mapping("key00001"))
+        assert cache.get("key00001") is None
+
+    def test_sweep_fans_out(self, repo, monkeypatch):
+        repo.save_many([make_mapping(key, expires_in=10) for key in KEYS[:50]] +
+                       [make_mapping(key) for key in KEYS[50:60]])
+        real_time = time.time
+        monkeypatch.setattr(time, 'time', lambda: real_time() + 60)
+
+        assert len(list(repo.list_expired_mappings())) == 50
+        assert repo.purge_expired(batch_size=7) == 50
+        assert sorted(repo.iter_short_keys()) == KEYS[50:60]
+
+    def test_unordered_streams_read_shards_concurrently(self, repo):
+        repo.save_many([make_mapping(key, expires_in=10) for key in KEYS])
+        # Every shard waits for the others before its first batch, so a serial scan would fail
+        barrier = threading.Barrier(len(repo.shards), timeout=5)
+        for shard in repo.shards.values():
+            for name in ('iter_short_keys', 'iter_mapping_rows', 'list_expired_mappings'):
+                def waiting(*args, scan=getattr(shard, name)):
+                    barrier.wait()
+                    yield from scan(*args)
+                setattr(shard, name, waiting)
+
+        assert sorted(repo.iter_short_keys(batch_size=7)) == KEYS
+        assert sorted(row[0] for row in repo.iter_mapping_rows(batch_size=7)) == KEYS
+        assert list(repo.list_expired_mappings(batch_size=7)) == []
+
+    def test_ordered_streams_merge_shards(self, repo):
+        created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        repo.save_many([URLMapping(short_key=key, long_url="https://example.com", created_at=created +
+                                   timedelta(seconds=i % 7)) for i, key in enumerate(KEYS)])
+
+        assert [row[0] for row in repo.iter_redirect_rows(batch_size=10)] == KEYS
+        rows = list(repo.iter_mappings(fields=('short_key',), batch_size=10))
+        positions = [(row['created_at'], row['short_key']) for row in rows]
+        assert len(rows) == len(KEYS) and positions == sorted(positions)
+        assert [(row['created_at'], row['short_key']) for row in repo.iter_mappings(after=positions[99])] == \
+            positions[100:]
+
+    def test_clicks_and_counters(self, repo):
+        repo.save_many([make_mapping(key) for key in KEYS[:10]])
+
+        assert repo.increment_clicks({key: (2, 1000.0) for key in KEYS[:10]}) == 10
+        assert repo.get_click_stats("key00004") == (2, 1000.0)
+        assert repo.allocate_id_block("url_mappings", 100) == 0
+        assert repo.allocate_id_block("url_mappings", 100) == 100
+        assert all(not shard._counters for shard in repo.shards.values())
+
+    def test_url_hash_lookups_fan_out(self, repo):
+        repo.save_many([make_mapping(key, url_hash=bytes([i]) * 16) for i, key in enumerate(KEYS[:20])])
+
+        found = repo.find_by_url_hashes([bytes([i]) * 16 for i in range(0, 20, 5)])
+        assert sorted(short_key for _, short_key, _, _ in found) == ["key00000", "key00005", "key00010", "key00015"]
+
+
+class TestRebalance:
+
+    def test_moves_keys_to_new_shard(self):
+        shards = {name: MemoryRepository() for name in ("a", "b", "c")}
+        old = ShardedRepository(dict(shards), counters=MemoryRepository())
+        old.save_many([make_mapping(key, click_count=3) for key in KEYS])
+        shards["d"] = MemoryRepository()
+        ring = HashRing(shards)
+
+        assert sum(rebalance(shards, ring, dry_run=True).values()) == \
+            sum(1 for key in KEYS if ring.node_for(key) != old.ring.node_for(key))
+        assert not shards["d"]._records
+        moved = rebalance(shards, ring, batch_size=7)
+
+        new = ShardedRepository(shards, counters=MemoryRepository())
+        assert sum(moved.values()) == len(shards["d"]._records) > 0
+        assert {target for _, target in moved} == {"d"}
+        assert sorted(new.iter_short_keys()) == KEYS
+        for name, shard in shards.items():
+            assert all(ring.node_for(key) == name for key in shard.iter_short_keys())
+        assert new.get_click_stats(next(iter(shards["d"]._records))) == (3, None)
+        assert rebalance(shards, ring) == {}
+
+    def test_finishes_an_interrupted_move(self):
+        shards = {"a": MemoryRepository(), "b": MemoryRepository()}
+        ring = HashRing(shards)
+        key = next(key for key in KEYS if ring.node_for(key) == "b")
+        shards["a"].save_url_mapping(make_mapping(key))
+        shards["b"].save_url_mapping(make_mapping(key))
+
+        assert rebalance(shards, ring) == {("a", "b"): 1}
+        assert shards["a"].get_mapping_by_key(key) is None
+
+    def test_keeps_conflicting_keys(self):
+        shards = {"a": MemoryRepository(), "b": MemoryRepository()}
+        ring = HashRing(shards)
+        key = next(key for key in KEYS if ring.node_for(key) == "b")
+        shards["a"].save_url_mapping(make_mapping(key))
+        shards["b"].save_url_mapping(URLMapping(short_key=key, long_url="https://other.example.com"))
+
+        assert rebalance(shards, ring) == {("a", "b"): 0}
+        assert shards["a"].get_mapping_by_key(key) is not None
+
+
+    def test_empties_a_removed_shard(self):
+        shards = {name: MemoryRepository() for name in ("a", "b", "c")}
+        ShardedRepository(dict(shards), counters=MemoryRepository()).save_many([make_mapping(key) for key in KEYS])
+        ring = HashRing(["a", "b"])
+
+        moved = rebalance(shards, ring)
+        assert {source for source, _ in moved} == {"c"}
+        assert not shards["c"]._records
+        assert sorted(list(shards["a"].iter_short_keys()) + list(shards["b"].iter_short_keys())) == KEYS
+
+    def test_app_finds_every_mapping_while_it_runs(self):
+        shards = {name: MemoryRepository() for name in ("a", "b", "c", "d")}
+        ShardedRepository({name: shards[name] for name in "abc"}, counters=MemoryRepository()) \
+            .save_many([make_mapping(key) for key in KEYS])
+        # Deployed with the new list before the rebalance starts
+        app = ShardedRepository(shards, counters=MemoryRepository(), nodes="abcd", previous_nodes="abc")
+        assert len(app.get_redirect_targets(KEYS)) == len(KEYS)
+
+        # Interrupted between copying a batch and deleting it
+        original = shards["a"].delete_mapping
+        deletes = iter(range(3))
+
+        def delete_mapping(short_key):
+            if next(deletes, None) is None:
+                raise RuntimeError("interrupted")
+            return original(short_key)
+
+        shards["a"].delete_mapping = delete_mapping
+        with pytest.raises(RuntimeError):
+            rebalance(shards, app.ring, batch_size=2)
+        assert all(app.get_redirect_target(key) is not None for key in KEYS)
+        assert app.existing_keys(KEYS) == set(KEYS)
+
+        del shards["a"].delete_mapping
+        rebalance(shards, app.ring)
+        assert not any(app.ring.node_for(key) != name for name, shard in shards.items()
+                       for key in shard.iter_short_keys())
+        assert len(app.get_redirect_targets(KEYS)) == len(KEYS)
+        assert all(app.get_mapping_by_key(key) is not None for key in KEYS)
+
+
+class TestPreviousRing:
+
+    @pytest.fixture
+    def shards(self):
+        shards = {name: MemoryRepository() for name in ("a", "b", "c")}
+        ShardedRepository({"a": shards["a"], "b": shards["b"]}, counters=MemoryRepository()) \
+            .save_many([make_mapping(key) for key in KEYS])
+        return shards
+
+    @pytest.fixture
+    def repo(self, shards):
+        return ShardedRepository(shards, counters=MemoryRepository(), nodes=["a", "b", "c"],
+                                 previous_nodes=["a", "b"])
+
+    def test_reads_fall_back_to_previous_owner(self, repo):
+        moved = next(key for key in KEYS if repo.ring.node_for(key) == "c")
+
+        assert repo.get_mapping_by_key(moved).long_url == f"https://example.com/{moved}"
+        assert repo.get_redirect_target(moved)[0] == f"https://example.com/{moved}"
+        assert repo.get_click_stats(moved) == (0, None)
+        assert repo.existing_keys(KEYS + ["missing1"]) == set(KEYS)
+        assert set(repo.get_redirect_targets(KEYS + ["missing1"])) == set(KEYS)
+        assert repo.get_mapping_by_key("missing1") is None
+
+    def test_new_mappings_go_to_their_owner(self, repo, shards):
+        key = next(f"new{i:05d}" for i in range(1000) if repo.ring.node_for(f"new{i:05d}") == "c")
+        repo.save_url_mapping(make_mapping(key))
+
+        assert shards["c"].get_mapping_by_key(key) is not None
+
+    def test_deletes_and_clicks_reach_both_copies(self, repo, shards):
+        moved = [key for key in KEYS if repo.ring.node_for(key) == "c"][:2]
+        shards["c"].save_url_mapping(make_mapping(moved[0]))
+
+        repo.increment_clicks({key: (2, 100.0) for key in moved})
+        assert repo.get_click_stats(moved[0]) == (2, 100.0)
+        assert repo.get_click_stats(moved[1]) == (2, 100.0)
+        assert repo.delete_mapping(moved[0]) is True
+        assert repo.existing_keys(moved) == {moved[1]}
+
+    def test_unknown_shard_name(self, shards):
+        with pytest.raises(ValueError):
+            ShardedRepository(shards, counters=MemoryRepository(), previous_nodes=["a", "x"])
+
+
+class TestCreateShardedRepository:
+
+    def test_one_connection_per_shard(self):
+        settings = config.as_dict({'storage_backend': 'mongo',
+                                   'mongo_shards': {'a': 'mongodb://db-a:27017', 'b': 'db-b'}})
+        repo = create_repository(settings)
+
+        assert isinstance(repo, ShardedRepository)
+        assert {name: shard.alias for name, shard in repo.shards.items()} == {'a': 'shard-a', 'b': 'shard-b'}
+        assert repo.shards['b'].connection._settings['host'] == 'db-b'
+        assert repo.counters.alias == 'default'
+
+    def test_previous_shards_are_read_while_rebalancing(self):
+        settings = config.as_dict({'storage_backend': 'mongo', 'mongo_shards': {'a': 'db-a', 'b': 'db-b'},
+                                   'mongo_previous_shards': {'a': 'db-a', 'old': 'db-old'}})
+        repo = create_repository(settings)
+
+        assert set(repo.shards) == {'a', 'b', 'old'}
+        assert repo.ring.nodes == ['a', 'b']
+        assert repo.previous_ring.nodes == ['a', 'old']
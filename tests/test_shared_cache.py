@@ -0,0 +1,131 @@
+import os
+import time
+
+import pytest
+
+from model.url_mapping import URLMapping
+from repository.memory_repo import MemoryRepository
+from util.shared_cache import SharedCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "redirect_cache")
+
+
+class TestSharedCache:
+
+    def test_put_and_get(self, path):
+        cache = SharedCache(path, max_size=16, ttl=60)
+        cache.put("abc123", ("https://example.com", None, None))
+        cache.put("def456", ("https://example.com/other", 301, 3600), expires_at=time.time() + 60)
+
+        assert cache.get("abc123").value == ("https://example.com", None, None)
+        entry = cache.get("def456")
+        assert entry.value == ("https://example.com/other", 301, 3600)
+        assert entry.expires_at > time.time()
+        assert cache.get("missing") is None
+        assert (cache.hits, cache.misses, len(cache)) == (2, 1, 2)
+
+    def test_shared_between_processes(self, path):
+        cache = SharedCache(path, max_size=16, ttl=60)
+        cache.put("abc123", ("https://example.com", None, None))
+
+        pid = os.fork()
+        if pid == 0:
+            # A write in another worker invalidates the key for everyone
+            cache.invalidate("abc123")
+            cache.put("def456", ("https://example.com/other", None, None))
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert cache.get("abc123") is None
+        assert cache.get("def456").value[0] == "https://example.com/other"
+        assert SharedCache(path, max_size=16, ttl=60).get("def456") is not None
+
+    def test_clock_evicts_unreferenced_entries(self, path):
+        cache = SharedCache(path, max_size=2, ttl=60, ways=2)
+        cache.put("a", ("https://a.example.com", None, None))
+        cache.put("b", ("https://b.example.com", None, None))
+        cache.get("a")  # sets a's reference bit
+        cache.put("c", ("https://c.example.com", None, None))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats()['evictions'] == 1
+        assert len(cache) == 2
+
+    def test_entry_never_outlives_expires_at(self, path):
+        cache = SharedCache(path, max_size=8, ttl=60, max_stale=600)
+        cache.put("soon", ("https://example.com", None, None), expires_at=time.time() + 0.05)
+        cache.put("gone", ("https://example.com", None, None), expires_at=time.time() - 1)
+        assert cache.get("soon") is not None
+        assert cache.get("gone") is None
+
+        time.sleep(0.06)
+        assert cache.get("soon") is None
+        assert cache.get_stale("soon") is None
+
+    def test_stale_entries(self, path):
+        cache = SharedCache(path, max_size=8, ttl=0.05, max_stale=60)
+        cache.put("abc123", ("https://example.com", None, None))
+        time.sleep(0.06)
+
+        assert cache.get("abc123") is None
+        assert cache.get_stale("abc123").value[0] == "https://example.com"
+        assert cache.get_stale("abc123", max_age=0.01) is None
+
+    def test_overwritten_url_is_a_miss(self, path):
+        cache = SharedCache(path, max_size=8, ttl=60, url_bytes=32)
+        cache.put("first", ("https://example.com/" + "a" * 10, None, None))
+        for i in range(10):
+            cache.put("other", (f"https://example.com/{i}" + "b" * 10, None, None))
+
+        assert cache.get("first") is None
+        assert cache.get("other").value[0] == "https://example.com/9" + "b" * 10
+
+    def test_skips_what_does_not_fit(self, path):
+        cache = SharedCache(path, max_size=8, ttl=60, url_bytes=32)
+        cache.put("k" * 17, ("https://example.com", None, None))
+        cache.put("abc123", ("https://example.com/" + "x" * 40, None, None))
+        assert len(cache) == 0
+
+    def test_resized_cache_replaces_the_file(self, path):
+        SharedCache(path, max_size=8, ttl=60).put("abc123", ("https://example.com", None, None))
+        cache = SharedCache(path, max_size=64, ttl=60)
+
+        assert cache.get("abc123") is None
+        assert os.path.getsize(path) == cache.file_size
+
+    def test_invalidated_by_repository_writes(self, path):
+        cache = SharedCache(path, max_size=16, ttl=60)
+        repo = MemoryRepository(cache=cache)
+        cache.put("abc123", ("https://stale.example.com", None, None))
+        repo.save_url_mapping(URLMapping(short_key="abc123", long_url="https://example.com"))
+        assert cache.get("abc123") is None
+
+        cache.put("abc123", ("https://example.com", None, None))
+        repo.delete_mapping("abc123")
+        assert cache.get("abc123") is None
+
+    def test_put_after_invalidation_is_dropped(self, path):
+        cache = SharedCache(path, max_size=16, ttl=60)
+        generation = cache.generation("abc123")
+        # Another worker's write lands between the lookup and the store
+        SharedCache(path, max_size=16, ttl=60).invalidate("abc123")
+        cache.put("abc123", ("https://stale.example.com", None, None), generation=generation)
+        assert cache.get("abc123") is None
+
+        cache.put("abc123", ("https://example.com", None, None), generation=cache.generation("abc123"))
+        assert cache.get("abc123").value[0] == "https://example.com"
+
+    def test_clear(self, path):
+        cache = SharedCache(path, max_size=16, ttl=60)
+        for key in ("abcd1", "abcd2", "abcd3"):
+            cache.put(key, ("https://example.com", None, None))
+        cache.invalidate("abcd2")
+        cache.clear()
+
+        assert len(cache) == 0
+        assert cache.get("abcd1") is None
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from util.singleflight import AsyncSingleFlight, SingleFlight
+
+THREADS = 50
+
+
+def run_concurrently(flight, key, fn, release, threads=THREADS):
+    """
+    Start `threads` callers of flight.do(key, fn), release fn once all but the
+    leader are waiting on it, and return each caller's result or exception
+    """
+    outcomes = [None] * threads
+
+    def call(i):
+        try:
+            outcomes[i] = flight.do(key, fn)
+        except Exception as e:
+            outcomes[i] = e
+
+    workers = [threading.Thread(target=call, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    deadline = time.monotonic() + 5
+    while flight.waiting(key) < threads - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for worker in workers:
+        worker.join(5)
+    return outcomes
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_share_one_call(self):
+        flight = SingleFlight(timeout=5)
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return "https://example.com"
+
+        outcomes = run_concurrently(flight, "abc123", fetch, release)
+
+        assert len(calls) == 1
+        assert outcomes == ["https://example.com"] * THREADS
+        assert flight.waiting("abc123") == 0
+
+    def test_waiters_get_the_exception(self):
+        flight = SingleFlight(timeout=5)
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            raise ConnectionError("db down")
+
+        outcomes = run_concurrently(flight, "abc123", fetch, release)
+
+        assert len(calls) == 1
+        assert all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+        # Each waiter raises its own copy, chained from the leader's exception
+        leader = next(outcome for outcome in outcomes if outcome.__cause__ is None)
+        waiters = [outcome for outcome in outcomes if outcome is not leader]
+        assert len({id(outcome) for outcome in waiters}) == THREADS - 1
+        assert all(outcome.__cause__ is leader and outcome.args == ("db down",) for outcome in waiters)
+
+    def test_sequential_calls_are_not_cached(self):
+        flight = SingleFlight()
+        results = iter(["first", "second"])
+
+        assert flight.do("abc123", lambda: next(results)) == "first"
+        assert flight.do("abc123", lambda: next(results)) == "second"
+
+    def test_keys_are_independent(self):
+        flight = SingleFlight()
+
+        assert flight.do("abc123", lambda: flight.do("def456", lambda: "inner")) == "inner"
+
+    def test_waiter_timeout(self):
+        flight = SingleFlight(timeout=0.05)
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=("abc123", lambda: release.wait(5)))
+        leader.start()
+        while flight._calls.get("abc123") is None:
+            time.sleep(0.001)
+
+        with pytest.raises(TimeoutError):
+            flight.do("abc123", lambda: "not called")
+        release.set()
+        leader.join(5)
+        assert flight.do("abc123", lambda: "fresh") == "fresh"
+
+
+class TestAsyncSingleFlight:
+
+    def test_concurrent_calls_share_one_call(self):
+        flight = AsyncSingleFlight(timeout=5)
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "https://example.com"
+
+        async def run():
+            return await asyncio.gather(*(flight.do("abc123", fetch) for _ in range(THREADS)))
+
+        assert asyncio.run(run()) == ["https://example.com"] * THREADS
+        assert len(calls) == 1
+        assert flight.waiting("abc123") == 0
+
+    def test_waiters_get_the_exception(self):
+        flight = AsyncSingleFlight(timeout=5)
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ConnectionError("db down")
+
+        async def run():
+            return await asyncio.gather(*(flight.do("abc123", fetch) for _ in range(THREADS)),
+                                        return_exceptions=True)
+
+        outcomes = asyncio.run(run())
+        assert all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+        assert len({id(outcome) for outcome in outcomes}) == THREADS
+
+    def test_waiter_timeout_leaves_the_call_running(self):
+        flight = AsyncSingleFlight(timeout=0.01)
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "https://example.com"
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do("abc123", fetch))
+            await asyncio.sleep(0)
+            with pytest.raises(TimeoutError):
+                await flight.do("abc123", fetch)
+            return await leader
+
+        assert asyncio.run(run()) == "https://example.com"
@@ -0,0 +1,129 @@
+import os
+import time
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from model.url_mapping import URLMapping
+from repository.memory_repo import MemoryRepository
+from repository.snapshot import SnapshotSource, export_delta, export_snapshot
+from tools.snapshot import main
+from util.snapshot import Snapshot, write_snapshot
+
+ROWS = [
+    ("abc", "https://example.com/a", None, None, None),
+    ("abc1", "https://example.com/ünïcode", 2000000000.0, 301, 600),
+    ("zzzz9999", "https://example.com/z", None, 307, 0),
+]
+
+
+class TestSnapshotFile:
+
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / "mappings.snap")
+        assert write_snapshot(path, ROWS, generated_at=123.0) == 3
+
+        snapshot = Snapshot(path)
+        assert len(snapshot) == 3
+        assert snapshot.generated_at == 123.0
+        for short_key, *target in ROWS:
+            assert snapshot.get(short_key) == tuple(target)
+        for missing in ("ab", "abc0", "zzzz99999", "0", "~", "a" * 17):
+            assert snapshot.get(missing) is None
+        assert "abc1" in snapshot
+
+    def test_empty(self, tmp_path):
+        path = str(tmp_path / "mappings.snap")
+        write_snapshot(path, [])
+
+        assert Snapshot(path).get("abc") is None
+
+    def test_rejects_unsorted_and_long_keys(self, tmp_path):
+        path = str(tmp_path / "mappings.snap")
+        with pytest.raises(ValueError):
+            write_snapshot(path, [ROWS[1], ROWS[0]])
+        with pytest.raises(ValueError):
+            write_snapshot(path, [("a" * 17, "https://example.com", None, None, None)])
+        assert not os.path.exists(path)
+
+    def test_rejects_other_files(self, tmp_path):
+        path = tmp_path / "other.bin"
+        path.write_bytes(b"not a snapshot at all, just bytes")
+
+        with pytest.raises(ValueError):
+            Snapshot(str(path))
+
+
+class TestSnapshotSource:
+
+    @pytest.fixture
+    def repo(self):
+        repo = MemoryRepository()
+        repo.save_url_mapping(URLMapping(short_key="old12345", long_url="https://example.com/old"))
+        return repo
+
+    def test_export_and_delta(self, repo, tmp_path):
+        path = str(tmp_path / "mappings.snap")
+        source = SnapshotSource(path)
+        assert source.refresh() is False
+        assert source.get_redirect_target("old12345") is None
+
+        assert export_snapshot(repo, path) == 1
+        assert source.refresh() is True
+        assert source.get_redirect_target("old12345") == ("https://example.com/old", None, None, None)
+
+        repo.save_url_mapping(URLMapping(short_key="new12345", long_url="https://example.com/new"))
+        repo.save_url_mapping(URLMapping(short_key="old12345", long_url="https://example.com/moved"))
+        export_delta(repo, path)
+        assert source.refresh() is True
+        assert source.get_redirect_target("new12345")[0] == "https://example.com/new"
+        assert source.get_redirect_target("old12345")[0] == "https://example.com/moved"
+        assert source.refresh() is False
+
+    def test_delta_for_another_snapshot_is_ignored(self, repo, tmp_path):
+        path = str(tmp_path / "mappings.snap")
+        write_snapshot(path, [("old12345", "https://example.com/old", None, None, None)], generated_at=100.0)
+        write_snapshot(path + SnapshotSource.DELTA_SUFFIX,
+                       [("old12345", "https://example.com/stale", None, None, None)], base_generated_at=50.0)
+
+        source = SnapshotSource(path)
+        source.refresh()
+        assert source.get_redirect_target("old12345")[0] == "https://example.com/old"
+
+    def test_hot_swap_keeps_old_lookups_working(self, repo, tmp_path):
+        path = str(tmp_path / "mappings.snap")
+        export_snapshot(repo, path)
+        source = SnapshotSource(path)
+        source.refresh()
+        old_snapshot, _ = source._current
+
+        repo.delete_mapping("old12345")
+        repo.save_url_mapping(URLMapping(short_key="new12345", long_url="https://example.com/new"))
+        export_snapshot(repo, path)
+        source.refresh()
+
+        assert source.get_redirect_target("old12345") is None
+        assert source.get_redirect_target("new12345") is not None
+        assert old_snapshot.get("old12345") is not None
+
+    def test_expired_mappings_are_not_exported(self, repo, tmp_path, monkeypatch):
+        path = str(tmp_path / "mappings.snap")
+        now = datetime.now(timezone.utc)
+        repo.save_url_mapping(URLMapping(short_key="exp12345", long_url="https://example.com",
+                                         created_at=now, expires_at=now + timedelta(seconds=1)))
+        real_time = time.time
+        monkeypatch.setattr(time, 'time', lambda: real_time() + 2)
+
+        export_snapshot(repo, path)
+        assert "exp12345" not in Snapshot(path)
+
+    def test_main_once(self, repo, tmp_path, monkeypatch):
+        path = str(tmp_path / "mappings.snap")
+        monkeypatch.setattr('tools.snapshot.create_repository', lambda settings: repo)
+
+        main(['--path', path, '--once', '--delta'])  # no snapshot yet, so a full one is written
+        repo.save_url_mapping(URLMapping(short_key="new12345", long_url="https://example.com/new"))
+        main(['--path', path, '--once', '--delta'])
+
+        assert len(Snapshot(path)) == 1
+        assert len(Snapshot(path + SnapshotSource.DELTA_SUFFIX)) >= 1
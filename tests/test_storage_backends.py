@@ -0,0 +1,242 @@
+import time
+from datetime import datetime, timezone, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+
+from model.url_mapping import URLMapping
+from repository.base import DuplicateKeyError
+from repository.factory import create_repository
+from repository.memory_repo import MemoryRepository
+from repository.sqlite_repo import SQLiteRepository
+from util import config
+from util.cache import LRUCache
+from util.urls import hash_url
+
+
+def make_mapping(short_key, long_url="https://example.com", expires_in=None, **kwargs):
+    now = datetime.now(timezone.utc)
+    return URLMapping(short_key=short_key, long_url=long_url, created_at=now,
+                      expires_at=now + timedelta(seconds=expires_in) if expires_in is not None else None, **kwargs)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def repo(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryRepository(cache=LRUCache(100, 60))
+    return SQLiteRepository(str(tmp_path / 'test.db'), cache=LRUCache(100, 60))
+
+
+class TestStorageBackend:
+
+    def test_save_and_get(self, repo):
+        repo.save_url_mapping(make_mapping("abc12345", expires_in=3600))
+
+        mapping = repo.get_mapping_by_key("abc12345")
+        assert mapping.long_url == "https://example.com"
+        assert mapping.expires_at > datetime.now(timezone.utc)
+        assert repo.get_mapping_by_key("missing1") is None
+
+    def test_redirect_target(self, repo):
+        repo.save_url_mapping(make_mapping("abc12345", expires_in=3600))
+        repo.save_url_mapping(make_mapping("policy12", redirect_code=301, cache_max_age=600))
+
+        long_url, expires_at, redirect_code, cache_max_age = repo.get_redirect_target("abc12345")
+        assert long_url == "https://example.com"
+        assert expires_at == pytest.approx(time.time() + 3600, abs=5)
+        assert (redirect_code, cache_max_age) == (None, None)
+        assert repo.get_redirect_target("policy12")[2:] == (301, 600)
+        assert repo.get_mapping_by_key("policy12").redirect_code == 301
+        assert repo.get_redirect_target("missing1") is None
+
+    def test_redirect_targets(self, repo):
+        repo.save_url_mapping(make_mapping("abc12345", expires_in=3600))
+        repo.save_url_mapping(make_mapping("policy12", redirect_code=301, cache_max_age=600))
+
+        targets = repo.get_redirect_targets(["abc12345", "policy12", "missing1"])
+        assert targets == {"abc12345": repo.get_redirect_target("abc12345"),
+                           "policy12": repo.get_redirect_target("policy12")}
+        assert repo.get_redirect_targets([]) == {}
+
+    def test_force_insert_rejects_duplicates(self, repo):
+        repo.save_url_mapping(make_mapping("abc12345"))
+
+        with pytest.raises(DuplicateKeyError):
+            repo.save_url_mapping(make_mapping("abc12345"), force_insert=True)
+        repo.save_url_mapping(make_mapping("abc12345", long_url="https://example.org"))
+        assert repo.get_redirect_target("abc12345")[0] == "https://example.org"
+
+    def test_save_many_reports_errors_by_index(self, repo):
+        repo.save_url_mapping(make_mapping("taken123"))
+
+        errors = repo.save_many([make_mapping("new12345"), make_mapping("taken123"), make_mapping("new67890")])
+
+        assert list(errors) == [1]
+        assert isinstance(errors[1], DuplicateKeyError)
+        assert repo.existing_keys(["new12345", "new67890", "nothere1"]) == {"new12345", "new67890"}
+
+    def test_save_invalidates_cache(self, repo):
+        repo.cache.put("abc12345", "https://stale.example.com")
+
+        repo.save_url_mapping(make_mapping("abc12345"))
+        assert repo.cache.get("abc12345") is None
+
+    def test_delete(self, repo):
+        repo.dedup_cache = LRUCache(100, 60)
+        url_hash = hash_url("https://example.com")
+        repo.save_url_mapping(make_mapping("abc12345", url_hash=url_hash))
+        repo.dedup_cache.put(url_hash.hex(), ("abc12345", None))
+
+        assert repo.delete_mapping("abc12345") is True
+        assert repo.delete_mapping("abc12345") is False
+        assert repo.get_redirect_target("abc12345") is None
+        assert repo.dedup_cache.get(url_hash.hex()) is None
+
+    def test_find_by_url_hashes(self, repo):
+        url_hash = hash_url("https://example.com")
+        repo.save_url_mapping(make_mapping("abc12345", url_hash=url_hash))
+        repo.save_url_mapping(make_mapping("nohash12"))
+
+        assert repo.find_by_url_hashes([url_hash]) == [(url_hash, "abc12345", "https://example.com", None)]
+
+    def test_list_and_purge_expired(self, repo, monkeypatch):
+        repo.save_url_mapping(make_mapping("old12345", expires_in=3600))
+        repo.save_many([make_mapping(f"old{i:05d}", expires_in=3600) for i in range(5)])
+        repo.save_url_mapping(make_mapping("forever1"))
+        # Re-saved with a later expiry, so its first expiry no longer applies
+        repo.save_url_mapping(make_mapping("live1234", expires_in=3600))
+        repo.save_url_mapping(make_mapping("live1234", expires_in=7200))
+
+        # Move the clock past the first expiry
+        real_time = time.time
+        monkeypatch.setattr(time, 'time', lambda: real_time() + 3601)
+        listed = {mapping.short_key for mapping in repo.list_expired_mappings()}
+        deleted = repo.purge_expired(batch_size=2)
+
+        assert listed == {"old12345"} | {f"old{i:05d}" for i in range(5)}
+        assert deleted == 6
+        assert repo.existing_keys(["old12345", "live1234", "forever1"]) == {"live1234", "forever1"}
+
+    def test_allocate_id_block(self, repo):
+        assert repo.allocate_id_block("url_mappings", 100) == 0
+        assert repo.allocate_id_block("url_mappings", 100) == 100
+        assert repo.allocate_id_block("other", 10) == 0
+        assert repo.read_counter("url_mappings") == 200
+        assert repo.read_counter("missing") == 0
+
+    def test_iter_short_keys(self, repo):
+        repo.save_many([make_mapping(f"key{i:05d}") for i in range(3)])
+
+        assert sorted(repo.iter_short_keys()) == ["key00000", "key00001", "key00002"]
+        assert list(repo.iter_short_keys(created_since=time.time() + 60)) == []
+
+    def test_iter_redirect_rows(self, repo, monkeypatch):
+        repo.save_many([make_mapping("key00002", redirect_code=301, cache_max_age=60),
+                        make_mapping("key00001", expires_in=3600), make_mapping("expired1", expires_in=10)])
+
+        real_time = time.time
+        monkeypatch.setattr(time, 'time', lambda: real_time() + 60)
+        rows = list(repo.iter_redirect_rows(batch_size=1))
+        assert [row[0] for row in rows] == ["key00001", "key00002"]
+        assert rows[1][1:] == ("https://example.com", None, 301, 60)
+        assert list(repo.iter_redirect_rows(created_since=real_time() + 60)) == []
+
+    def test_iter_mappings_keyset_order(self, repo):
+        created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        repo.save_many([URLMapping(short_key=short_key, long_url="https://example.com", created_at=created + offset)
+                        for short_key, offset in (("key00002", timedelta(0)), ("key00001", timedelta(0)),
+                                                  ("key00000", timedelta(seconds=1)))])
+
+        rows = list(repo.iter_mappings(batch_size=1))
+        assert [row['short_key'] for row in rows] == ["key00001", "key00002", "key00000"]
+        assert rows[0]['created_at'] == created.timestamp()
+        assert rows[0]['click_count'] == 0
+        after = (rows[0]['created_at'], rows[0]['short_key'])
+        assert [row['short_key'] for row in repo.iter_mappings(after=after)] == ["key00002", "key00000"]
+
+    def test_iter_mappings_after_delete(self, repo):
+        created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        repo.save_many([URLMapping(short_key=f"key{i:05d}", long_url="https://example.com",
+                                   created_at=created + timedelta(seconds=i)) for i in range(5)])
+        repo.delete_mapping("key00002")
+
+        rows = list(repo.iter_mappings(after=(created.timestamp() + 1, "key00001"), batch_size=1))
+        assert [row['short_key'] for row in rows] == ["key00003", "key00004"]
+        assert sorted(repo.iter_short_keys(created_since=created + timedelta(seconds=2))) == \
+            ["key00003", "key00004"]
+
+    def test_iter_mappings_filters_and_fields(self, repo):
+        now = time.time()
+        repo.save_many([make_mapping("soon0001", "https://example.com/a", expires_in=60),
+                        make_mapping("late0001", "http://example.com/b", expires_in=3600),
+                        make_mapping("other001", "https://other.com/example.com"),
+                        make_mapping("sub00001", "https://docs.example.com")])
+
+        assert [row['short_key'] for row in repo.iter_mappings(expires_before=now + 600)] == ["soon0001"]
+        assert [row['short_key'] for row in repo.iter_mappings(expires_after=now + 600)] == ["late0001"]
+        assert sorted(row['short_key'] for row in repo.iter_mappings(domain_prefix="example.com")) == \
+            ["late0001", "soon0001"]
+        row = next(repo.iter_mappings(domain_prefix="docs.", fields=('long_url',)))
+        assert row == {'short_key': "sub00001", 'created_at': row['created_at'], 'long_url': "https://docs.example.com"}
+
+    def test_iter_mappings_domain_prefix_rule(self, repo):
+        # Every backend: http(s) in any case, '://', then the prefix as given
+        repo.save_many([make_mapping("upper001", "HTTPS://example.com/a"),
+                        make_mapping("mixed001", "Http://example.com/b"),
+                        make_mapping("noschem1", "xxexample.com/c"),
+                        make_mapping("ftp00001", "ftp://example.com/d"),
+                        make_mapping("case0001", "https://Example.com/e")])
+
+        assert sorted(row['short_key'] for row in repo.iter_mappings(domain_prefix="example.com")) == \
+            ["mixed001", "upper001"]
+        assert list(repo.iter_mappings(domain_prefix="ample.com/c")) == []
+
+    def test_clicks(self, repo):
+        repo.save_url_mapping(make_mapping("abc12345"))
+
+        assert repo.get_click_stats("abc12345") == (0, None)
+        assert repo.increment_clicks({"abc12345": (3, 1000.0), "missing1": (1, 1000.0)}) == 1
+        repo.increment_clicks({"abc12345": (2, 900.0)})
+        assert repo.get_click_stats("abc12345") == (5, 1000.0)
+        assert repo.get_click_stats("missing1") is None
+
+    def test_resave_keeps_clicks(self, repo):
+        repo.save_url_mapping(make_mapping("abc12345"))
+        repo.increment_clicks({"abc12345": (3, 1000.0)})
+        repo.save_url_mapping(make_mapping("abc12345", "https://example.com/new"))
+
+        assert repo.get_mapping_by_key("abc12345").long_url == "https://example.com/new"
+        assert repo.get_click_stats("abc12345") == (3, 1000.0)
+
+
+class TestMemoryRepository:
+
+    def test_created_order_follows_resaves(self):
+        repo = MemoryRepository()
+        created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        for i in range(3):
+            repo.save_url_mapping(URLMapping(short_key=f"key{i:05d}", long_url="https://example.com",
+                                             created_at=created + timedelta(seconds=i)))
+        repo.save_url_mapping(URLMapping(short_key="key00000", long_url="https://example.com/new",
+                                         created_at=created + timedelta(seconds=10)))
+
+        assert [row['short_key'] for row in repo.iter_mappings()] == ["key00001", "key00002", "key00000"]
+        assert repo._by_created == sorted((record.created_at, short_key)
+                                          for short_key, record in repo._records.items())
+
+
+class TestCreateRepository:
+
+    def test_backends(self, tmp_path):
+        settings = config.as_dict({'sqlite_path': str(tmp_path / 'test.db')})
+        key_filter = MagicMock()
+
+        for backend, cls in (('memory', MemoryRepository), ('sqlite', SQLiteRepository)):
+            settings['storage_backend'] = backend
+            repo = create_repository(settings, key_filter=key_filter)
+            assert isinstance(repo, cls)
+            assert repo.key_filter is key_filter
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            create_repository(config.as_dict({'storage_backend': 'redis'}))
@@ -0,0 +1,20 @@
+from unittest.mock import MagicMock, patch
+
+from tools.sweep import sweep, main
+
+
+class TestSweep:
+
+    def test_sweep_purges_in_batches(self):
+        repo = MagicMock()
+        repo.purge_expired.return_value = 42
+
+        assert sweep(repo, batch_size=500, max_runtime=10) == 42
+        repo.purge_expired.assert_called_once_with(batch_size=500, max_runtime=10)
+
+    def test_main_once(self):
+        with patch('tools.sweep.create_repository') as mock_create_repository:
+            mock_create_repository.return_value.purge_expired.return_value = 0
+            main(['--once', '--batch-size', '10'])
+
+            mock_create_repository.return_value.purge_expired.assert_called_once_with(batch_size=10, max_runtime=None)
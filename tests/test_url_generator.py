@@ -1,10 +1,16 @@
+import threading
+
 import pytest
 from datetime import datetime, timezone, timedelta
 from unittest.mock import patch, MagicMock
 
-from service.url_generator import URLGeneratorService, InvalidURLError, AliasConflictError
+from service.url_generator import URLGeneratorService, InvalidURLError, AliasConflictError, BatchTooLargeError
 from model.url_mapping import URLMapping
-from repository.db_repo import DBRepository
+from repository.db_repo import DBRepository, DuplicateKeyError
+from repository.memory_repo import MemoryRepository
+from util.cache import LRUCache
+from util.metrics import Metrics
+from util.urls import hash_url
 
 @pytest.fixture
 def url_generator():
@@ -58,6 +64,48 @@ class TestURLGeneratorService:
             with pytest.raises(AliasConflictError):
                 url_generator.generate("https://example.com", custom_alias="test123")
     
+    def test_concurrent_requests_for_one_alias(self):
+        repo = MemoryRepository()
+        generator = URLGeneratorService(repo=repo)
+        # Both requests pass the existence check before either saves
+        barrier = threading.Barrier(2, timeout=5)
+        check = repo.get_mapping_by_key
+
+        def checked(short_key):
+            found = check(short_key)
+            barrier.wait()
+            return found
+
+        results = {}
+
+        def shorten(long_url):
+            try:
+                results[long_url] = generator.generate(long_url, custom_alias="race1234")
+            except AliasConflictError as e:
+                results[long_url] = e
+
+        with patch.object(repo, 'get_mapping_by_key', side_effect=checked):
+            threads = [threading.Thread(target=shorten, args=(f"https://example.com/{i}",)) for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        winners = [long_url for long_url, result in results.items() if result == "race1234"]
+        assert len(winners) == 1
+        assert sum(isinstance(result, AliasConflictError) for result in results.values()) == 1
+        assert repo.get_redirect_target("race1234")[0] == winners[0]
+
+    def test_random_key_taken_since_the_check_is_retried(self):
+        repo = MemoryRepository()
+        repo.save_url_mapping(URLMapping(short_key="raced111", long_url="https://example.com/first"))
+        generator = URLGeneratorService(repo=repo)
+        generator._make_random_key = MagicMock(side_effect=["raced111", "free2222"])
+
+        with patch.object(repo, 'get_mapping_by_key', return_value=None):
+            assert generator.generate("https://example.com/second") == "free2222"
+        assert repo.get_redirect_target("raced111")[0] == "https://example.com/first"
+
     def test_generate_with_random_key(self, url_generator):
         with patch.object(url_generator.repo, 'get_mapping_by_key', return_value=None), \
              patch.object(url_generator.repo, 'save_url_mapping'):
@@ -106,4 +154,206 @@ class TestURLGeneratorService:
         naive_datetime = datetime.now()  # No timezone
         
         with pytest.raises(ValueError):
-            url_generator.generate("https://example.com", expires_at=naive_datetime)
\ No newline at end of file
+            url_generator.generate("https://example.com", expires_at=naive_datetime)
+
+class TestURLGeneratorRedirectPolicy:
+
+    def test_policy_is_stored(self):
+        service = URLGeneratorService(repo=MagicMock())
+        service.repo.get_mapping_by_key.return_value = None
+
+        service.generate("https://example.com", redirect_code=301, cache_max_age=600)
+
+        mapping = service.repo.save_url_mapping.call_args[0][0]
+        assert (mapping.redirect_code, mapping.cache_max_age) == (301, 600)
+
+    def test_invalid_policy(self):
+        service = URLGeneratorService(repo=MagicMock())
+
+        with pytest.raises(ValueError):
+            service.generate("https://example.com", redirect_code=200)
+        with pytest.raises(ValueError):
+            service.generate("https://example.com", cache_max_age=-1)
+        service.repo.save_url_mapping.assert_not_called()
+
+
+class TestURLGeneratorKeyAllocation:
+
+    @pytest.fixture
+    def counter_generator(self):
+        allocator = MagicMock()
+        allocator.next_key.side_effect = ["aaaa0001", "aaaa0002"]
+        return URLGeneratorService(repo=MagicMock(), key_allocator=allocator)
+
+    def test_allocated_key_skips_existence_check(self, counter_generator):
+        short_key = counter_generator.generate("https://example.com")
+
+        assert short_key == "aaaa0001"
+        counter_generator.repo.get_mapping_by_key.assert_not_called()
+        _, kwargs = counter_generator.repo.save_url_mapping.call_args
+        assert kwargs == {'force_insert': True}
+
+    def test_allocated_key_clashing_with_alias_is_skipped(self, counter_generator):
+        counter_generator.repo.save_url_mapping.side_effect = [DuplicateKeyError("taken"), None]
+
+        short_key = counter_generator.generate("https://example.com")
+        assert short_key == "aaaa0002"
+
+    def test_custom_alias_still_checked(self, counter_generator):
+        counter_generator.repo.get_mapping_by_key.return_value = URLMapping()
+
+        with pytest.raises(AliasConflictError):
+            counter_generator.generate("https://example.com", custom_alias="test123")
+        counter_generator.key_allocator.next_key.assert_not_called()
+
+
+class TestURLGeneratorBatch:
+
+    @pytest.fixture
+    def batch_generator(self):
+        service = URLGeneratorService(repo=MagicMock())
+        service.repo.existing_keys.return_value = set()
+        service.repo.save_many.return_value = {}
+        return service
+
+    def test_generate_many_results_in_order(self, batch_generator):
+        results = batch_generator.generate_many([
+            ("https://example.com/1", None, None),
+            ("not-a-url", None, None),
+            ("https://example.com/2", "alias1", None),
+        ])
+
+        assert len(results[0]) == batch_generator._key_length
+        assert isinstance(results[1], InvalidURLError)
+        assert results[2] == "alias1"
+        batch_generator.repo.save_many.assert_called_once()
+        batch_generator.repo.existing_keys.assert_called_once()
+
+    def test_generate_many_alias_conflicts(self, batch_generator):
+        batch_generator.repo.existing_keys.return_value = {"taken1"}
+
+        results = batch_generator.generate_many([
+            ("https://example.com/1", "taken1", None),
+            ("https://example.com/2", "free1", None),
+            ("https://example.com/3", "free1", None),
+        ])
+
+        assert isinstance(results[0], AliasConflictError)
+        assert results[1] == "free1"
+        assert isinstance(results[2], AliasConflictError)
+
+    def test_generate_many_retries_duplicate_generated_keys(self, batch_generator):
+        batch_generator.repo.save_many.side_effect = [{0: DuplicateKeyError("taken")}, {}]
+
+        with patch.object(batch_generator, '_make_random_key', side_effect=["clash001", "fresh001"]):
+            results = batch_generator.generate_many([("https://example.com", None, None)])
+
+        assert results == ["fresh001"]
+        assert batch_generator.repo.save_many.call_count == 2
+
+    def test_generate_many_storage_failure(self, batch_generator):
+        batch_generator.repo.save_many.side_effect = Exception("db down")
+
+        results = batch_generator.generate_many([("https://example.com", None, None)])
+        assert str(results[0]) == "db down"
+
+    def test_generate_many_too_large(self, batch_generator):
+        batch_generator.batch_max_size = 2
+        with pytest.raises(BatchTooLargeError):
+            batch_generator.generate_many([("https://example.com", None, None)] * 3)
+
+
+class TestURLGeneratorDedup:
+
+    @pytest.fixture
+    def dedup_generator(self):
+        service = URLGeneratorService(repo=MagicMock(), dedup=True, dedup_cache=LRUCache(100, 60))
+        service.repo.get_mapping_by_key.return_value = None
+        service.repo.find_by_url_hashes.return_value = []
+        service.repo.existing_keys.return_value = set()
+        service.repo.save_many.return_value = {}
+        return service
+
+    def test_existing_mapping_is_reused(self, dedup_generator):
+        url_hash = hash_url("https://example.com/")
+        dedup_generator.repo.find_by_url_hashes.return_value = [
+            (url_hash, "abc12345", "https://EXAMPLE.com:443/", None)]
+
+        assert dedup_generator.generate("https://example.com") == "abc12345"
+        dedup_generator.repo.save_url_mapping.assert_not_called()
+
+    def test_cache_hit_skips_repository(self, dedup_generator):
+        first = dedup_generator.generate("https://example.com/page")
+        second = dedup_generator.generate("https://example.com/page")
+
+        assert first == second
+        dedup_generator.repo.save_url_mapping.assert_called_once()
+        dedup_generator.repo.find_by_url_hashes.assert_called_once()
+
+    def test_new_mapping_stores_hash(self, dedup_generator):
+        dedup_generator.generate("https://example.com/page")
+
+        mapping = dedup_generator.repo.save_url_mapping.call_args[0][0]
+        assert mapping.url_hash == hash_url("https://example.com/page")
+
+    def test_different_expiry_creates_new_mapping(self, dedup_generator):
+        expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+        url_hash = hash_url("https://example.com/")
+        dedup_generator.repo.find_by_url_hashes.return_value = [
+            (url_hash, "abc12345", "https://example.com/", None)]
+
+        short_key = dedup_generator.generate("https://example.com", expires_at=expires_at)
+
+        assert short_key != "abc12345"
+        dedup_generator.repo.save_url_mapping.assert_called_once()
+
+    def test_urls_differing_only_in_fragment_get_their_own_keys(self, dedup_generator):
+        first = dedup_generator.generate("https://app.example/#/a")
+        second = dedup_generator.generate("https://app.example/#/b")
+
+        assert first != second
+        assert dedup_generator.repo.save_url_mapping.call_count == 2
+
+    def test_alias_is_never_deduplicated(self, dedup_generator):
+        assert dedup_generator.generate("https://example.com", custom_alias="mine1234") == "mine1234"
+        dedup_generator.repo.find_by_url_hashes.assert_not_called()
+
+    def test_generate_many_reuses_and_shares_keys(self, dedup_generator):
+        url_hash = hash_url("https://example.com/old")
+        dedup_generator.repo.find_by_url_hashes.return_value = [
+            (url_hash, "old12345", "https://example.com/old", None)]
+
+        results = dedup_generator.generate_many([
+            ("https://example.com/old", None, None),
+            ("https://example.com/new", None, None),
+            ("https://EXAMPLE.com:443/new", None, None),
+        ])
+
+        assert results[0] == "old12345"
+        assert results[1] == results[2]
+        dedup_generator.repo.find_by_url_hashes.assert_called_once()
+        mappings = dedup_generator.repo.save_many.call_args[0][0]
+        assert len(mappings) == 1
+
+
+class TestURLGeneratorMetrics:
+
+    def test_collisions_and_fallback_are_counted(self):
+        service = URLGeneratorService(repo=MagicMock(), metrics=Metrics())
+        service.repo.get_mapping_by_key.return_value = URLMapping()
+
+        short_key = service.generate("https://example.com")
+
+        assert len(short_key) == 16
+        assert service.metrics.collision_retries.value() == 5
+        assert service.metrics.long_key_fallbacks.value() == 1
+
+    def test_alias_conflicts_are_counted(self):
+        service = URLGeneratorService(repo=MagicMock(), metrics=Metrics())
+        service.repo.existing_keys.return_value = {"taken1"}
+        service.repo.save_many.return_value = {}
+
+        service.generate_many([("https://example.com/1", "taken1", None),
+                               ("https://example.com/2", "free1", None)])
+
+        assert service.metrics.alias_conflicts.value() == 1
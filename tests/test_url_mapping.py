@@ -40,4 +40,11 @@ def test_is_expired_true_false():
     assert m2.is_expired() is False
 
     m3 = URLMapping(short_key="none", long_url="x", created_at=now, expires_at=None)
-    assert m3.is_expired() is False
\ No newline at end of file
+    assert m3.is_expired() is False
+
+def test_expiry_index_follows_settings():
+    from model.url_mapping import expiry_index
+
+    assert expiry_index(True, None) == {'fields': [('expires_at', 1)]}
+    assert expiry_index(False, 3600) == {'fields': [('expires_at', 1)], 'expireAfterSeconds': 3600}
+    assert expiry_index(False, None) is None
@@ -0,0 +1,47 @@
+from util.urls import has_domain_prefix, normalize_url, hash_url
+
+
+class TestNormalizeURL:
+
+    def test_scheme_and_host_lower_cased(self):
+        assert normalize_url("HTTPS://Example.COM/Path") == "https://example.com/Path"
+
+    def test_default_port_dropped(self):
+        assert normalize_url("https://example.com:443/a") == "https://example.com/a"
+        assert normalize_url("http://example.com:8080/a") == "http://example.com:8080/a"
+
+    def test_fragment_kept(self):
+        assert normalize_url("https://App.example#/a") == "https://app.example/#/a"
+
+    def test_empty_path(self):
+        assert normalize_url("https://example.com") == "https://example.com/"
+
+    def test_query_kept(self):
+        assert normalize_url("https://example.com/?b=2&a=1") == "https://example.com/?b=2&a=1"
+
+
+class TestHashURL:
+
+    def test_equivalent_urls_share_a_hash(self):
+        assert hash_url("https://EXAMPLE.com") == hash_url("https://example.com/")
+        assert len(hash_url("https://example.com")) == 16
+
+    def test_different_urls_differ(self):
+        assert hash_url("https://example.com/a") != hash_url("https://example.com/b")
+
+    def test_urls_differing_only_in_fragment_differ(self):
+        assert hash_url("https://app.example/#/a") != hash_url("https://app.example/#/b")
+
+
+class TestHasDomainPrefix:
+
+    def test_matches_after_either_scheme_in_any_case(self):
+        assert has_domain_prefix("https://example.com/a", "example.com")
+        assert has_domain_prefix("HTTP://example.com", "example.com")
+
+    def test_prefix_is_case_sensitive(self):
+        assert not has_domain_prefix("https://Example.com", "example.com")
+
+    def test_needs_an_http_scheme(self):
+        assert not has_domain_prefix("ftp://example.com", "example.com")
+        assert not has_domain_prefix("example.com/x", "ample.com")
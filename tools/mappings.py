@@ -0,0 +1,358 @@
+"""
+Streams URL mappings between the configured storage backend and JSONL or
+CSV files, for migrations and backups. Memory use stays constant however
+many mappings there are.
+
+    python -m tools.mappings export backup.jsonl
+    python -m tools.mappings export backup.csv.gz --batch-size 5000
+    python -m tools.mappings import backup.jsonl --chunk-size 1000
+    python -m tools.mappings import backup.jsonl --resume
+
+Each record has the fields in MAPPING_FIELDS; only short_key and long_url
+are required on import. Times are ISO-8601 with an offset and url_hash is
+hex. Invalid rows and keys that already exist are written, with the reason,
+to a reject file (<input>.rejects.jsonl by default) and the import goes on.
+
+An import records its progress in <input>.checkpoint after every chunk;
+--resume skips the records already handled.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from model.url_mapping import URLMapping
+from repository.base import MAPPING_FIELDS, BaseRepository, DuplicateKeyError
+from repository.factory import create_repository
+from repository.key_filter import KeyFilter
+from service.url_generator import URLGeneratorService
+from util import config
+
+logger = logging.getLogger('tools.mappings')
+
+FORMATS = ('jsonl', 'csv')
+
+# Short keys are aliases or generated keys (both match the alias rules), or
+# the 16-character keys generated after running out of collision retries
+_FALLBACK_KEY_REGEX = re.compile(r'^[A-Za-z0-9]{16}$')
+_TIME_FIELDS = ('created_at', 'expires_at', 'last_accessed_at')
+
+
+class Progress:
+    """
+    Counts records and logs throughput at most every `interval` seconds
+    """
+
+    def __init__(self, action: str, interval: float = 5.0):
+        self.action = action
+        self.interval = interval
+        self.count = 0
+        self.started = time.monotonic()
+        self._logged = self.started
+
+    def add(self, count: int) -> None:
+        self.count += count
+        now = time.monotonic()
+        if now - self._logged >= self.interval:
+            self._logged = now
+            logger.info("%s %d mappings (%.0f/s)", self.action, self.count, self.rate)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def _open(path: str, mode: str):
+    # '-' is stdin/stdout (left open on close); .gz files are compressed transparently
+    if path == '-':
+        stream = sys.stdout if 'w' in mode else sys.stdin
+        return io.TextIOWrapper(stream.buffer, encoding='utf-8', newline='', closefd=False)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def detect_format(path: str) -> str:
+    return 'csv' if path.removesuffix('.gz').endswith('.csv') else 'jsonl'
+
+
+def _format_time(value: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(value, tz=timezone.utc).isoformat() if value is not None else None
+
+
+def to_record(row: tuple) -> dict:
+    """
+    Convert a repository row to a JSON-ready record
+    :param row: tuple with the fields in MAPPING_FIELDS order
+    :return: dict
+    """
+    record = dict(zip(MAPPING_FIELDS, row))
+    for field in _TIME_FIELDS:
+        record[field] = _format_time(record[field])
+    if record['url_hash'] is not None:
+        record['url_hash'] = bytes(record['url_hash']).hex()
+    return record
+
+
+def write_records(out, records: Iterable[dict], fmt: str) -> Iterator[int]:
+    """
+    Write records to out, yielding after each one so the caller can count them
+    """
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=MAPPING_FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow({field: '' if value is None else value for field, value in record.items()})
+            yield 1
+    else:
+        for record in records:
+            out.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False))
+            out.write('\n')
+            yield 1
+
+
+def export_mappings(repo: BaseRepository, out, fmt: str = 'jsonl', batch_size: int = 10000) -> int:
+    """
+    Stream every mapping to out
+    :param repo:
+    :param out: text file object
+    :param fmt: 'jsonl' or 'csv'
+    :param batch_size: mappings per cursor round trip
+    :return: number of mappings written
+    """
+    progress = Progress('Exported')
+    for _ in write_records(out, map(to_record, repo.iter_mapping_rows(batch_size=batch_size)), fmt):
+        progress.add(1)
+    logger.info("Exported %d mappings in %.1fs (%.0f/s)", progress.count, progress.elapsed, progress.rate)
+    return progress.count
+
+
+def read_records(f, fmt: str) -> Iterator[dict]:
+    """
+    Stream records from f; a JSONL line that does not parse yields {'_error': reason}
+    so it can be rejected with its record number
+    """
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            yield {field: value for field, value in row.items() if value not in ('', None)}
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield {'_error': f'Invalid JSON: {e}', '_line': line.rstrip('\n')}
+            continue
+        yield record if isinstance(record, dict) else {'_error': 'Not a JSON object', '_line': line.rstrip('\n')}
+
+
+def _parse_time(record: dict, field: str) -> Optional[datetime]:
+    value = record.get(field)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid {field}; use ISO-8601 with offset') from None
+    if parsed.tzinfo is None:
+        raise ValueError(f'{field} must include a timezone offset')
+    return parsed
+
+
+def _parse_int(record: dict, field: str) -> Optional[int]:
+    value = record.get(field)
+    if value is None:
+        return None
+    # bool is a subclass of int, so rule it out explicitly
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{field} must be an integer')
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{field} must be an integer') from None
+
+
+def to_mapping(record: dict) -> URLMapping:
+    """
+    Validate a record with the same rules as POST /shorten and build its mapping
+    :param record:
+    :return: URLMapping
+    :raises ValueError: (or InvalidURLError) with the reason the record is rejected
+    """
+    if '_error' in record:
+        raise ValueError(record['_error'])
+    short_key, long_url = record.get('short_key'), record.get('long_url')
+    if not isinstance(short_key, str) or not (URLGeneratorService._ALIAS_REGEX.fullmatch(short_key)
+                                              or _FALLBACK_KEY_REGEX.fullmatch(short_key)):
+        raise ValueError('short_key must be 4-8 (or 16) alphanumeric characters')
+    if not isinstance(long_url, str):
+        raise ValueError('Missing required field: long_url')
+    URLGeneratorService._validate_url(long_url)
+    redirect_code, cache_max_age = _parse_int(record, 'redirect_code'), _parse_int(record, 'cache_max_age')
+    URLGeneratorService._validate_policy(redirect_code, cache_max_age)
+    url_hash = record.get('url_hash')
+    try:
+        url_hash = bytes.fromhex(url_hash) if url_hash is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('url_hash must be hex') from None
+    return URLMapping(short_key=short_key, long_url=long_url,
+                      created_at=_parse_time(record, 'created_at') or datetime.now(timezone.utc),
+                      expires_at=_parse_time(record, 'expires_at'), url_hash=url_hash,
+                      redirect_code=redirect_code, cache_max_age=cache_max_age,
+                      click_count=_parse_int(record, 'click_count') or 0,
+                      last_accessed_at=_parse_time(record, 'last_accessed_at'))
+
+
+class Checkpoint:
+    """
+    Progress of an import, rewritten atomically after every chunk
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.position = 0  # records read and handled (imported or rejected)
+        self.imported = 0
+        self.rejected = 0
+
+    def load(self) -> 'Checkpoint':
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self.position, self.imported, self.rejected = state['position'], state['imported'], state['rejected']
+        return self
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'position': self.position, 'imported': self.imported, 'rejected': self.rejected}, f)
+        os.replace(tmp_path, self.path)
+
+
+def import_mappings(repo: BaseRepository, records: Iterable[dict], rejects, chunk_size: int = 1000,
+                    checkpoint: Optional[Checkpoint] = None) -> Checkpoint:
+    """
+    Validate records and insert them in chunks with save_many (one unordered
+    bulk insert each). Rejected records go to rejects as JSON lines with the
+    record number, the reason and the record. Imported mappings keep their
+    created_at, so once done the import has every key filter rebuilt (until
+    then, the app's key filters may answer 404 for the imported keys).
+    :param repo:
+    :param records: dicts, e.g. from read_records()
+    :param rejects: text file object for rejected records
+    :param chunk_size: mappings per bulk insert
+    :param checkpoint: resume after checkpoint.position records and keep it up to date
+    :return: the final checkpoint
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    # A chunk may have been inserted before the last run stopped without
+    # its checkpoint, so its keys can already exist with the same data
+    resumed = checkpoint.position > 0
+    progress = Progress('Imported')
+    records = iter(records)
+    for _ in range(checkpoint.position):
+        if next(records, None) is None:
+            break
+
+    def reject(number: int, reason: str, record: dict):
+        rejects.write(json.dumps({'record': number, 'error': reason, 'data': record}, default=str,
+                                 ensure_ascii=False) + '\n')
+        checkpoint.rejected += 1
+
+    number = checkpoint.position
+    while True:
+        chunk: list[tuple[int, dict, URLMapping]] = []
+        for record in records:
+            number += 1
+            try:
+                chunk.append((number, record, to_mapping(record)))
+            except Exception as e:
+                reject(number, str(e), record)
+            if len(chunk) >= chunk_size:
+                break
+        if not chunk:
+            break
+
+        errors = repo.save_many([mapping for _, _, mapping in chunk])
+        for i, error in sorted(errors.items()):
+            record_number, record, mapping = chunk[i]
+            if isinstance(error, DuplicateKeyError):
+                if resumed and _already_imported(repo, mapping):
+                    continue
+                reject(record_number, 'Duplicate short_key', record)
+            else:
+                reject(record_number, str(error), record)
+        resumed = False
+        imported = len(chunk) - len(errors)
+        checkpoint.imported += imported
+        checkpoint.position = number
+        rejects.flush()
+        checkpoint.save()
+        progress.add(len(chunk))
+
+    checkpoint.position = number
+    checkpoint.save()
+    if checkpoint.imported:
+        KeyFilter.request_rebuild(repo)
+    logger.info("Imported %d mappings, rejected %d, in %.1fs (%.0f/s)", checkpoint.imported, checkpoint.rejected,
+                progress.elapsed, progress.rate)
+    return checkpoint
+
+
+def _already_imported(repo: BaseRepository, mapping: URLMapping) -> bool:
+    existing = repo.get_mapping_by_key(mapping.short_key)
+    return existing is not None and existing.long_url == mapping.long_url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export URL mappings as JSONL or CSV")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='write every mapping to a file')
+    export_parser.add_argument('output', help="output file ('-' for stdout; .csv for CSV; .gz to compress)")
+    export_parser.add_argument('--format', choices=FORMATS, help='defaults to the file extension')
+    export_parser.add_argument('--batch-size', type=int, default=10000, help='mappings per cursor round trip')
+    import_parser = commands.add_parser('import', help='insert mappings from a file')
+    import_parser.add_argument('input', help="input file ('-' for stdin; .csv for CSV; .gz if compressed)")
+    import_parser.add_argument('--format', choices=FORMATS, help='defaults to the file extension')
+    import_parser.add_argument('--chunk-size', type=int, default=1000, help='mappings per bulk insert')
+    import_parser.add_argument('--rejects', help='reject file (defaults to <input>.rejects.jsonl)')
+    import_parser.add_argument('--resume', action='store_true', help='continue from <input>.checkpoint')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s', stream=sys.stderr)
+    repo = create_repository(config.as_dict())
+
+    if args.command == 'export':
+        fmt = args.format or detect_format(args.output)
+        with _open(args.output, 'w') as out:
+            export_mappings(repo, out, fmt, args.batch_size)
+        return
+
+    fmt = args.format or detect_format(args.input)
+    stdin = args.input == '-'
+    if args.resume and stdin:
+        parser.error('--resume needs an input file')
+    rejects_path = args.rejects or ('rejects.jsonl' if stdin else f"{args.input}.rejects.jsonl")
+    checkpoint = Checkpoint(None if stdin else f"{args.input}.checkpoint")
+    if args.resume:
+        checkpoint.load()
+    with _open(args.input, 'r') as f, open(rejects_path, 'a' if args.resume else 'w', encoding='utf-8') as rejects:
+        import_mappings(repo, read_records(f, fmt), rejects, args.chunk_size, checkpoint)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Moves mappings to the shard that owns them after shards are added to or
+removed from mongo_shards. Every shard in mongo_shards and
+mongo_previous_shards is streamed in turn, and every mapping that the new
+ring places on another shard is copied there and then deleted where it was.
+The other mappings are not touched, so after adding the Nth shard about 1/N
+of them move, and a removed shard is emptied.
+
+Deploy the app with the new MONGO_SHARDS and the old list as
+MONGO_PREVIOUS_SHARDS first: until a mapping is moved, the app finds it on
+its previous shard. Then run this with the same two settings, and deploy
+without MONGO_PREVIOUS_SHARDS once it has finished. Runs are idempotent: a
+mapping already copied by an interrupted run is only deleted.
+
+    python -m tools.rebalance --dry-run
+    python -m tools.rebalance --batch-size 1000
+"""
+import argparse
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from model.url_mapping import URLMapping
+from repository.base import MAPPING_FIELDS, BaseRepository, DuplicateKeyError
+from repository.factory import create_shards
+from tools.mappings import Progress
+from util import config
+from util.hash_ring import HashRing
+
+logger = logging.getLogger('tools.rebalance')
+
+_TIME_FIELDS = ('created_at', 'expires_at', 'last_accessed_at')
+
+
+def _from_epoch(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value is not None else None
+
+
+def mapping_from_row(row: tuple) -> URLMapping:
+    """
+    Rebuild a mapping from a repository row, keeping every field (click counts included)
+    :param row: tuple with the fields in MAPPING_FIELDS order
+    :return: URLMapping
+    """
+    fields = dict(zip(MAPPING_FIELDS, row))
+    for field in _TIME_FIELDS:
+        fields[field] = _from_epoch(fields[field])
+    return URLMapping(**fields)
+
+
+def _move(source: BaseRepository, target: BaseRepository, mappings: list[URLMapping]) -> int:
+    """
+    Copy mappings to target, then delete the copied ones from source
+    :return: number of mappings moved
+    """
+    errors = target.save_many(mappings)
+    moved = 0
+    for i, mapping in enumerate(mappings):
+        error = errors.get(i)
+        if isinstance(error, DuplicateKeyError):
+            # Copied by an earlier run, unless the key was reused on the target
+            existing = target.get_mapping_by_key(mapping.short_key)
+            if existing is None or existing.long_url != mapping.long_url:
+                logger.warning("Key %s exists on both shards with different URLs; left in place", mapping.short_key)
+                continue
+        elif error is not None:
+            logger.warning("Copying %s failed: %s", mapping.short_key, error)
+            continue
+        source.delete_mapping(mapping.short_key)
+        moved += 1
+    return moved
+
+
+def rebalance(shards: dict[str, BaseRepository], ring: HashRing, batch_size: int = 1000,
+              dry_run: bool = False) -> dict[tuple[str, str], int]:
+    """
+    Move every mapping stored on a shard other than its owner on ring
+    :param shards: shard name -> repository, for every node of ring and every shard being removed
+    :param ring: the new ring
+    :param batch_size: mappings copied per save_many
+    :param dry_run: only count the mappings that would move
+    :return: (source, target) shard names -> number of mappings moved (or to move)
+    """
+    moved: dict[tuple[str, str], int] = {}
+    progress = Progress('Scanned')
+    for name, source in shards.items():
+        pending: dict[str, list[URLMapping]] = {}
+        for row in source.iter_mapping_rows(batch_size):
+            progress.add(1)
+            owner = ring.node_for(row[0])
+            if owner == name:
+                continue
+            if dry_run:
+                moved[name, owner] = moved.get((name, owner), 0) + 1
+                continue
+            batch = pending.setdefault(owner, [])
+            batch.append(mapping_from_row(row))
+            if len(batch) >= batch_size:
+                moved[name, owner] = moved.get((name, owner), 0) + _move(source, shards[owner], batch)
+                pending[owner] = []
+        for owner, batch in pending.items():
+            if batch:
+                moved[name, owner] = moved.get((name, owner), 0) + _move(source, shards[owner], batch)
+
+    for (source_name, target_name), count in sorted(moved.items()):
+        logger.info("%s %d mappings from %s to %s", 'Would move' if dry_run else 'Moved', count,
+                    source_name, target_name)
+    logger.info("Scanned %d mappings in %.1fs (%.0f/s)", progress.count, progress.elapsed, progress.rate)
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move mappings to their owning shard after mongo_shards changes")
+    parser.add_argument('--batch-size', type=int, default=1000, help='mappings copied per bulk insert')
+    parser.add_argument('--dry-run', action='store_true', help='only count the mappings that would move')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    settings = config.as_dict()
+    if not settings['mongo_shards']:
+        parser.error("mongo_shards is empty; set MONGO_SHARDS to the new shard list")
+    if not settings['mongo_previous_shards']:
+        # Without it the app would stop finding the moved mappings
+        parser.error("mongo_previous_shards is empty; set MONGO_PREVIOUS_SHARDS to the shard list before the change"
+                     " and deploy the app with it first")
+    rebalance(create_shards(settings), HashRing(settings['mongo_shards'], settings['mongo_shard_vnodes']),
+              batch_size=args.batch_size, dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
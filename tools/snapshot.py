@@ -0,0 +1,77 @@
+"""
+Exports unexpired URL mappings to the read-only snapshot that redirect
+workers can serve from while the database is slow or down. Runs as its own
+process, like the sweeper.
+
+    python -m tools.snapshot --path /var/lib/url_shortener/mappings.snap --once
+    python -m tools.snapshot --path mappings.snap --interval 10 --full-interval 3600
+
+Each pass writes a small delta of mappings created since the last full
+snapshot; a full snapshot is written on the first pass and every
+--full-interval seconds. Both files are replaced atomically.
+"""
+import argparse
+import logging
+import os
+import time
+
+from repository.base import BaseRepository
+from repository.factory import create_repository
+from repository.snapshot import export_delta, export_snapshot
+from util import config
+
+logger = logging.getLogger('tools.snapshot')
+
+
+def export(repo: BaseRepository, path: str, full: bool, batch_size: int = 10000) -> int:
+    """
+    Write a full snapshot or a delta and log what it did
+    :return: number of mappings written
+    """
+    started = time.monotonic()
+    if full:
+        count = export_snapshot(repo, path, batch_size=batch_size)
+    else:
+        count = export_delta(repo, path, batch_size=batch_size)
+    logger.info("Wrote %s with %d mappings in %.1fs", 'snapshot' if full else 'delta', count,
+                time.monotonic() - started)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export URL mappings to a redirect snapshot")
+    parser.add_argument('--path', default=config.snapshot_path, required=config.snapshot_path is None,
+                        help='snapshot file (defaults to $SNAPSHOT_PATH)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='mappings per repository round trip')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between delta exports')
+    parser.add_argument('--full-interval', type=float, default=3600, help='seconds between full snapshots')
+    parser.add_argument('--delta', action='store_true', help='with --once, write only a delta')
+    parser.add_argument('--once', action='store_true', help='run a single export and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    repo = create_repository(config.as_dict())
+
+    last_full = None
+    while True:
+        if args.once:
+            full = not args.delta
+        else:
+            full = last_full is None or time.monotonic() - last_full >= args.full_interval
+        # A delta needs a snapshot to apply to
+        full = full or not os.path.exists(args.path)
+        try:
+            export(repo, args.path, full, args.batch_size)
+            if full:
+                last_full = time.monotonic()
+        except Exception:
+            if args.once:
+                raise
+            logger.exception("Snapshot export failed")
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
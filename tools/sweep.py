@@ -0,0 +1,54 @@
+"""
+Deletes expired URL mappings in bounded chunks. Runs as its own process (from
+cron, a systemd timer or a sidecar), so request workers never do the sweep.
+
+    python -m tools.sweep --once
+    python -m tools.sweep --interval 300 --batch-size 1000 --max-runtime 60
+"""
+import argparse
+import logging
+import time
+
+from repository.base import BaseRepository
+from repository.factory import create_repository
+from util import config
+
+logger = logging.getLogger('tools.sweep')
+
+
+def sweep(repo: BaseRepository, batch_size: int, max_runtime: float = None) -> int:
+    """
+    Run one purge pass and log what it did
+    :return: number of mappings deleted
+    """
+    started = time.monotonic()
+    deleted = repo.purge_expired(batch_size=batch_size, max_runtime=max_runtime)
+    logger.info("Deleted %d expired mappings in %.1fs", deleted, time.monotonic() - started)
+    return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete expired URL mappings")
+    parser.add_argument('--batch-size', type=int, default=1000, help='mappings deleted per delete_many')
+    parser.add_argument('--max-runtime', type=float, default=None, help='seconds per pass before stopping')
+    parser.add_argument('--interval', type=float, default=300, help='seconds between passes')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    repo = create_repository(config.as_dict())
+
+    while True:
+        try:
+            sweep(repo, args.batch_size, args.max_runtime)
+        except Exception:
+            if args.once:
+                raise
+            logger.exception("Sweep failed")
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
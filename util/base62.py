@@ -0,0 +1,39 @@
+import string
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+_INDEX = {char: i for i, char in enumerate(ALPHABET)}
+
+
+def encode(num: int, min_length: int = 1) -> str:
+    """
+    Encodes a non-negative integer as a Base62 string, left-padded with '0'
+    :param num:
+    :param min_length: pad the result to at least this many characters
+    :return: str
+    """
+    if num < 0:
+        raise ValueError("num must be non-negative")
+    chars = []
+    while num:
+        num, rem = divmod(num, BASE)
+        chars.append(ALPHABET[rem])
+    encoded = ''.join(reversed(chars))
+    return encoded.rjust(min_length, ALPHABET[0])
+
+
+def decode(value: str) -> int:
+    """
+    Decodes a Base62 string back to an integer
+    :param value:
+    :return: int
+    """
+    if not value:
+        raise ValueError("Cannot decode an empty string")
+    num = 0
+    for char in value:
+        try:
+            num = num * BASE + _INDEX[char]
+        except KeyError:
+            raise ValueError(f"Invalid Base62 character: {char!r}") from None
+    return num
@@ -0,0 +1,106 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+_MAGIC = b'BLM2'
+# magic, bit count, hash count, capacity, item count, saved_at epoch, generation
+_HEADER = struct.Struct('<4sQIQQdQ')
+
+
+class BloomFilter:
+    """
+    Probabilistic set membership over a compact bytearray bitset.
+
+    `key in filter` is False only if the key was never added; a True answer
+    is wrong with probability roughly `error_rate` while at most `capacity`
+    keys have been added. Keys cannot be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        # Double hashing: k positions derived from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        h2 |= 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        positions = self._positions(key)
+        with self._lock:
+            bits = self._bits
+            for pos in positions:
+                bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = struct.unpack('<QQ', hashlib.blake2b(key.encode(), digest_size=16).digest())
+        h2 |= 1
+        bits, num_bits = self._bits, self.num_bits
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % num_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def save(self, path: str, saved_at: Optional[float] = None, generation: int = 0) -> None:
+        """
+        Write the filter to path atomically
+        :param path:
+        :param saved_at: epoch the contents are current as of (defaults to now)
+        :param generation: caller-defined version of the contents, returned by load()
+        """
+        saved_at = time.time() if saved_at is None else saved_at
+        # Every worker saves to the same path; keep their partial writes apart
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock, open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.num_bits, self.num_hashes, self.capacity, self.count, saved_at,
+                                 generation))
+            f.write(self._bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> tuple['BloomFilter', float, int]:
+        """
+        Read a filter written by save()
+        :param path:
+        :return: (filter, saved_at epoch, generation)
+        """
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            magic, num_bits, num_hashes, capacity, count, saved_at, generation = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            bits = bytearray(f.read())
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError(f"{path} is truncated")
+        bloom = cls.__new__(cls)
+        bloom.capacity = capacity
+        bloom.error_rate = math.exp(-num_bits / capacity * math.log(2) ** 2)
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.count = count
+        bloom._bits = bits
+        bloom._lock = threading.Lock()
+        return bloom, saved_at, generation
+
+    def __len__(self) -> int:
+        return self.count
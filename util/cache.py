@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Invalidations are counted per stripe of keys, so the counts take fixed memory
+_GENERATION_STRIPES = 1024
+
+
+class CacheEntry:
+    """
+    A compact cache record: the cached value, the absolute expiry of the
+    underlying mapping (epoch seconds or None) and when it was stored
+    """
+    __slots__ = ('value', 'expires_at', 'stored_at')
+
+    def __init__(self, value, expires_at: Optional[float], stored_at: float):
+        self.value = value
+        self.expires_at = expires_at
+        self.stored_at = stored_at
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU cache with a per-entry TTL.
+
+    An entry is served only while it is younger than ``ttl`` seconds and its
+    ``expires_at`` (if any) has not passed, so a cached value never outlives
+    the mapping it was read from.
+
+    With ``max_stale`` above ttl, entries past their ttl are kept (still
+    subject to LRU eviction) until they are that old, for get_stale() to
+    answer while the source of the data is unavailable.
+
+    A caller filling the cache from the database reads generation() before
+    the lookup and passes it to put(); if the key was invalidated in
+    between, the value it read may predate the write and is dropped.
+    """
+
+    def __init__(self, max_size: int, ttl: float, max_stale: Optional[float] = 0):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        # None keeps entries until they are evicted
+        self.max_stale = float('inf') if max_stale is None else max_stale
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generations = [0] * _GENERATION_STRIPES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Return the live entry for key, or None on a miss
+        :param key:
+        :return: CacheEntry or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            age = now - entry.stored_at
+            expired = entry.expires_at is not None and entry.expires_at <= now
+            if age >= self.ttl or expired:
+                if expired or age >= self.max_stale:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generation(self, key: str) -> int:
+        """
+        Invalidation count of key's stripe, to pass to put() after looking the key up elsewhere
+        :param key:
+        :return: opaque count
+        """
+        return self._generations[hash(key) % _GENERATION_STRIPES]
+
+    def put(self, key: str, value, expires_at: Optional[float] = None, generation: Optional[int] = None) -> None:
+        """
+        Store value under key, evicting the least recently used entry when full
+        :param key:
+        :param value:
+        :param expires_at: epoch seconds after which the value must not be served
+        :param generation: generation(key) from before value was read; the value is dropped if the key
+                           has been invalidated since
+        """
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            return
+        entry = CacheEntry(value, expires_at, now)
+        with self._lock:
+            if generation is not None and self._generations[hash(key) % _GENERATION_STRIPES] != generation:
+                return
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stale(self, key: str, max_age: Optional[float] = None) -> Optional[CacheEntry]:
+        """
+        Return the entry for key even if it is past its ttl, as long as it is
+        younger than max_age and its expires_at has not passed
+        :param key:
+        :param max_age: seconds since the entry was stored; None allows any entry still kept
+        :return: CacheEntry or None
+        """
+        now = time.time()
+        # Entries are kept for the longer of ttl and max_stale
+        limit = max(self.max_stale, self.ttl)
+        if max_age is not None:
+            limit = min(limit, max_age)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or now - entry.stored_at >= limit or \
+                (entry.expires_at is not None and entry.expires_at <= now):
+            return None
+        return entry
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop key from the cache if present
+        :param key:
+        """
+        with self._lock:
+            # Counted even when the key is absent: a lookup may be about to store it
+            self._generations[hash(key) % _GENERATION_STRIPES] += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generations = [generation + 1 for generation in self._generations]
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss/eviction counters and the current size
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Optional
+
+from util.metrics import Metrics
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that keeps failing.
+
+    Closed: calls go through, and `failure_threshold` consecutive failures
+    open the breaker. Open: allow() refuses every call for `reset_timeout`
+    seconds. Half-open: one trial call is let through; its success closes
+    the breaker and its failure opens it again.
+
+    Callers ask allow() before each call and report the outcome with record().
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    # Values of the state gauge
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0,
+                 metrics: Optional[Metrics] = None, clock=time.monotonic):
+        if failure_threshold <= 0:
+            raise ValueError("failure_threshold must be positive")
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # State gauge and transition/failure/rejection counters; None disables them
+        self.metrics = metrics
+        self.failures = 0
+        self.rejected = 0
+        self._clock = clock
+        self._state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        if metrics is not None:
+            metrics.breaker_state.set(0, name)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go ahead now. A True answer in the half-open
+        state makes the caller the trial call, which must call record().
+        """
+        if self._state == self.CLOSED:
+            return True
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+        if self.metrics is not None:
+            self.metrics.breaker_rejections.inc(self.name)
+        return False
+
+    def record(self, success: bool) -> None:
+        """
+        Report the outcome of an allowed call
+        :param success: False for a failure of the dependency itself (timeout,
+                        connection error), True otherwise
+        """
+        if success and self._state == self.CLOSED and not self._consecutive:
+            return
+        with self._lock:
+            if not success:
+                self.failures += 1
+            if self._state == self.HALF_OPEN:
+                self._trial_running = False
+                self._transition(self.CLOSED if success else self.OPEN)
+            elif self._state == self.CLOSED:
+                self._consecutive = 0 if success else self._consecutive + 1
+                if self._consecutive >= self.failure_threshold:
+                    self._transition(self.OPEN)
+            # Calls that were already running when the breaker opened do not change it
+        if not success and self.metrics is not None:
+            self.metrics.breaker_failures.inc(self.name)
+
+    def _transition(self, state: str) -> None:
+        # Called with the lock held
+        self._state = state
+        self._consecutive = 0
+        if state == self.OPEN:
+            self._opened_at = self._clock()
+        if self.metrics is not None:
+            self.metrics.breaker_state.set(self.STATE_VALUES[state], self.name)
+            self.metrics.breaker_transitions.inc(self.name, state)
@@ -1,2 +1,188 @@
+import os
+
 BASE_URL = ''
-collision_retries = 5
\ No newline at end of file
+collision_retries = 5
+
+# Storage backend: 'mongo', 'sqlite' (one file, WAL mode) or 'memory'
+# (process-local, not persisted; single-process deployments and tests only)
+storage_backend = 'mongo'
+sqlite_path = os.environ.get('SQLITE_PATH', 'url_shortener.db')
+
+# Redirect responses: status code and Cache-Control max-age (seconds) for
+# mappings that do not set their own. max-age is always capped at the time
+# left before the mapping expires; 0 sends no Cache-Control for 302/307
+# and "no-store" for the permanent 301/308
+redirect_code = 302
+redirect_cache_max_age = 0
+
+# Answer GET /<short_key> in a WSGI middleware in front of Flask, with the
+# same responses as the Flask route but without its per-request overhead
+redirect_fast_path = True
+
+# In-process redirect cache (0 disables it)
+redirect_cache_size = 10000
+redirect_cache_ttl = 60  # seconds
+
+# With a path (best on /dev/shm) the redirect cache is one memory-mapped
+# table shared by every worker on the host instead of a copy per worker, and
+# a write in any worker invalidates it for all. redirect_cache_size is then
+# its slot count; each slot takes 56 bytes plus redirect_cache_url_bytes of
+# space for long URLs
+redirect_cache_shared_path = os.environ.get('REDIRECT_CACHE_SHARED_PATH')
+redirect_cache_url_bytes = 128
+
+# Concurrent cache misses for the same key in a worker share one lookup;
+# requests waiting on it longer than the timeout get a 503
+redirect_single_flight = True
+redirect_single_flight_timeout = 5.0  # seconds
+
+# While the database is unavailable, redirects are answered from cache
+# entries past their ttl or from the snapshot, as long as the data is at
+# most this many seconds old (cache entries are kept that long); links are
+# never served past their expiry. None lifts the limit
+redirect_stale_max_age = 3600
+
+# Read-only snapshot of live mappings, written by `python -m tools.snapshot`,
+# for serving redirects without the database: 'fallback' reads it only when
+# a repository lookup fails, 'first' before the repository. Workers re-open
+# the snapshot and its delta (snapshot_path + '.delta') once replaced
+snapshot_path = os.environ.get('SNAPSHOT_PATH')
+snapshot_mode = 'fallback'
+snapshot_refresh_interval = 5.0  # seconds between checks for a new file
+
+# Heavy hitters: each worker counts redirects of its hottest keys in
+# hot_keys_capacity fixed slots, served from GET /admin/hot-keys. Every
+# hot_keys_interval seconds the counts are multiplied by hot_keys_decay so
+# the ranking follows recent traffic, and saved to hot_keys_path if set; a
+# starting worker loads the saved keys' mappings into the redirect cache
+# with one query before serving its first request
+hot_keys_enabled = True
+hot_keys_capacity = 1000
+hot_keys_path = os.environ.get('HOT_KEYS_PATH')
+hot_keys_interval = 60.0  # seconds
+hot_keys_decay = 0.5
+
+# Bearer token for the /admin endpoints; they answer 404 while it is unset
+admin_token = os.environ.get('ADMIN_TOKEN')
+# GET /admin/mappings: largest page a request may ask for
+admin_page_max_size = 1000
+
+# On-demand profiling, written to profiling_dir; nothing is installed while
+# disabled. Needs admin_token: the /admin/profile endpoints sample CPU
+# stacks and diff tracemalloc snapshots, a request sending
+# profiling_header with the admin token runs under cProfile, and SIGUSR2
+# starts (or ends) sampling a worker for profiling_signal_seconds
+profiling_enabled = False
+profiling_dir = os.environ.get('PROFILING_DIR', 'profiles')
+profiling_header = 'X-Profile'
+profiling_max_seconds = 300
+profiling_signal_seconds = 30
+
+# Short key allocation: 'random' probes the DB for collisions, 'counter' hands
+# out Base62 keys from ID blocks leased from a counter document
+key_allocator = 'random'
+key_block_size = 1000
+key_scramble = True
+key_scramble_secret = 0x5DEECE66D
+
+# POST /shorten/batch: maximum items per JSON request, and per bulk insert
+# when streaming JSON lines
+batch_max_size = 1000
+
+# Bloom filter over existing short keys, so lookups of keys that were never
+# created are answered 404 without a database round trip
+bloom_filter_enabled = False
+bloom_filter_capacity = 1_000_000
+bloom_filter_error_rate = 0.01
+bloom_filter_path = None  # persist here to skip the full scan on restart
+bloom_filter_refresh_interval = 1.0  # seconds; picks up keys created by other workers
+
+# Dedup: return the existing short key when the same long URL is shortened
+# again with no alias and the same expiry
+dedup_enabled = False
+dedup_cache_size = 10000  # recent url-hash -> key pairs kept in memory
+dedup_cache_ttl = 60  # seconds
+
+# Click counting: per-worker buffer flushed as one bulk $inc update
+click_tracking_enabled = True
+click_flush_interval_ms = 1000
+click_flush_max_keys = 1000  # flush early once this many distinct keys are pending
+click_max_pending_keys = 100000  # memory bound; clicks on further keys are dropped
+
+# Group commit for POST /shorten: concurrent requests' mappings are inserted
+# by a writer thread with one bulk insert, at most group_commit_max_delay_ms
+# after the first one arrives; each response waits for its own batch, and
+# answers 503 after group_commit_timeout_ms
+group_commit_enabled = False
+group_commit_max_delay_ms = 2
+group_commit_max_batch = 256  # insert at once when this many are queued
+group_commit_timeout_ms = 5000
+
+# Latency histograms and outcome counters served from GET /metrics; when
+# disabled no timers are installed at all
+metrics_enabled = True
+
+# Expired mappings: index expires_at for the sweeper, and optionally let a
+# MongoDB TTL index delete mappings this many seconds after they expire
+# (deleted links answer 404 rather than 410)
+expires_at_index = True
+mapping_ttl_seconds = None
+
+# Time budgets for MongoDB calls made by the app (pymongo client-side
+# timeouts covering server selection, the query and retries): redirect
+# lookups, other reads, and writes. None keeps the driver's timeouts below
+mongo_redirect_timeout_ms = 250
+mongo_read_timeout_ms = 1000
+mongo_write_timeout_ms = 2000
+
+# Circuit breaker around those calls: after breaker_failure_threshold
+# consecutive timeouts or connection errors, calls fail at once for
+# breaker_reset_timeout seconds (writes answer 503, redirects fall back to
+# stale data), then a single trial call decides whether it closes again
+breaker_enabled = True
+breaker_failure_threshold = 5
+breaker_reset_timeout = 10.0  # seconds
+
+# MongoDB connection, opened lazily in each worker process
+mongo_db = os.environ.get('MONGO_DB', 'url_shortener')
+mongo_host = os.environ.get('MONGO_HOST', 'localhost')
+mongo_port = int(os.environ.get('MONGO_PORT', 27017))
+mongo_username = os.environ.get('MONGO_USERNAME')
+mongo_password = os.environ.get('MONGO_PASSWORD')
+mongo_auth_source = os.environ.get('MONGO_AUTH_SOURCE', 'admin')
+mongo_max_pool_size = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+mongo_connect_timeout_ms = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 2000))
+mongo_server_selection_timeout_ms = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+mongo_socket_timeout_ms = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 5000))
+
+# Horizontal sharding: mappings are spread across the servers below by
+# consistent hashing of short_key, with mongo_shard_vnodes points on the ring
+# per shard. Shard name -> host or mongodb:// URI, e.g.
+# MONGO_SHARDS="a=mongodb://db-a:27017,b=mongodb://db-b:27017". Names place
+# the keys, so keep them when a host changes, and run tools.rebalance after
+# adding or removing a shard. Key allocation counters stay on mongo_host. Empty means
+# every mapping lives on mongo_host
+mongo_shards = dict(entry.split('=', 1) for entry in os.environ.get('MONGO_SHARDS', '').split(',') if entry)
+# While tools.rebalance runs after mongo_shards changed: the list before the
+# change (MONGO_PREVIOUS_SHARDS, same format). Lookups that miss on a key's
+# shard try its previous shard, and removed shards are still read. Empty it
+# once the rebalance has finished
+mongo_previous_shards = dict(entry.split('=', 1)
+                             for entry in os.environ.get('MONGO_PREVIOUS_SHARDS', '').split(',') if entry)
+mongo_shard_vnodes = 160
+
+
+def as_dict(overrides: dict = None) -> dict:
+    """
+    Returns the settings in this module as a dict, with overrides applied
+    :param overrides: setting name -> value
+    :return: dict
+    """
+    settings = {name: value for name, value in globals().items()
+                if not name.startswith('_') and not callable(value) and name != 'os'}
+    if overrides:
+        unknown = set(overrides) - set(settings)
+        if unknown:
+            raise KeyError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        settings.update(overrides)
+    return settings
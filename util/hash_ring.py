@@ -0,0 +1,73 @@
+import bisect
+import hashlib
+from typing import Iterable
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto named nodes.
+
+    Each node owns `vnodes` points on a 64-bit ring, and a key belongs to the
+    node owning the first point at or after the key's hash. Adding a node
+    only moves the keys that now fall to it (about 1/N of them), and the
+    virtual nodes spread both the keys and the moved keys evenly. Positions
+    come from node names, not their order, so every process builds the same ring.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 160):
+        if vnodes <= 0:
+            raise ValueError("vnodes must be positive")
+        self.vnodes = vnodes
+        self._nodes: set[str] = set()
+        # Sorted (point, node) pairs, split so lookups bisect a list of ints
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    @property
+    def nodes(self) -> list[str]:
+        return sorted(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def add(self, node: str) -> None:
+        """
+        Add a node and its virtual nodes
+        :param node: name of the node
+        """
+        if node in self._nodes:
+            raise ValueError(f"Node {node!r} is already on the ring")
+        self._nodes.add(node)
+        self._rebuild([(self._hash(f"{node}#{i}"), node) for i in range(self.vnodes)])
+
+    def remove(self, node: str) -> None:
+        """
+        Remove a node; its keys fall to the nodes after its points
+        :param node: name of the node
+        """
+        self._nodes.remove(node)
+        self._rebuild([])
+
+    def _rebuild(self, new_points: list[tuple[int, str]]) -> None:
+        # Ties between nodes are broken by name, so they resolve the same everywhere
+        points = sorted([(point, owner) for point, owner in zip(self._points, self._owners)
+                         if owner in self._nodes] + new_points)
+        self._points = [point for point, _ in points]
+        self._owners = [owner for _, owner in points]
+
+    def node_for(self, key: str) -> str:
+        """
+        The node owning key
+        :param key:
+        :return: node name
+        """
+        if not self._points:
+            raise LookupError("The ring has no nodes")
+        i = bisect.bisect_left(self._points, self._hash(key))
+        return self._owners[i if i < len(self._points) else 0]
@@ -0,0 +1,102 @@
+import heapq
+import threading
+from typing import Optional
+
+
+class SpaceSaving:
+    """
+    Approximate most-frequent keys of a stream in constant memory, using the
+    Space-Saving algorithm.
+
+    At most `capacity` keys are counted. A key that is not counted yet
+    replaces the one with the lowest count and inherits that count, which is
+    recorded as its possible overestimate (`error`). Every key seen more than
+    total / capacity times is guaranteed to be counted, and no count is more
+    than its error above the true one.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.total = 0
+        # key -> [count, error]
+        self._counts: dict[str, list] = {}
+        # One (count, key) entry per counted key; entries are only refreshed
+        # when they reach the top, so each holds a lower bound of its count
+        self._heap: list[tuple[int, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def add(self, key: str, amount: int = 1) -> None:
+        """
+        Count amount occurrences of key
+        :param key:
+        :param amount:
+        """
+        with self._lock:
+            self._add(key, amount)
+
+    def add_many(self, amounts: dict[str, int]) -> None:
+        """
+        Count several keys under one acquisition of the lock
+        :param amounts: key -> occurrences
+        """
+        with self._lock:
+            for key, amount in amounts.items():
+                self._add(key, amount)
+
+    def _add(self, key: str, amount: int) -> None:
+        # Caller holds the lock
+        self.total += amount
+        counts = self._counts
+        entry = counts.get(key)
+        if entry is not None:
+            entry[0] += amount
+            return
+        heap = self._heap
+        if len(counts) < self.capacity:
+            counts[key] = [amount, 0]
+            heapq.heappush(heap, (amount, key))
+            return
+        # Find the smallest count, refreshing stale heap entries on the way
+        while True:
+            floor, victim = heap[0]
+            count = counts[victim][0]
+            if count == floor:
+                break
+            heapq.heapreplace(heap, (count, victim))
+        del counts[victim]
+        counts[key] = [floor + amount, floor]
+        heapq.heapreplace(heap, (floor + amount, key))
+
+    def top(self, k: Optional[int] = None) -> list[tuple[str, int, int]]:
+        """
+        The k keys with the highest counts
+        :param k: defaults to every counted key
+        :return: (key, count, error) tuples, highest count first
+        """
+        with self._lock:
+            items = [(key, count, error) for key, (count, error) in self._counts.items()]
+        if k is None or k >= len(items):
+            return sorted(items, key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(k, items, key=lambda item: item[1])
+
+    def decay(self, factor: float) -> None:
+        """
+        Scale every count and error by factor, so old traffic fades;
+        keys whose count drops to zero are forgotten
+        :param factor: between 0 and 1
+        """
+        with self._lock:
+            self.total = int(self.total * factor)
+            counts = {}
+            for key, (count, error) in self._counts.items():
+                count = int(count * factor)
+                if count > 0:
+                    counts[key] = [count, int(error * factor)]
+            self._counts = counts
+            self._heap = [(count, key) for key, (count, _) in counts.items()]
+            heapq.heapify(self._heap)
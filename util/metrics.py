@@ -0,0 +1,247 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable
+
+# Latency buckets in seconds, from 50us (cache hits) to 2.5s (timeouts)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by label values
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def set(self, value: float, *labelvalues) -> None:
+        """
+        Overwrite the total, for counters kept elsewhere and copied in at render time
+        """
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    Current value that can go up and down, optionally split by label values
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labelvalues) -> None:
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, optionally split by label values. observe() is a
+    bisect and three additions under a lock.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labelvalues) -> int:
+        series = self._series.get(labelvalues)
+        return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labelvalues, (list(counts), total, count))
+                              for labelvalues, (counts, total, count) in self._series.items())
+        bounds = self.buckets + (float('inf'),)
+        for labelvalues, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Metrics:
+    """
+    The service's metrics, rendered in the Prometheus text exposition format
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.http_duration = Histogram('http_request_duration_seconds',
+                                       'Time spent handling a request in Flask', ('endpoint',))
+        self.http_responses = Counter('http_responses_total', 'Responses by endpoint and status code',
+                                      ('endpoint', 'status'))
+        self.service_duration = Histogram('service_duration_seconds',
+                                          'Time spent in service methods', ('operation',))
+        self.repository_duration = Histogram('repository_duration_seconds',
+                                             'Time spent in repository methods', ('method',))
+        self.alias_conflicts = Counter('url_generator_alias_conflicts_total',
+                                       'Custom aliases rejected because they are taken')
+        self.collision_retries = Counter('url_generator_collision_retries_total',
+                                         'Generated short keys discarded because they were taken')
+        self.long_key_fallbacks = Counter('url_generator_long_key_fallbacks_total',
+                                          'Mappings given a 16-character key after running out of retries')
+        self.breaker_state = Gauge('circuit_breaker_state',
+                                   'Circuit breaker state: 0 closed, 1 half-open, 2 open', ('name',))
+        self.breaker_transitions = Counter('circuit_breaker_transitions_total',
+                                           'Circuit breaker state changes by new state', ('name', 'state'))
+        self.breaker_failures = Counter('circuit_breaker_failures_total',
+                                        'Calls that failed with a timeout or connection error', ('name',))
+        self.breaker_rejections = Counter('circuit_breaker_rejections_total',
+                                          'Calls refused while the circuit breaker was open', ('name',))
+        self.stale_redirects = Counter('redirect_stale_served_total',
+                                       'Redirects answered from stale data while the database was unavailable',
+                                       ('source',))
+        self.cache_lookups = Counter('redirect_cache_lookups_total',
+                                     'Redirect cache lookups in this worker by result', ('result',))
+        self.cache_entries = Gauge('redirect_cache_entries', 'Mappings held in the redirect cache')
+        self.cache_capacity = Gauge('redirect_cache_capacity', 'Mappings the redirect cache can hold (slots when shared)')
+        self.cache_entry_bytes = Gauge('redirect_cache_bytes_per_entry',
+                                       'Bytes of shared memory per slot of the shared redirect cache')
+        self.cache_evictions = Counter('redirect_cache_evictions_total', 'Mappings evicted from the redirect cache')
+        self._cache = None
+
+    def watch_cache(self, cache) -> None:
+        """
+        Export cache.stats() (an LRUCache or SharedCache) on every render
+        :param cache:
+        """
+        self._cache = cache
+
+    def collect(self) -> list:
+        return [value for value in vars(self).values() if isinstance(value, (Counter, Gauge, Histogram))]
+
+    def render(self) -> str:
+        if self._cache is not None:
+            stats = self._cache.stats()
+            self.cache_lookups.set(stats['hits'], 'hit')
+            self.cache_lookups.set(stats['misses'], 'miss')
+            self.cache_entries.set(stats['size'])
+            self.cache_capacity.set(stats['max_size'])
+            if 'bytes_per_entry' in stats:
+                self.cache_entry_bytes.set(stats['bytes_per_entry'])
+            self.cache_evictions.set(stats['evictions'])
+        lines = []
+        for metric in self.collect():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def timed(fn, histogram: Histogram, *labelvalues):
+    """
+    Wrap fn so each call's wall time (including failed calls) is observed in
+    histogram. For a coroutine function the time until the coroutine
+    finishes is observed.
+    """
+    perf_counter = time.perf_counter
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start, *labelvalues)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start, *labelvalues)
+    return wrapper
+
+
+def instrument(obj, method_names: Iterable[str], histogram: Histogram) -> None:
+    """
+    Time the named methods of obj, labelled with the method name. The
+    wrappers are set on the instance, so uninstrumented objects pay nothing.
+    Generator methods are skipped: calling them does no work.
+    """
+    for name in method_names:
+        method = getattr(obj, name)
+        if inspect.isgeneratorfunction(method):
+            continue
+        setattr(obj, name, timed(method, histogram, name))
@@ -0,0 +1,38 @@
+import os
+import threading
+import weakref
+
+
+def _reset_after_fork(ref):
+    target = ref()
+    if target is not None:
+        target.reset()
+
+
+class OncePerProcess:
+    """
+    Calls `fn` the first time the instance is called in each process.
+
+    The flag is cleared in forked children, so work done in a pre-fork
+    parent (opening connections, starting threads) is redone lazily in every
+    worker without checking the PID on each call.
+    """
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._done = False
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda ref=weakref.ref(self): _reset_after_fork(ref))
+
+    def reset(self):
+        self._done = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self._done:
+            return
+        with self._lock:
+            if not self._done:
+                self._fn()
+                self._done = True
@@ -0,0 +1,177 @@
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from itertools import count
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingError(Exception):
+    pass
+
+
+class Profiler:
+    """
+    On-demand profiling of one worker process, writing results to
+    `directory`:
+
+    - start_sampling() records every thread's stack every `interval`
+      seconds for a while, from a background thread, and writes the counts
+      as collapsed stacks (one "frame;frame;frame count" line per distinct
+      stack, the input of flamegraph.pl and speedscope). Samples are wall
+      clock: threads waiting on the database or a lock are counted too.
+    - profile() runs a block under cProfile and writes a pstats file.
+    - snapshot_memory() starts tracemalloc on its first call, and on each
+      later one writes the allocation growth since the previous snapshot by
+      source line.
+
+    Nothing runs until one of them is called; tracemalloc slows allocations
+    down until stop_memory().
+    """
+
+    def __init__(self, directory: str, max_seconds: float = 300, memory_frames: int = 1):
+        self.directory = directory
+        self.max_seconds = max_seconds
+        self.memory_frames = memory_frames
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+        self._sampling_path: Optional[str] = None
+        self._memory_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+        self._ids = count(1)
+
+    def _path(self, kind: str, extension: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{kind}-{os.getpid()}-{time.strftime('%Y%m%dT%H%M%S')}-{next(self._ids)}.{extension}"
+        return os.path.join(self.directory, name)
+
+    @property
+    def sampling(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def start_sampling(self, seconds: float, interval: float = 0.005) -> str:
+        """
+        Sample every thread's stack in the background for `seconds`
+        :param seconds: at most max_seconds
+        :param interval: seconds between samples
+        :return: path the collapsed stacks are written to when sampling ends
+        :raises ProfilingError: if sampling is already running
+        :raises ValueError: for a duration or interval out of range
+        """
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be between 0 and {self.max_seconds}")
+        if not 0 < interval <= seconds:
+            raise ValueError("interval must be positive and at most seconds")
+        with self._lock:
+            if self.sampling:
+                raise ProfilingError("A CPU profile is already being recorded")
+            path = self._path('cpu', 'collapsed')
+            self._stop_sampling = threading.Event()
+            self._sampling_path = path
+            self._sampler = threading.Thread(target=self._sample, args=(seconds, interval, path, self._stop_sampling),
+                                             name='profiler', daemon=True)
+            self._sampler.start()
+        return path
+
+    def stop_sampling(self, timeout: float = 5.0) -> str:
+        """
+        End sampling early and wait until the profile is written
+        :param timeout: seconds to wait for the file
+        :return: path of the collapsed stacks
+        :raises ProfilingError: if sampling is not running
+        """
+        with self._lock:
+            sampler, path = self._sampler, self._sampling_path
+            if sampler is None or not sampler.is_alive():
+                raise ProfilingError("No CPU profile is being recorded")
+            self._stop_sampling.set()
+        sampler.join(timeout)
+        return path
+
+    def _sample(self, seconds: float, interval: float, path: str, stop: threading.Event):
+        stacks: Counter = Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while not stop.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[';'.join(reversed(frames))] += 1
+            samples += 1
+        try:
+            with open(path, 'w') as f:
+                for stack, hits in sorted(stacks.items()):
+                    f.write(f"{stack} {hits}\n")
+            logger.info("Wrote %d CPU samples to %s", samples, path)
+        except OSError:
+            logger.exception("Writing the CPU profile failed")
+
+    @contextmanager
+    def profile(self, name: str = 'request') -> Iterator[str]:
+        """
+        Run the block under cProfile and write its stats
+        :param name: prefix of the file name
+        :return: context manager yielding the pstats path, written when the block exits
+        :raises ProfilingError: if another profiler is active (Python 3.12+ allows one at a time)
+        """
+        path = self._path(name, 'pstats')
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            raise ProfilingError(str(e)) from None
+        try:
+            yield path
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+
+    def snapshot_memory(self, limit: int = 20) -> tuple[Optional[str], list[str]]:
+        """
+        Take a tracemalloc snapshot and write how allocations grew since the
+        previous one. The first call starts tracing and only takes the
+        baseline.
+        :param limit: source lines listed in the returned summary (the file lists all)
+        :return: (path of the diff or None for the baseline, the largest `limit` differences)
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.memory_frames)
+                self._memory_snapshot = None
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+            previous, self._memory_snapshot = self._memory_snapshot, snapshot
+        if previous is None:
+            return None, []
+        lines = [str(stat) for stat in snapshot.compare_to(previous, 'lineno')]
+        path = self._path('memory', 'txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path, lines[:limit]
+
+    def stop_memory(self) -> bool:
+        """
+        Stop tracemalloc and drop the snapshot
+        :return: whether it was tracing
+        """
+        with self._lock:
+            self._memory_snapshot = None
+            if not tracemalloc.is_tracing():
+                return False
+            tracemalloc.stop()
+            return True
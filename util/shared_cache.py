@@ -0,0 +1,382 @@
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Optional
+
+from util.cache import CacheEntry
+from util.process import OncePerProcess
+
+_MAGIC = b'SHC2'
+# magic, slot count, ways, arena size, arena head (bytes ever appended), clock hand, entries, evictions
+_HEADER = struct.Struct('<4sIIQQQQQ')
+_HEADER_SIZE = 64
+_HEAD_OFFSET = 20
+_HAND_OFFSET = 28
+_ENTRIES_OFFSET = 36
+_EVICTIONS_OFFSET = 44
+# The header is followed by one u64 invalidation count per window, then the slots
+# seqlock counter, state, reference bit, redirect_code (0 for none), short key (NUL-padded),
+# url position in the arena, url length, cache_max_age (-1 for none), expires_at (NaN for none), stored_at
+_SLOT = struct.Struct('<IBBH16sQIidd')
+_STATE_OFFSET = 4
+_REF_OFFSET = 5
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
+_EMPTY, _USED, _DELETED = 0, 1, 2
+KEY_WIDTH = 16
+# A reader that keeps finding a slot mid-write gives up and reports a miss
+_READ_RETRIES = 8
+
+
+class SharedCache:
+    """
+    Redirect cache shared by every worker process on a host, with the same
+    interface as LRUCache for (long_url, redirect_code, cache_max_age) values:
+    a fixed-size hash table in a memory-mapped file (put it on /dev/shm).
+
+    A key hashes to a window of `ways` slots and is only ever stored there,
+    so a lookup reads at most `ways` fixed-size slots. A full window evicts
+    with CLOCK: hits set a slot's reference bit, and a writer takes the first
+    slot whose bit is clear, clearing bits as it passes. Long URLs are
+    appended to a circular arena of `max_size * url_bytes` bytes and slots
+    hold their position; a slot whose URL has since been overwritten is a
+    miss.
+
+    Reads take no lock. Writers make a slot's sequence counter odd while
+    they change it and even again after, and a reader that saw the counter
+    odd or changed retries (a seqlock). Writers serialise with a thread lock
+    and flock on the file, so invalidations from any worker's writes are
+    seen by every worker.
+
+    Every window counts the invalidations of its keys. A lookup that goes to
+    the database reads generation() first and passes it to put(), which
+    drops the value if the key was invalidated in between, so a read that
+    raced a write cannot cache the old mapping for a whole ttl.
+
+    The first worker sizes the file; a worker configured with another size
+    replaces it, leaving workers still on the old file to miss invalidations
+    until they restart. Hits and misses are counted per process.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: float, max_stale: Optional[float] = 0,
+                 ways: int = 8, url_bytes: int = 128):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.path = path
+        self.ways = ways
+        self.windows = -(-max_size // ways)
+        self.max_size = self.windows * ways
+        self.ttl = ttl
+        # None keeps entries until they are evicted
+        self.max_stale = float('inf') if max_stale is None else max_stale
+        self.arena_size = self.max_size * url_bytes
+        self._slots_offset = _HEADER_SIZE + self.windows * _U64.size
+        self._arena_offset = self._slots_offset + self.max_size * _SLOT.size
+        self.file_size = self._arena_offset + self.arena_size
+        self._window_size = ways * _SLOT.size
+        self.hits = 0
+        self.misses = 0
+        self._map: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+        # flock is held per open file, so each process opens its own
+        self._attach = OncePerProcess(self._open)
+
+    def _open(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                # Replaced by another worker while this one waited for the lock
+                os.close(fd)
+                continue
+            size = os.fstat(fd).st_size
+            if size == 0:
+                self._initialise(fd)
+            elif not self._compatible(fd, size):
+                os.close(fd)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                tmp_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                try:
+                    self._initialise(tmp_fd)
+                finally:
+                    os.close(tmp_fd)
+                os.replace(tmp_path, self.path)
+                continue
+            self._map = mmap.mmap(fd, self.file_size)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            self._fd = fd
+            self._lock = threading.Lock()
+            return
+
+    def _initialise(self, fd: int):
+        # The slots and arena start zeroed, i.e. empty
+        os.ftruncate(fd, self.file_size)
+        os.pwrite(fd, _HEADER.pack(_MAGIC, self.max_size, self.ways, self.arena_size, 0, 0, 0, 0), 0)
+
+    def _compatible(self, fd: int, size: int) -> bool:
+        if size != self.file_size:
+            return False
+        magic, slots, ways, arena_size = _HEADER.unpack(os.pread(fd, _HEADER.size, 0))[:4]
+        return (magic, slots, ways, arena_size) == (_MAGIC, self.max_size, self.ways, self.arena_size)
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _window(self, key: bytes) -> range:
+        start = self._slots_offset + (zlib.crc32(key) % self.windows) * self._window_size
+        return range(start, start + self._window_size, _SLOT.size)
+
+    def _generation_offset(self, key: bytes) -> int:
+        return _HEADER_SIZE + (zlib.crc32(key) % self.windows) * _U64.size
+
+    def generation(self, key: str) -> int:
+        """
+        Invalidation count of key's window, to pass to put() after looking the key up elsewhere
+        :param key:
+        :return: opaque count
+        """
+        encoded = key.encode()
+        if len(encoded) > KEY_WIDTH:
+            return 0
+        self._attach()
+        return _U64.unpack_from(self._map, self._generation_offset(encoded))[0]
+
+    def _lookup(self, key: str) -> Optional[tuple]:
+        """
+        Lock-free read of key's slot
+        :return: (long_url, redirect_code, cache_max_age, expires_at, stored_at) or None
+        """
+        self._attach()
+        encoded = key.encode()
+        if len(encoded) > KEY_WIDTH:
+            return None
+        padded = encoded.ljust(KEY_WIDTH, b'\0')
+        mm = self._map
+        start = self._slots_offset + (zlib.crc32(encoded) % self.windows) * self._window_size
+        stop = start + self._window_size
+        # One scan of the window's bytes finds the key; deleted slots may still hold it
+        found = mm.find(padded, start, stop)
+        while found != -1:
+            offset = found - 8
+            if (offset - start) % _SLOT.size == 0 and mm[offset + _STATE_OFFSET] == _USED:
+                break
+            found = mm.find(padded, found + 1, stop)
+        else:
+            return None
+        for _ in range(_READ_RETRIES):
+            seq, state, ref, redirect_code, slot_key, position, length, cache_max_age, expires_at, stored_at = \
+                _SLOT.unpack_from(mm, offset)
+            if seq & 1:
+                continue
+            if state != _USED or slot_key != padded:
+                # Replaced since the key was found
+                return None
+            url_start = self._arena_offset + position % self.arena_size
+            url = mm[url_start:url_start + length]
+            if _U32.unpack_from(mm, offset)[0] != seq:
+                continue
+            if _U64.unpack_from(mm, _HEAD_OFFSET)[0] > position + self.arena_size:
+                # Overwritten by newer URLs
+                return None
+            if not ref:
+                mm[offset + _REF_OFFSET] = 1
+            return (url.decode(), redirect_code or None, None if cache_max_age < 0 else cache_max_age,
+                    None if math.isnan(expires_at) else expires_at, stored_at)
+        return None
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Return the live entry for key, or None on a miss
+        :param key:
+        :return: CacheEntry or None
+        """
+        found = self._lookup(key)
+        if found is not None:
+            long_url, redirect_code, cache_max_age, expires_at, stored_at = found
+            now = time.time()
+            if now - stored_at < self.ttl and (expires_at is None or expires_at > now):
+                self.hits += 1
+                return CacheEntry((long_url, redirect_code, cache_max_age), expires_at, stored_at)
+        self.misses += 1
+        return None
+
+    def get_stale(self, key: str, max_age: Optional[float] = None) -> Optional[CacheEntry]:
+        """
+        Return the entry for key even if it is past its ttl, as long as it is
+        younger than max_age and its expires_at has not passed
+        :param key:
+        :param max_age: seconds since the entry was stored; None allows any entry still kept
+        :return: CacheEntry or None
+        """
+        found = self._lookup(key)
+        if found is None:
+            return None
+        long_url, redirect_code, cache_max_age, expires_at, stored_at = found
+        now = time.time()
+        limit = max(self.max_stale, self.ttl)
+        if max_age is not None:
+            limit = min(limit, max_age)
+        if now - stored_at >= limit or (expires_at is not None and expires_at <= now):
+            return None
+        return CacheEntry((long_url, redirect_code, cache_max_age), expires_at, stored_at)
+
+    def put(self, key: str, value, expires_at: Optional[float] = None, generation: Optional[int] = None) -> None:
+        """
+        Store value under key, evicting from key's window by CLOCK when it is full.
+        Keys longer than KEY_WIDTH bytes and URLs longer than an eighth of the arena are not cached.
+        :param key:
+        :param value: (long_url, redirect_code, cache_max_age)
+        :param expires_at: epoch seconds after which the value must not be served
+        :param generation: generation(key) from before value was read; the value is dropped if the key
+                           has been invalidated since
+        """
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            return
+        long_url, redirect_code, cache_max_age = value
+        encoded, url = key.encode(), long_url.encode()
+        if len(encoded) > KEY_WIDTH or len(url) > self.arena_size // 8:
+            return
+        self._attach()
+        padded = encoded.ljust(KEY_WIDTH, b'\0')
+        mm = self._map
+        with self._write_lock():
+            if generation is not None and \
+                    _U64.unpack_from(mm, self._generation_offset(encoded))[0] != generation:
+                return
+            window = self._window(encoded)
+            target = free = None
+            for offset in window:
+                state, slot_key = mm[offset + _STATE_OFFSET], mm[offset + 8:offset + 8 + KEY_WIDTH]
+                if state == _USED and slot_key == padded:
+                    target = offset
+                    break
+                if free is None and (state != _USED or self._dead(offset, now)):
+                    free = offset
+                if state == _EMPTY:
+                    break
+            filled = target is None and free is not None and mm[free + _STATE_OFFSET] != _USED
+            if target is None:
+                target = free if free is not None else self._evict(window)
+            position = self._append(url)
+            self._write_slot(target, _USED, padded, position, len(url), redirect_code, cache_max_age,
+                             expires_at, now)
+            if filled:
+                self._add_header(_ENTRIES_OFFSET, 1)
+
+    def _dead(self, offset: int, now: float) -> bool:
+        # Past every use: expired, too old even for get_stale, or its URL overwritten
+        position, _, _, expires_at, stored_at = _SLOT.unpack_from(self._map, offset)[5:]
+        return (not math.isnan(expires_at) and expires_at <= now) or \
+            now - stored_at >= max(self.max_stale, self.ttl) or \
+            _U64.unpack_from(self._map, _HEAD_OFFSET)[0] > position + self.arena_size
+
+    def _evict(self, window: range) -> int:
+        # CLOCK over the window, starting where the shared hand points
+        mm = self._map
+        hand = _U64.unpack_from(mm, _HAND_OFFSET)[0]
+        _U64.pack_into(mm, _HAND_OFFSET, hand + 1)
+        for i in range(2 * self.ways):
+            offset = window[(hand + i) % self.ways]
+            if not mm[offset + _REF_OFFSET]:
+                break
+            mm[offset + _REF_OFFSET] = 0
+        self._add_header(_EVICTIONS_OFFSET, 1)
+        return offset
+
+    def _append(self, url: bytes) -> int:
+        # URLs never wrap around the end of the arena; the head is published
+        # before the bytes are written, so readers of the old bytes see it moved
+        mm = self._map
+        head = _U64.unpack_from(mm, _HEAD_OFFSET)[0]
+        if head % self.arena_size + len(url) > self.arena_size:
+            head += self.arena_size - head % self.arena_size
+        _U64.pack_into(mm, _HEAD_OFFSET, head + len(url))
+        start = self._arena_offset + head % self.arena_size
+        mm[start:start + len(url)] = url
+        return head
+
+    def _write_slot(self, offset: int, state: int, key: bytes, position: int = 0, length: int = 0,
+                    redirect_code: Optional[int] = None, cache_max_age: Optional[int] = None,
+                    expires_at: Optional[float] = None, stored_at: float = 0.0):
+        mm = self._map
+        seq = _U32.unpack_from(mm, offset)[0]
+        _U32.pack_into(mm, offset, seq + 1)
+        _SLOT.pack_into(mm, offset, seq + 1, state, 0, redirect_code or 0, key, position, length,
+                        -1 if cache_max_age is None else cache_max_age,
+                        math.nan if expires_at is None else expires_at, stored_at)
+        _U32.pack_into(mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _add_header(self, offset: int, amount: int):
+        _U64.pack_into(self._map, offset, _U64.unpack_from(self._map, offset)[0] + amount)
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop key from the cache if present, for every worker
+        :param key:
+        """
+        encoded = key.encode()
+        if len(encoded) > KEY_WIDTH:
+            return
+        self._attach()
+        padded = encoded.ljust(KEY_WIDTH, b'\0')
+        mm = self._map
+        with self._write_lock():
+            # Counted even when the key is absent: a lookup may be about to store it
+            self._add_header(self._generation_offset(encoded), 1)
+            for offset in self._window(encoded):
+                state = mm[offset + _STATE_OFFSET]
+                if state == _EMPTY:
+                    return
+                if state == _USED and mm[offset + 8:offset + 8 + KEY_WIDTH] == padded:
+                    # Marked deleted rather than emptied, so later slots of the window stay reachable
+                    self._write_slot(offset, _DELETED, padded)
+                    self._add_header(_ENTRIES_OFFSET, -1)
+                    return
+
+    def clear(self) -> None:
+        self._attach()
+        mm = self._map
+        with self._write_lock():
+            for offset in range(_HEADER_SIZE, self._slots_offset, _U64.size):
+                self._add_header(offset, 1)
+            for offset in range(self._slots_offset, self._arena_offset, _SLOT.size):
+                if mm[offset + _STATE_OFFSET] != _EMPTY:
+                    self._write_slot(offset, _EMPTY, bytes(KEY_WIDTH))
+            _U64.pack_into(mm, _ENTRIES_OFFSET, 0)
+
+    def stats(self) -> dict:
+        """
+        Return this process's hit/miss counters, the shared eviction count
+        and size, and the bytes of shared memory per slot
+        :return: dict
+        """
+        self._attach()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': _U64.unpack_from(self._map, _EVICTIONS_OFFSET)[0],
+            'size': len(self),
+            'max_size': self.max_size,
+            'bytes_per_entry': self.file_size / self.max_size,
+        }
+
+    def __len__(self) -> int:
+        self._attach()
+        return _U64.unpack_from(self._map, _ENTRIES_OFFSET)[0]
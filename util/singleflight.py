@@ -0,0 +1,150 @@
+import asyncio
+import copy
+import threading
+from typing import Callable, Optional
+
+
+def _for_waiter(error: BaseException) -> BaseException:
+    """
+    A copy of the leader's exception for one waiter to raise, chained from
+    it. Raising the same object in every waiter would append each waiter's
+    frames to its one traceback.
+    :param error:
+    :return: a new exception of the same type and arguments, or error itself if it cannot be copied
+    """
+    try:
+        return copy.copy(error)
+    except Exception:
+        return error
+
+
+class _Call:
+    """
+    One in-flight call and the callers waiting for it
+    """
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    function and everyone who arrives while it is running waits for it and
+    gets the same result, or a copy of its exception chained from it.
+
+    Nothing is cached; once the call returns, the next caller for the key
+    starts a new one.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        # Seconds a waiter blocks for another caller's result; None waits indefinitely
+        self.timeout = timeout
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable, *args):
+        """
+        Call fn(*args), or wait for the call already running for key
+        :param key:
+        :param fn:
+        :return: fn's result
+        :raises TimeoutError: waited longer than timeout for another caller's call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                raise TimeoutError(f"Timed out after {self.timeout}s waiting for the in-flight call for {key!r}")
+            if call.error is not None:
+                raise _for_waiter(call.error) from call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def waiting(self, key: str) -> int:
+        """
+        Number of callers waiting on the running call for key (0 if none is running)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            return call.waiters if call is not None else 0
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop: concurrent awaits of
+    do() for the same key share one run of the coroutine function.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        # Seconds a waiter waits for another caller's result; None waits indefinitely
+        self.timeout = timeout
+        self._calls: dict[str, asyncio.Future] = {}
+        self._waiters: dict[str, int] = {}
+
+    async def do(self, key: str, fn: Callable, *args):
+        """
+        Await fn(*args), or wait for the call already running for key
+        :param key:
+        :param fn: coroutine function
+        :return: fn's result
+        :raises TimeoutError: waited longer than timeout for another caller's call
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self._waiters[key] += 1
+            try:
+                # Shielded, so a waiter timing out does not cancel the shared call
+                return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Timed out after {self.timeout}s waiting for the in-flight call for {key!r}") \
+                    from None
+            except Exception as e:
+                raise _for_waiter(e) from e
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self._waiters[key] = 0
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            # Only the leader was cancelled; the waiters fail instead
+            future.set_exception(RuntimeError(f"The in-flight call for {key!r} was cancelled"))
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so an unawaited failure is not logged as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key], self._waiters[key]
+
+    def waiting(self, key: str) -> int:
+        """
+        Number of callers waiting on the running call for key (0 if none is running)
+        """
+        return self._waiters.get(key, 0)
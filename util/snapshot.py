@@ -0,0 +1,142 @@
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from typing import Iterable, Optional
+
+_MAGIC = b'SNP1'
+# magic, key width, row count, generated_at epoch, base generated_at epoch (0 for a full snapshot)
+_HEADER = struct.Struct('<4sHQdd')
+# url offset into the blob, url length, expires_at epoch (NaN for none),
+# redirect_code (0 for none), cache_max_age (-1 for none)
+_RECORD = struct.Struct('<QIdHi')
+
+# Short keys are at most 16 characters (the long-key fallback)
+DEFAULT_KEY_WIDTH = 16
+
+
+def write_snapshot(path: str, rows: Iterable[tuple], generated_at: Optional[float] = None,
+                   base_generated_at: float = 0.0, key_width: int = DEFAULT_KEY_WIDTH) -> int:
+    """
+    Write rows to an immutable snapshot file, atomically replacing path.
+
+    The file is a header, the short keys as fixed-width NUL-padded slots in
+    ascending order, one fixed-size record per key and a blob of UTF-8 long
+    URLs. Rows are streamed to temporary files, so memory use does not grow
+    with the number of rows.
+    :param path:
+    :param rows: (short_key, long_url, expires_at epoch, redirect_code, cache_max_age) tuples in
+                 ascending short_key order; None for unset fields
+    :param generated_at: epoch the rows are current as of (defaults to now)
+    :param base_generated_at: for a delta, generated_at of the snapshot it applies to
+    :param key_width: bytes reserved per short key
+    :return: number of rows written
+    :raises ValueError: keys out of order, duplicated or longer than key_width
+    """
+    generated_at = time.time() if generated_at is None else generated_at
+    tmp_path = f"{path}.tmp"
+    count = 0
+    blob_size = 0
+    previous = b''
+    with open(tmp_path, 'wb') as f, tempfile.TemporaryFile() as records, tempfile.TemporaryFile() as blob:
+        f.write(bytes(_HEADER.size))
+        for short_key, long_url, expires_at, redirect_code, cache_max_age in rows:
+            key = short_key.encode()
+            if len(key) > key_width:
+                raise ValueError(f"Key {short_key!r} is longer than {key_width} bytes")
+            if key <= previous:
+                raise ValueError(f"Keys must be unique and ascending; {short_key!r} is out of order")
+            previous = key
+            url = long_url.encode()
+            f.write(key.ljust(key_width, b'\0'))
+            records.write(_RECORD.pack(blob_size, len(url), math.nan if expires_at is None else expires_at,
+                                       redirect_code or 0, -1 if cache_max_age is None else cache_max_age))
+            blob.write(url)
+            blob_size += len(url)
+            count += 1
+        for section in (records, blob):
+            section.seek(0)
+            shutil.copyfileobj(section, f)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, key_width, count, generated_at, base_generated_at))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file written by write_snapshot().
+
+    The file is memory-mapped, so opening it costs no reads and the pages
+    are shared by every worker process. A lookup is a binary search over the
+    key slots followed by one record unpack and one URL slice.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < _HEADER.size:
+            raise ValueError(f"{path} is not a snapshot file")
+        magic, self.key_width, self.count, self.generated_at, self.base_generated_at = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        self._keys_at = _HEADER.size
+        self._records_at = self._keys_at + self.count * self.key_width
+        self._blob_at = self._records_at + self.count * _RECORD.size
+        if len(self._mm) < self._blob_at:
+            raise ValueError(f"{path} is truncated")
+
+    def _find(self, short_key: str) -> int:
+        # Index of short_key, or -1
+        key = short_key.encode()
+        width = self.key_width
+        if len(key) > width:
+            return -1
+        key = key.ljust(width, b'\0')
+        mm, base = self._mm, self._keys_at
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            start = base + mid * width
+            probe = mm[start:start + width]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def get(self, short_key: str) -> Optional[tuple]:
+        """
+        Look up short_key; expired rows are returned as-is for the caller to check
+        :param short_key:
+        :return: (long_url, expires_at epoch, redirect_code, cache_max_age) with None for unset
+                 fields, or None if the key is not in the snapshot
+        """
+        index = self._find(short_key)
+        if index < 0:
+            return None
+        offset, length, expires_at, redirect_code, cache_max_age = \
+            _RECORD.unpack_from(self._mm, self._records_at + index * _RECORD.size)
+        start = self._blob_at + offset
+        return (self._mm[start:start + length].decode(),
+                None if math.isnan(expires_at) else expires_at,
+                redirect_code or None,
+                None if cache_max_age < 0 else cache_max_age)
+
+    def __contains__(self, short_key: str) -> bool:
+        return self._find(short_key) >= 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        self._mm.close()
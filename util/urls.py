@@ -0,0 +1,54 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalises a URL for duplicate detection: lower-cases the scheme and
+    host, drops default ports, and uses '/' for an empty path. The fragment
+    is kept, since hash-routed apps use it to pick the page
+    :param url:
+    :return: str
+    """
+    parts = urlsplit(url.strip())
+    try:
+        port = parts.port
+    except ValueError:
+        # Malformed port: leave the URL as it is
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = f"[{host}]"
+    netloc = host
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, parts.fragment))
+
+
+def hash_url(url: str) -> bytes:
+    """
+    Fixed-size (16 byte) hash of the normalised URL, so an index over it
+    stays small however long the URLs are
+    :param url:
+    :return: bytes
+    """
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).digest()
+
+
+def has_domain_prefix(url: str, prefix: str) -> bool:
+    """
+    The domain filter of iter_mappings, which every backend implements the
+    same way: an http or https scheme in any case, '://', then prefix
+    (compared case-sensitively)
+    :param url:
+    :param prefix: e.g. 'example.com' or 'example.com/blog'
+    :return: bool
+    """
+    scheme, separator, rest = url.partition('://')
+    return bool(separator) and scheme.lower() in _DEFAULT_PORTS and rest.startswith(prefix)